@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Decoding time of a chunked InfluxDB 1.x response for a synthetic year with one sample
+every 10 seconds. The rows of the client library are compared with the columns of
+InfluxDBBackend.query_columns(). No database is needed:
+PYTHONPATH=.. python -m benchmark.column_decode_benchmark [--days 365]
+"""
+import argparse
+import json
+import time
+from itertools import compress
+
+from influxdb.resultset import ResultSet
+
+from source.storage import values_to_columns
+from source.constants import QUERY_CHUNK_SIZE
+
+SAMPLE_INTERVAL_S = 10
+COLUMNS = ["time", "energy_wh", "power", "sample_count", "fetch_success"]
+
+
+def create_response(days: int) -> list:
+    """
+    Lines of a chunked response with the streamed fields of the reports.
+    :param days: Number of days
+    :return: One JSON line per chunk
+    """
+    count = days * 86_400 // SAMPLE_INTERVAL_S
+    lines = []
+    for offset in range(0, count, QUERY_CHUNK_SIZE):
+        values = [
+            [index * SAMPLE_INTERVAL_S * 1000, 0.2, 80.0, None, bool(index % 500)]
+            for index in range(offset, min(offset + QUERY_CHUNK_SIZE, count))
+        ]
+        series = {"name": "census", "columns": COLUMNS, "values": values}
+        lines.append(json.dumps({"results": [{"statement_id": 0, "series": [series]}]}))
+    return lines
+
+
+def decode_rows(lines: list) -> float:
+    """
+    Decode like the client library and read the energy of every row.
+    :param lines: Response lines
+    :return: Energy sum
+    """
+    energy_wh = 0.0
+    for line in lines:
+        data = json.loads(line)
+        for point in ResultSet(data["results"][0]).get_points():
+            if point["fetch_success"]:
+                energy_wh += point["energy_wh"]
+    return energy_wh
+
+
+def decode_columns(lines: list) -> float:
+    """
+    Decode into columns and read the energy column.
+    :param lines: Response lines
+    :return: Energy sum
+    """
+    energy_wh = 0.0
+    for line in lines:
+        for series in json.loads(line)["results"][0]["series"]:
+            columns = values_to_columns(series["columns"], series["values"], COLUMNS[1:])
+            energy_wh = sum(compress(columns["energy_wh"], columns["fetch_success"]), energy_wh)
+    return energy_wh
+
+
+def decode_json(lines: list) -> int:
+    """
+    Only parse the JSON of the response, which both decoders need.
+    :param lines: Response lines
+    :return: Number of chunks
+    """
+    return sum(1 for line in lines if json.loads(line))
+
+
+def main() -> None:
+    """
+    Run the benchmark and print the results.
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--days", type=int, default=365, help="Number of days with data")
+    args = parser.parse_args()
+    lines = create_response(args.days)
+    results = {}
+    for function in (decode_json, decode_rows, decode_columns):
+        start_time = time.perf_counter()
+        result = function(lines)
+        results[function.__name__] = (result, time.perf_counter() - start_time)
+    print(f"Chunks:                    {len(lines)} ({args.days} days)")
+    print(f"JSON parser only:          {results['decode_json'][1]:8.2f} s")
+    print(f"Rows of the client:        {results['decode_rows'][1]:8.2f} s")
+    print(f"Columns:                   {results['decode_columns'][1]:8.2f} s")
+    print(
+        f"Same energy:               "
+        f"{results['decode_rows'][0] == results['decode_columns'][0]}"
+    )
+
+if __name__ == "__main__":
+    main()
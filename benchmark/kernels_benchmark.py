@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Speed of the vectorized kernels compared with the per-row functions on a synthetic year
+with one sample every 10 seconds. NumPy must be installed:
+PYTHONPATH=.. python -m benchmark.kernels_benchmark [--days 365]
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from source import kernels
+from source.calculations import PeriodAccumulator, STREAMED_FIELDS
+from source.line_protocol import encode_timestamp
+from source.storage import rows_to_columns
+from source.rollup import count_power_on
+from source.constants import QUERY_CHUNK_SIZE
+
+SAMPLE_INTERVAL_S = 10
+THRESHOLDS = (10, 5)
+FIELDS = STREAMED_FIELDS + ["fetch_success"]
+
+
+def create_rows(end: datetime, days: int) -> list:
+    """
+    Rows like the streamed census rows with a failed poll now and then.
+    :param end: Timestamp of the last sample
+    :param days: Number of days
+    :return: Rows in time order
+    """
+    rng = random.Random(1)
+    count = days * 86_400 // SAMPLE_INTERVAL_S
+    start_ms = encode_timestamp(end, "ms") - count * SAMPLE_INTERVAL_S * 1000
+    rows = []
+    for index in range(count):
+        power = 80.0 if (index // 360) % 3 else 2.0 + rng.random()
+        rows.append(
+            {
+                "time": start_ms + index * SAMPLE_INTERVAL_S * 1000,
+                "fetch_success": bool(index % 500),
+                "energy_wh": power * SAMPLE_INTERVAL_S / 3600,
+                "power": power,
+            }
+        )
+    return rows
+
+
+def timed(function, *args) -> tuple:
+    """
+    Run a function and measure its time.
+    :param function: Measured function
+    :return: Result and time in seconds
+    """
+    start_time = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start_time
+
+
+def accumulate_rows(starts: list, rows: list) -> PeriodAccumulator:
+    """
+    Add the rows one by one.
+    :return: Accumulator
+    """
+    accumulator = PeriodAccumulator(starts, THRESHOLDS)
+    for row in rows:
+        if row["fetch_success"]:
+            accumulator.add_sample(row)
+        else:
+            accumulator.add_failure(row["time"])
+    return accumulator
+
+
+def accumulate_columns(starts: list, rows: list) -> PeriodAccumulator:
+    """
+    Convert the rows to columns chunk by chunk and add them with the kernels.
+    :return: Accumulator
+    """
+    accumulator = PeriodAccumulator(starts, THRESHOLDS)
+    for offset in range(0, len(rows), QUERY_CHUNK_SIZE):
+        chunk = rows[offset:offset + QUERY_CHUNK_SIZE]
+        accumulator.add_columns(kernels.numpy_columns(rows_to_columns(chunk, FIELDS)))
+    return accumulator
+
+
+def main() -> None:
+    """
+    Run the benchmark and print the results.
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--days", type=int, default=365, help="Number of days with data")
+    args = parser.parse_args()
+    end = datetime.utcnow()
+    rows = create_rows(end, args.days)
+    power = [row["power"] for row in rows]
+    power_array = np.array(power)
+
+    expected, loop_time = timed(count_power_on, power, *THRESHOLDS)
+    (count, _), kernel_time = timed(kernels.count_power_on, power_array, *THRESHOLDS)
+    print(f"Samples:                   {len(rows)} ({args.days} days)")
+    print(
+        f"Power on count:            {loop_time:8.3f} s loop {kernel_time:8.3f} s kernel "
+        f"{loop_time / kernel_time:6.1f}x, equal {count == expected}"
+    )
+    expected, loop_time = timed(sum, power)
+    result, kernel_time = timed(kernels.sequential_sum, power_array)
+    print(
+        f"Energy sum:                {loop_time:8.3f} s loop {kernel_time:8.3f} s kernel "
+        f"{loop_time / kernel_time:6.1f}x, equal {result == expected}"
+    )
+    starts = [end - timedelta(days=days) for days in (1, 30, args.days)]
+    expected, loop_time = timed(accumulate_rows, starts, rows)
+    result, kernel_time = timed(accumulate_columns, starts, rows)
+    equal = (
+        result.statistics == expected.statistics
+        and result.failure_counts == expected.failure_counts
+        and result.power_on == expected.power_on
+    )
+    print(
+        f"Day, month and year:       {loop_time:8.3f} s rows {kernel_time:8.3f} s columns "
+        f"{loop_time / kernel_time:6.1f}x, equal {equal}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the line protocol encoder against the serialization of the influxdb library
+which is used by write_points() with json points. Run from the repository root with:
+python -m benchmark.line_protocol_benchmark
+"""
+import gzip
+import timeit
+from datetime import datetime, timedelta
+
+from influxdb.line_protocol import make_lines
+from source.line_protocol import encode_points
+
+NUMBER_OF_POINTS = 10_000
+REPEAT = 5
+
+
+def create_3em_points(count: int) -> list:
+    """
+    Create points like the shelly:3em handler with all 21 fields.
+    :param count: Number of points
+    :return: List of points
+    """
+    start = datetime(2023, 5, 1)
+    points = []
+    for index in range(count):
+        fields = {"power": 1234.5 + index, "energy_wh": 3.42, "fetch_success": True}
+        for phase in ("a", "b", "c"):
+            fields |= {
+                f"power_{phase}": 411.5,
+                f"power_factor_{phase}": 0.98,
+                f"current_{phase}": 1.79,
+                f"voltage_{phase}": 230.1,
+                f"is_valid_{phase}": True,
+                f"energy_wh_{phase}": 1.14,
+            }
+        points.append(
+            {
+                "measurement": "census",
+                "tags": {"device": "Waermepumpe"},
+                "time": start + timedelta(seconds=10 * index),
+                "fields": fields,
+            }
+        )
+    return points
+
+
+def main() -> None:
+    """
+    Run the benchmark and print the results.
+    :return: None
+    """
+    points = create_3em_points(NUMBER_OF_POINTS)
+    library_time = min(
+        timeit.repeat(lambda: make_lines({"points": points}), number=1, repeat=REPEAT)
+    )
+    encoder_time = min(
+        timeit.repeat(lambda: encode_points(points, "ms"), number=1, repeat=REPEAT)
+    )
+    body = ("\n".join(encode_points(points, "ms")) + "\n").encode("utf-8")
+    compressed = gzip.compress(body, compresslevel=9)
+    print(f"Points:                    {NUMBER_OF_POINTS} (shelly:3em, 21 fields)")
+    print(f"influxdb make_lines:       {library_time * 1000:8.1f} ms")
+    print(f"line_protocol encoder:     {encoder_time * 1000:8.1f} ms")
+    print(f"Speedup:                   {library_time / encoder_time:8.1f}x")
+    print(f"Body size plain:           {len(body) / 1024:8.1f} KiB")
+    print(f"Body size gzip:            {len(compressed) / 1024:8.1f} KiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the yearly calculation of calculation_handler() on the SQLite backend with one
+sample every 10 seconds. The database and the report are created in a temporary directory.
+Like the app it is run from the source directory, because the logging writes to ../files:
+PYTHONPATH=.. python -m benchmark.sqlite_yearly_benchmark [--days 365]
+"""
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from source import calculations as cc
+from source import support_functions as sf
+from source.storage_sqlite import SQLiteBackend
+from source.constants import SCHEMA_LEGACY
+
+SAMPLE_INTERVAL_S = 10
+WRITE_BATCH_SIZE = 10_000
+
+
+def fill_database(backend: SQLiteBackend, end: datetime, days: int) -> int:
+    """
+    Write plug samples with one sample every 10 seconds up to the end timestamp.
+    :param backend: SQLite backend
+    :param end: Timestamp of the last sample
+    :param days: Number of days
+    :return: Number of written samples
+    """
+    count = days * 86_400 // SAMPLE_INTERVAL_S
+    start = end - timedelta(seconds=count * SAMPLE_INTERVAL_S)
+    for offset in range(0, count, WRITE_BATCH_SIZE):
+        points = []
+        for index in range(offset, min(offset + WRITE_BATCH_SIZE, count)):
+            power = 80.0 if (index // 360) % 3 else 2.0
+            points.append(
+                {
+                    "measurement": "census",
+                    "tags": {"device": "plug"},
+                    "time": start + timedelta(seconds=SAMPLE_INTERVAL_S * index),
+                    "fields": {
+                        "power": power,
+                        "energy_wh": power * SAMPLE_INTERVAL_S / 3600,
+                        "is_valid": True,
+                        "temperature": 24.5,
+                        "fetch_success": bool(index % 500),
+                    },
+                }
+            )
+        backend.write_points(points)
+    return count
+
+
+def main() -> None:
+    """
+    Run the benchmark and print the results.
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--days", type=int, default=365, help="Number of days with data")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        working_directory = os.path.join(directory, "source")
+        os.makedirs(working_directory)
+        os.makedirs(os.path.join(directory, "files"))
+        database_path = os.path.join(directory, "files", "benchmark.sqlite")
+        backend = SQLiteBackend(SimpleNamespace(db_path=database_path), SCHEMA_LEGACY)
+        sf.storage["backend"] = backend
+        now = datetime.utcnow()
+        cc.config_request_time["calc_request_time_yearly"] = f"{now:%d.%m}"
+
+        start_time = time.perf_counter()
+        count = fill_database(backend, now, args.days)
+        write_time = time.perf_counter() - start_time
+
+        previous_directory = os.getcwd()
+        os.chdir(working_directory)
+        try:
+            start_time = time.perf_counter()
+            cc.calculation_handler(
+                {
+                    "device_name": "plug",
+                    "update_time": SAMPLE_INTERVAL_S,
+                    "power_on_counter": {"on_threshold": 10, "off_threshold": 5},
+                },
+                {
+                    "start_schedule_task": True,
+                    "cost_calc": [False, False, True],
+                    "power_on_counter": [False, False, True],
+                },
+            )
+            calculation_time = time.perf_counter() - start_time
+            with open(os.path.join("..", "files", "plug_year.txt"), encoding="utf-8") as file:
+                report = file.readlines()[-1].strip()
+        finally:
+            os.chdir(previous_directory)
+        database_size = sum(
+            os.path.getsize(os.path.join(directory, "files", name))
+            for name in os.listdir(os.path.join(directory, "files"))
+            if name.startswith("benchmark.sqlite")
+        )
+    print(f"Samples:                   {count} ({args.days} days, every {SAMPLE_INTERVAL_S} s)")
+    print(f"Write time:                {write_time:8.1f} s")
+    print(f"Database size:             {database_size / 1024 / 1024:8.1f} MiB")
+    print(f"Yearly calculation:        {calculation_time:8.2f} s")
+    print(f"Report:                    {report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Memory benchmark of the day, month and year evaluation on the SQLite backend with one
+sample every 10 seconds. The peak memory of the streaming pass is compared with the
+evaluation on fully fetched lists of rows. The database is created in a temporary
+directory:
+PYTHONPATH=.. python -m benchmark.streaming_memory_benchmark [--days 365]
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from types import SimpleNamespace
+
+from dateutil.relativedelta import relativedelta
+
+from benchmark.sqlite_yearly_benchmark import fill_database
+from source import calculations as cc
+from source import rollup
+from source.line_protocol import encode_timestamp
+from source.storage_sqlite import SQLiteBackend
+from source.constants import SCHEMA_LEGACY
+
+THRESHOLDS = (10, 5)
+
+
+def evaluate_lists(backend: SQLiteBackend, end: datetime, starts: list) -> list:
+    """
+    Evaluation like before the streaming pass: the rows of the longest period are fetched
+    into a list and filtered per period.
+    :param backend: SQLite backend
+    :param end: Common end of the periods
+    :param starts: Starts of the periods
+    :return: Energy and power on count per period
+    """
+    rows = list(backend.query_samples("plug", min(starts), end, ["energy_wh", "power"]))
+    results = []
+    for start in starts:
+        start_ms = encode_timestamp(start, "ms")
+        period = [row for row in rows if row["time"] > start_ms]
+        results.append(
+            (
+                sum(row["energy_wh"] for row in period),
+                rollup.count_power_on([row["power"] for row in period], *THRESHOLDS),
+            )
+        )
+    return results
+
+
+def evaluate_stream(backend: SQLiteBackend, end: datetime, starts: list) -> list:
+    """
+    Evaluation with one streaming pass.
+    :param backend: SQLite backend
+    :param end: Common end of the periods
+    :param starts: Starts of the periods
+    :return: Energy and power on count per period
+    """
+    accumulator = cc.stream_period_aggregates(backend, "plug", end, starts, THRESHOLDS)
+    return [
+        (statistics["energy_wh"], power_on)
+        for statistics, power_on in zip(accumulator.statistics, accumulator.power_on)
+    ]
+
+
+def measure(function, *args) -> tuple:
+    """
+    Run a function and measure its time and the peak of the allocated memory.
+    :param function: Measured function
+    :return: Result, time in seconds and peak memory in bytes
+    """
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    result = function(*args)
+    duration = time.perf_counter() - start_time
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, duration, peak
+
+
+def main() -> None:
+    """
+    Run the benchmark and print the results.
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--days", type=int, default=365, help="Number of days with data")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        backend = SQLiteBackend(
+            SimpleNamespace(db_path=os.path.join(directory, "benchmark.sqlite")), SCHEMA_LEGACY
+        )
+        now = datetime.utcnow()
+        count = fill_database(backend, now, args.days)
+        starts = [now - relativedelta(**{period: 1}) for period in ("days", "months", "years")]
+        expected, list_time, list_peak = measure(evaluate_lists, backend, now, starts)
+        result, stream_time, stream_peak = measure(evaluate_stream, backend, now, starts)
+    print(f"Samples:                   {count} ({args.days} days, every 10 s)")
+    print(f"Lists:                     {list_time:8.2f} s {list_peak / 1024 / 1024:10.1f} MiB")
+    print(f"Streaming pass:            {stream_time:8.2f} s {stream_peak / 1024 / 1024:10.1f} MiB")
+    same = all(
+        abs(energy_wh - expected_wh) <= 1e-6 * max(1.0, expected_wh) and power_on == expected_on
+        for (energy_wh, power_on), (expected_wh, expected_on) in zip(result, expected)
+    )
+    print(f"Same results:              {same}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,12 @@
 """
 File provides test structures and test data
 """
+import gzip
+import http.server
+import threading
+import urllib.parse
+
+import pytest
 
 
 def data_for_check_year_parameter():
@@ -34,3 +40,78 @@ def data_for_check_year_parameter():
             data = (day_month, {"day": control_data_day, "month": control_data_month})
             test_data.append(data)
     return test_data
+
+
+class StandInServer:
+    """
+    Local HTTP server which replaces a database in tests. All requests are recorded and
+    answered with the response registered for the path.
+    """
+
+    def __init__(self):
+        self.requests = []
+        self.responses = {}
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            """
+            Request handler which records the request and sends the registered response
+            """
+
+            def _handle(self):
+                url = urllib.parse.urlsplit(self.path)
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if self.headers.get("Content-Encoding") == "gzip":
+                    body = gzip.decompress(body)
+                server.requests.append(
+                    {
+                        "method": self.command,
+                        "path": url.path,
+                        "params": dict(urllib.parse.parse_qsl(url.query)),
+                        "headers": dict(self.headers),
+                        "body": body.decode("utf-8"),
+                    }
+                )
+                status, headers, content = server.responses.get(url.path, (204, {}, ""))
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(len(content.encode("utf-8"))))
+                self.end_headers()
+                self.wfile.write(content.encode("utf-8"))
+
+            do_GET = _handle
+            do_POST = _handle
+
+            def log_message(self, *_):
+                pass
+
+        self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.port = self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever, args=(0.05,), daemon=True)
+        self.thread.start()
+
+    def respond(self, path: str, status: int, content: str = "", headers: dict = None):
+        """
+        Register the response for a path
+        :return: None
+        """
+        self.responses[path] = (status, headers or {}, content)
+
+    def close(self):
+        """
+        Stop the server
+        :return: None
+        """
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture(name="stand_in_server")
+def fixture_stand_in_server():
+    """
+    Local stand-in HTTP server for database tests
+    """
+    server = StandInServer()
+    yield server
+    server.close()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pre-aggregation stage of the ingest pipeline. The samples of a device are collected in
+memory for a fixed time window and written as one point per window. The point holds the
+sum of the energy fields, the mean of all other numeric fields and the minimum and maximum
+of the configured fields. The raw samples still reach the listeners of the pipeline.
+"""
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+
+from source.constants import (
+    CENSUS_MEASUREMENT,
+    HEALTH_MEASUREMENT,
+    DEFAULT_AGGREGATION_WINDOW_S,
+    DEFAULT_AGGREGATION_MIN_MAX_FIELDS,
+)
+from source.compression import is_energy_field
+from source.configuration import apply_positive_int_settings, apply_field_list_setting
+
+
+@dataclass
+class AggregationConfig:
+    """
+    Settings of the pre-aggregation, read from the section aggregation of a device.
+    """
+
+    window_s: int = DEFAULT_AGGREGATION_WINDOW_S
+    fields: list = field(default_factory=lambda: list(DEFAULT_AGGREGATION_MIN_MAX_FIELDS))
+
+
+def check_aggregation_config(device_name: str, settings: dict) -> AggregationConfig:
+    """
+    Check the pre-aggregation settings of a device. Invalid values are replaced by the
+    default values.
+    :param device_name: Device name for the log messages
+    :param settings: Settings of the device from devices.json
+    :return: Aggregation configuration or None if the pre-aggregation is not active
+    """
+    aggregation_settings = settings.get("aggregation", {})
+    if not aggregation_settings.get("active", False):
+        return None
+    config = AggregationConfig()
+    apply_positive_int_settings(
+        config, aggregation_settings, ("window_s",), f"aggregation of {device_name}"
+    )
+    apply_field_list_setting(config, aggregation_settings, f"aggregation of {device_name}")
+    return config
+
+
+def window_start(timestamp: datetime, window_s: int) -> datetime:
+    """
+    Start of the window which contains the timestamp. The windows are aligned to the
+    full minute, hour or day like the windows of the database queries.
+    :param timestamp: Timestamp of a sample
+    :param window_s: Length of the window in seconds
+    :return: Start of the window
+    """
+    epoch = datetime(1970, 1, 1, tzinfo=timestamp.tzinfo)
+    offset = (timestamp - epoch) % timedelta(seconds=window_s)
+    return timestamp - offset
+
+
+@dataclass
+class Window:
+    """
+    Running statistics of one window. The values hold the sum, count, minimum and
+    maximum of every numeric field.
+    """
+
+    start: datetime
+    tags: dict
+    sample_count: int = 0
+    values: dict = field(default_factory=dict)
+    flags: dict = field(default_factory=dict)
+
+    def add(self, point: dict) -> None:
+        """
+        Add a valid sample to the window.
+        :param point: Census point of a successful poll
+        :return: None
+        """
+        self.sample_count += point["fields"].get("sample_count") or 1
+        for name, value in point["fields"].items():
+            if name in ("fetch_success", "sample_count") or value is None:
+                continue
+            if isinstance(value, bool):
+                self.flags[name] = self.flags.get(name, True) and value
+            elif isinstance(value, (int, float)):
+                statistics = self.values.get(name)
+                if statistics is None:
+                    self.values[name] = [value, 1, value, value]
+                else:
+                    statistics[0] += value
+                    statistics[1] += 1
+                    statistics[2] = min(statistics[2], value)
+                    statistics[3] = max(statistics[3], value)
+
+    def to_point(self, min_max_fields: list) -> dict:
+        """
+        Create the point of the window.
+        :param min_max_fields: Fields for which the minimum and maximum are written
+        :return: Census point with the start of the window as time
+        """
+        fields = {"fetch_success": True, "sample_count": self.sample_count}
+        for name, (total, count, minimum, maximum) in self.values.items():
+            if is_energy_field(name):
+                fields[name] = total
+                continue
+            fields[name] = total / count
+            if name in min_max_fields:
+                fields[f"{name}_min"] = minimum
+                fields[f"{name}_max"] = maximum
+        fields |= self.flags
+        return {
+            "measurement": CENSUS_MEASUREMENT,
+            "tags": self.tags,
+            "time": self.start,
+            "fields": fields,
+        }
+
+
+class WindowAggregator:
+    """
+    Pre-aggregation stage for the census samples of one device. Failed polls and all
+    other measurements pass unchanged. A window is written as soon as a poll of a later
+    window arrives, also if this poll failed.
+    """
+
+    def __init__(self, config: AggregationConfig):
+        self.config = config
+        self.window = None
+
+    def flush(self) -> list:
+        """
+        Write the open window.
+        :return: Points to write
+        """
+        if self.window is None:
+            return []
+        point = self.window.to_point(self.config.fields)
+        self.window = None
+        return [point]
+
+    def process(self, points: list) -> list:
+        """
+        Aggregate the points of one poll.
+        :param points: Points of the device handler
+        :return: Points to write
+        """
+        result = []
+        for point in points:
+            if point["measurement"] not in (CENSUS_MEASUREMENT, HEALTH_MEASUREMENT):
+                result.append(point)
+                continue
+            start = window_start(point["time"], self.config.window_s)
+            if self.window is not None and self.window.start != start:
+                result += self.flush()
+            if point["measurement"] == CENSUS_MEASUREMENT and point["fields"].get(
+                "fetch_success", False
+            ):
+                if self.window is None:
+                    self.window = Window(start, point["tags"])
+                self.window.add(point)
+            else:
+                result.append(point)
+        return result
+
+
+def main() -> None:
+    """
+    Scheduling function for regular call.
+    :return: None
+    """
+
+
+if __name__ == "__main__":
+    main()
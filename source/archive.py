@@ -0,0 +1,432 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compressed archive for old raw samples of the census measurement. Every device has one file
+per day in which the timestamps are stored as delta of delta and every field as XOR
+compressed float column. The files are read with a memory map and only the requested
+columns are decoded. The export job moves days older than the configured age from the
+database into the archive.
+"""
+import os
+import json
+import mmap
+import math
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Iterator
+
+from source.constants import (
+    CENSUS_MEASUREMENT,
+    ARCHIVE_FILE_SUFFIX,
+    ARCHIVE_STATE_FILE,
+    DEFAULT_ARCHIVE_EXPORT_AFTER_DAYS,
+    DEFAULT_ARCHIVE_DAYS_PER_RUN,
+    DEFAULT_ARCHIVE_FIRST_DAY,
+)
+from source import gorilla
+from source import logging_helper as lh
+from source.configuration import read_config_section, apply_positive_int_settings
+from source.line_protocol import encode_timestamp
+
+ARCHIVE_MAGIC = b"ISDLGRL1"
+HEADER_LENGTH_BYTES = 4
+DAY_FORMAT = "%Y-%m-%d"
+ONE_DAY = timedelta(days=1)
+# Queries exclude the start, so a day is queried from just before midnight
+BEFORE_MIDNIGHT = timedelta(microseconds=1)
+COLUMN_TYPE_CONVERTER = {
+    "float": float,
+    "integer": int,
+    "boolean": bool,
+}
+
+
+@dataclass
+class ArchiveConfig:
+    """
+    Settings of the archive, read from the section archive in config.json.
+    """
+
+    active: bool = False
+    export_after_days: int = DEFAULT_ARCHIVE_EXPORT_AFTER_DAYS
+    days_per_run: int = DEFAULT_ARCHIVE_DAYS_PER_RUN
+    first_day: str = DEFAULT_ARCHIVE_FIRST_DAY
+
+
+def check_archive_config() -> ArchiveConfig:
+    """
+    Read the archive settings from the configuration file. Missing or invalid values are
+    replaced by the default values.
+    :return: Checked archive configuration
+    """
+    config = ArchiveConfig()
+    archive_settings = read_config_section("archive")
+    if isinstance(archive_settings.get("active"), bool):
+        config.active = archive_settings["active"]
+    apply_positive_int_settings(
+        config, archive_settings, ("export_after_days", "days_per_run"), "archive"
+    )
+    first_day = archive_settings.get("first_day")
+    if first_day is not None:
+        try:
+            datetime.strptime(first_day, DAY_FORMAT)
+            config.first_day = first_day
+        except (TypeError, ValueError):
+            message = (
+                f"The archive setting first_day {first_day} is not a date like 2023-01-01. "
+                f"The default value {config.first_day} is used."
+            )
+            lh.write_log(lh.LoggingLevel.WARNING.value, message)
+    return config
+
+
+def column_type(values: list) -> str:
+    """
+    Type of a column, stored in the header to restore the values.
+    :param values: Values of the column, None for missing values
+    :return: float, integer or boolean
+    """
+    types = {type(value) for value in values if value is not None}
+    if float in types:
+        return "float"
+    if types == {bool}:
+        return "boolean"
+    return "integer"
+
+
+def encode_day(device: str, day: datetime, rows: list) -> bytes:
+    """
+    Encode the rows of one device and day to the archive file format. Only numeric and
+    boolean fields are archived.
+    :param device: Device name
+    :param day: Day of the rows
+    :param rows: Rows sorted by time with the time as epoch milliseconds
+    :return: Content of the archive file
+    """
+    names = sorted(
+        {
+            key
+            for row in rows
+            for key, value in row.items()
+            if isinstance(value, (int, float)) and key not in ("time", "device")
+        }
+    )
+    blocks = [gorilla.encode_timestamps([row["time"] for row in rows])]
+    header = {
+        "device": device,
+        "day": day.strftime(DAY_FORMAT),
+        "count": len(rows),
+        "time": {"offset": 0, "length": len(blocks[0])},
+        "columns": {},
+    }
+    offset = len(blocks[0])
+    for name in names:
+        values = [row.get(name) for row in rows]
+        block = gorilla.encode_floats(
+            [math.nan if value is None else float(value) for value in values]
+        )
+        header["columns"][name] = {
+            "type": column_type(values),
+            "offset": offset,
+            "length": len(block),
+        }
+        blocks.append(block)
+        offset += len(block)
+    encoded_header = json.dumps(header).encode("utf-8")
+    return b"".join(
+        [
+            ARCHIVE_MAGIC,
+            len(encoded_header).to_bytes(HEADER_LENGTH_BYTES, "big"),
+            encoded_header,
+        ]
+        + blocks
+    )
+
+
+class ArchiveFile:
+    """
+    Memory mapped archive file of one device and day for the context manager.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = None
+        self.buffer = None
+        self.header = {}
+        self.data_start = 0
+
+    def __enter__(self):
+        self.file = open(self.path, "rb")  # pylint: disable=consider-using-with
+        self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.buffer[: len(ARCHIVE_MAGIC)] != ARCHIVE_MAGIC:
+            self.__exit__(None, None, None)
+            raise ValueError(f"{self.path} is not an archive file.")
+        header_start = len(ARCHIVE_MAGIC) + HEADER_LENGTH_BYTES
+        header_length = int.from_bytes(self.buffer[len(ARCHIVE_MAGIC): header_start], "big")
+        self.data_start = header_start + header_length
+        self.header = json.loads(self.buffer[header_start: self.data_start])
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.buffer.close()
+        self.file.close()
+
+    def timestamps(self) -> list:
+        """
+        Decode the timestamps.
+        :return: Timestamps as epoch milliseconds
+        """
+        return gorilla.decode_timestamps(
+            self.buffer, self.header["count"], self.data_start + self.header["time"]["offset"]
+        )
+
+    def column(self, name: str) -> list:
+        """
+        Decode one column with the original type of the values.
+        :param name: Field name
+        :return: Values, None for missing values
+        """
+        info = self.header["columns"].get(name)
+        if info is None:
+            return [None] * self.header["count"]
+        converter = COLUMN_TYPE_CONVERTER[info["type"]]
+        return [
+            None if math.isnan(value) else converter(value)
+            for value in gorilla.decode_floats(
+                self.buffer, self.header["count"], self.data_start + info["offset"]
+            )
+        ]
+
+    def rows(
+        self, start_ms: int, end_ms: int, fields: list = None, filters: dict = None
+    ) -> Iterator[dict]:
+        """
+        Rows between start and end (both exclusive) with the requested fields.
+        :param start_ms: Start as epoch milliseconds
+        :param end_ms: End as epoch milliseconds
+        :param fields: Fields to return, all fields if None
+        :param filters: Field values the rows must match
+        :return: Rows with the key time and the requested fields
+        """
+        names = list(fields) if fields else sorted(self.header["columns"])
+        filters = filters or {}
+        columns = {name: self.column(name) for name in set(names) | set(filters)}
+        for index, timestamp in enumerate(self.timestamps()):
+            if not start_ms < timestamp < end_ms:
+                continue
+            if any(columns[key][index] != value for key, value in filters.items()):
+                continue
+            row = {"time": timestamp}
+            for name in names:
+                row[name] = columns[name][index]
+            yield row
+
+
+class RawSampleArchive:
+    """
+    Directory with one subdirectory per device. Each device directory holds the day files
+    and a state file with the day up to which the data was moved from the database.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.exported = {}
+
+    def _device_directory(self, device: str) -> str:
+        return os.path.join(self.directory, device.replace(os.sep, "_"))
+
+    def day_path(self, device: str, day: datetime) -> str:
+        """
+        Path of the archive file of a device and day.
+        :param device: Device name
+        :param day: Day
+        :return: Path of the file
+        """
+        return os.path.join(
+            self._device_directory(device), day.strftime(DAY_FORMAT) + ARCHIVE_FILE_SUFFIX
+        )
+
+    def exported_until(self, device: str) -> datetime:
+        """
+        All census data of the device before this day is in the archive.
+        :param device: Device name
+        :return: Midnight of the first day which is not archived or None
+        """
+        if device not in self.exported:
+            path = os.path.join(self._device_directory(device), ARCHIVE_STATE_FILE)
+            try:
+                with open(path, encoding="utf-8") as file:
+                    self.exported[device] = datetime.strptime(
+                        json.load(file)["exported_until"], DAY_FORMAT
+                    )
+            except FileNotFoundError:
+                self.exported[device] = None
+        return self.exported[device]
+
+    def set_exported_until(self, device: str, day: datetime) -> None:
+        """
+        Save the day up to which the data of the device is archived.
+        :param device: Device name
+        :param day: Midnight of the first day which is not archived
+        :return: None
+        """
+        os.makedirs(self._device_directory(device), exist_ok=True)
+        path = os.path.join(self._device_directory(device), ARCHIVE_STATE_FILE)
+        with open(path + ".tmp", "w", encoding="utf-8") as file:
+            json.dump({"exported_until": day.strftime(DAY_FORMAT)}, file)
+        os.replace(path + ".tmp", path)
+        self.exported[device] = day
+
+    def write_day(self, device: str, day: datetime, rows: list) -> None:
+        """
+        Write the rows of one day. The file is replaced atomically.
+        :param device: Device name
+        :param day: Day of the rows
+        :param rows: Rows sorted by time with the time as epoch milliseconds
+        :return: None
+        """
+        os.makedirs(self._device_directory(device), exist_ok=True)
+        path = self.day_path(device, day)
+        with open(path + ".tmp", "wb") as file:
+            file.write(encode_day(device, day, rows))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(path + ".tmp", path)
+
+    def field_keys(self, device: str, start: datetime, end: datetime) -> list:
+        """
+        Names of the fields in the archived days of a device, only the headers are read.
+        :param device: Device name
+        :param start: Start of the range
+        :param end: End of the range
+        :return: Sorted field names
+        """
+        fields = set()
+        day = datetime(start.year, start.month, start.day)
+        while day < end:
+            path = self.day_path(device, day)
+            if os.path.exists(path):
+                with ArchiveFile(path) as archive_file:
+                    fields |= set(archive_file.header["columns"])
+            day += ONE_DAY
+        return sorted(fields)
+
+    def scan(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        device: str,
+        start: datetime,
+        end: datetime,
+        fields: list = None,
+        filters: dict = None,
+    ) -> Iterator[dict]:
+        """
+        Stream the archived rows of a device between start and end (both exclusive). Only
+        one day is decoded at a time.
+        :param device: Device name
+        :param start: Start of the range
+        :param end: End of the range
+        :param fields: Fields to return, all fields if None
+        :param filters: Field values the rows must match
+        :return: Rows with the key time and the requested fields
+        """
+        start_ms = encode_timestamp(start, "ms")
+        end_ms = encode_timestamp(end, "ms")
+        day = datetime(start.year, start.month, start.day)
+        while day < end:
+            path = self.day_path(device, day)
+            if os.path.exists(path):
+                with ArchiveFile(path) as archive_file:
+                    yield from archive_file.rows(start_ms, end_ms, fields, filters)
+            day += ONE_DAY
+
+
+def first_of_next_month(day: datetime) -> datetime:
+    """
+    Midnight of the first day of the following month.
+    :param day: Day
+    :return: First day of the next month
+    """
+    if day.month == 12:
+        return datetime(day.year + 1, 1, 1)
+    return datetime(day.year, day.month + 1, 1)
+
+
+def export_device(
+    backend, archive: RawSampleArchive, device: str, cutoff: datetime, config: ArchiveConfig
+) -> int:
+    """
+    Move the census data of a device older than the cutoff day by day into the archive.
+    Months without data are skipped with one count query. The boundary of a day moves
+    after its archive file was written and before the day is deleted from the database,
+    so the readers always find the day in one of both. Rows of the last archived day
+    which were left in the database by an interrupted run are deleted first.
+    :param backend: Storage backend of the database
+    :param archive: Archive
+    :param device: Device name
+    :param cutoff: Midnight of the first day which stays in the database
+    :param config: Archive configuration
+    :return: Number of archived days with data
+    """
+    day = archive.exported_until(device)
+    if day is None:
+        day = datetime.strptime(config.first_day, DAY_FORMAT)
+    else:
+        backend.delete_range(CENSUS_MEASUREMENT, device, day - ONE_DAY, day)
+    archived_days = 0
+    while day < cutoff and archived_days < config.days_per_run:
+        month_end = min(first_of_next_month(day), cutoff)
+        count = backend.query_aggregate(
+            CENSUS_MEASUREMENT, device, day - BEFORE_MIDNIGHT, month_end, "fetch_success", "count"
+        )
+        if not count:
+            archive.set_exported_until(device, month_end)
+            day = month_end
+            continue
+        while day < month_end and archived_days < config.days_per_run:
+            rows = list(
+                backend.query_range(
+                    CENSUS_MEASUREMENT, device, day - BEFORE_MIDNIGHT, day + ONE_DAY
+                )
+            )
+            if rows:
+                archive.write_day(device, day, rows)
+            archive.set_exported_until(device, day + ONE_DAY)
+            if rows:
+                backend.delete_range(CENSUS_MEASUREMENT, device, day, day + ONE_DAY)
+                archived_days += 1
+            day += ONE_DAY
+    return archived_days
+
+
+def export(backend, archive: RawSampleArchive, devices: list, config: ArchiveConfig) -> None:
+    """
+    Export job: move the old census data of all devices into the archive.
+    :param backend: Storage backend of the database
+    :param archive: Archive
+    :param devices: Device names
+    :param config: Archive configuration
+    :return: None
+    """
+    today = datetime.utcnow()
+    cutoff = datetime(today.year, today.month, today.day) - timedelta(
+        days=config.export_after_days
+    )
+    for device in devices:
+        archived_days = export_device(backend, archive, device, cutoff, config)
+        if archived_days:
+            message = (
+                f"{archived_days} days of {device} were moved to the archive, archived "
+                f"until {archive.exported_until(device):{DAY_FORMAT}}."
+            )
+            lh.write_log(lh.LoggingLevel.INFO.value, message)
+
+
+def main() -> None:
+    """
+    Scheduling function for regular call.
+    :return: None
+    """
+
+
+if __name__ == "__main__":
+    main()
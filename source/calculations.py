@@ -6,8 +6,10 @@ in Daily, monthly, and yearly rhythm.
 """
 import re
 import json
+import math
+import threading
 from datetime import datetime, timedelta
-import influxdb.resultset
+from typing import Callable
 from dateutil.relativedelta import relativedelta
 
 from source.constants import (
@@ -15,12 +17,24 @@ from source.constants import (
     TIME_OF_DAY_SCHEDULE_MATCH,
     DAY_OF_MONTH_SCHEDULE_MATCH,
     DATE_OF_YEAR_SCHEDULE_MATCH,
+    CENSUS_MEASUREMENT,
+    POWER_BASELOAD_QUANTILE,
 )
 from source import support_functions as sf
 from source import logging_helper as lh
+from source import rollup
+from source import report_store
+from source import kernels
+from source.line_protocol import encode_timestamp
+from source.storage import StorageBackend
+from source.query_executor import cancellable
+from source.quantile_sketch import QuantileSketch
 
 TIMESTAMP_FORMAT_INPUT = "%Y-%m-%dT%H:%M:%S.%fZ"
 TIMESTAMP_FORMAT_OUTPUT = "%Y-%m-%dT%H:%M:%S"
+CALCULATION_PERIODS = (relativedelta(days=1), relativedelta(months=1), relativedelta(years=1))
+STREAMED_FIELDS = ["energy_wh", "power", "sample_count"]
+CALCULATION_DATA_KEYS = ("start_date", "end_date") + report_store.REPORT_COLUMNS
 configuration_failed_message_send = {
     "FileNotFoundError": False,
     "ValueError": False,
@@ -137,12 +151,13 @@ def check_cost_config() -> float:
         return default_price
 
 
-def cost_calc(
+def cost_calc(  # pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-locals
     settings: dict,
     data: dict,
     current_timestamp: datetime,
     time_difference: relativedelta,
-    db_fetch: influxdb.resultset.ResultSet,
+    db_fetch: list,
+    failure_count: int,
 ) -> None:
     """
     Calculate the monthly cost for a specific device.
@@ -150,7 +165,8 @@ def cost_calc(
     :param data: data structure for writing in file
     :param current_timestamp: Now date and time from request
     :param time_difference: needed time difference for calculation
-    :param db_fetch: Result set from device
+    :param db_fetch: Valid measurements or aggregated rows of the device
+    :param failure_count: Number of failed polls in the period
     :return: None
     """
     start_date = current_timestamp - time_difference
@@ -158,23 +174,14 @@ def cost_calc(
     end_date = current_timestamp
     end_date_format = end_date.strftime("%Y-%m-%d %H:%M:%S")
 
-    success_measurements = list(
-        filter(
-            lambda measurement: measurement["fetch_success"] is True,
-            db_fetch.get_points(),
-        )
-    )
-    failed_measurements = list(
-        filter(
-            lambda measurement: measurement["fetch_success"] is False,
-            db_fetch.get_points(),
-        )
-    )
-    sum_of_energy_in_kwh = round(
-        (sum(element["energy_wh"] for element in success_measurements) / 1000), 2
-    )
+    success_count = 0
+    sum_of_energy_in_wh = 0
+    for element in db_fetch:
+        success_count += element.get("sample_count") or 1
+        sum_of_energy_in_wh += element["energy_wh"]
+    sum_of_energy_in_kwh = round((sum_of_energy_in_wh / 1000), 2)
     cost_kwh = check_cost_config()
-    if (len(success_measurements) + len(failed_measurements)) == 0:
+    if (success_count + failure_count) == 0:
         return
     max_values = ((end_date - start_date).total_seconds()) / settings["update_time"]
 
@@ -183,28 +190,24 @@ def cost_calc(
     data["sum_of_energy"] = sum_of_energy_in_kwh
     data["total_cost"] = sum_of_energy_in_kwh * cost_kwh
     data["cost_kwh"] = cost_kwh
-    data["error_rate_one"] = (
-        len(failed_measurements)
-        * 100
-        / (len(success_measurements) + len(failed_measurements))
-    )
-    data["error_rate_two"] = (max_values - len(success_measurements)) * 100 / max_values
+    data["error_rate_one"] = failure_count * 100 / (success_count + failure_count)
+    data["error_rate_two"] = (max_values - success_count) * 100 / max_values
 
 
-def power_on_calc(  # pylint: disable=too-many-locals
+def power_on_calc(
     settings: dict,
     data: dict,
     current_timestamp: datetime,
     time_difference: relativedelta,
-    db_fetch: influxdb.resultset.ResultSet,
+    power_on: int,
 ) -> None:
     """
-    Calculate the monthly cost for a specific device.
+    Write the power on count for a specific device.
     :param settings: device parameters
     :param data: data structure for writing in file
     :param current_timestamp: Now date and time from request
     :param time_difference: needed time difference for calculation
-    :param db_fetch: Result set from device
+    :param power_on: Counted power on transitions, None if there is no valid power value
     :return: None
     """
     start_date = current_timestamp - time_difference
@@ -212,25 +215,10 @@ def power_on_calc(  # pylint: disable=too-many-locals
     end_date = current_timestamp
     end_date_format = end_date.strftime("%Y-%m-%d %H:%M:%S")
 
-    values = [element["power"] for element in db_fetch.get_points()]
-    counter = 0
-    high_threshold = settings["power_on_counter"]["on_threshold"]
-    low_threshold = settings["power_on_counter"]["off_threshold"]
-    high_threshold_passed = False
-    no_valid_data = True
-    for value in values:
-        if value is None:
-            continue
-        if (value >= high_threshold) and not high_threshold_passed:
-            high_threshold_passed = True
-        elif (value < low_threshold) and high_threshold_passed:
-            counter += 1
-            high_threshold_passed = False
-        no_valid_data = False
-    data["power_on"] = counter
+    data["power_on"] = power_on if power_on is not None else 0
     data["start_date"] = start_date_format
     data["end_date"] = end_date_format
-    if no_valid_data:
+    if power_on is None:
         error_message = (
             f"For {settings['device_name']} no data available between "
             f"{start_date_format} - {end_date_format}"
@@ -238,6 +226,24 @@ def power_on_calc(  # pylint: disable=too-many-locals
         lh.write_log(lh.LoggingLevel.WARNING.value, error_message)
 
 
+def power_statistics(sketch: QuantileSketch) -> dict:
+    """
+    Power statistics of a period from its power sketch. The peak is the exact maximum, the
+    baseload is the power the device stays above for all but a small share of the period.
+    :param sketch: Power sketch of the period, None if it has none
+    :return: Report values of the power statistics, empty if the sketch holds no value
+    """
+    if sketch is None or sketch.count == 0:
+        return {}
+    return {
+        "power_p50": sketch.quantile(0.5),
+        "power_p95": sketch.quantile(0.95),
+        "power_p99": sketch.quantile(0.99),
+        "power_peak": float(sketch.max),
+        "power_baseload": sketch.quantile(POWER_BASELOAD_QUANTILE),
+    }
+
+
 def last_day_of_month(date) -> datetime:
     """
     Functions calculate the last day of the provided date.
@@ -364,103 +370,384 @@ def check_matched_day_and_month(
     return False
 
 
-def fetch_device_data_for_calculation(
-    settings: dict, current_timestamp: datetime, time_difference: relativedelta
-) -> influxdb.resultset.ResultSet:
+class PeriodAccumulator:
+    """
+    Aggregates of periods which end at the same time, computed in one pass over the rows
+    of the longest period in time order. Only running totals, the hysteresis state and a
+    quantile sketch of the power of each period are kept, so the memory does not grow with
+    the length of the periods.
+    """
+
+    def __init__(self, starts: list, thresholds: tuple):
+        self.starts_ms = [encode_timestamp(start, "ms") for start in starts]
+        self.statistics = [{"energy_wh": 0, "sample_count": 0} for _ in starts]
+        self.failure_counts = [0] * len(starts)
+        self.counters = [rollup.PowerOnCounter(*thresholds) for _ in starts]
+        self.power_on = [None] * len(starts)
+        self.sketches = [QuantileSketch() for _ in starts]
+
+    def add_sample(self, row: dict) -> None:
+        """
+        Add a valid sample to all periods which contain it.
+        :param row: Row with time in epoch milliseconds, energy_wh, power and sample_count
+        :return: None
+        """
+        power = row.get("power")
+        for index, start_ms in enumerate(self.starts_ms):
+            if row["time"] <= start_ms:
+                continue
+            statistics = self.statistics[index]
+            statistics["energy_wh"] += row.get("energy_wh") or 0
+            statistics["sample_count"] += row.get("sample_count") or 1
+            if power is not None:
+                completed = self.counters[index].update(power)
+                self.power_on[index] = (self.power_on[index] or 0) + completed
+                self.sketches[index].add(power, row.get("sample_count") or 1)
+
+    def add_columns(self, columns: dict) -> None:
+        """
+        Add a chunk of rows with the vectorized kernels, with the same result as adding
+        the rows one by one.
+        :param columns: Columns of the rows, see kernels.chunk_aggregates()
+        :return: None
+        """
+        for index, start_ms in enumerate(self.starts_ms):
+            statistics = self.statistics[index]
+            energy_wh, sample_count, failure_count, power_on = kernels.chunk_aggregates(
+                columns, start_ms, statistics["energy_wh"], self.counters[index]
+            )
+            statistics["energy_wh"] = energy_wh
+            statistics["sample_count"] += sample_count
+            self.failure_counts[index] += failure_count
+            if power_on is not None:
+                self.power_on[index] = (self.power_on[index] or 0) + power_on
+            self.sketches[index].add_array(*kernels.valid_power(columns, start_ms))
+
+    def add_failure(self, time_ms: int) -> None:
+        """
+        Add a failed poll to all periods which contain it.
+        :param time_ms: Time of the poll in epoch milliseconds
+        :return: None
+        """
+        for index, start_ms in enumerate(self.starts_ms):
+            if time_ms > start_ms:
+                self.failure_counts[index] += 1
+
+
+def stream_period_aggregates(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+    backend: StorageBackend,
+    device: str,
+    end: datetime,
+    starts: list,
+    thresholds: tuple,
+    cancel: threading.Event = None,
+) -> PeriodAccumulator:
+    """
+    Evaluate periods which end at the same time in one pass over the streamed census rows
+    of the longest period. If NumPy is installed the rows are decoded into columns and
+    evaluated in chunks with the vectorized kernels. With the split schema the failed
+    polls are streamed from the health measurement.
+    :param backend: Storage backend
+    :param device: Device name
+    :param end: Common end of the periods in UTC
+    :param starts: Starts of the periods in UTC
+    :param thresholds: On and off threshold of the power on counter
+    :param cancel: Event which stops the streaming when the query is cancelled
+    :return: Accumulator with the aggregates per period
+    """
+    cancel = cancel or threading.Event()
+    accumulator = PeriodAccumulator(starts, thresholds)
+    start = min(starts)
+    failure_measurement, failure_field = backend.failure_source()
+    legacy = failure_measurement == CENSUS_MEASUREMENT
+    fields = STREAMED_FIELDS + ["fetch_success"] if legacy else STREAMED_FIELDS
+    if kernels.available():
+        for columns in cancellable(
+            backend.query_columns(CENSUS_MEASUREMENT, device, start, end, fields), cancel
+        ):
+            accumulator.add_columns(kernels.numpy_columns(columns))
+    else:
+        for row in cancellable(
+            backend.query_range(CENSUS_MEASUREMENT, device, start, end, fields), cancel
+        ):
+            success = row.get("fetch_success") if legacy else True
+            if success:
+                accumulator.add_sample(row)
+            elif success is not None:
+                accumulator.add_failure(row["time"])
+    if not legacy:
+        for row in cancellable(
+            backend.query_range(
+                failure_measurement, device, start, end, [failure_field], {failure_field: False}
+            ),
+            cancel,
+        ):
+            accumulator.add_failure(row["time"])
+    return accumulator
+
+
+def bucket_power_on_count(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+    backend: StorageBackend,
+    device: str,
+    start: datetime,
+    end: datetime,
+    thresholds: tuple,
+    interval: timedelta,
+) -> int:
+    """
+    Count the power on transitions on the maximum power of time buckets, for periods
+    whose raw rows are too many to stream. A device counts as off only if it stayed below
+    the off threshold for a whole bucket.
+    :param backend: Storage backend
+    :param device: Device name
+    :param start: Start of the period in UTC
+    :param end: End of the period in UTC
+    :param thresholds: On and off threshold of the power on counter
+    :param interval: Length of the buckets
+    :return: Number of power on transitions or None if there is no valid power value
+    """
+    rows = backend.query_buckets(
+        CENSUS_MEASUREMENT,
+        device,
+        start,
+        end,
+        "power",
+        "max",
+        interval,
+        backend.valid_sample_filter(),
+        end,
+    )
+    if not rows:
+        return None
+    return rollup.PowerOnCounter(*thresholds).count([row["value"] for row in rows])
+
+
+def run_report_query(query: Callable[[], object]):
+    """
+    Run a query of the reports on the query executor with the deadline of the reports.
+    :param query: Function which runs the query
+    :return: Result of the query
+    """
+    return sf.run_query(
+        "reports", lambda _: query(), sf.get_query_executor().config.report_timeout_s
+    )
+
+
+def routed_power_on_count(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+    backend: StorageBackend,
+    settings: dict,
+    start: datetime,
+    end: datetime,
+    thresholds: tuple,
+) -> int:
     """
-    Fetch the device date from requested time delta.
+    Count the power on transitions of a period with too many raw rows on time buckets,
+    which are sized so that the bucket rows stay within max_raw_rows.
+    :param backend: Storage backend
     :param settings: device parameters
-    :param current_timestamp: Now date and time from request
-    :param time_difference: needed time difference for calculation
-    :return: Result set from device
+    :param start: Start of the period in UTC
+    :param end: End of the period in UTC
+    :param thresholds: On and off threshold of the power on counter
+    :return: Number of power on transitions or None if there is no valid power value
     """
-    start_date = current_timestamp - time_difference
-    start_date_format = start_date.strftime("%Y-%m-%d %H:%M:%S")
-    end_date = current_timestamp
-    end_date_format = end_date.strftime("%Y-%m-%d %H:%M:%S")
+    executor = sf.get_query_executor()
+    duration_min = (end - start).total_seconds() / 60
+    interval = timedelta(minutes=math.ceil(duration_min / executor.config.max_raw_rows))
+    message = (
+        f"The raw rows of {settings['device_name']} from {start} to {end} are too many, "
+        f"the power on count is taken from buckets of {interval}."
+    )
+    lh.write_log(lh.LoggingLevel.WARNING.value, message)
+    return run_report_query(
+        lambda: bucket_power_on_count(
+            backend, settings["device_name"], start, end, thresholds, interval
+        )
+    )
+
 
-    result = sf.fetch_measurements(
-        {
-            "device": settings["device_name"],
-            "target_date": start_date_format,
-            "current_date": end_date_format,
+def raw_period_aggregates(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+    settings: dict,
+    current_timestamp: datetime,
+    starts: dict,
+    power_periods: list,
+    thresholds: tuple,
+) -> tuple:
+    """
+    Evaluate the periods with a power on count on the raw data. The periods up to the
+    longest one whose estimated rows stay within max_raw_rows of the query executor are
+    streamed in one pass, longer periods count the power on transitions on time buckets.
+    :param settings: device parameters
+    :param current_timestamp: Now date and time from request
+    :param starts: Starts of the due periods by period index
+    :param power_periods: Indexes of the periods with a power on count
+    :param thresholds: On and off threshold of the power on counter
+    :return: Streamed periods, their sample statistics and failure counts, the power on
+    counts and the power sketches of the streamed periods by period index
+    """
+    backend = sf.get_storage_backend()
+    executor = sf.get_query_executor()
+    device = settings["device_name"]
+    raw_rows = run_report_query(
+        lambda: {
+            period: executor.raw_rows(
+                backend, CENSUS_MEASUREMENT, device, starts[period], current_timestamp,
+                settings["update_time"],
+            )
+            for period in power_periods
         }
     )
-    return result
+    oversized = [
+        period for period in power_periods if raw_rows[period] > executor.config.max_raw_rows
+    ]
+    power_on = {
+        period: routed_power_on_count(
+            backend, settings, starts[period], current_timestamp, thresholds
+        )
+        for period in oversized
+    }
+    raw_periods = [period for period in power_periods if period not in oversized]
+    if not raw_periods:
+        return [], {}, {}, power_on, {}
+    longest = min(starts[period] for period in raw_periods)
+    streamed = [period for period in starts if starts[period] >= longest]
+    accumulator = sf.run_query(
+        "reports",
+        lambda cancel: stream_period_aggregates(
+            backend,
+            device,
+            current_timestamp,
+            [starts[period] for period in streamed],
+            thresholds,
+            cancel,
+        ),
+        executor.config.report_timeout_s,
+    )
+    return (
+        streamed,
+        dict(zip(streamed, accumulator.statistics)),
+        dict(zip(streamed, accumulator.failure_counts)),
+        power_on | dict(zip(streamed, accumulator.power_on)),
+        dict(zip(streamed, accumulator.sketches)),
+    )
+
+
+def period_aggregates(
+    settings: dict, current_timestamp: datetime, starts: dict, calc_requested: dict
+) -> tuple:
+    """
+    Read the aggregates of the due periods, which all end at the current timestamp. The
+    rollups answer all periods if they cover the device. Otherwise the periods up to the
+    longest one with a power on count are evaluated in one streaming pass over the raw
+    data, see raw_period_aggregates(), and the remaining cost periods are aggregated by
+    the database. The power sketches are merged from the rollups or taken from the
+    streaming pass, other periods have none.
+    :param settings: device parameters
+    :param current_timestamp: Now date and time from request
+    :param starts: Starts of the due periods by period index
+    :param calc_requested: Structure which calculations are requested
+    :return: Sample statistics, failure counts, power on counts and power sketches by
+    period index
+    """
+    periods = list(starts)
+    reader = rollup.create_period_reader(
+        settings["device_name"], current_timestamp, list(starts.values())
+    )
+    power_periods = [period for period in periods if calc_requested["power_on_counter"][period]]
+    statistics, failure_counts, power_on, sketches = {}, {}, {}, {}
+    streamed = []
+    if isinstance(reader, rollup.RollupReader):
+        sketches = dict(zip(periods, run_report_query(reader.power_sketches)))
+    if power_periods:
+        thresholds = (
+            settings["power_on_counter"]["on_threshold"],
+            settings["power_on_counter"]["off_threshold"],
+        )
+        if isinstance(reader, rollup.RollupReader):
+            power_on = dict(
+                zip(periods, run_report_query(lambda: reader.power_on_counts(*thresholds)))
+            )
+        else:
+            streamed, statistics, failure_counts, power_on, sketches = raw_period_aggregates(
+                settings, current_timestamp, starts, power_periods, thresholds
+            )
+    if any(
+        calc_requested["cost_calc"][period] and period not in streamed for period in periods
+    ):
+        statistics = dict(zip(periods, run_report_query(reader.sample_statistics))) | statistics
+        failure_counts = (
+            dict(zip(periods, run_report_query(reader.failure_counts))) | failure_counts
+        )
+    return statistics, failure_counts, power_on, sketches
+
+
+def due_periods(calc_requested: dict, current_timestamp: datetime) -> list:
+    """
+    Periods whose calculation is requested and due today.
+    :param calc_requested: Structure which calculations are requested
+    :param current_timestamp: Now date and time from request
+    :return: Indexes of the periods, 0 for day, 1 for month and 2 for year
+    """
+    requested = [
+        calc_requested["cost_calc"][period] or calc_requested["power_on_counter"][period]
+        for period in range(len(CALCULATION_PERIODS))
+    ]
+    requested_day, requested_month = config_request_time["calc_request_time_yearly"].split(".")
+    due = [
+        True,
+        check_matched_day(
+            current_timestamp, int(config_request_time["calc_request_time_monthly"])
+        ),
+        check_matched_day_and_month(
+            current_timestamp, int(requested_day), int(requested_month)
+        ),
+    ]
+    return [
+        period for period in range(len(CALCULATION_PERIODS)) if requested[period] and due[period]
+    ]
 
 
 def calculation_handler(
     settings: dict,
     calc_requested: dict,
+    current_timestamp: datetime = None,
 ) -> None:
     """
-    Check with costs are requested and call the correct calculations.
+    Check with costs are requested and call the correct calculations. The due periods end
+    at the same time, so their aggregates are read together, see period_aggregates().
     :param settings: device parameters
     :param calc_requested: Structure which calculations are requested
+    :param current_timestamp: Common end of the periods of a report batch, now if None
     :return: None
     """
-    data = {
-        "start_date": "Not req",
-        "end_date": "Not req",
-        "sum_of_energy": "Not req",
-        "total_cost": "Not req",
-        "cost_kwh": "Not req",
-        "error_rate_one": "Not req",
-        "error_rate_two": "Not req",
-        "power_on": "Not req",
-    }
-    current_timestamp = datetime.utcnow()
-    if calc_requested["cost_calc"][0] or calc_requested["power_on_counter"][0]:
-        result = fetch_device_data_for_calculation(
-            settings, current_timestamp, relativedelta(days=1)
-        )
-    if calc_requested["cost_calc"][0]:
-        cost_calc(settings, data, current_timestamp, relativedelta(days=1), result)
-    if calc_requested["power_on_counter"][0]:
-        power_on_calc(settings, data, current_timestamp, relativedelta(days=1), result)
-
-    if calc_requested["cost_calc"][0] or calc_requested["power_on_counter"][0]:
-        sf.write_device_information(settings["device_name"] + "_day", data)
-
-    if calc_requested["cost_calc"][1] or calc_requested["power_on_counter"][1]:
-        data = {key: "Not req" for key in data}
-        requested_day = int(config_request_time["calc_request_time_monthly"])
-        if check_matched_day(current_timestamp, requested_day):
-            result = fetch_device_data_for_calculation(
-                settings, current_timestamp, relativedelta(months=1)
+    if current_timestamp is None:
+        current_timestamp = datetime.utcnow()
+    periods = due_periods(calc_requested, current_timestamp)
+    starts = {period: current_timestamp - CALCULATION_PERIODS[period] for period in periods}
+    statistics, failure_counts, power_on, sketches = period_aggregates(
+        settings, current_timestamp, starts, calc_requested
+    )
+    for period in periods:
+        data = {key: "Not req" for key in CALCULATION_DATA_KEYS}
+        if calc_requested["cost_calc"][period]:
+            cost_calc(
+                settings,
+                data,
+                current_timestamp,
+                CALCULATION_PERIODS[period],
+                [statistics[period]] if statistics[period]["sample_count"] else [],
+                failure_counts[period],
             )
-            if calc_requested["cost_calc"][1]:
-                cost_calc(
-                    settings, data, current_timestamp, relativedelta(months=1), result
-                )
-            if calc_requested["power_on_counter"][1]:
-                power_on_calc(
-                    settings, data, current_timestamp, relativedelta(months=1), result
-                )
-            sf.write_device_information(settings["device_name"] + "_month", data)
-
-    if calc_requested["cost_calc"][2] or calc_requested["power_on_counter"][2]:
-        data = {key: "Not req" for key in data}
-        requested_day, requested_month = config_request_time[
-            "calc_request_time_yearly"
-        ].split(".")
-        if check_matched_day_and_month(
-            current_timestamp,
-            int(requested_day),
-            int(requested_month),
-        ):
-            result = fetch_device_data_for_calculation(
-                settings, current_timestamp, relativedelta(years=1)
+        if calc_requested["power_on_counter"][period]:
+            power_on_calc(
+                settings, data, current_timestamp, CALCULATION_PERIODS[period], power_on[period]
             )
-            if calc_requested["cost_calc"][2]:
-                cost_calc(
-                    settings, data, current_timestamp, relativedelta(years=1), result
-                )
-            if calc_requested["power_on_counter"][2]:
-                power_on_calc(
-                    settings, data, current_timestamp, relativedelta(years=1), result
-                )
-            sf.write_device_information(settings["device_name"] + "_year", data)
+        data |= power_statistics(sketches.get(period))
+        if data["start_date"] == "Not req":
+            data["start_date"] = starts[period].strftime("%Y-%m-%d %H:%M:%S")
+            data["end_date"] = current_timestamp.strftime("%Y-%m-%d %H:%M:%S")
+        report_store.write_report(
+            settings["device_name"], report_store.PERIOD_TYPES[period], data
+        )
 
 
 def main() -> None:
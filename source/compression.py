@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compression stage of the ingest pipeline. Samples which can be reconstructed from the
+written points within a tolerance are not written. The deadband mode holds the last written
+value, the swinging door mode interpolates linearly between the written points. The energy
+of suppressed samples is added to the next written point and the field sample_count tells
+how many samples a point represents.
+"""
+from dataclasses import dataclass, field
+
+from source.constants import (
+    CENSUS_MEASUREMENT,
+    HEALTH_MEASUREMENT,
+    COMPRESSION_DEADBAND,
+    COMPRESSION_SWINGING_DOOR,
+    DEFAULT_COMPRESSION_HEARTBEAT_S,
+)
+from source import logging_helper as lh
+from source.configuration import apply_field_list_setting
+
+
+def is_energy_field(name: str) -> bool:
+    """
+    Energy fields are summed up over suppressed samples.
+    :param name: Field name
+    :return: True for energy_wh and the per-phase energy fields
+    """
+    return name == "energy_wh" or name.startswith("energy_wh_")
+
+
+@dataclass
+class CompressionConfig:
+    """
+    Settings of the compression, read from the section compression of a device.
+    """
+
+    mode: str = COMPRESSION_DEADBAND
+    absolute: float = 0.0
+    relative: float = 0.0
+    heartbeat_s: int = DEFAULT_COMPRESSION_HEARTBEAT_S
+    fields: list = field(default_factory=lambda: ["power"])
+
+
+def check_compression_config(device_name: str, settings: dict) -> CompressionConfig:
+    """
+    Check the compression settings of a device. Invalid values are replaced by the
+    default values.
+    :param device_name: Device name for the log messages
+    :param settings: Settings of the device from devices.json
+    :return: Compression configuration or None if the compression is not active
+    """
+    compression_settings = settings.get("compression", {})
+    if not compression_settings.get("active", False):
+        return None
+    config = CompressionConfig()
+    mode = compression_settings.get("mode", config.mode)
+    if mode in (COMPRESSION_DEADBAND, COMPRESSION_SWINGING_DOOR):
+        config.mode = mode
+    else:
+        message = (
+            f"The compression mode {mode} of {device_name} is not supported. The mode "
+            f"{config.mode} is used."
+        )
+        lh.write_log(lh.LoggingLevel.WARNING.value, message)
+    for key in ("absolute", "relative", "heartbeat_s"):
+        value = compression_settings.get(key)
+        if value is None:
+            continue
+        if isinstance(value, (int, float)) and not isinstance(value, bool) and value >= 0:
+            setattr(config, key, value)
+        else:
+            message = (
+                f"The compression setting {key} of {device_name} must be a positive number. "
+                f"The default value {getattr(config, key)} is used."
+            )
+            lh.write_log(lh.LoggingLevel.WARNING.value, message)
+    apply_field_list_setting(config, compression_settings, f"compression of {device_name}")
+    return config
+
+
+class SampleCompressor:
+    """
+    Compression stage for the census samples of one device. Failed polls and all other
+    measurements pass unchanged.
+    """
+
+    def __init__(self, config: CompressionConfig):
+        self.config = config
+        self.anchor = None
+        self.pending = None
+        self.doors = {}
+
+    def tolerance(self, reference: float) -> float:
+        """
+        Allowed deviation from a reference value.
+        :param reference: Reference value
+        :return: Larger value of the absolute and the relative tolerance
+        """
+        return max(self.config.absolute, self.config.relative * abs(reference))
+
+    def _merge(self, point: dict) -> dict:
+        """
+        Copy of the point which also carries the energy and the sample count of the
+        pending sample.
+        """
+        fields = dict(point["fields"])
+        fields["sample_count"] = point["fields"].get("sample_count") or 1
+        if self.pending is not None:
+            for name, value in self.pending["fields"].items():
+                if is_energy_field(name) and value is not None:
+                    fields[name] = fields.get(name, 0) + value
+            fields["sample_count"] += self.pending["fields"]["sample_count"]
+        return point | {"fields": fields}
+
+    def _tracked_values(self, point: dict) -> dict:
+        return {
+            name: point["fields"][name]
+            for name in self.config.fields
+            if point["fields"].get(name) is not None
+        }
+
+    def _outside_deadband(self, point: dict) -> bool:
+        anchor_values = self._tracked_values(self.anchor)
+        for name, value in self._tracked_values(point).items():
+            reference = anchor_values.get(name)
+            if reference is None or abs(value - reference) > self.tolerance(reference):
+                return True
+        return False
+
+    def _open_doors(self, point: dict) -> None:
+        self.doors = {}
+        self._door_closes(point)
+
+    def _door_closes(self, point: dict) -> bool:
+        """
+        Check if the line from the anchor to the point passes all samples since the anchor
+        within the tolerance and narrow the doors of all tracked fields with the point.
+        :return: True if the point does not fit through all doors
+        """
+        seconds = (point["time"] - self.anchor["time"]).total_seconds()
+        if seconds <= 0:
+            return False
+        anchor_values = self._tracked_values(self.anchor)
+        doors = {}
+        for name, value in self._tracked_values(point).items():
+            reference = anchor_values.get(name)
+            if reference is None:
+                return True
+            tolerance = self.tolerance(reference)
+            lower, upper = self.doors.get(name, (float("-inf"), float("inf")))
+            if not lower <= (value - reference) / seconds <= upper:
+                return True
+            doors[name] = (
+                max(lower, (value - tolerance - reference) / seconds),
+                min(upper, (value + tolerance - reference) / seconds),
+            )
+        self.doors |= doors
+        return False
+
+    def _heartbeat_due(self) -> bool:
+        seconds = (self.pending["time"] - self.anchor["time"]).total_seconds()
+        return seconds >= self.config.heartbeat_s
+
+    def _emit_pending(self) -> list:
+        if self.pending is None:
+            return []
+        emitted = self.pending
+        self.anchor = emitted
+        self.pending = None
+        self.doors = {}
+        return [emitted]
+
+    def compress(self, point: dict) -> list:
+        """
+        Compress one valid sample.
+        :param point: Census point of a successful poll
+        :return: Points to write
+        """
+        merged = self._merge(point)
+        if self.anchor is None:
+            self.anchor = merged
+            self.pending = None
+            return [merged]
+        emitted = []
+        if self.config.mode == COMPRESSION_DEADBAND:
+            self.pending = merged
+            if self._outside_deadband(point):
+                emitted = self._emit_pending()
+        elif self.pending is None:
+            self.pending = merged
+            self._open_doors(point)
+        elif self._door_closes(point):
+            emitted = self._emit_pending()
+            self.pending = self._merge(point)
+            self._open_doors(point)
+        else:
+            self.pending = merged
+        if self.pending is not None and self._heartbeat_due():
+            emitted += self._emit_pending()
+        return emitted
+
+    def flush(self) -> list:
+        """
+        Emit the pending sample, so its energy is not lost.
+        :return: Points to write
+        """
+        emitted = self._emit_pending()
+        self.anchor = None
+        return emitted
+
+    def process(self, points: list) -> list:
+        """
+        Compress the points of one poll. A failed poll ends the series, so the pending
+        sample is written before it and no line is drawn across the gap.
+        :param points: Points of the device handler
+        :return: Points to write
+        """
+        result = []
+        for point in points:
+            if point["measurement"] == HEALTH_MEASUREMENT and not point["fields"]["success"]:
+                # With the split schema a failed poll only leaves a health record
+                result += self.flush()
+                result.append(point)
+            elif point["measurement"] != CENSUS_MEASUREMENT:
+                result.append(point)
+            elif point["fields"].get("fetch_success", False):
+                result += self.compress(point)
+            else:
+                result += self.flush()
+                result.append(point)
+        return result
+
+
+def main() -> None:
+    """
+    Scheduling function for regular call.
+    :return: None
+    """
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Helper functions to read the optional sections of the configuration file into the
+configuration dataclasses of the modules.
+"""
+import json
+
+from source.constants import CONFIGURATION_FILE_PATH
+from source import logging_helper as lh
+
+
+def read_config_section(section: str) -> dict:
+    """
+    Read one section of the configuration file.
+    :param section: Name of the section
+    :return: Settings of the section, empty if the file or the section is missing
+    """
+    try:
+        with open(CONFIGURATION_FILE_PATH, encoding="utf-8") as file:
+            data = json.load(file)
+    except FileNotFoundError:
+        return {}
+    return data.get(section, {})
+
+
+def apply_positive_int_settings(config, settings: dict, keys: tuple, section: str) -> None:
+    """
+    Copy positive integer settings to the configuration. Invalid values are logged and
+    the default value of the configuration is kept.
+    :param config: Configuration dataclass with the default values
+    :param settings: Settings of the section
+    :param keys: Names of the integer settings
+    :param section: Name of the section for the log message
+    :return: None
+    """
+    for key in keys:
+        value = settings.get(key)
+        if value is None:
+            continue
+        if isinstance(value, int) and not isinstance(value, bool) and value > 0:
+            setattr(config, key, value)
+        else:
+            message = (
+                f"The {section} setting {key} must be a positive integer. The default value "
+                f"{getattr(config, key)} is used."
+            )
+            lh.write_log(lh.LoggingLevel.WARNING.value, message)
+
+
+def apply_field_list_setting(config, settings: dict, description: str) -> None:
+    """
+    Copy the list of field names in the setting fields to the configuration. An invalid
+    list is logged and the default value of the configuration is kept.
+    :param config: Configuration dataclass with the attribute fields
+    :param settings: Settings of the section
+    :param description: Description of the section for the log message
+    :return: None
+    """
+    fields = settings.get("fields")
+    if isinstance(fields, list) and fields and all(isinstance(name, str) for name in fields):
+        config.fields = fields
+    elif fields is not None:
+        message = (
+            f"The {description} setting fields must be a list of field names. "
+            f"The default value {config.fields} is used."
+        )
+        lh.write_log(lh.LoggingLevel.WARNING.value, message)
+
+
+def main() -> None:
+    """
+    Scheduling function for regular call.
+    :return: None
+    """
+
+
+if __name__ == "__main__":
+    main()
@@ -22,3 +22,71 @@ DEFAULT_ALARM_THRESHOLD_WH = DEFAULT_REFERENCE_WH * 1.2
 DEFAULT_ALARM_PERIOD_MIN = 30
 NUM_IS_INT_OR_FLOAT_MATCH = r"\d+[.,]?\d*"
 DEVICE_SWITCH_STATUS_UPDATE_TIME = 60
+SPOOL_DIR_PATH = "../files/spool"
+SPOOL_SEGMENT_PREFIX = "segment_"
+SPOOL_SEGMENT_SUFFIX = ".jsonl"
+DEFAULT_SPOOL_MAX_SIZE_MB = 100
+DEFAULT_SPOOL_SEGMENT_SIZE_KB = 1024
+DEFAULT_SPOOL_REPLAY_BATCH_SIZE = 5000
+DEFAULT_SPOOL_REPLAY_BATCHES_PER_RUN = 10
+DEFAULT_SPOOL_RETRY_AFTER_S = 60
+SPOOL_REPLAY_INTERVAL_S = 30
+CENSUS_MEASUREMENT = "census"
+HEALTH_MEASUREMENT = "poll_health"
+SCHEMA_LEGACY = "legacy"
+SCHEMA_SPLIT = "split"
+BACKEND_INFLUXDB = "influxdb"
+BACKEND_INFLUXDB2 = "influxdb2"
+BACKEND_SQLITE = "sqlite"
+SQLITE_DATABASE_PATH = "../files/shelly_datalogger.sqlite"
+REPORT_DATABASE_PATH = "../files/reports.sqlite"
+RETENTION_PRUNE_TIME = "03:30"
+ARCHIVE_DIR_PATH = "../files/archive"
+ARCHIVE_FILE_SUFFIX = ".gorilla"
+ARCHIVE_STATE_FILE = "state.json"
+ARCHIVE_EXPORT_TIME = "03:00"
+DEFAULT_ARCHIVE_EXPORT_AFTER_DAYS = 90
+DEFAULT_ARCHIVE_DAYS_PER_RUN = 31
+DEFAULT_ARCHIVE_FIRST_DAY = "2020-01-01"
+DEFAULT_UDP_PORT = 8089
+DEFAULT_UDP_MAX_DATAGRAM_SIZE = 1400
+UDP_STATISTICS_LOG_INTERVAL_S = 3600
+COMPRESSION_DEADBAND = "deadband"
+COMPRESSION_SWINGING_DOOR = "swinging_door"
+DEFAULT_COMPRESSION_HEARTBEAT_S = 600
+PIPELINE_STATISTICS_LOG_INTERVAL_S = 3600
+DEFAULT_AGGREGATION_WINDOW_S = 60
+DEFAULT_AGGREGATION_MIN_MAX_FIELDS = [
+    "power",
+    "device_temperature",
+    "power_a",
+    "power_b",
+    "power_c",
+]
+MAX_PLANNER_BUCKETS = 10000
+ROLLUP_MINUTE_MEASUREMENT = "rollup_1m"
+ROLLUP_HOUR_MEASUREMENT = "rollup_1h"
+ROLLUP_DAY_MEASUREMENT = "rollup_1d"
+ROLLUP_STATE_FILE_PATH = "../files/rollup_state.json"
+ROLLUP_SETTLE_S = 600
+DEFAULT_ENERGY_INDEX_RETENTION_MIN = 1440
+DEFAULT_ENERGY_INDEX_MAX_MEMORY_KB = 2048
+QUERY_CHUNK_SIZE = 10000
+DEFAULT_QUERY_CACHE_TTL_S = 10
+DEFAULT_QUERY_CACHE_PAST_TTL_S = 86400
+DEFAULT_QUERY_CACHE_MAX_MEMORY_KB = 4096
+QUERY_CACHE_PAST_AFTER_S = 3600
+QUERY_CACHE_STATISTICS_LOG_INTERVAL_S = 3600
+DEFAULT_REPORT_WORKERS = 4
+REPORT_CATCH_UP_MAX_DAYS = 366
+DEFAULT_QUERY_WORKERS = 2
+DEFAULT_QUERY_TIMEOUT_S = 30
+DEFAULT_REPORT_QUERY_TIMEOUT_S = 900
+DEFAULT_QUERY_MAX_RAW_ROWS = 1000000
+QUERY_EXECUTOR_STATISTICS_LOG_INTERVAL_S = 3600
+SKETCH_RELATIVE_ACCURACY = 0.01
+SKETCH_MIN_VALUE = 0.001
+POWER_BASELOAD_QUANTILE = 0.05
+EXPORT_DIR_PATH = "../files/export"
+DEFAULT_EXPORT_SHARD_DAYS = 7
+DEFAULT_EXPORT_WORKERS = 4
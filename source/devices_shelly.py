@@ -11,6 +11,57 @@ from datetime import datetime
 from source.constants import TIMEOUT_RESPONSE_TIME
 from source.communication import SwitchDevice
 from source.logging_helper import WatchHen
+from source.projection import PHASES, is_selected
+
+PHASE_FIELDS = (
+    ("power", "power"),
+    ("power_factor", "pf"),
+    ("current", "current"),
+    ("voltage", "voltage"),
+    ("is_valid", "is_valid"),
+)
+
+
+def plug_s_fields(settings: dict, data: dict) -> dict:
+    """
+    Extract the selected fields from the status of a Plug S.
+    :param settings: Settings of the device
+    :param data: Status response of the device
+    :return: Fields of the census point
+    """
+    meter = data["meters"][0]
+    fields = {"power": meter["power"]}
+    if is_selected(settings, "is_valid"):
+        fields["is_valid"] = meter["is_valid"]
+    if is_selected(settings, "device_temperature"):
+        fields["device_temperature"] = data["temperature"]
+    fields["fetch_success"] = True
+    fields["energy_wh"] = meter["power"] * settings["update_time"] / 3600
+    return fields
+
+
+def em3_fields(settings: dict, data: dict) -> dict:
+    """
+    Extract the selected fields from the status of a 3EM. The totals are always
+    extracted, the per-phase values only if they are selected.
+    :param settings: Settings of the device
+    :param data: Status response of the device
+    :return: Fields of the census point
+    """
+    emeters = data["emeters"][:3]
+    total_power = emeters[0]["power"] + emeters[1]["power"] + emeters[2]["power"]
+    fields = {
+        "power": total_power,
+        "energy_wh": total_power * settings["update_time"] / 3600,
+        "fetch_success": True,
+    }
+    for phase, emeter in zip(PHASES, emeters):
+        for name, key in PHASE_FIELDS:
+            if is_selected(settings, f"{name}_{phase}"):
+                fields[f"{name}_{phase}"] = emeter[key]
+        if is_selected(settings, f"energy_wh_{phase}"):
+            fields[f"energy_wh_{phase}"] = emeter["power"] * settings["update_time"] / 3600
+    return fields
 
 
 def setup(plugins) -> None:
@@ -36,15 +87,7 @@ def setup(plugins) -> None:
                         "measurement": "census",
                         "tags": {"device": device_name},
                         "time": datetime.utcnow(),
-                        "fields": {
-                            "power": data["meters"][0]["power"],
-                            "is_valid": data["meters"][0]["is_valid"],
-                            "device_temperature": data["temperature"],
-                            "fetch_success": True,
-                            "energy_wh": data["meters"][0]["power"]
-                                         * settings["update_time"]
-                                         / 3600,
-                        },
+                        "fields": plug_s_fields(settings, data),
                     }
                 ]
                 settings["watch_hen"].normal_processing()
@@ -72,46 +115,12 @@ def setup(plugins) -> None:
                     request_url, timeout=TIMEOUT_RESPONSE_TIME
             ) as url:
                 data = json.loads(url.read().decode())
-                total_power = (
-                        data["emeters"][0]["power"]
-                        + data["emeters"][1]["power"]
-                        + data["emeters"][2]["power"]
-                )
-                total_energy_wh = total_power * settings["update_time"] / 3600
                 device_data = [
                     {
                         "measurement": "census",
                         "tags": {"device": device_name},
                         "time": datetime.utcnow(),
-                        "fields": {
-                            "power": total_power,
-                            "energy_wh": total_energy_wh,
-                            "fetch_success": True,
-                            "power_a": data["emeters"][0]["power"],
-                            "power_factor_a": data["emeters"][0]["pf"],
-                            "current_a": data["emeters"][0]["current"],
-                            "voltage_a": data["emeters"][0]["voltage"],
-                            "is_valid_a": data["emeters"][0]["is_valid"],
-                            "energy_wh_a": data["emeters"][0]["power"]
-                                           * settings["update_time"]
-                                           / 3600,
-                            "power_b": data["emeters"][1]["power"],
-                            "power_factor_b": data["emeters"][1]["pf"],
-                            "current_b": data["emeters"][1]["current"],
-                            "voltage_b": data["emeters"][1]["voltage"],
-                            "is_valid_b": data["emeters"][1]["is_valid"],
-                            "energy_wh_b": data["emeters"][1]["power"]
-                                           * settings["update_time"]
-                                           / 3600,
-                            "power_c": data["emeters"][2]["power"],
-                            "power_factor_c": data["emeters"][2]["pf"],
-                            "current_c": data["emeters"][2]["current"],
-                            "voltage_c": data["emeters"][2]["voltage"],
-                            "is_valid_c": data["emeters"][2]["is_valid"],
-                            "energy_wh_c": data["emeters"][2]["power"]
-                                           * settings["update_time"]
-                                           / 3600,
-                        },
+                        "fields": em3_fields(settings, data),
                     }
                 ]
                 settings["watch_hen"].normal_processing()
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+In-memory index of the recent energy per device. Every valid sample of the ingest pipeline
+is appended to a ring of the device with its time and the cumulative energy, so the energy
+between two timestamps is the difference of two entries found with binary search. The
+energy monitoring and the energy overview read the index instead of the database as long as
+it holds the requested period. At the start the rings are filled from the database.
+"""
+import math
+from array import array
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from source.constants import (
+    CENSUS_MEASUREMENT,
+    DEFAULT_ENERGY_INDEX_RETENTION_MIN,
+    DEFAULT_ENERGY_INDEX_MAX_MEMORY_KB,
+)
+from source import support_functions as sf
+from source import logging_helper as lh
+from source import ingest
+from source.configuration import read_config_section, apply_positive_int_settings
+from source.line_protocol import encode_timestamp
+from source.storage import StorageBackend, StorageError
+
+# Time as 8 byte integer and cumulative energy as 8 byte float
+BYTES_PER_SAMPLE = 16
+# Headroom for polls which are delayed by the scheduler
+CAPACITY_HEADROOM = 1.1
+
+
+@dataclass
+class EnergyIndexConfig:
+    """
+    Settings of the energy index, read from the section energy_index in config.json.
+    """
+
+    active: bool = False
+    retention_min: int = DEFAULT_ENERGY_INDEX_RETENTION_MIN
+    max_memory_kb: int = DEFAULT_ENERGY_INDEX_MAX_MEMORY_KB
+
+
+def check_energy_index_config() -> EnergyIndexConfig:
+    """
+    Read the energy index settings from the configuration file. Missing or invalid values
+    are replaced by the default values.
+    :return: Checked energy index configuration
+    """
+    config = EnergyIndexConfig()
+    index_settings = read_config_section("energy_index")
+    if isinstance(index_settings.get("active"), bool):
+        config.active = index_settings["active"]
+    apply_positive_int_settings(
+        config, index_settings, ("retention_min", "max_memory_kb"), "energy_index"
+    )
+    return config
+
+
+class EnergyRing:
+    """
+    Ring buffer with the time in epoch milliseconds and the cumulative energy of the
+    recent samples of one device. When the ring is full the oldest sample is dropped.
+    """
+
+    def __init__(self, capacity: int, complete_since_ms: int):
+        self.capacity = capacity
+        self.times = array("q", bytes(8 * capacity))
+        self.cumulative = array("d", bytes(8 * capacity))
+        self.first = 0
+        self.length = 0
+        # Cumulative energy before the oldest sample in the ring
+        self.base = 0.0
+        # All samples after this time are in the ring
+        self.complete_since_ms = complete_since_ms
+
+    def _time(self, position: int) -> int:
+        return self.times[(self.first + position) % self.capacity]
+
+    def _cumulative(self, position: int) -> float:
+        if position < 0:
+            return self.base
+        return self.cumulative[(self.first + position) % self.capacity]
+
+    def _bisect(self, time_ms: int, inclusive: bool) -> int:
+        """
+        Position of the first sample after the time, or at the time if inclusive.
+        """
+        low, high = 0, self.length
+        while low < high:
+            middle = (low + high) // 2
+            sample_time = self._time(middle)
+            if sample_time < time_ms or (sample_time == time_ms and not inclusive):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def append(self, time_ms: int, energy_wh: float) -> None:
+        """
+        Append a sample. Samples which are not newer than the last sample are ignored.
+        :param time_ms: Time of the sample in epoch milliseconds
+        :param energy_wh: Energy of the sample
+        :return: None
+        """
+        if self.length and time_ms <= self._time(self.length - 1):
+            return
+        total = self._cumulative(self.length - 1) + energy_wh
+        if self.length == self.capacity:
+            self.base = self.cumulative[self.first]
+            self.complete_since_ms = self.times[self.first]
+            self.first = (self.first + 1) % self.capacity
+            self.length -= 1
+        position = (self.first + self.length) % self.capacity
+        self.times[position] = time_ms
+        self.cumulative[position] = total
+        self.length += 1
+
+    def energy_between(self, start_ms: int, end_ms: int) -> float:
+        """
+        Energy of the samples between start and end (both exclusive).
+        :param start_ms: Start in epoch milliseconds
+        :param end_ms: End in epoch milliseconds
+        :return: Energy in Wh or None if the ring does not hold all samples of the range
+        """
+        if start_ms < self.complete_since_ms:
+            return None
+        first = self._bisect(start_ms, inclusive=False)
+        last = self._bisect(end_ms, inclusive=True)
+        if last <= first:
+            return 0.0
+        return self._cumulative(last - 1) - self._cumulative(first - 1)
+
+
+class EnergyIndex:
+    """
+    Energy rings of all indexed devices.
+    """
+
+    def __init__(self):
+        self.rings = {}
+
+    def add_device(
+        self, device: str, update_time: int, config: EnergyIndexConfig, now: datetime
+    ) -> EnergyRing:
+        """
+        Create the ring of a device which holds the samples of the retention within the
+        memory limit.
+        :param device: Device name
+        :param update_time: Poll interval of the device in seconds
+        :param config: Energy index configuration
+        :param now: Current time in UTC, the ring holds all samples after it
+        :return: Ring of the device
+        """
+        needed = int(config.retention_min * 60 / update_time * CAPACITY_HEADROOM) + 1
+        limit = config.max_memory_kb * 1024 // BYTES_PER_SAMPLE
+        if needed > limit:
+            message = (
+                f"The energy index of {device} holds only {limit} samples instead of "
+                f"{config.retention_min} minutes because of the memory limit."
+            )
+            lh.write_log(lh.LoggingLevel.WARNING.value, message)
+        ring = EnergyRing(min(needed, limit), encode_timestamp(now, "ms"))
+        self.rings[device] = ring
+        return ring
+
+    def warm_up(
+        self, device: str, backend: StorageBackend, start: datetime, end: datetime
+    ) -> None:
+        """
+        Fill the ring of a device with the stored samples.
+        :param device: Device name
+        :param backend: Storage backend
+        :param start: Start of the stored period
+        :param end: End of the stored period, the time at which the ring was created
+        :return: None
+        """
+        ring = self.rings[device]
+        for columns in backend.query_sample_columns(device, start, end, ["energy_wh"]):
+            for time_ms, energy_wh in zip(columns["time"], columns["energy_wh"]):
+                ring.append(time_ms, 0 if math.isnan(energy_wh) else energy_wh)
+        if ring.complete_since_ms == encode_timestamp(end, "ms"):
+            # No sample was dropped, so the ring holds all samples after the start
+            ring.complete_since_ms = encode_timestamp(start, "ms")
+
+    def add_points(self, points: list) -> None:
+        """
+        Raw sample listener of the ingest pipeline.
+        :param points: Points of one poll
+        :return: None
+        """
+        for point in points:
+            if point["measurement"] != CENSUS_MEASUREMENT:
+                continue
+            ring = self.rings.get(point["tags"]["device"])
+            if ring is None or not point["fields"].get("fetch_success", False):
+                continue
+            ring.append(
+                encode_timestamp(point["time"], "ms"), point["fields"].get("energy_wh") or 0
+            )
+
+    def energy_sum(self, device: str, start: datetime, end: datetime) -> float:
+        """
+        Energy of the valid samples of a device between start and end (both exclusive).
+        :param device: Device name
+        :param start: Start of the period in UTC
+        :param end: End of the period in UTC
+        :return: Energy in Wh or None if the index does not hold the period
+        """
+        ring = self.rings.get(device)
+        if ring is None:
+            return None
+        return ring.energy_between(encode_timestamp(start, "ms"), encode_timestamp(end, "ms"))
+
+
+recent_energy = EnergyIndex()
+
+
+def setup(devices: dict) -> None:
+    """
+    Create and fill the rings of the started devices and register the index at the
+    ingest pipeline if the energy index is active.
+    :param devices: Settings of the started devices by device name
+    :return: None
+    """
+    config = check_energy_index_config()
+    if not config.active:
+        return
+    now = datetime.utcnow()
+    for device, settings in devices.items():
+        recent_energy.add_device(device, settings["update_time"], config, now)
+        try:
+            recent_energy.warm_up(
+                device,
+                sf.get_storage_backend(),
+                now - timedelta(minutes=config.retention_min),
+                now,
+            )
+        except StorageError as err:
+            message = f"The energy index of {device} could not be filled from the database: {err}"
+            lh.write_log(lh.LoggingLevel.WARNING.value, message)
+    ingest.register_raw_sample_listener(recent_energy.add_points)
+
+
+def main() -> None:
+    """
+    Scheduling function for regular call.
+    :return: None
+    """
+
+
+if __name__ == "__main__":
+    main()
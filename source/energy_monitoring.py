@@ -9,6 +9,7 @@ from datetime import datetime, timedelta
 from source import communication as com
 import source.support_functions as sf
 import source.logging_helper as lh
+from source.energy_index import recent_energy
 from source.constants import (
     DEVICES_FILE_PATH,
     DEFAULT_ALARM_THRESHOLD_WH,
@@ -19,7 +20,8 @@ from source.constants import (
 
 def get_device_energy_overview(device: str) -> list:
     """
-    Function return the energy values for interesting periods.
+    Function return the energy values for interesting periods. They are read from the
+    energy index if it holds the last day, otherwise from the database.
     :param device: Device name
     :return: list with values
     """
@@ -31,55 +33,44 @@ def get_device_energy_overview(device: str) -> list:
         [timedelta(hours=12), 0, "Last 12 hours:"],
         [timedelta(days=1), 0, "Last  day:"],
     ]
-    for entry in energy_overview_table:
-        start_date = current_timestamp - entry[0]
-        start_date_format = start_date.strftime("%Y-%m-%d %H:%M:%S")
-        end_date = current_timestamp
-        end_date_format = end_date.strftime("%Y-%m-%d %H:%M:%S")
-        result = sf.fetch_measurements(
-            {
-                "device": device,
-                "target_date": start_date_format,
-                "current_date": end_date_format,
-            }
-        )
-        entry[1] = round(
-            sum(
-                measurement["energy_wh"]
-                for measurement in result.get_points()
-                if measurement["fetch_success"]
-            ),
-            2,
-        )
+    starts = [current_timestamp - entry[0] for entry in energy_overview_table]
+    energy_sums = [recent_energy.energy_sum(device, start, current_timestamp) for start in starts]
+    if None in energy_sums:
+        planner = sf.create_window_planner(device, current_timestamp, starts)
+        energy_sums = sf.run_query("energy_overview", lambda _: planner.energy_sums())
+    for entry, energy_wh in zip(energy_overview_table, energy_sums):
+        entry[1] = round(energy_wh, 2)
     return energy_overview_table
 
 
+def get_devices_energy_last_period(devices: list, period_min: int) -> dict:
+    """
+    Calculate the energy of several devices for the same last period. Devices whose
+    period the energy index holds are answered from it, the others with one query.
+    :param devices: Devices for which the calculation run
+    :param period_min: Length of the period in minutes
+    :return: Sum of energy per device name
+    """
+    current_timestamp = datetime.utcnow()
+    start = current_timestamp - timedelta(minutes=period_min)
+    energy = {
+        device.name: recent_energy.energy_sum(device.name, start, current_timestamp)
+        for device in devices
+    }
+    missing = [name for name, energy_wh in energy.items() if energy_wh is None]
+    if missing:
+        energy.update(sf.fetch_energy_sums(missing, start, current_timestamp))
+    return {name: round(energy_wh, 2) for name, energy_wh in energy.items()}
+
+
 def get_device_energy_last_period(device: com.Device) -> float:
     """
-    Calculate the energy of the device for the last period.
+    Calculate the energy of the device for the last period, from the energy index if it
+    holds the period.
     :param device: Device for which the calculation run
     :return: Sum of energy of the device
     """
-    current_timestamp = datetime.utcnow()
-    start_date = current_timestamp - timedelta(minutes=device.period_min)
-    start_date_format = start_date.strftime("%Y-%m-%d %H:%M:%S")
-    end_date = current_timestamp
-    end_date_format = end_date.strftime("%Y-%m-%d %H:%M:%S")
-    result = sf.fetch_measurements(
-        {
-            "device": device.name,
-            "target_date": start_date_format,
-            "current_date": end_date_format,
-        }
-    )
-    return round(
-        sum(
-            measurement["energy_wh"]
-            for measurement in result.get_points()
-            if measurement["fetch_success"]
-        ),
-        2,
-    )
+    return get_devices_energy_last_period([device], device.period_min)[device.name]
 
 
 def update_device_monitoring_value_ref(device: com.Device) -> None:
@@ -134,20 +125,33 @@ def update_device_monitoring_value_thr(device: com.Device, threshold: str) -> No
     com.to_bot.put(com.Response("status", {"output_text": message}))
 
 
-def run_monitoring(device: com.Device) -> None:
+def group_by_period(devices: list) -> dict:
     """
-    Checks whether a device exceeds the limit values in the set time period
-    :param device: Device to be checked
-    :return: None
+    Group the observed devices by their monitoring period.
+    :param devices: Observed devices
+    :return: Devices per period in minutes
     """
-    energy_wh = get_device_energy_last_period(device)
+    groups = {}
+    for device in devices:
+        groups.setdefault(device.period_min, []).append(device)
+    return groups
 
-    if energy_wh >= device.threshold_wh:
-        com.to_bot.put(
-            com.Request(command="alarm_message", data={"device_name": device.name})
-        )
-        log_message = f"Energy consumption of {device.name} is unusually high."
-        lh.write_log(lh.LoggingLevel.WARNING.value, log_message)
+
+def run_monitoring(devices: list) -> None:
+    """
+    Checks whether the devices of one monitoring period exceed their limit values. The
+    energy of all devices is fetched at once and the alarms are queued afterwards.
+    :param devices: Devices to be checked, all with the same period
+    :return: None
+    """
+    energy = get_devices_energy_last_period(devices, devices[0].period_min)
+    for device in devices:
+        if energy[device.name] >= device.threshold_wh:
+            com.to_bot.put(
+                com.Request(command="alarm_message", data={"device_name": device.name})
+            )
+            log_message = f"Energy consumption of {device.name} is unusually high."
+            lh.write_log(lh.LoggingLevel.WARNING.value, log_message)
 
 
 def check_monitoring_requested(started_devices: list) -> None:
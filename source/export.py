@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bulk export of the stored rows of some devices into CSV or Parquet files, for example a
+year of census data for an analysis. The range is split into shards of some days. Every
+shard of a device is read with a chunked range query and written chunk by chunk into its
+own file, so the memory does not grow with the range. A shard contains its start and
+not its end, so no row is lost or doubled at the borders. The archive is read like in the
+reports, the rollups are exported with their measurement name. The devices are exported
+by worker processes. A shard file appears only when it is complete, shards which exist
+already and ended before the export started are skipped, so an interrupted export
+continues where it stopped and the shard of the current day is exported again. Parquet
+needs the optional package pyarrow:
+python -m source.export --start 2023-01-01 --end 2024-01-01 --device plug [--field power]
+"""
+import argparse
+import csv
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from itertools import chain, islice
+
+from source.constants import (
+    CENSUS_MEASUREMENT,
+    QUERY_CHUNK_SIZE,
+    EXPORT_DIR_PATH,
+    DEFAULT_EXPORT_SHARD_DAYS,
+    DEFAULT_EXPORT_WORKERS,
+)
+from source import support_functions as sf
+from source import logging_helper as lh
+from source.storage import StorageBackend, StorageError
+from source.rollup import BEFORE_BOUNDARY
+
+try:
+    import pyarrow as pa
+    from pyarrow import parquet as pq
+except ImportError as _:
+    pa = None  # pylint: disable=invalid-name
+    pq = None  # pylint: disable=invalid-name
+
+DAY_FORMAT = "%Y-%m-%d"
+FILE_FORMATS = ("csv", "parquet")
+EXPORT_ERRORS = (StorageError, OSError, ValueError, BrokenProcessPool) + (
+    (pa.ArrowException,) if pa else ()
+)
+
+
+@dataclass
+class ExportRequest:  # pylint: disable=too-many-instance-attributes
+    """
+    Rows of one device to export.
+    """
+
+    device: str
+    start: datetime
+    end: datetime
+    measurement: str = CENSUS_MEASUREMENT
+    fields: list = None
+    file_format: str = "csv"
+    shard_days: int = DEFAULT_EXPORT_SHARD_DAYS
+    output: str = EXPORT_DIR_PATH
+
+
+def shards(start: datetime, end: datetime, shard_days: int) -> list:
+    """
+    Split a range into consecutive shards.
+    :param start: Start of the range
+    :param end: End of the range
+    :param shard_days: Length of a shard in days
+    :return: Start and end of each shard, the last one ends at the end of the range
+    """
+    ranges = []
+    while start < end:
+        ranges.append((start, min(end, start + timedelta(days=shard_days))))
+        start = ranges[-1][1]
+    return ranges
+
+
+def shard_path(request: ExportRequest, start: datetime) -> str:
+    """
+    File of a shard.
+    :param request: Export request
+    :param start: Start of the shard
+    :return: Path <output>/<device>/<measurement>_<start>.<format>
+    """
+    return os.path.join(
+        request.output,
+        request.device,
+        f"{request.measurement}_{start.strftime(DAY_FORMAT)}.{request.file_format}",
+    )
+
+
+def format_time(time_ms: int) -> str:
+    """
+    Time of a row in a CSV file.
+    :param time_ms: Epoch milliseconds
+    :return: ISO 8601 time in UTC
+    """
+    return datetime.fromtimestamp(time_ms / 1000, timezone.utc).isoformat(
+        timespec="milliseconds"
+    )
+
+
+def write_csv(path: str, fields: list, chunks) -> int:
+    """
+    Write chunks of rows into a CSV file with the header time and the fields.
+    :param path: File name
+    :param fields: Fields of the columns after the time
+    :param chunks: Lists of rows with the time in epoch milliseconds
+    :return: Number of rows
+    """
+    count = 0
+    with open(path, "w", encoding="utf-8", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["time"] + fields)
+        for chunk in chunks:
+            writer.writerows(
+                [format_time(row["time"])] + [row.get(field) for field in fields]
+                for row in chunk
+            )
+            count += len(chunk)
+    return count
+
+
+def parquet_schema(fields: list, chunk: list):
+    """
+    Schema of a Parquet file. Fields with text values are strings, all other fields are
+    doubles.
+    :param fields: Fields of the columns after the time
+    :param chunk: First rows of the file
+    :return: Schema with the time in UTC milliseconds
+    """
+    columns = [pa.field("time", pa.timestamp("ms", tz="UTC"))]
+    for field in fields:
+        value = next((row[field] for row in chunk if row.get(field) is not None), None)
+        columns.append(pa.field(field, pa.string() if isinstance(value, str) else pa.float64()))
+    return pa.schema(columns)
+
+
+def parquet_table(schema, chunk: list):
+    """
+    Chunk of rows as table with a schema from parquet_schema().
+    :param schema: Schema of the file
+    :param chunk: Rows with the time in epoch milliseconds
+    :return: Table
+    """
+    columns = {"time": [row["time"] for row in chunk]}
+    for column in schema:
+        if column.name == "time":
+            continue
+        convert = str if pa.types.is_string(column.type) else float
+        values = (row.get(column.name) for row in chunk)
+        columns[column.name] = [None if value is None else convert(value) for value in values]
+    return pa.Table.from_pydict(columns, schema=schema)
+
+
+def write_parquet(path: str, fields: list, chunks) -> int:
+    """
+    Write chunks of rows into a Parquet file, one row group per chunk.
+    :param path: File name
+    :param fields: Fields of the columns after the time
+    :param chunks: Lists of rows with the time in epoch milliseconds
+    :return: Number of rows
+    """
+    count = 0
+    chunks = iter(chunks)
+    first = next(chunks, [])
+    schema = parquet_schema(fields, first)
+    with pq.ParquetWriter(path, schema) as writer:
+        for chunk in chain([first], chunks):
+            if chunk:
+                writer.write_table(parquet_table(schema, chunk))
+                count += len(chunk)
+    return count
+
+
+WRITERS = {"csv": write_csv, "parquet": write_parquet}
+
+
+def export_shard(
+    backend: StorageBackend, request: ExportRequest, start: datetime, end: datetime
+) -> int:
+    """
+    Export the rows of a shard into its file. Without requested fields the columns are
+    all fields which the backend knows for the device and shard.
+    :param backend: Storage backend
+    :param request: Export request
+    :param start: Start of the shard (inclusive)
+    :param end: End of the shard (exclusive)
+    :return: Number of rows
+    """
+    path = shard_path(request, start)
+    fields = request.fields or backend.field_keys(
+        request.measurement, request.device, start - BEFORE_BOUNDARY, end
+    )
+    rows = backend.query_range(
+        request.measurement, request.device, start - BEFORE_BOUNDARY, end, fields
+    )
+    chunks = iter(lambda: list(islice(rows, QUERY_CHUNK_SIZE)), [])
+    count = WRITERS[request.file_format](path + ".tmp", fields, chunks)
+    os.replace(path + ".tmp", path)
+    return count
+
+
+def export_device(request: ExportRequest) -> int:
+    """
+    Export the shards of a device one after another. Existing shard files are kept if
+    the shard ended before now, a shard which is still being logged is exported again.
+    :param request: Export request
+    :return: Number of exported rows
+    """
+    backend = sf.get_storage_backend()
+    os.makedirs(os.path.join(request.output, request.device), exist_ok=True)
+    now = datetime.utcnow()
+    count = 0
+    for start, end in shards(request.start, request.end, request.shard_days):
+        if end > now or not os.path.exists(shard_path(request, start)):
+            count += export_shard(backend, request, start, end)
+    return count
+
+
+def init_worker() -> None:
+    """
+    Read the configuration in a new worker process.
+    :return: None
+    """
+    sf.check_database_config()
+
+
+def export(requests: list, max_workers: int) -> int:
+    """
+    Export several devices in worker processes, each device is handled by one process.
+    :param requests: Export requests
+    :param max_workers: Maximum number of processes
+    :return: Number of exported rows
+    """
+    if not requests:
+        return 0
+    total = 0
+    with ProcessPoolExecutor(
+        max_workers=min(max_workers, len(requests)),
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_worker,
+    ) as executor:
+        futures = {request.device: executor.submit(export_device, request) for request in requests}
+        for device, future in futures.items():
+            try:
+                count = future.result()
+            except EXPORT_ERRORS as err:
+                message = f"The rows of {device} could not be exported: {err}"
+                lh.write_log(lh.LoggingLevel.ERROR.value, message)
+                continue
+            total += count
+            message = f"Exported {count} rows of {device}."
+            lh.write_log(lh.LoggingLevel.INFO.value, message)
+    return total
+
+
+def main() -> None:
+    """
+    Command line entry point of the export.
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description="Export the rows of devices to CSV or Parquet.")
+    parser.add_argument("--start", required=True, help="First day, e.g. 2023-01-01")
+    parser.add_argument("--end", help="Day after the last exported day, default tomorrow")
+    parser.add_argument(
+        "--device", action="append", required=True, help="Device name, can be repeated"
+    )
+    parser.add_argument("--field", action="append", help="Exported field, can be repeated")
+    parser.add_argument("--measurement", default=CENSUS_MEASUREMENT, help="Measurement")
+    parser.add_argument("--format", choices=FILE_FORMATS, default="csv", help="File format")
+    parser.add_argument(
+        "--shard-days", type=int, default=DEFAULT_EXPORT_SHARD_DAYS, help="Days per file"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=DEFAULT_EXPORT_WORKERS, help="Number of processes"
+    )
+    parser.add_argument("--output", default=EXPORT_DIR_PATH, help="Output directory")
+    args = parser.parse_args()
+    if args.format == "parquet" and pa is None:
+        parser.error("The Parquet export needs the package pyarrow.")
+    init_worker()
+    sf.check_and_verify_db_connection()
+    if sf.login_information.verified is False:
+        return
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    start = datetime.strptime(args.start, DAY_FORMAT)
+    end = datetime.strptime(args.end, DAY_FORMAT) if args.end else today + timedelta(days=1)
+    requests = [
+        ExportRequest(
+            device,
+            start,
+            end,
+            args.measurement,
+            args.field,
+            args.format,
+            max(1, args.shard_days),
+            args.output,
+        )
+        for device in args.device
+    ]
+    export(requests, max(1, args.workers))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compression of time series columns as described for the Gorilla database of Facebook.
+Timestamps are stored as delta of delta with variable bit length, so a constant polling
+interval costs one bit per sample. Float values are stored as XOR with the previous value,
+so repeated or slowly changing values only need a few bits.
+"""
+from array import array
+
+# Delta of delta ranges (lowest, highest, prefix, number of prefix bits, number of value bits)
+DELTA_OF_DELTA_BUCKETS = (
+    (-64, 63, 0b10, 2, 7),
+    (-256, 255, 0b110, 3, 9),
+    (-2048, 2047, 0b1110, 4, 12),
+)
+DELTA_OF_DELTA_FALLBACK_BITS = 64
+
+
+class BitWriter:
+    """
+    Append bits to a byte array, the most significant bit first.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.accumulator = 0
+        self.bits = 0
+
+    def write(self, value: int, length: int) -> None:
+        """
+        Append the lowest bits of the value.
+        :param value: Non-negative integer
+        :param length: Number of bits
+        :return: None
+        """
+        self.accumulator = (self.accumulator << length) | value
+        self.bits += length
+        while self.bits >= 8:
+            self.bits -= 8
+            self.buffer.append((self.accumulator >> self.bits) & 0xFF)
+        self.accumulator &= (1 << self.bits) - 1
+
+    def to_bytes(self) -> bytes:
+        """
+        Written bits, the last byte is filled with zeros.
+        :return: Bytes
+        """
+        if self.bits:
+            return bytes(self.buffer) + bytes([(self.accumulator << (8 - self.bits)) & 0xFF])
+        return bytes(self.buffer)
+
+
+class BitReader:
+    """
+    Read bits from a bytes-like object, for example a memory map.
+    """
+
+    def __init__(self, buffer, offset: int = 0):
+        self.buffer = buffer
+        self.position = offset * 8
+
+    def read(self, length: int) -> int:
+        """
+        Read the next bits as unsigned integer.
+        :param length: Number of bits
+        :return: Value
+        """
+        position = self.position
+        first = position >> 3
+        last = (position + length + 7) >> 3
+        chunk = int.from_bytes(self.buffer[first:last], "big")
+        self.position = position + length
+        return (chunk >> ((last << 3) - position - length)) & ((1 << length) - 1)
+
+    def read_bit(self) -> int:
+        """
+        Read the next bit.
+        :return: 0 or 1
+        """
+        position = self.position
+        self.position = position + 1
+        return (self.buffer[position >> 3] >> (7 - (position & 7))) & 1
+
+
+def _to_signed(value: int, length: int) -> int:
+    if value >= 1 << (length - 1):
+        return value - (1 << length)
+    return value
+
+
+def encode_timestamps(timestamps: list) -> bytes:
+    """
+    Compress ascending integer timestamps with delta of delta encoding.
+    :param timestamps: Integer timestamps
+    :return: Compressed bytes
+    """
+    writer = BitWriter()
+    previous = 0
+    previous_delta = 0
+    for index, timestamp in enumerate(timestamps):
+        if index == 0:
+            writer.write(timestamp, 64)
+        else:
+            delta = timestamp - previous
+            delta_of_delta = delta - previous_delta
+            previous_delta = delta
+            if delta_of_delta == 0:
+                writer.write(0, 1)
+            else:
+                for lowest, highest, prefix, prefix_bits, value_bits in DELTA_OF_DELTA_BUCKETS:
+                    if lowest <= delta_of_delta <= highest:
+                        writer.write(prefix, prefix_bits)
+                        writer.write(delta_of_delta & ((1 << value_bits) - 1), value_bits)
+                        break
+                else:
+                    writer.write(0b1111, 4)
+                    writer.write(
+                        delta_of_delta & ((1 << DELTA_OF_DELTA_FALLBACK_BITS) - 1),
+                        DELTA_OF_DELTA_FALLBACK_BITS,
+                    )
+        previous = timestamp
+    return writer.to_bytes()
+
+
+def decode_timestamps(buffer, count: int, offset: int = 0) -> list:
+    """
+    Decompress timestamps of encode_timestamps().
+    :param buffer: Bytes-like object with the compressed timestamps
+    :param count: Number of timestamps
+    :param offset: Start of the compressed timestamps in the buffer
+    :return: Integer timestamps
+    """
+    if count == 0:
+        return []
+    reader = BitReader(buffer, offset)
+    timestamp = reader.read(64)
+    timestamps = [timestamp]
+    delta = 0
+    for _ in range(count - 1):
+        if reader.read_bit():
+            if not reader.read_bit():
+                value_bits = 7
+            elif not reader.read_bit():
+                value_bits = 9
+            elif not reader.read_bit():
+                value_bits = 12
+            else:
+                value_bits = DELTA_OF_DELTA_FALLBACK_BITS
+            delta += _to_signed(reader.read(value_bits), value_bits)
+        timestamp += delta
+        timestamps.append(timestamp)
+    return timestamps
+
+
+def encode_floats(values: list) -> bytes:
+    """
+    Compress float values with XOR encoding. NaN is stored like any other value.
+    :param values: Float values
+    :return: Compressed bytes
+    """
+    writer = BitWriter()
+    previous = 0
+    previous_leading = -1
+    previous_trailing = 0
+    for index, value in enumerate(array("Q", array("d", values).tobytes())):
+        if index == 0:
+            writer.write(value, 64)
+            previous = value
+            continue
+        xor = value ^ previous
+        previous = value
+        if xor == 0:
+            writer.write(0, 1)
+            continue
+        leading = min(64 - xor.bit_length(), 31)
+        trailing = (xor & -xor).bit_length() - 1
+        if 0 <= previous_leading <= leading and trailing >= previous_trailing:
+            writer.write(0b10, 2)
+            meaningful = 64 - previous_leading - previous_trailing
+            writer.write(xor >> previous_trailing, meaningful)
+        else:
+            meaningful = 64 - leading - trailing
+            writer.write(0b11, 2)
+            writer.write(leading, 5)
+            writer.write(meaningful & 0x3F, 6)
+            writer.write(xor >> trailing, meaningful)
+            previous_leading = leading
+            previous_trailing = trailing
+    return writer.to_bytes()
+
+
+def decode_floats(buffer, count: int, offset: int = 0) -> array:
+    """
+    Decompress float values of encode_floats().
+    :param buffer: Bytes-like object with the compressed values
+    :param count: Number of values
+    :param offset: Start of the compressed values in the buffer
+    :return: Float values
+    """
+    raw = array("Q")
+    if count == 0:
+        return array("d")
+    reader = BitReader(buffer, offset)
+    value = reader.read(64)
+    raw.append(value)
+    leading = 0
+    trailing = 0
+    for _ in range(count - 1):
+        if reader.read_bit():
+            if reader.read_bit():
+                leading = reader.read(5)
+                meaningful = reader.read(6) or 64
+                trailing = 64 - leading - meaningful
+            else:
+                meaningful = 64 - leading - trailing
+            value ^= reader.read(meaningful) << trailing
+        raw.append(value)
+    return array("d", raw.tobytes())
+
+
+def main() -> None:
+    """
+    Scheduling function for regular call.
+    :return: None
+    """
+
+
+if __name__ == "__main__":
+    main()
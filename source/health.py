@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Poll health records for the split database schema. With the split schema the success,
+latency and error type of every poll are written to their own compact measurement and the
+census measurement only holds valid samples. The module also contains the migration tool
+which converts existing data:
+python -m source.health --start 2023-01-01
+"""
+import argparse
+from datetime import datetime, timedelta
+
+from source.constants import CENSUS_MEASUREMENT, HEALTH_MEASUREMENT, SCHEMA_SPLIT
+from source import support_functions as sf
+from source import logging_helper as lh
+from source.storage_influxdb import InfluxDBBackend
+
+MIGRATION_WINDOW = timedelta(days=1)
+MIGRATION_DELETE_BATCH_SIZE = 500
+FIELD_TYPE_CONVERTER = {
+    "float": float,
+    "integer": int,
+    "boolean": bool,
+    "string": str,
+}
+
+
+def create_health_point(point: dict, latency_ms: int, error_type: str = None) -> dict:
+    """
+    Create the health record for one point of a device handler.
+    :param point: Point of the device handler
+    :param latency_ms: Duration of the poll in milliseconds
+    :param error_type: Type of the error if the poll failed
+    :return: Point for the health measurement
+    """
+    fields = {
+        "success": point["fields"]["fetch_success"],
+        "latency_ms": latency_ms,
+    }
+    if not fields["success"]:
+        fields["error_type"] = error_type if error_type is not None else "unknown"
+    return {
+        "measurement": HEALTH_MEASUREMENT,
+        "tags": point["tags"],
+        "time": point["time"],
+        "fields": fields,
+    }
+
+
+def split_device_data(
+    device_data: list, latency_ms: int, error_type: str = None
+) -> list:
+    """
+    Convert the points of a device handler to the configured schema. With the legacy
+    schema the points are returned unchanged. With the split schema a health record is
+    added for every poll and failed polls are removed from the census measurement.
+    :param device_data: Points of the device handler
+    :param latency_ms: Duration of the poll in milliseconds
+    :param error_type: Type of the error if the poll failed
+    :return: Points to write
+    """
+    if sf.database_config["schema"] != SCHEMA_SPLIT:
+        return device_data
+    points = []
+    for point in device_data:
+        if point["measurement"] != CENSUS_MEASUREMENT:
+            points.append(point)
+            continue
+        points.append(create_health_point(point, latency_ms, error_type))
+        if point["fields"].get("fetch_success", False):
+            points.append(point)
+    return points
+
+
+def get_census_field_types(conn) -> dict:
+    """
+    Query the field types of the census measurement. They are needed because the
+    JSON response of InfluxDB does not distinguish between 1.0 and 1.
+    :param conn: Open database connection
+    :return: Field name with converter function
+    """
+    result = conn.query(f'SHOW FIELD KEYS FROM "{CENSUS_MEASUREMENT}"')
+    return {
+        row["fieldKey"]: FIELD_TYPE_CONVERTER[row["fieldType"]]
+        for row in result.get_points()
+    }
+
+
+def get_census_devices(conn) -> list:
+    """
+    Query all devices which have data in the census measurement.
+    :param conn: Open database connection
+    :return: List of device names
+    """
+    result = conn.query(f'SHOW TAG VALUES FROM "{CENSUS_MEASUREMENT}" WITH KEY = "device"')
+    return [row["value"] for row in result.get_points()]
+
+
+def migrate_window(conn, device: str, start: datetime, end: datetime, field_types: dict) -> int:
+    """
+    Migrate the census data of one device in one time window. The failed polls are written
+    as health records, then only the failed polls are deleted by their timestamps. The
+    valid samples are never touched, so a failed write or delete cannot lose them, and a
+    repeated migration of the window only deletes what is left. Only one window is held
+    in memory at any time.
+    :param conn: Open database connection
+    :param device: Device name
+    :param start: Start of the window (inclusive)
+    :param end: End of the window (exclusive)
+    :param field_types: Field types of the census measurement
+    :return: Number of migrated failure rows
+    """
+    bind_params = {
+        "device": device,
+        "start": start.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "end": end.strftime("%Y-%m-%dT%H:%M:%SZ"),
+    }
+    result = conn.query(
+        f'SELECT * FROM "{CENSUS_MEASUREMENT}" '
+        f"WHERE device=$device AND time >= $start AND time < $end",
+        bind_params=bind_params,
+        epoch="ns",
+    )
+    health_points = []
+    for row in result.get_points():
+        fetch_success = row.get("fetch_success")
+        if fetch_success is not None and field_types.get("fetch_success", bool)(fetch_success):
+            continue
+        point = {
+            "measurement": CENSUS_MEASUREMENT,
+            "tags": {"device": device},
+            "time": row["time"],
+            "fields": {"fetch_success": False},
+        }
+        health_points.append(create_health_point(point, 0))
+    if not health_points:
+        return 0
+    sf.write_points(health_points, time_precision="n")
+    for index in range(0, len(health_points), MIGRATION_DELETE_BATCH_SIZE):
+        conn.query(
+            "; ".join(
+                f'DELETE FROM "{CENSUS_MEASUREMENT}" WHERE device=$device '
+                f"AND time = {point['time']}"
+                for point in health_points[index: index + MIGRATION_DELETE_BATCH_SIZE]
+            ),
+            bind_params={"device": device},
+            method="POST",
+        )
+    return len(health_points)
+
+
+def migrate(start: datetime, end: datetime, devices: list = None) -> None:
+    """
+    Move all failed polls from the census measurement to the health measurement.
+    :param start: Start of the migrated period
+    :param end: End of the migrated period
+    :param devices: Devices to migrate, all devices if None
+    :return: None
+    """
+    backend = sf.get_database_backend()
+    if not isinstance(backend, InfluxDBBackend):
+        message = "The migration of the census measurement is only available for InfluxDB 1.x."
+        lh.write_log(lh.LoggingLevel.ERROR.value, message)
+        return
+    with backend.connection() as conn:
+        field_types = get_census_field_types(conn)
+        for device in devices if devices else get_census_devices(conn):
+            migrated = 0
+            window_start = start
+            while window_start < end:
+                window_end = min(window_start + MIGRATION_WINDOW, end)
+                migrated += migrate_window(conn, device, window_start, window_end, field_types)
+                window_start = window_end
+            message = f"Migrated {migrated} failed polls of {device} to {HEALTH_MEASUREMENT}."
+            lh.write_log(lh.LoggingLevel.INFO.value, message)
+
+
+def main() -> None:
+    """
+    Command line entry point of the migration tool.
+    :return: None
+    """
+    parser = argparse.ArgumentParser(
+        description=f"Move failed polls from {CENSUS_MEASUREMENT} to {HEALTH_MEASUREMENT}."
+    )
+    parser.add_argument("--start", required=True, help="First day, e.g. 2023-01-01")
+    parser.add_argument("--end", help="Last day (exclusive), default today")
+    parser.add_argument("--device", action="append", help="Device name, can be repeated")
+    args = parser.parse_args()
+    start = datetime.strptime(args.start, "%Y-%m-%d")
+    end = datetime.strptime(args.end, "%Y-%m-%d") if args.end else datetime.utcnow()
+    sf.check_database_config()
+    sf.check_and_verify_db_connection()
+    if sf.login_information.verified is not False:
+        migrate(start, end, args.device)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Ingest pipeline between the device handlers and the write to the database. Every poll is
+first passed to the raw sample listeners inside the app and to the rollups, then the
+stages configured for the device (pre-aggregation and compression) reduce the points which
+are written. The pipeline counts the samples and written points and reports the reduction
+per device.
+"""
+import time
+from typing import Callable
+
+from source.constants import CENSUS_MEASUREMENT, PIPELINE_STATISTICS_LOG_INTERVAL_S
+from source import logging_helper as lh
+from source import compression
+from source import aggregation
+from source import rollup
+
+raw_sample_listeners = []
+
+
+def register_raw_sample_listener(listener: Callable[[list], None]) -> None:
+    """
+    Register a function which receives the unreduced points of every poll.
+    :param listener: Function which is called with the points of the device handler
+    :return: None
+    """
+    raw_sample_listeners.append(listener)
+
+
+def count_census_points(points: list) -> int:
+    """
+    Count the points of the census measurement.
+    :param points: Points in the format of the device handlers
+    :return: Number of census points
+    """
+    return sum(1 for point in points if point["measurement"] == CENSUS_MEASUREMENT)
+
+
+class DevicePipeline:
+    """
+    Ingest pipeline of one device with its stages.
+    """
+
+    def __init__(self, device_name: str, stages: list):
+        self.device_name = device_name
+        self.stages = stages
+        self.samples = 0
+        self.written_points = 0
+        self.last_report = time.monotonic()
+
+    def process(self, points: list) -> list:
+        """
+        Pass the points of one poll to the listeners and through the stages.
+        :param points: Points of the device handler
+        :return: Points to write
+        """
+        for listener in raw_sample_listeners:
+            listener(points)
+        self.samples += count_census_points(points)
+        for stage in self.stages:
+            points = stage.process(points)
+        self.written_points += count_census_points(points)
+        if time.monotonic() - self.last_report >= PIPELINE_STATISTICS_LOG_INTERVAL_S:
+            self.report()
+        return points
+
+    def reduction(self) -> float:
+        """
+        Reduction of the written census points by the stages.
+        :return: Reduction in percent
+        """
+        if self.samples == 0:
+            return 0.0
+        return (self.samples - self.written_points) * 100 / self.samples
+
+    def report(self) -> None:
+        """
+        Write the reduction since the start to the log.
+        :return: None
+        """
+        self.last_report = time.monotonic()
+        if not self.stages:
+            return
+        message = (
+            f"{self.device_name}: {self.samples} samples were written as "
+            f"{self.written_points} points, {self.reduction():.1f} % less write volume."
+        )
+        lh.write_log(lh.LoggingLevel.INFO.value, message)
+
+
+def create_pipeline(device_name: str, settings: dict) -> DevicePipeline:
+    """
+    Create the pipeline of a device with the stages configured in devices.json.
+    :param device_name: Device name
+    :param settings: Settings of the device
+    :return: Pipeline of the device
+    """
+    stages = []
+    rollup_stage = rollup.create_rollup_stage(device_name, settings)
+    if rollup_stage is not None:
+        stages.append(rollup_stage)
+    aggregation_config = aggregation.check_aggregation_config(device_name, settings)
+    if aggregation_config is not None:
+        stages.append(aggregation.WindowAggregator(aggregation_config))
+    compression_config = compression.check_compression_config(device_name, settings)
+    if compression_config is not None:
+        stages.append(compression.SampleCompressor(compression_config))
+    return DevicePipeline(device_name, stages)
+
+
+def main() -> None:
+    """
+    Scheduling function for regular call.
+    :return: None
+    """
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Vectorized kernels of the report calculations on columns of NumPy arrays. They give the
+same results as the per-row functions: sums are added in the same order and the
+hysteresis of the power on counter is evaluated as a state sequence. NumPy is optional,
+without it the per-row functions are used.
+"""
+try:
+    import numpy as np
+except ImportError as _:
+    np = None  # pylint: disable=invalid-name
+
+
+def available() -> bool:
+    """
+    Check if NumPy is installed.
+    :return: True if the kernels can be used
+    """
+    return np is not None
+
+
+def sequential_sum(values, initial: float = 0.0) -> float:
+    """
+    Sum of the values added one after another to the initial value. Unlike numpy.sum
+    with its pairwise summation this is bit for bit the result of a Python loop.
+    :param values: Float array
+    :param initial: Value to which the values are added
+    :return: Sum
+    """
+    if values.size == 0:
+        return initial
+    return float(np.cumsum(np.concatenate(([initial], values)))[-1])
+
+
+def hysteresis_states(power, on_threshold: float, off_threshold: float, initial: bool):
+    """
+    State of the power on counter after each value, see rollup.PowerOnCounter. A value
+    at or above the on threshold switches on, a value below the off threshold switches
+    off. A value which does both toggles the state, NaN keeps it.
+    :param power: Float array of power values in time order
+    :param on_threshold: Power which switches the device on
+    :param off_threshold: Power below which the device is off again
+    :param initial: State before the first value
+    :return: Boolean array with the state after each value
+    """
+    above = power >= on_threshold
+    below = power < off_threshold
+    toggles = np.cumsum(above & below)
+    positions = np.arange(len(power))
+    # Position of the last value which sets the state regardless of the previous one
+    last = np.maximum.accumulate(np.where(above ^ below, positions, -1))
+    known = last >= 0
+    base = np.where(known, above[last], initial)
+    toggled = toggles - np.where(known, toggles[last], 0)
+    return base ^ (toggled % 2 == 1)
+
+
+def count_power_on(
+    power, on_threshold: float, off_threshold: float, initial: bool = False
+) -> tuple:
+    """
+    Count the completed power on transitions of a series of power values.
+    :param power: Float array of power values in time order, missing values are NaN
+    :param on_threshold: Power which switches the device on
+    :param off_threshold: Power below which the device is off again
+    :param initial: State before the first value
+    :return: Number of transitions and the state after the last value
+    """
+    if power.size == 0:
+        return 0, initial
+    states = hysteresis_states(power, on_threshold, off_threshold, initial)
+    previous = np.concatenate(([initial], states[:-1]))
+    return int(np.count_nonzero(previous & ~states)), bool(states[-1])
+
+
+def on_time_ms(times, states, end_ms: int) -> int:
+    """
+    Time in which the device was switched on. Each state lasts until the next sample,
+    the state of the last sample until the end.
+    :param times: Integer array of the sample times in epoch milliseconds
+    :param states: Boolean array of the states after each sample
+    :param end_ms: End of the period in epoch milliseconds
+    :return: Duration in milliseconds
+    """
+    if times.size == 0:
+        return 0
+    durations = np.diff(times, append=end_ms)
+    return int(np.sum(durations[states]))
+
+
+def error_rates(success_counts, failure_counts, max_values) -> tuple:
+    """
+    Error rates of the cost calculation for several periods.
+    :param success_counts: Valid samples per period
+    :param failure_counts: Failed polls per period
+    :param max_values: Expected number of polls per period
+    :return: Failures per poll and missing samples per expected poll in percent
+    """
+    success_counts = np.asarray(success_counts, dtype=np.float64)
+    failure_counts = np.asarray(failure_counts, dtype=np.float64)
+    max_values = np.asarray(max_values, dtype=np.float64)
+    return (
+        failure_counts * 100 / (success_counts + failure_counts),
+        (max_values - success_counts) * 100 / max_values,
+    )
+
+
+def chunk_aggregates(columns: dict, start_ms: int, energy_wh: float, counter) -> tuple:
+    """
+    Aggregates of the rows of a chunk after the start of a period like
+    calculations.PeriodAccumulator.add_sample(). The energy is added to the total of the
+    previous chunks and the state of the power on counter is carried to the next chunk.
+    :param columns: Columns of the rows in time order with time, energy_wh, sample_count,
+        power and fetch_success (NaN if unknown), all rows are valid without fetch_success
+    :param start_ms: Start of the period in epoch milliseconds
+    :param energy_wh: Energy of the previous chunks
+    :param counter: Power on counter with thresholds and state of the previous chunks
+    :return: Energy total, samples, failures and power on count of the chunk, None if
+        the chunk has no power value
+    """
+    first = int(np.searchsorted(columns["time"], start_ms, side="right"))
+    if "fetch_success" in columns:
+        success = columns["fetch_success"][first:]
+        valid = (success != 0) & ~np.isnan(success)
+    else:
+        success = np.ones(len(columns["time"]) - first)
+        valid = success == 1
+    energy = np.nan_to_num(columns["energy_wh"][first:][valid], nan=0.0)
+    sample_count = columns["sample_count"][first:][valid]
+    sample_count[np.isnan(sample_count) | (sample_count == 0)] = 1
+    power = columns["power"][first:][valid]
+    power = power[~np.isnan(power)]
+    power_on = None
+    if power.size:
+        power_on, counter.high_threshold_passed = count_power_on(
+            power, counter.on_threshold, counter.off_threshold, counter.high_threshold_passed
+        )
+    return (
+        sequential_sum(energy, energy_wh),
+        int(np.sum(sample_count)),
+        int(np.count_nonzero(success == 0)),
+        power_on,
+    )
+
+
+def valid_power(columns: dict, start_ms: int) -> tuple:
+    """
+    Power values of the valid rows of a chunk after the start of a period.
+    :param columns: Columns of the rows like in chunk_aggregates()
+    :param start_ms: Start of the period in epoch milliseconds
+    :return: Power values without NaN and the number of samples of each value
+    """
+    first = int(np.searchsorted(columns["time"], start_ms, side="right"))
+    power = columns["power"][first:]
+    valid = ~np.isnan(power)
+    if "fetch_success" in columns:
+        success = columns["fetch_success"][first:]
+        valid &= (success != 0) & ~np.isnan(success)
+    sample_count = columns["sample_count"][first:][valid]
+    sample_count = np.where(np.isnan(sample_count) | (sample_count == 0), 1, sample_count)
+    return power[valid], sample_count
+
+
+def numpy_columns(columns: dict) -> dict:
+    """
+    View columns from StorageBackend.query_columns() as NumPy arrays without copying.
+    :param columns: Columns as array.array
+    :return: Columns as read-only NumPy arrays
+    """
+    return {
+        name: np.frombuffer(column, dtype=np.int64 if name == "time" else np.float64)
+        for name, column in columns.items()
+    }
+
+
+def main() -> None:
+    """
+    Scheduling function for regular call.
+    :return: None
+    """
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Encoder which creates the InfluxDB line protocol directly from the output of the device
+handlers. Series keys and field keys are escaped only once and then taken from a cache.
+"""
+from datetime import datetime
+from functools import lru_cache
+
+EPOCH = datetime(1970, 1, 1)
+PRECISION_DIVIDER = {"s": 1_000_000, "ms": 1_000, "u": 1}
+SUPPORTED_PRECISIONS = ("s", "ms", "u", "n")
+
+
+def _escape_key(key: str) -> str:
+    return (
+        key.replace("\\", "\\\\")
+        .replace(" ", "\\ ")
+        .replace(",", "\\,")
+        .replace("=", "\\=")
+        .replace("\n", "\\n")
+    )
+
+
+@lru_cache(maxsize=1024)
+def series_key(measurement: str, tags: tuple) -> str:
+    """
+    Escaped measurement with the sorted tags of a point.
+    :param measurement: Name of the measurement
+    :param tags: Tags as sorted tuple of key value pairs
+    :return: Series key in line protocol format
+    """
+    escaped_tags = "".join(
+        f",{_escape_key(key)}={_escape_key(str(value))}"
+        for key, value in tags
+        if key != "" and value != ""
+    )
+    return _escape_key(measurement) + escaped_tags
+
+
+@lru_cache(maxsize=1024)
+def field_key(key: str) -> str:
+    """
+    Escaped field key followed by the equal sign.
+    :param key: Name of the field
+    :return: Escaped field key
+    """
+    return _escape_key(key) + "="
+
+
+def encode_value(value) -> str:
+    """
+    Convert a field value to line protocol. The formatting is identical to the influxdb
+    library, so existing field types in the database stay the same.
+    :param value: Field value
+    :return: Value in line protocol format
+    """
+    value_type = type(value)
+    if value_type is float:
+        return repr(value)
+    if value_type is bool:
+        return "True" if value else "False"
+    if value_type is int:
+        return f"{value}i"
+    if value_type is str:
+        return '"' + value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+    return repr(float(value))
+
+
+def encode_timestamp(timestamp, precision: str = "ms") -> int:
+    """
+    Convert the timestamp of a point to integer epoch time. Naive datetime objects are
+    interpreted as UTC. Integer timestamps are returned unchanged.
+    :param timestamp: Timestamp as datetime or integer
+    :param precision: Precision of the result, one of s, ms, u and n
+    :return: Timestamp as integer
+    """
+    if isinstance(timestamp, int):
+        return timestamp
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.replace(tzinfo=None) - timestamp.utcoffset()
+    delta = timestamp - EPOCH
+    micros = (delta.days * 86_400 + delta.seconds) * 1_000_000 + delta.microseconds
+    if precision == "n":
+        return micros * 1_000
+    return micros // PRECISION_DIVIDER[precision]
+
+
+def encode_point(point: dict, precision: str = "ms") -> str:
+    """
+    Convert one point of a device handler to a line.
+    :param point: Point with measurement, tags, time and fields
+    :param precision: Precision of the timestamp
+    :return: Line in line protocol format
+    """
+    tags = point.get("tags")
+    key = series_key(point["measurement"], tuple(sorted(tags.items())) if tags else ())
+    fields = ",".join(
+        field_key(name) + encode_value(value)
+        for name, value in point["fields"].items()
+        if value is not None
+    )
+    if "time" in point and point["time"] is not None:
+        return f"{key} {fields} {encode_timestamp(point['time'], precision)}"
+    return f"{key} {fields}"
+
+
+def encode_points(points: list, precision: str = "ms") -> list:
+    """
+    Convert the points of a device handler to line protocol.
+    :param points: List of points with measurement, tags, time and fields
+    :param precision: Precision of the timestamps, one of s, ms, u and n
+    :return: List of lines
+    """
+    if precision not in SUPPORTED_PRECISIONS:
+        raise ValueError(f"Time precision {precision} is not supported.")
+    return [encode_point(point, precision) for point in points]
+
+
+def main() -> None:
+    """
+    Scheduling function for regular call.
+    :return: None
+    """
+
+
+if __name__ == "__main__":
+    main()
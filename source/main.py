@@ -9,9 +9,7 @@ import json
 import time
 from datetime import datetime
 
-import requests
 import schedule
-from influxdb.exceptions import InfluxDBClientError
 
 from source.supported_devices import plugins
 from source import support_functions
@@ -21,9 +19,26 @@ from source import telegram_handler as th
 from source import communication as com
 from source import energy_monitoring as em
 from source import switch as sw
-from source.constants import DEVICES_FILE_PATH
+from source import spool as sp
+from source import health
+from source import archive
+from source import ingest
+from source import projection
+from source import energy_index
+from source import report_runner
+from source.storage import StorageError, StorageConnectionError, StorageWriteError
+from source.constants import (
+    DEVICES_FILE_PATH,
+    SPOOL_DIR_PATH,
+    SPOOL_REPLAY_INTERVAL_S,
+    RETENTION_PRUNE_TIME,
+    ARCHIVE_EXPORT_TIME,
+)
 
 write_watch_hen = lh.WatchHen(device_name="write_handler")
+write_spool = sp.WriteAheadSpool(SPOOL_DIR_PATH, sp.check_spool_config())
+archive_config = archive.check_archive_config()
+reports = report_runner.ReportRunner(report_runner.check_report_runner_config())
 timestamp_now = datetime.utcnow().strftime("%d/%m/%Y %H:%M:%S")
 start_message = f"Start Program: {timestamp_now} UTC"
 
@@ -36,8 +51,13 @@ def fetch_device_data(settings: dict) -> None:
     :return: None
     """
     try:
+        poll_start = time.perf_counter()
         device_data = plugins[settings["type"]](settings)
-        write_data(device_data)
+        latency_ms = round((time.perf_counter() - poll_start) * 1000)
+        last_failures = settings["watch_hen"].last_failures
+        error_type = last_failures[-1].error_type if last_failures else None
+        points = health.split_device_data(device_data, latency_ms, error_type)
+        write_data(settings["pipeline"].process(points))
         if device_data[0]["fields"]["fetch_success"]:
             settings["watch_hen"].normal_processing()
     except KeyError as err:
@@ -50,23 +70,83 @@ def fetch_device_data(settings: dict) -> None:
 
 def write_data(device_data: list):
     """
-    Write fetched data to Db with own context manager.
+    Write fetched data to Db. If the database is not reachable, the data is stored in the
+    spool and written later. While the database is known to be down, the data goes
+    directly to the spool without waiting for the connection timeout.
     :param device_data: fetched data
     :return: None
     """
+    if write_spool.config.active and write_spool.db_known_down():
+        write_spool.append(device_data)
+        return
     try:
-        with support_functions.InfluxDBConnection() as conn:
-            conn.switch_database(support_functions.login_information.db_name)
-            conn.write_points(device_data)
-            write_watch_hen.normal_processing()
-    except InfluxDBClientError as err:
+        support_functions.write_points(device_data)
+        write_watch_hen.normal_processing()
+        write_spool.mark_db_up()
+        return
+    except StorageWriteError as err:
         write_watch_hen.failure_processing(
-            type(err).__name__, err, "- data could not be saved to database."
+            type(err.__cause__ or err).__name__, err, "- data could not be saved to database."
         )
-    except requests.exceptions.ConnectionError as err:
+    except StorageConnectionError as err:
         write_watch_hen.failure_processing(
-            type(err).__name__, err, "- no connection to database."
+            type(err.__cause__ or err).__name__, err, "- no connection to database."
         )
+    if write_spool.config.active:
+        write_spool.mark_db_down()
+        write_spool.append(device_data)
+
+
+def write_spooled_points(points: list) -> None:
+    """
+    Write a batch of spooled points. A batch which is rejected by the database as
+    invalid is dropped, otherwise it would block the spool forever.
+    :param points: Points from the spool with timestamps in nanoseconds
+    :return: None
+    """
+    try:
+        support_functions.write_points(points, time_precision="n")
+    except StorageWriteError as err:
+        if not err.invalid_data:
+            raise
+        message = f"{len(points)} spooled points were rejected by the database: {err}"
+        lh.write_log(lh.LoggingLevel.ERROR.value, message)
+
+
+def replay_spool() -> None:
+    """
+    Replay the spooled points as long as the database is not known to be down.
+    :return: None
+    """
+    if write_spool.db_known_down() or not write_spool.pending():
+        return
+    try:
+        written = write_spool.replay(write_spooled_points)
+        write_watch_hen.normal_processing()
+        if written:
+            message = f"{written} spooled points were written to the database."
+            lh.write_log(lh.LoggingLevel.INFO.value, message)
+    except StorageError as err:
+        write_watch_hen.failure_processing(
+            type(err.__cause__ or err).__name__,
+            err,
+            "- spooled data could not be saved to database.",
+        )
+        write_spool.mark_db_down()
+
+
+def export_archive(devices: list) -> None:
+    """
+    Move the old census data of the devices from the database into the archive.
+    :param devices: Device names
+    :return: None
+    """
+    backend = support_functions.get_storage_backend()
+    try:
+        archive.export(backend.inner, backend.archive, devices, archive_config)
+    except StorageError as err:
+        message = f"Old data could not be moved to the archive: {err}"
+        lh.write_log(lh.LoggingLevel.ERROR.value, message)
 
 
 def handle_communication() -> None:
@@ -91,12 +171,21 @@ def main() -> None:
         with open(DEVICES_FILE_PATH, encoding="utf-8") as file:
             data = json.load(file)
         cc.check_cost_calc_request_time()
+        if write_spool.config.active:
+            schedule.every(SPOOL_REPLAY_INTERVAL_S).seconds.do(replay_spool)
+        if support_functions.database_config["retention_days"] is not None:
+            schedule.every().day.at(RETENTION_PRUNE_TIME).do(support_functions.prune_storage)
+        if archive_config.active:
+            schedule.every().day.at(ARCHIVE_EXPORT_TIME).do(export_archive, list(data))
         for device_name, settings in data.items():
             if all(key in settings for key in keys):
                 device_settings = settings | {
                     "device_name": device_name,
                     "watch_hen": lh.WatchHen(device_name=device_name),
+                    "pipeline": ingest.create_pipeline(device_name, settings),
+                    "field_selection": projection.check_field_projection(device_name, settings),
                 }
+                projection.log_write_volume(device_name, device_settings)
                 schedule.every(settings["update_time"]).seconds.do(
                     fetch_device_data, device_settings
                 )
@@ -106,13 +195,15 @@ def main() -> None:
                 support_functions.validation_power_on_parameter(
                     settings, calc_requested
                 )
-                schedule.every().day.at(
-                    cc.config_request_time["calc_request_time_daily"]
-                ).do(
-                    cc.calculation_handler,
-                    settings | {"device_name": device_name},
-                    calc_requested,
-                )
+                reports.add(settings | {"device_name": device_name}, calc_requested)
+        if reports.jobs:
+            schedule.every().day.at(cc.config_request_time["calc_request_time_daily"]).do(
+                reports.start
+            )
+            reports.start_catch_up()
+        energy_index.setup(
+            {name: data[name] for name in com.shared_information["started_devices"]}
+        )
         # Start Telegram-Bot and send message
         th.check_and_verify_bot_connection()
         if th.verified_bot_connection["verified"]:
@@ -124,10 +215,11 @@ def main() -> None:
             schedule.every(
                 th.verified_bot_connection["bot_request_handle_time"]
             ).seconds.do(handle_communication)
-            # Start energy monitoring for each device
+            # Start energy monitoring, one job per monitoring period
             em.check_monitoring_requested(com.shared_information["started_devices"])
-            for device in com.shared_information["observed_devices"]:
-                schedule.every(device.period_min).minutes.do(em.run_monitoring, device)
+            observed_devices = com.shared_information["observed_devices"]
+            for period_min, devices in em.group_by_period(observed_devices).items():
+                schedule.every(period_min).minutes.do(em.run_monitoring, devices)
             schedule.every(
                 th.verified_bot_connection["bot_request_handle_time"]
             ).seconds.do(em.handle_communication)
@@ -148,6 +240,7 @@ def main() -> None:
 
 
 if __name__ == "__main__":
+    support_functions.check_database_config()
     support_functions.check_and_verify_db_connection()
     if support_functions.login_information.verified is not False:
         main()
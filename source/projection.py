@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Field projection per device. With the setting fields in devices.json the handlers only
+extract and write the selected fields of a sample. The selection is a preset, an include
+list or a preset with include and exclude lists. At startup the expected write volume of
+every device is written to the log.
+"""
+from datetime import datetime
+
+from source.constants import CENSUS_MEASUREMENT
+from source import logging_helper as lh
+from source.line_protocol import encode_point
+
+PHASES = ("a", "b", "c")
+REQUIRED_FIELDS = frozenset(("power", "energy_wh", "fetch_success"))
+DEVICE_FIELDS = {
+    "shelly:plug-s": ["power", "is_valid", "device_temperature", "fetch_success", "energy_wh"],
+    "shelly:3em": ["power", "energy_wh", "fetch_success"]
+    + [
+        f"{name}_{phase}"
+        for phase in PHASES
+        for name in ("power", "power_factor", "current", "voltage", "is_valid", "energy_wh")
+    ],
+}
+FIELD_PRESETS = {
+    "totals": REQUIRED_FIELDS | {"is_valid", "device_temperature"},
+    "per_phase_power": REQUIRED_FIELDS
+    | {"is_valid", "device_temperature"}
+    | {f"{name}_{phase}" for phase in PHASES for name in ("power", "energy_wh")},
+    "full": None,
+}
+SECONDS_PER_DAY = 86400
+
+
+def is_selected(settings: dict, name: str) -> bool:
+    """
+    Check if a handler should extract a field.
+    :param settings: Settings of the device with the checked field selection
+    :param name: Field name
+    :return: True if the field is selected or no selection is configured
+    """
+    selection = settings.get("field_selection")
+    return selection is None or name in selection
+
+
+def _name_list(device_name: str, value, key: str) -> list:
+    if isinstance(value, list) and all(isinstance(name, str) for name in value):
+        return value
+    message = f"The setting fields.{key} of {device_name} must be a list of field names."
+    lh.write_log(lh.LoggingLevel.WARNING.value, message)
+    return []
+
+
+def check_field_projection(device_name: str, settings: dict) -> frozenset:
+    """
+    Check the field selection of a device. A list extends the preset totals, unknown
+    presets select all fields, the fields power, energy_wh and fetch_success are always
+    written.
+    :param device_name: Device name for the log messages
+    :param settings: Settings of the device from devices.json
+    :return: Selected field names or None if all fields are written
+    """
+    projection = settings.get("fields")
+    if projection is None:
+        return None
+    if isinstance(projection, list):
+        projection = {"preset": "totals", "include": projection}
+    elif isinstance(projection, str):
+        projection = {"preset": projection}
+    elif not isinstance(projection, dict):
+        message = f"The setting fields of {device_name} is invalid, all fields are written."
+        lh.write_log(lh.LoggingLevel.WARNING.value, message)
+        return None
+    preset = projection.get("preset", "full")
+    if preset is not None and preset not in FIELD_PRESETS:
+        message = (
+            f"The field preset {preset} of {device_name} is unknown, all fields are written."
+        )
+        lh.write_log(lh.LoggingLevel.WARNING.value, message)
+        return None
+    if preset is None:
+        selection = set(REQUIRED_FIELDS)
+    elif FIELD_PRESETS[preset] is not None:
+        selection = set(FIELD_PRESETS[preset])
+    elif "exclude" not in projection:
+        return None
+    elif settings.get("type") in DEVICE_FIELDS:
+        selection = set(DEVICE_FIELDS[settings["type"]])
+    else:
+        message = (
+            f"The fields of the device type {settings.get('type')} of {device_name} are "
+            f"unknown, the exclusions are ignored and all fields are written."
+        )
+        lh.write_log(lh.LoggingLevel.WARNING.value, message)
+        return None
+    selection |= set(_name_list(device_name, projection.get("include", []), "include"))
+    excluded = set(_name_list(device_name, projection.get("exclude", []), "exclude"))
+    if excluded & REQUIRED_FIELDS:
+        message = (
+            f"The fields {sorted(excluded & REQUIRED_FIELDS)} of {device_name} are needed "
+            f"for the calculations and are not excluded."
+        )
+        lh.write_log(lh.LoggingLevel.WARNING.value, message)
+    return frozenset(selection - (excluded - REQUIRED_FIELDS))
+
+
+def estimate_write_volume(device_name: str, settings: dict) -> tuple:
+    """
+    Estimate the points and bytes per day which a device produces before pre-aggregation
+    and compression. The size is taken from a line protocol sample with typical values.
+    :param device_name: Device name
+    :param settings: Settings of the device with the checked field selection
+    :return: Points and bytes per day, None for unknown device types
+    """
+    fields = DEVICE_FIELDS.get(settings["type"])
+    if fields is None:
+        return None
+    sample = {
+        "measurement": CENSUS_MEASUREMENT,
+        "tags": {"device": device_name},
+        "time": datetime(2023, 1, 1),
+        "fields": {
+            name: True if name.startswith(("is_valid", "fetch_success")) else 1234.56
+            for name in fields
+            if is_selected(settings, name)
+        },
+    }
+    points = SECONDS_PER_DAY // settings["update_time"]
+    return points, points * (len(encode_point(sample, "n")) + 1)
+
+
+def log_write_volume(device_name: str, settings: dict) -> None:
+    """
+    Write the estimated write volume of a device to the log.
+    :param device_name: Device name
+    :param settings: Settings of the device with the checked field selection
+    :return: None
+    """
+    estimate = estimate_write_volume(device_name, settings)
+    if estimate is None:
+        return
+    points, size = estimate
+    message = (
+        f"{device_name} writes about {points} points with {size / 1024 / 1024:.1f}MB "
+        f"per day before aggregation and compression."
+    )
+    lh.write_log(lh.LoggingLevel.INFO.value, message)
+
+
+def main() -> None:
+    """
+    Scheduling function for regular call.
+    :return: None
+    """
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Mergeable quantile sketch of the power values (DDSketch). A value is counted in the bin
+of its logarithm to the base gamma, so every quantile is returned with a relative error
+of at most the relative accuracy. Sketches of hours and days are merged by adding their
+bins, which gives the same sketch as adding all values to one sketch. The rollup rows of
+the hour and day tiers hold the sketch of their bucket as a JSON string field.
+"""
+import json
+import math
+
+from source.constants import SKETCH_RELATIVE_ACCURACY, SKETCH_MIN_VALUE
+
+try:
+    import numpy as np
+except ImportError as _:
+    np = None  # pylint: disable=invalid-name
+
+
+class QuantileSketch:  # pylint: disable=too-many-instance-attributes
+    """
+    DDSketch with separate bins for positive and negative values and a bin for the values
+    near zero. The exact minimum and maximum are kept besides the bins.
+    """
+
+    def __init__(self, relative_accuracy: float = SKETCH_RELATIVE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.positive = {}
+        self.negative = {}
+        self.zero_count = 0
+        self.count = 0
+        self.min = None
+        self.max = None
+
+    def _index(self, value: float) -> int:
+        return math.ceil(math.log(value) / self.log_gamma)
+
+    def _value(self, index: int) -> float:
+        return 2 * self.gamma**index / (self.gamma + 1)
+
+    def add(self, value: float, count: int = 1) -> None:
+        """
+        Add a value.
+        :param value: Value
+        :param count: Number of samples the value stands for
+        :return: None
+        """
+        if value > SKETCH_MIN_VALUE:
+            index = self._index(value)
+            self.positive[index] = self.positive.get(index, 0) + count
+        elif value < -SKETCH_MIN_VALUE:
+            index = self._index(-value)
+            self.negative[index] = self.negative.get(index, 0) + count
+        else:
+            self.zero_count += count
+        self.count += count
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def add_array(self, values, counts) -> None:
+        """
+        Add the values of NumPy arrays, with the same result as adding them one by one.
+        :param values: Float array without NaN
+        :param counts: Float array with the number of samples of each value
+        :return: None
+        """
+        if values.size == 0:
+            return
+        for sign, bins in ((1, self.positive), (-1, self.negative)):
+            selected = sign * values > SKETCH_MIN_VALUE
+            if not np.any(selected):
+                continue
+            indexes = np.ceil(np.log(sign * values[selected]) / self.log_gamma).astype(np.int64)
+            unique, inverse = np.unique(indexes, return_inverse=True)
+            for index, count in zip(unique, np.bincount(inverse, weights=counts[selected])):
+                bins[int(index)] = bins.get(int(index), 0) + int(count)
+        self.zero_count += int(np.sum(counts[np.abs(values) <= SKETCH_MIN_VALUE]))
+        self.count += int(np.sum(counts))
+        low, high = float(np.min(values)), float(np.max(values))
+        self.min = low if self.min is None else min(self.min, low)
+        self.max = high if self.max is None else max(self.max, high)
+
+    def merge(self, other: "QuantileSketch") -> None:
+        """
+        Add the values of another sketch with the same relative accuracy.
+        :param other: Sketch
+        :return: None
+        """
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Sketches with different relative accuracy can not be merged.")
+        for bins, other_bins in ((self.positive, other.positive), (self.negative, other.negative)):
+            for index, count in other_bins.items():
+                bins[index] = bins.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        for value in (other.min, other.max):
+            if value is not None:
+                self.min = value if self.min is None else min(self.min, value)
+                self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, quantile: float) -> float:
+        """
+        Value below which the given share of the samples lies.
+        :param quantile: Share between 0 and 1
+        :return: Value, None if the sketch is empty
+        """
+        if self.count == 0:
+            return None
+        if not 0 < quantile < 1:
+            return self.min if quantile <= 0 else self.max
+        rank = quantile * (self.count - 1)
+        seen = 0
+        for index in sorted(self.negative, reverse=True):
+            seen += self.negative[index]
+            if seen > rank:
+                return max(self.min, -self._value(index))
+        seen += self.zero_count
+        if seen > rank:
+            return 0.0
+        for index in sorted(self.positive):
+            seen += self.positive[index]
+            if seen > rank:
+                return min(self.max, self._value(index))
+        return self.max
+
+    def to_field(self) -> str:
+        """
+        Encode the sketch for a string field.
+        :return: Compact JSON
+        """
+        return json.dumps(
+            {
+                "a": self.relative_accuracy,
+                "p": self.positive,
+                "n": self.negative,
+                "z": self.zero_count,
+                "min": self.min,
+                "max": self.max,
+            },
+            separators=(",", ":"),
+        )
+
+    @classmethod
+    def from_field(cls, text: str) -> "QuantileSketch":
+        """
+        Decode a sketch from a string field.
+        :param text: JSON from to_field()
+        :return: Sketch
+        """
+        data = json.loads(text)
+        sketch = cls(data["a"])
+        sketch.positive = {int(index): count for index, count in data["p"].items()}
+        sketch.negative = {int(index): count for index, count in data["n"].items()}
+        sketch.zero_count = data["z"]
+        sketch.count = sketch.zero_count + sum(sketch.positive.values()) + sum(
+            sketch.negative.values()
+        )
+        sketch.min, sketch.max = data["min"], data["max"]
+        return sketch
+
+
+def main() -> None:
+    """
+    Scheduling function for regular call.
+    :return: None
+    """
+
+
+if __name__ == "__main__":
+    main()
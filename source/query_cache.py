@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cache for the aggregate queries of the energy monitoring and the Telegram requests. The
+results are kept for a short time, results of windows which lie entirely in the past for
+much longer, because they do not change anymore. The cache is bounded in memory and
+evicts the least recently used results. Concurrent identical queries are sent to the
+database only once, the other callers wait for its result.
+"""
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Callable, Iterator
+
+from source.constants import (
+    DEFAULT_QUERY_CACHE_TTL_S,
+    DEFAULT_QUERY_CACHE_PAST_TTL_S,
+    DEFAULT_QUERY_CACHE_MAX_MEMORY_KB,
+    QUERY_CACHE_PAST_AFTER_S,
+    QUERY_CACHE_STATISTICS_LOG_INTERVAL_S,
+)
+from source import logging_helper as lh
+from source.configuration import read_config_section, apply_positive_int_settings
+from source.line_protocol import encode_timestamp
+from source.storage import StorageBackend, interval_ms
+
+
+@dataclass
+class QueryCacheConfig:
+    """
+    Settings of the query cache, read from the section query_cache in config.json.
+    """
+
+    active: bool = False
+    ttl_s: int = DEFAULT_QUERY_CACHE_TTL_S
+    past_ttl_s: int = DEFAULT_QUERY_CACHE_PAST_TTL_S
+    max_memory_kb: int = DEFAULT_QUERY_CACHE_MAX_MEMORY_KB
+
+
+def check_query_cache_config() -> QueryCacheConfig:
+    """
+    Read the query cache settings from the configuration file. Missing or invalid values
+    are replaced by the default values.
+    :return: Checked query cache configuration
+    """
+    config = QueryCacheConfig()
+    cache_settings = read_config_section("query_cache")
+    if isinstance(cache_settings.get("active"), bool):
+        config.active = cache_settings["active"]
+    apply_positive_int_settings(
+        config, cache_settings, ("ttl_s", "past_ttl_s", "max_memory_kb"), "query_cache"
+    )
+    return config
+
+
+def estimate_size(value) -> int:
+    """
+    Rough memory of a key or a result with its nested lists, tuples and rows.
+    :param value: Key or cached result
+    :return: Size in bytes
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, (list, tuple)):
+        size += sum(estimate_size(item) for item in value)
+    elif isinstance(value, dict):
+        size += sum(sys.getsizeof(item) for item in value.values())
+    return size
+
+
+class QueryCache:  # pylint: disable=too-many-instance-attributes
+    """
+    LRU cache with a time to live per entry and single flight of identical queries.
+    """
+
+    def __init__(self, config: QueryCacheConfig, clock: Callable[[], float] = time.monotonic):
+        self.config = config
+        self.clock = clock
+        self.lock = threading.Lock()
+        # Key -> (expiry, size, result), the least recently used entry first
+        self.entries = OrderedDict()
+        self.in_flight = {}
+        self.size = 0
+        self.counters = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0}
+        self.last_report = clock()
+
+    def get(self, key: tuple, query: Callable[[], object], ttl_s: int):
+        """
+        Return the cached result of a query or run the query. If the same query is
+        already running, its result is awaited instead.
+        :param key: Normalized query
+        :param query: Function which runs the query
+        :param ttl_s: Time to live of the result in seconds
+        :return: Result of the query
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > self.clock():
+                self.entries.move_to_end(key)
+                self.counters["hits"] += 1
+                return entry[2]
+            flight = self.in_flight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.in_flight[key] = Future()
+                self.counters["misses"] += 1
+            else:
+                self.counters["coalesced"] += 1
+        if not leader:
+            return flight.result()
+        try:
+            result = query()
+        except Exception as err:
+            with self.lock:
+                del self.in_flight[key]
+            flight.set_exception(err)
+            raise
+        with self.lock:
+            del self.in_flight[key]
+            self._store(key, result, ttl_s)
+        flight.set_result(result)
+        if self.clock() - self.last_report >= QUERY_CACHE_STATISTICS_LOG_INTERVAL_S:
+            self.report()
+        return result
+
+    def _store(self, key: tuple, result, ttl_s: int) -> None:
+        if key in self.entries:
+            self.size -= self.entries.pop(key)[1]
+        size = estimate_size(key) + estimate_size(result)
+        self.entries[key] = (self.clock() + ttl_s, size, result)
+        self.size += size
+        while self.size > self.config.max_memory_kb * 1024 and self.entries:
+            self.size -= self.entries.popitem(last=False)[1][1]
+            self.counters["evictions"] += 1
+
+    def clear(self) -> None:
+        """
+        Drop all cached results, for example after data was deleted.
+        :return: None
+        """
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def statistics(self) -> dict:
+        """
+        Counters of the cache since the start.
+        :return: Hits, misses, coalesced queries, evictions, entries and size in bytes
+        """
+        with self.lock:
+            return self.counters | {"entries": len(self.entries), "size": self.size}
+
+    def report(self) -> None:
+        """
+        Write the counters to the log.
+        :return: None
+        """
+        self.last_report = self.clock()
+        statistics = self.statistics()
+        message = (
+            f"Query cache: {statistics['hits']} hits, {statistics['misses']} misses, "
+            f"{statistics['coalesced']} coalesced, {statistics['evictions']} evictions, "
+            f"{statistics['entries']} entries with {statistics['size'] / 1024:.0f} kB."
+        )
+        lh.write_log(lh.LoggingLevel.INFO.value, message)
+
+
+class CachingBackend(StorageBackend):
+    """
+    View of a backend which answers aggregate and bucket queries from the cache. The
+    time range of windows which reach into the last minutes is rounded to the time to
+    live, so queries within this time share one result like a plain TTL cache. Range
+    queries and writes are passed through, deletes clear the cache.
+    """
+
+    def __init__(self, inner: StorageBackend, cache: QueryCache):
+        super().__init__(inner.schema)
+        self.inner = inner
+        self.cache = cache
+
+    def _window_key(self, start: datetime, end: datetime) -> tuple:
+        """
+        Normalized time range and the time to live of its result.
+        :return: Start and end in the key and the time to live in seconds
+        """
+        start_ms = encode_timestamp(start, "ms")
+        end_ms = encode_timestamp(end, "ms")
+        if end <= datetime.utcnow() - timedelta(seconds=QUERY_CACHE_PAST_AFTER_S):
+            return start_ms, end_ms, self.cache.config.past_ttl_s
+        resolution_ms = self.cache.config.ttl_s * 1000
+        return start_ms // resolution_ms, end_ms // resolution_ms, self.cache.config.ttl_s
+
+    def verify(self) -> None:
+        self.inner.verify()
+
+    def write_points(self, points: list, time_precision: str = None) -> None:
+        self.inner.write_points(points, time_precision)
+
+    def delete_range(self, measurement: str, device: str, start: datetime, end: datetime) -> None:
+        self.inner.delete_range(measurement, device, start, end)
+        self.cache.clear()
+
+    def prune(self, before: datetime) -> int:
+        deleted = self.inner.prune(before)
+        self.cache.clear()
+        return deleted
+
+    def field_keys(self, measurement: str, device: str, start: datetime, end: datetime) -> list:
+        return self.inner.field_keys(measurement, device, start, end)
+
+    def series_cardinality(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self, measurement: str, device: str, start: datetime, end: datetime, field: str = None
+    ) -> int:
+        return self.inner.series_cardinality(measurement, device, start, end, field)
+
+    def query_range(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        measurement: str,
+        device: str,
+        start: datetime,
+        end: datetime,
+        fields: list = None,
+        filters: dict = None,
+    ) -> Iterator[dict]:
+        return self.inner.query_range(measurement, device, start, end, fields, filters)
+
+    def query_columns(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        measurement: str,
+        device: str,
+        start: datetime,
+        end: datetime,
+        fields: list,
+        filters: dict = None,
+    ) -> Iterator[dict]:
+        return self.inner.query_columns(measurement, device, start, end, fields, filters)
+
+    def query_aggregate(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        measurement: str,
+        device: str,
+        start: datetime,
+        end: datetime,
+        field: str,
+        function: str,
+        filters: dict = None,
+    ):
+        """
+        Aggregate one field of a device between start and end (both exclusive) from the
+        cache or the database.
+        :return: Aggregated value or None if there is no row
+        """
+        start_key, end_key, ttl_s = self._window_key(start, end)
+        key = (
+            "aggregate",
+            measurement,
+            device,
+            start_key,
+            end_key,
+            field,
+            function,
+            tuple(sorted((filters or {}).items())),
+        )
+        return self.cache.get(
+            key,
+            lambda: self.inner.query_aggregate(
+                measurement, device, start, end, field, function, filters
+            ),
+            ttl_s,
+        )
+
+    def query_group_aggregate(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        measurement: str,
+        devices: list,
+        start: datetime,
+        end: datetime,
+        field: str,
+        function: str,
+        filters: dict = None,
+    ) -> dict:
+        """
+        Aggregate one field of several devices between start and end (both exclusive)
+        from the cache or the database.
+        :return: Aggregated value per device, devices without rows are left out
+        """
+        start_key, end_key, ttl_s = self._window_key(start, end)
+        key = (
+            "group_aggregate",
+            measurement,
+            tuple(sorted(devices)),
+            start_key,
+            end_key,
+            field,
+            function,
+            tuple(sorted((filters or {}).items())),
+        )
+        return dict(
+            self.cache.get(
+                key,
+                lambda: self.inner.query_group_aggregate(
+                    measurement, devices, start, end, field, function, filters
+                ),
+                ttl_s,
+            )
+        )
+
+    def query_buckets(  # pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-locals
+        self,
+        measurement: str,
+        device: str,
+        start: datetime,
+        end: datetime,
+        field: str,
+        function: str,
+        interval: timedelta,
+        filters: dict = None,
+        origin: datetime = None,
+    ) -> list:
+        """
+        Aggregate one field of a device in time buckets from the cache or the database.
+        :return: Rows with the start of the bucket as time and the aggregate as value
+        """
+        start_key, end_key, ttl_s = self._window_key(start, end)
+        end_ms = encode_timestamp(end, "ms")
+        key = (
+            "buckets",
+            measurement,
+            device,
+            start_key,
+            end_key,
+            field,
+            function,
+            interval_ms(interval),
+            tuple(sorted((filters or {}).items())),
+            None if origin is None else encode_timestamp(origin, "ms") - end_ms,
+        )
+        cached_end_ms, rows = self.cache.get(
+            key,
+            lambda: (
+                end_ms,
+                self.inner.query_buckets(
+                    measurement, device, start, end, field, function, interval, filters, origin
+                ),
+            ),
+            ttl_s,
+        )
+        shift_ms = end_ms - cached_end_ms if origin is not None else 0
+        if shift_ms == 0:
+            return rows
+        # Buckets aligned to the end of a slightly older window are moved to this window
+        return [{"time": row["time"] + shift_ms, "value": row["value"]} for row in rows]
+
+
+def main() -> None:
+    """
+    Scheduling function for regular call.
+    :return: None
+    """
+
+
+if __name__ == "__main__":
+    main()
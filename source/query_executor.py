@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Executor of the database queries. The queries run on a small pool of worker threads, so
+a long query does not block the scheduler and only few queries compete with the writes
+at the same time. Every query has a deadline, after which the caller gets an error and
+the query is asked to stop. Streaming queries check the cancellation between their rows.
+Before a raw range query runs, its rows are estimated from the number of series and the
+sampling interval, oversized queries are answered from time buckets instead.
+The queue wait and execution time are counted per caller.
+"""
+import math
+import threading
+import time
+from concurrent import futures
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Iterable, Iterator
+
+from source.constants import (
+    DEFAULT_QUERY_WORKERS,
+    DEFAULT_QUERY_TIMEOUT_S,
+    DEFAULT_REPORT_QUERY_TIMEOUT_S,
+    DEFAULT_QUERY_MAX_RAW_ROWS,
+    QUERY_EXECUTOR_STATISTICS_LOG_INTERVAL_S,
+)
+from source import logging_helper as lh
+from source.configuration import read_config_section, apply_positive_int_settings
+from source.storage import StorageBackend, StorageError
+
+
+class QueryTimeoutError(StorageError):
+    """
+    The query did not finish before its deadline and was cancelled.
+    """
+
+
+@dataclass
+class QueryExecutorConfig:
+    """
+    Settings of the query executor, read from the section query_executor in config.json.
+    """
+
+    max_workers: int = DEFAULT_QUERY_WORKERS
+    timeout_s: int = DEFAULT_QUERY_TIMEOUT_S
+    report_timeout_s: int = DEFAULT_REPORT_QUERY_TIMEOUT_S
+    max_raw_rows: int = DEFAULT_QUERY_MAX_RAW_ROWS
+
+
+def check_query_executor_config() -> QueryExecutorConfig:
+    """
+    Read the query executor settings from the configuration file. Missing or invalid
+    values are replaced by the default values.
+    :return: Checked query executor configuration
+    """
+    config = QueryExecutorConfig()
+    apply_positive_int_settings(
+        config,
+        read_config_section("query_executor"),
+        ("max_workers", "timeout_s", "report_timeout_s", "max_raw_rows"),
+        "query_executor",
+    )
+    return config
+
+
+def estimate_rows(cardinality: int, start: datetime, end: datetime, interval_s: float) -> int:
+    """
+    Rows of a raw range query, one row per series and sampling interval.
+    :param cardinality: Number of series
+    :param start: Start of the range
+    :param end: End of the range
+    :param interval_s: Sampling interval in seconds
+    :return: Estimated number of rows
+    """
+    return cardinality * math.ceil((end - start).total_seconds() / interval_s)
+
+
+def cancellable(rows: Iterable, cancel: threading.Event) -> Iterator:
+    """
+    Pass the rows of a streaming query until the query is cancelled.
+    :param rows: Rows or chunks of the query
+    :param cancel: Event which is set when the query is cancelled
+    :return: Rows
+    """
+    for row in rows:
+        if cancel.is_set():
+            raise QueryTimeoutError("The query was cancelled.")
+        yield row
+
+
+class QueryExecutor:
+    """
+    Bounded worker pool for the queries with deadlines and statistics per caller.
+    """
+
+    def __init__(self, config: QueryExecutorConfig, clock: Callable[[], float] = time.monotonic):
+        self.config = config
+        self.clock = clock
+        self.pool = futures.ThreadPoolExecutor(
+            max_workers=config.max_workers, thread_name_prefix="query"
+        )
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.callers = {}
+        self.last_report = clock()
+
+    def run(self, caller: str, query: Callable[[threading.Event], object], timeout_s: int = None):
+        """
+        Run a query on the pool and wait for its result. A query which is started by
+        another query runs directly, so the pool cannot block itself.
+        :param caller: Name of the caller in the statistics
+        :param query: Function which runs the query, it gets the cancellation event
+        :param timeout_s: Deadline in seconds, timeout_s of the configuration if None
+        :return: Result of the query
+        """
+        if getattr(self.local, "worker", False):
+            return query(threading.Event())
+        timeout_s = timeout_s or self.config.timeout_s
+        cancel = threading.Event()
+        future = self.pool.submit(self._execute, caller, query, cancel, self.clock())
+        try:
+            result = future.result(timeout=timeout_s)
+        except futures.TimeoutError as err:
+            cancel.set()
+            future.cancel()
+            self._count(caller, "timeouts", 1)
+            raise QueryTimeoutError(
+                f"The query of {caller} was cancelled after {timeout_s} s."
+            ) from err
+        if self.clock() - self.last_report >= QUERY_EXECUTOR_STATISTICS_LOG_INTERVAL_S:
+            self.report()
+        return result
+
+    def _execute(
+        self, caller: str, query: Callable, cancel: threading.Event, submitted: float
+    ):
+        self.local.worker = True
+        started = self.clock()
+        try:
+            return query(cancel)
+        finally:
+            self._count(caller, "queries", 1)
+            self._count(caller, "queue_s", started - submitted)
+            self._count(caller, "execution_s", self.clock() - started)
+
+    def _count(self, caller: str, counter: str, value: float) -> None:
+        with self.lock:
+            counters = self.callers.setdefault(
+                caller, {"queries": 0, "timeouts": 0, "queue_s": 0.0, "execution_s": 0.0}
+            )
+            counters[counter] += value
+
+    @staticmethod
+    def raw_rows(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        backend: StorageBackend,
+        measurement: str,
+        device: str,
+        start: datetime,
+        end: datetime,
+        interval_s: float,
+    ) -> int:
+        """
+        Estimate the rows of a raw range query from the series of energy_wh.
+        :param backend: Storage backend
+        :param measurement: Name of the measurement
+        :param device: Device name
+        :param start: Start of the range
+        :param end: End of the range
+        :param interval_s: Sampling interval of the device in seconds
+        :return: Estimated number of rows
+        """
+        cardinality = backend.series_cardinality(measurement, device, start, end, "energy_wh")
+        return estimate_rows(cardinality, start, end, interval_s)
+
+    def statistics(self) -> dict:
+        """
+        Counters per caller since the start.
+        :return: Queries, timeouts, queue wait and execution time in seconds per caller
+        """
+        with self.lock:
+            return {caller: dict(counters) for caller, counters in self.callers.items()}
+
+    def report(self) -> None:
+        """
+        Write the counters per caller to the log.
+        :return: None
+        """
+        self.last_report = self.clock()
+        for caller, counters in self.statistics().items():
+            message = (
+                f"Queries of {caller}: {counters['queries']} queries, "
+                f"{counters['timeouts']} timeouts, {counters['queue_s']:.2f} s queue wait, "
+                f"{counters['execution_s']:.2f} s execution."
+            )
+            lh.write_log(lh.LoggingLevel.INFO.value, message)
+
+
+def main() -> None:
+    """
+    Scheduling function for regular call.
+    :return: None
+    """
+
+
+if __name__ == "__main__":
+    main()
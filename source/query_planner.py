@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Planner for aggregates over nested windows which all end at the same time, like the
+energy overview or the day, month and year reports. Instead of one query per window the
+widest window is queried once in time buckets aligned to the common end. Every window is
+then read from the prefix sums of the buckets.
+"""
+from datetime import datetime, timedelta
+from itertools import accumulate
+from math import gcd
+
+from source.constants import CENSUS_MEASUREMENT, MAX_PLANNER_BUCKETS
+from source.line_protocol import encode_timestamp
+from source.storage import StorageBackend
+
+ADDITIVE_FUNCTIONS = ("sum", "count")
+
+
+class NestedWindowPlanner:
+    """
+    Aggregates of one device over windows from the given starts to a common end. The
+    bucket length is the greatest common divisor of the window lengths, so every window
+    consists of whole buckets. If this would need too many buckets, every window is
+    queried on its own.
+    """
+
+    def __init__(self, backend: StorageBackend, device: str, end: datetime, starts: list):
+        self.backend = backend
+        self.device = device
+        self.end = end
+        self.end_ms = encode_timestamp(end, "ms")
+        self.lengths_ms = [self.end_ms - encode_timestamp(start, "ms") for start in starts]
+        self.resolution_ms = None
+        if self.lengths_ms and min(self.lengths_ms) > 0:
+            resolution_ms = gcd(*self.lengths_ms)
+            if max(self.lengths_ms) // resolution_ms <= MAX_PLANNER_BUCKETS:
+                self.resolution_ms = resolution_ms
+
+    def aggregate(
+        self, measurement: str, field: str, function: str, filters: dict = None
+    ) -> list:
+        """
+        Sum or count one field for all windows with one bucket query.
+        :param measurement: Name of the measurement
+        :param field: Aggregated field
+        :param function: Aggregate function, sum or count
+        :param filters: Field values the rows must match
+        :return: Aggregate per window in the order of the starts, 0 for empty windows
+        """
+        if function not in ADDITIVE_FUNCTIONS:
+            raise ValueError(f"Aggregate function {function} can not be nested.")
+        if self.resolution_ms is None:
+            return [
+                self.backend.query_aggregate(
+                    measurement,
+                    self.device,
+                    self.end - timedelta(milliseconds=length_ms),
+                    self.end,
+                    field,
+                    function,
+                    filters,
+                )
+                or 0
+                for length_ms in self.lengths_ms
+            ]
+        widest_ms = max(self.lengths_ms)
+        rows = self.backend.query_buckets(
+            measurement,
+            self.device,
+            self.end - timedelta(milliseconds=widest_ms),
+            self.end,
+            field,
+            function,
+            timedelta(milliseconds=self.resolution_ms),
+            filters,
+            self.end,
+        )
+        # Index k holds the bucket which starts k buckets before the end
+        buckets = [0] * (widest_ms // self.resolution_ms + 1)
+        for row in rows:
+            buckets[(self.end_ms - row["time"]) // self.resolution_ms] += row["value"] or 0
+        prefix_sums = list(accumulate(buckets))
+        return [prefix_sums[length_ms // self.resolution_ms] for length_ms in self.lengths_ms]
+
+    def energy_sums(self) -> list:
+        """
+        Energy of the valid samples per window.
+        :return: Energy in Wh per window
+        """
+        return self.aggregate(
+            CENSUS_MEASUREMENT, "energy_wh", "sum", self.backend.valid_sample_filter()
+        )
+
+    def sample_statistics(self) -> list:
+        """
+        Energy and number of the valid samples per window like
+        StorageBackend.sample_statistics.
+        :return: Sum of energy_wh and number of samples per window
+        """
+        filters = self.backend.valid_sample_filter()
+        points = self.aggregate(CENSUS_MEASUREMENT, "energy_wh", "count", filters)
+        represented = self.aggregate(CENSUS_MEASUREMENT, "sample_count", "sum", filters)
+        counted_points = self.aggregate(CENSUS_MEASUREMENT, "sample_count", "count", filters)
+        return [
+            {"energy_wh": energy_wh, "sample_count": int(count + extra - counted)}
+            for energy_wh, count, extra, counted in zip(
+                self.energy_sums(), points, represented, counted_points
+            )
+        ]
+
+    def failure_counts(self) -> list:
+        """
+        Number of failed polls per window.
+        :return: Failures per window
+        """
+        measurement, field = self.backend.failure_source()
+        return [
+            int(count)
+            for count in self.aggregate(measurement, field, "count", {field: False})
+        ]
+
+
+def main() -> None:
+    """
+    Scheduling function for regular call.
+    :return: None
+    """
+
+
+if __name__ == "__main__":
+    main()
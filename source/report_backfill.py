@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Regeneration of the daily, monthly and yearly reports for a range of days. Every day is
+calculated like the scheduled run at calc_request_time_daily (UTC) of that day with the
+periods which were due on it, so the reports equal those of a running app. A report which
+ends on the same day as an existing one replaces it, for example after the price in
+config.json was fixed. The devices are distributed over worker processes. At the start the
+app catches up the reports it missed while it was not running. The reports are written to
+the report store, see report_store.py:
+python -m source.report_backfill --start 2023-01-01 [--end 2023-01-31] [--device plug]
+"""
+import argparse
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+from source.constants import (
+    DEVICES_FILE_PATH,
+    DEFAULT_REPORT_WORKERS,
+    REPORT_CATCH_UP_MAX_DAYS,
+)
+from source import calculations as cc
+from source import support_functions as sf
+from source import report_store
+from source import logging_helper as lh
+
+DAY_FORMAT = "%Y-%m-%d"
+ONE_DAY = timedelta(days=1)
+
+
+def run_time(day: datetime) -> datetime:
+    """
+    Time of the scheduled calculation on a day.
+    :param day: Midnight of the day
+    :return: Day with the time of calc_request_time_daily
+    """
+    hour, minute = cc.config_request_time["calc_request_time_daily"].split(":")
+    return day + timedelta(hours=int(hour), minutes=int(minute))
+
+
+def restrict_calc_requested(calc_requested: dict, periods: list) -> dict:
+    """
+    Requested calculations limited to some periods.
+    :param calc_requested: Structure which calculations are requested
+    :param periods: Indexes of the kept periods
+    :return: Structure with the other periods switched off
+    """
+    return calc_requested | {
+        key: [requested and period in periods for period, requested in enumerate(values)]
+        for key, values in calc_requested.items()
+        if key in ("cost_calc", "power_on_counter")
+    }
+
+
+def requested_runs(calc_requested: dict, first_day: datetime, last_day: datetime) -> list:
+    """
+    Scheduled runs between two days with the periods which were due on each day.
+    :param calc_requested: Structure which calculations are requested
+    :param first_day: Midnight of the first day
+    :param last_day: Midnight of the last day
+    :return: Time of the run and the indexes of the due periods, in time order
+    """
+    runs = []
+    day = first_day
+    while day <= last_day:
+        periods = cc.due_periods(calc_requested, run_time(day))
+        if periods:
+            runs.append((run_time(day), periods))
+        day += ONE_DAY
+    return runs
+
+
+def missed_runs(settings: dict, calc_requested: dict, now: datetime) -> list:
+    """
+    Runs whose reports are missing after the last stored report of each period. A period
+    without any report is not caught up, its history starts with the next run.
+    :param settings: Device parameters with the device name
+    :param calc_requested: Structure which calculations are requested
+    :param now: Current time, later runs are not missed yet
+    :return: Time of the run and the indexes of the missing periods, in time order
+    """
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    missing = {}
+    for period, period_type in enumerate(report_store.PERIOD_TYPES):
+        report_store.import_report_file(settings["device_name"], period_type)
+        last_end = report_store.get_report_store().last_end(settings["device_name"], period_type)
+        if last_end is None:
+            continue
+        first_day = max(
+            last_end.replace(hour=0, minute=0, second=0) + ONE_DAY,
+            today - timedelta(days=REPORT_CATCH_UP_MAX_DAYS),
+        )
+        period_requested = restrict_calc_requested(calc_requested, [period])
+        for time, _ in requested_runs(period_requested, first_day, today):
+            if time <= now:
+                missing.setdefault(time, []).append(period)
+    return sorted(missing.items())
+
+
+def init_worker() -> None:
+    """
+    Read the configuration in a new worker process.
+    :return: None
+    """
+    sf.check_database_config()
+    cc.check_cost_calc_request_time()
+
+
+def regenerate_device(settings: dict, calc_requested: dict, runs: list) -> int:
+    """
+    Calculate and write the reports of one device. The runs are processed in time order,
+    so the reports of the device stay in order.
+    :param settings: Device parameters with the device name
+    :param calc_requested: Structure which calculations are requested
+    :param runs: Time of the run and the indexes of the periods to calculate
+    :return: Number of runs
+    """
+    for time, periods in runs:
+        cc.calculation_handler(settings, restrict_calc_requested(calc_requested, periods), time)
+    return len(runs)
+
+
+def regenerate(jobs: list, runs: dict, max_workers: int) -> int:
+    """
+    Regenerate the reports of several devices in worker processes. Each device is handled
+    by one process, because its reports share the report files. An error of one device,
+    also of a broken worker process, is logged and the other devices are still reported.
+    :param jobs: Device parameters and requested calculations of each device
+    :param runs: Runs per device name
+    :param max_workers: Maximum number of processes
+    :return: Number of regenerated runs
+    """
+    jobs = [(settings, calc) for settings, calc in jobs if runs.get(settings["device_name"])]
+    if not jobs:
+        return 0
+    total = 0
+    with ProcessPoolExecutor(
+        max_workers=min(max_workers, len(jobs)),
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_worker,
+    ) as executor:
+        futures = {
+            settings["device_name"]: executor.submit(
+                regenerate_device, settings, calc_requested, runs[settings["device_name"]]
+            )
+            for settings, calc_requested in jobs
+        }
+        for device, future in futures.items():
+            try:
+                count = future.result()
+            except Exception as err:  # pylint: disable=broad-exception-caught
+                message = f"The reports of {device} could not be regenerated: {err!r}"
+                lh.write_log(lh.LoggingLevel.ERROR.value, message)
+                continue
+            total += count
+            message = f"Regenerated the reports of {count} days for {device}."
+            lh.write_log(lh.LoggingLevel.INFO.value, message)
+    return total
+
+
+def catch_up(jobs: list, max_workers: int) -> int:
+    """
+    Write the reports which were missed while the app was not running.
+    :param jobs: Device parameters and requested calculations of each device
+    :param max_workers: Maximum number of processes
+    :return: Number of regenerated runs
+    """
+    now = datetime.utcnow()
+    runs = {
+        settings["device_name"]: missed_runs(settings, calc_requested, now)
+        for settings, calc_requested in jobs
+    }
+    return regenerate(jobs, runs, max_workers)
+
+
+def report_jobs(devices: list = None) -> list:
+    """
+    Device parameters and requested calculations of the devices with reports.
+    :param devices: Device names, all devices in devices.json if None
+    :return: Device parameters with the device name and requested calculations
+    """
+    with open(DEVICES_FILE_PATH, encoding="utf-8") as file:
+        data = json.load(file)
+    jobs = []
+    for device in devices if devices else list(data):
+        settings = data.get(device, {})
+        calc_requested = cc.check_calc_requested(settings)
+        if calc_requested["start_schedule_task"] is True:
+            sf.validation_power_on_parameter(settings, calc_requested)
+            jobs.append((settings | {"device_name": device}, calc_requested))
+    return jobs
+
+
+def main() -> None:
+    """
+    Command line entry point of the regeneration.
+    :return: None
+    """
+    parser = argparse.ArgumentParser(
+        description="Regenerate the daily, monthly and yearly reports of a range of days."
+    )
+    parser.add_argument("--start", required=True, help="First day, e.g. 2023-01-01")
+    parser.add_argument("--end", help="Last day, default today")
+    parser.add_argument("--device", action="append", help="Device name, can be repeated")
+    parser.add_argument(
+        "--workers", type=int, default=DEFAULT_REPORT_WORKERS, help="Number of processes"
+    )
+    args = parser.parse_args()
+    init_worker()
+    sf.check_and_verify_db_connection()
+    if sf.login_information.verified is False:
+        return
+    now = datetime.utcnow()
+    first_day = datetime.strptime(args.start, DAY_FORMAT)
+    last_day = datetime.strptime(args.end, DAY_FORMAT) if args.end else now
+    jobs = report_jobs(args.device)
+    runs = {
+        settings["device_name"]: [
+            (time, periods)
+            for time, periods in requested_runs(calc_requested, first_day, last_day)
+            if time <= now
+        ]
+        for settings, calc_requested in jobs
+    }
+    regenerate(jobs, runs, max(1, args.workers))
+
+
+if __name__ == "__main__":
+    main()
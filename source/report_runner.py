@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Runner of the daily report calculations. The calculations of all devices are collected in
+one batch, which runs in a background thread on a small worker pool, so the polling of the
+main loop continues while long periods are read. All reports of a batch end at the same
+timestamp, so identical windows of different devices are answered once by the query cache.
+The reports missed while the app was not running are caught up at the start, a daily batch
+which is due meanwhile waits for the catch-up and runs after it.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable
+
+from source.constants import DEFAULT_REPORT_WORKERS
+from source import calculations as cc
+from source import report_backfill
+from source import logging_helper as lh
+from source.configuration import read_config_section, apply_positive_int_settings
+from source.storage import StorageError
+
+CATCH_UP_THREAD_NAME = "report-catch-up"
+
+
+@dataclass
+class ReportRunnerConfig:
+    """
+    Settings of the report runner, read from the section report_runner in config.json.
+    """
+
+    max_workers: int = DEFAULT_REPORT_WORKERS
+
+
+def check_report_runner_config() -> ReportRunnerConfig:
+    """
+    Read the report runner settings from the configuration file. Missing or invalid values
+    are replaced by the default values.
+    :return: Checked report runner configuration
+    """
+    config = ReportRunnerConfig()
+    apply_positive_int_settings(
+        config, read_config_section("report_runner"), ("max_workers",), "report_runner"
+    )
+    return config
+
+
+def run_device_reports(
+    settings: dict, calc_requested: dict, current_timestamp: datetime
+) -> float:
+    """
+    Calculate and write the due reports of one device.
+    :param settings: Device parameters with the device name
+    :param calc_requested: Structure which calculations are requested
+    :param current_timestamp: Common end of the periods of the batch
+    :return: Duration in seconds
+    """
+    start_time = time.perf_counter()
+    try:
+        cc.calculation_handler(settings, calc_requested, current_timestamp)
+    except StorageError as err:
+        message = f"The reports of {settings['device_name']} could not be calculated: {err}"
+        lh.write_log(lh.LoggingLevel.ERROR.value, message)
+    duration = time.perf_counter() - start_time
+    message = f"Reports of {settings['device_name']} calculated in {duration:.2f} s."
+    lh.write_log(lh.LoggingLevel.INFO.value, message)
+    return duration
+
+
+class ReportRunner:
+    """
+    Daily batch of the report calculations of all devices.
+    """
+
+    def __init__(self, config: ReportRunnerConfig):
+        self.config = config
+        self.jobs = []
+        self.thread = None
+
+    def add(self, settings: dict, calc_requested: dict) -> None:
+        """
+        Add the calculations of a device to the batch.
+        :param settings: Device parameters with the device name
+        :param calc_requested: Structure which calculations are requested
+        :return: None
+        """
+        self.jobs.append((settings, calc_requested))
+
+    def start(self, batch: Callable[[], object] = None, name: str = "report-runner") -> None:
+        """
+        Start the batch in a background thread. The scheduler calls this once a day, a
+        batch which is still running is not started a second time. A batch which is due
+        while the catch-up is running waits for it and runs afterwards.
+        :param batch: Function of the batch, run_batch() if None
+        :param name: Name of the thread
+        :return: None
+        """
+        previous = self.thread
+        if previous is not None and previous.is_alive():
+            if previous.name != CATCH_UP_THREAD_NAME:
+                message = "The reports of the previous day are still being calculated."
+                lh.write_log(lh.LoggingLevel.WARNING.value, message)
+                return
+            message = "The reports are calculated after the missed reports were caught up."
+            lh.write_log(lh.LoggingLevel.INFO.value, message)
+        self.thread = threading.Thread(
+            target=self._run_after,
+            args=(previous, batch or self.run_batch),
+            name=name,
+            daemon=True,
+        )
+        self.thread.start()
+
+    @staticmethod
+    def _run_after(previous: threading.Thread, batch: Callable[[], object]) -> None:
+        if previous is not None:
+            previous.join()
+        batch()
+
+    def start_catch_up(self) -> None:
+        """
+        Start the catch-up of the missed reports in a background thread.
+        :return: None
+        """
+        self.start(self.catch_up, CATCH_UP_THREAD_NAME)
+
+    def catch_up(self) -> int:
+        """
+        Write the reports which were missed while the app was not running, see
+        report_backfill.catch_up().
+        :return: Number of regenerated runs
+        """
+        return report_backfill.catch_up(self.jobs, self.config.max_workers)
+
+    def run_batch(self) -> dict:
+        """
+        Calculate the reports of all devices with at most max_workers devices at once.
+        :return: Duration in seconds per device name
+        """
+        current_timestamp = datetime.utcnow()
+        start_time = time.perf_counter()
+        with ThreadPoolExecutor(
+            max_workers=self.config.max_workers, thread_name_prefix="report"
+        ) as executor:
+            futures = {
+                settings["device_name"]: executor.submit(
+                    run_device_reports, settings, calc_requested, current_timestamp
+                )
+                for settings, calc_requested in self.jobs
+            }
+            durations = {name: future.result() for name, future in futures.items()}
+        message = (
+            f"Reports of {len(durations)} devices calculated in "
+            f"{time.perf_counter() - start_time:.2f} s."
+        )
+        lh.write_log(lh.LoggingLevel.INFO.value, message)
+        return durations
+
+
+def main() -> None:
+    """
+    Scheduling function for regular call.
+    :return: None
+    """
+
+
+if __name__ == "__main__":
+    main()
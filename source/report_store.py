@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Store of the daily, monthly and yearly reports in an SQLite table with the primary key
+(device, period_type, start). Telegram and other consumers look up the report of a point
+in time or list the reports of a range through the index instead of parsing the text
+files. The report files are rendered from the store after every write. Report files which
+existed before the store are imported on the first write of their device and period.
+Stores and files from before the power statistics get their columns on first use.
+"""
+import os
+import re
+import sqlite3
+from contextlib import closing
+from datetime import datetime
+
+from source.constants import REPORT_DATABASE_PATH
+from source import support_functions as sf
+
+PERIOD_TYPES = ("day", "month", "year")
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+REPORT_COLUMNS = (
+    "sum_of_energy",
+    "total_cost",
+    "cost_kwh",
+    "error_rate_one",
+    "error_rate_two",
+    "power_on",
+) + sf.POWER_REPORT_KEYS
+# Costs column of a report file, "<total> (<price>€/KWh)"
+COST_PATTERN = re.compile(r"^\s*(.*?)\s*\(\s*(.*?)€/KWh\)\s*$")
+report_store = {"store": None}
+
+
+def parse_report_value(text: str):
+    """
+    Value of a column in a report file.
+    :param text: Column without padding
+    :return: Number, None for Not req and N.A.
+    """
+    if text == "9.99+":
+        return 10.0
+    try:
+        return int(text) if text.isdigit() else float(text)
+    except ValueError:
+        return None
+
+
+def parse_report_line(line: str) -> dict:
+    """
+    Report of a line in a report file.
+    :param line: Line of a report file
+    :return: Report with start_date, end_date and the report columns, None for the header
+    and reports without period. Lines without power statistics have None for them.
+    """
+    columns = line.split("|")
+    if len(columns) not in (8, 8 + len(sf.POWER_REPORT_KEYS)):
+        return None
+    start_date, _, end_date = columns[1].strip().partition(" - ")
+    cost = COST_PATTERN.match(columns[3])
+    try:
+        datetime.strptime(start_date, DATE_FORMAT)
+        datetime.strptime(end_date, DATE_FORMAT)
+    except ValueError:
+        return None
+    if cost is None:
+        return None
+    values = [columns[2], cost.group(1), cost.group(2), columns[4], columns[5], columns[6]]
+    values += columns[7:-1] or [""] * len(sf.POWER_REPORT_KEYS)
+    return {"start_date": start_date, "end_date": end_date} | {
+        key: parse_report_value(value.strip()) for key, value in zip(REPORT_COLUMNS, values)
+    }
+
+
+class ReportStore:
+    """
+    Reports of all devices in an SQLite file. Every call opens its own connection, so the
+    store is shared by the report threads and the processes of a backfill.
+    """
+
+    def __init__(self, database_path: str):
+        self.database_path = database_path
+
+    def connection(self) -> sqlite3.Connection:
+        """
+        Open the database and create the table if it does not exist.
+        :return: SQLite connection
+        """
+        directory = os.path.dirname(self.database_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.database_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS reports (device TEXT NOT NULL, "
+            "period_type TEXT NOT NULL, start TEXT NOT NULL, end TEXT NOT NULL, "
+            "sum_of_energy REAL, total_cost REAL, cost_kwh REAL, error_rate_one REAL, "
+            "error_rate_two REAL, power_on INTEGER, power_p50 REAL, power_p95 REAL, "
+            "power_p99 REAL, power_peak REAL, power_baseload REAL, "
+            "PRIMARY KEY (device, period_type, start)) WITHOUT ROWID"
+        )
+        existing = {row["name"] for row in conn.execute("PRAGMA table_info(reports)")}
+        for key in sf.POWER_REPORT_KEYS:
+            if key not in existing:
+                conn.execute(f"ALTER TABLE reports ADD COLUMN {key} REAL")
+        return conn
+
+    def write(self, device: str, period_type: str, reports: list) -> None:
+        """
+        Insert reports of a device. A report which ends on the same day as a stored
+        report replaces it, so regenerated reports do not appear twice.
+        :param device: Device name
+        :param period_type: day, month or year
+        :param reports: Reports with start_date, end_date and the report columns, Not req
+        for values which were not requested
+        :return: None
+        """
+        with closing(self.connection()) as conn:
+            with conn:
+                for data in reports:
+                    conn.execute(
+                        "DELETE FROM reports WHERE device = ? AND period_type = ? "
+                        "AND substr(end, 1, 10) = ?",
+                        (device, period_type, data["end_date"][:10]),
+                    )
+                    conn.execute(
+                        "INSERT OR REPLACE INTO reports (device, period_type, start, end, "
+                        f"{', '.join(REPORT_COLUMNS)}) "
+                        f"VALUES ({', '.join('?' * (4 + len(REPORT_COLUMNS)))})",
+                        (device, period_type, data["start_date"], data["end_date"])
+                        + tuple(
+                            None if data.get(key, "Not req") == "Not req" else data[key]
+                            for key in REPORT_COLUMNS
+                        ),
+                    )
+
+    @staticmethod
+    def _report(row: sqlite3.Row) -> dict:
+        return {"start_date": row["start"], "end_date": row["end"]} | {
+            key: "Not req" if row[key] is None else row[key] for key in REPORT_COLUMNS
+        }
+
+    def report(self, device: str, period_type: str, timestamp: datetime) -> dict:
+        """
+        Report whose period contains a point in time.
+        :param device: Device name
+        :param period_type: day, month or year
+        :param timestamp: Point in time in UTC
+        :return: Report like in write(), None if no report contains the point in time
+        """
+        at = timestamp.strftime(DATE_FORMAT)
+        with closing(self.connection()) as conn:
+            row = conn.execute(
+                "SELECT * FROM reports WHERE device = ? AND period_type = ? AND start <= ? "
+                "ORDER BY start DESC LIMIT 1",
+                (device, period_type, at),
+            ).fetchone()
+        if row is None or row["end"] <= at:
+            return None
+        return self._report(row)
+
+    def reports(
+        self, device: str, period_type: str, start: datetime = None, end: datetime = None
+    ) -> list:
+        """
+        Reports of a device whose period starts in a range.
+        :param device: Device name
+        :param period_type: day, month or year
+        :param start: First start in UTC, unbounded if None
+        :param end: End of the range in UTC (exclusive), unbounded if None
+        :return: Reports like in write() in the order of their start
+        """
+        first = "" if start is None else start.strftime(DATE_FORMAT)
+        last = "~" if end is None else end.strftime(DATE_FORMAT)
+        with closing(self.connection()) as conn:
+            rows = conn.execute(
+                "SELECT * FROM reports WHERE device = ? AND period_type = ? "
+                "AND start >= ? AND start < ? ORDER BY start",
+                (device, period_type, first, last),
+            ).fetchall()
+        return [self._report(row) for row in rows]
+
+    def latest(self, device: str, period_type: str) -> dict:
+        """
+        Latest report of a device.
+        :param device: Device name
+        :param period_type: day, month or year
+        :return: Report like in write(), None if there is no report
+        """
+        with closing(self.connection()) as conn:
+            row = conn.execute(
+                "SELECT * FROM reports WHERE device = ? AND period_type = ? "
+                "ORDER BY start DESC LIMIT 1",
+                (device, period_type),
+            ).fetchone()
+        return None if row is None else self._report(row)
+
+    def last_end(self, device: str, period_type: str) -> datetime:
+        """
+        End of the latest report of a device.
+        :param device: Device name
+        :param period_type: day, month or year
+        :return: End in UTC, None if there is no report
+        """
+        report = self.latest(device, period_type)
+        return None if report is None else datetime.strptime(report["end_date"], DATE_FORMAT)
+
+    def contains(self, device: str, period_type: str) -> bool:
+        """
+        Check whether the store holds a report of a device and period.
+        :param device: Device name
+        :param period_type: day, month or year
+        :return: True if there is a report
+        """
+        with closing(self.connection()) as conn:
+            row = conn.execute(
+                "SELECT 1 FROM reports WHERE device = ? AND period_type = ? LIMIT 1",
+                (device, period_type),
+            ).fetchone()
+        return row is not None
+
+
+def get_report_store() -> ReportStore:
+    """
+    Report store of the app, created on first use.
+    :return: Report store
+    """
+    if report_store["store"] is None:
+        report_store["store"] = ReportStore(REPORT_DATABASE_PATH)
+    return report_store["store"]
+
+
+def import_report_file(device: str, period_type: str) -> int:
+    """
+    Import the report file of a device and period into the store, if the store holds
+    no reports of it yet. Lines without period are skipped.
+    :param device: Device name
+    :param period_type: day, month or year
+    :return: Number of imported reports
+    """
+    store = get_report_store()
+    if store.contains(device, period_type):
+        return 0
+    try:
+        with open(
+            sf.device_information_path(f"{device}_{period_type}"), encoding="utf-8"
+        ) as file:
+            reports = [report for report in map(parse_report_line, file) if report]
+    except FileNotFoundError:
+        return 0
+    store.write(device, period_type, reports)
+    return len(reports)
+
+
+def write_report(device: str, period_type: str, data: dict) -> None:
+    """
+    Store a report and render the report file of its device and period.
+    :param device: Device name
+    :param period_type: day, month or year
+    :param data: Report with start_date, end_date and the report columns
+    :return: None
+    """
+    import_report_file(device, period_type)
+    store = get_report_store()
+    store.write(device, period_type, [data])
+    sf.write_device_information(f"{device}_{period_type}", store.reports(device, period_type))
+
+
+def latest_reports_message(devices: list) -> str:
+    """
+    Message with the latest report of each period of some devices for the Telegram bot.
+    :param devices: Device names
+    :return: Message, one block per device
+    """
+    store = get_report_store()
+    blocks = []
+    for device in devices:
+        lines = [device]
+        for period_type in PERIOD_TYPES:
+            report = store.latest(device, period_type)
+            if report is None:
+                continue
+            lines.append(
+                f"{period_type}: {report['start_date']} - {report['end_date']}: "
+                f"{report['sum_of_energy']} KWh, {report['total_cost']} €, "
+                f"power on {report['power_on']}"
+            )
+            if report["power_peak"] != "Not req":
+                lines[-1] += (
+                    f", peak {report['power_peak']:.1f} W, "
+                    f"baseload {report['power_baseload']:.1f} W"
+                )
+        if len(lines) == 1:
+            lines.append("No reports yet.")
+        blocks.append("\n".join(lines))
+    return "\n\n".join(blocks) if blocks else "No devices with reports are running."
+
+
+def main() -> None:
+    """
+    Scheduling function for regular call.
+    :return: None
+    """
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,704 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Rollups of the census data in a minute, an hour and a day tier. The rollup stage of the
+ingest pipeline keeps the open bucket of every tier per device and writes it as a row of
+the tier measurement when it is closed. A row holds the energy, the number of samples and
+failed polls, the minimum and maximum power and the power on transitions, the hour and
+day rows also a quantile sketch of the power, see quantile_sketch.py. The report
+periods read every part of their range from the coarsest tier which covers it and only
+the edges from the raw data. Existing history is rolled up with the backfill command:
+python -m source.rollup --start 2023-01-01
+"""
+import os
+import json
+import argparse
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from source.constants import (
+    CENSUS_MEASUREMENT,
+    HEALTH_MEASUREMENT,
+    DEVICES_FILE_PATH,
+    DEFAULT_THRESHOLD_ON_POWER_ON_COUNTER,
+    DEFAULT_THRESHOLD_OFF_POWER_ON_COUNTER,
+    ROLLUP_MINUTE_MEASUREMENT,
+    ROLLUP_HOUR_MEASUREMENT,
+    ROLLUP_DAY_MEASUREMENT,
+    ROLLUP_STATE_FILE_PATH,
+    ROLLUP_SETTLE_S,
+)
+from source import support_functions as sf
+from source import logging_helper as lh
+from source.aggregation import window_start
+from source.configuration import read_config_section
+from source.line_protocol import EPOCH
+from source.quantile_sketch import QuantileSketch
+from source.storage import StorageBackend, StorageError
+
+# Tiers from fine to coarse with the length of their buckets in seconds
+ROLLUP_TIERS = (
+    (ROLLUP_MINUTE_MEASUREMENT, 60),
+    (ROLLUP_HOUR_MEASUREMENT, 3600),
+    (ROLLUP_DAY_MEASUREMENT, 86400),
+)
+SAMPLE_FIELDS = ("energy_wh", "power", "sample_count")
+TOTAL_FIELDS = ("energy_wh", "sample_count", "failure_count", "power_on")
+SKETCH_FIELD = "power_sketch"
+# Index of the finest tier whose rows hold a sketch
+FIRST_SKETCH_TIER = 1
+DAY_FORMAT = "%Y-%m-%d"
+ONE_DAY = timedelta(days=1)
+# Queries exclude the start, so a bucket is queried from just before its start
+BEFORE_BOUNDARY = timedelta(microseconds=1)
+
+
+@dataclass
+class RollupConfig:
+    """
+    Settings of the rollups, read from the section rollup in config.json.
+    """
+
+    active: bool = False
+
+
+def check_rollup_config() -> RollupConfig:
+    """
+    Read the rollup settings from the configuration file.
+    :return: Checked rollup configuration
+    """
+    config = RollupConfig()
+    rollup_settings = read_config_section("rollup")
+    if isinstance(rollup_settings.get("active"), bool):
+        config.active = rollup_settings["active"]
+    return config
+
+
+def power_on_thresholds(settings: dict) -> tuple:
+    """
+    Thresholds of the power on counter of a device, default values if they are not set.
+    :param settings: Settings of the device from devices.json
+    :return: On and off threshold in watt
+    """
+    counter_settings = settings.get("power_on_counter", {})
+    on_threshold = counter_settings.get("on_threshold")
+    off_threshold = counter_settings.get("off_threshold")
+    if not isinstance(on_threshold, int):
+        on_threshold = DEFAULT_THRESHOLD_ON_POWER_ON_COUNTER
+    if not isinstance(off_threshold, int):
+        off_threshold = DEFAULT_THRESHOLD_OFF_POWER_ON_COUNTER
+    return on_threshold, off_threshold
+
+
+class PowerOnCounter:
+    """
+    Hysteresis of the power on counter. A power on is counted when the power falls below
+    the off threshold after it reached the on threshold.
+    """
+
+    def __init__(self, on_threshold: float, off_threshold: float):
+        self.on_threshold = on_threshold
+        self.off_threshold = off_threshold
+        self.high_threshold_passed = False
+
+    def update(self, value: float) -> bool:
+        """
+        Pass the next power value.
+        :param value: Power in watt
+        :return: True if a power on was completed
+        """
+        if value >= self.on_threshold and not self.high_threshold_passed:
+            self.high_threshold_passed = True
+        elif value < self.off_threshold and self.high_threshold_passed:
+            self.high_threshold_passed = False
+            return True
+        return False
+
+    def count(self, values: list) -> int:
+        """
+        Pass a series of power values.
+        :param values: Power values sorted by time, missing values are None
+        :return: Number of completed power on transitions
+        """
+        return sum(self.update(value) for value in values if value is not None)
+
+
+def count_power_on(values: list, on_threshold: float, off_threshold: float) -> int:
+    """
+    Count the power on transitions in a series of power values.
+    :param values: Power values sorted by time, missing values are None
+    :param on_threshold: Power which switches the device on
+    :param off_threshold: Power below which the device is off again
+    :return: Number of power on transitions or None if there is no value
+    """
+    if all(value is None for value in values):
+        return None
+    return PowerOnCounter(on_threshold, off_threshold).count(values)
+
+
+@dataclass
+class Bucket:  # pylint: disable=too-many-instance-attributes
+    """
+    Running totals of one bucket of a tier.
+    """
+
+    start: datetime
+    energy_wh: float = 0.0
+    sample_count: int = 0
+    failure_count: int = 0
+    power_min: float = None
+    power_max: float = None
+    power_on: int = 0
+    sketch: QuantileSketch = None
+
+    def add(self, fields: dict, valid: bool, power_on: bool) -> None:
+        """
+        Add a poll to the bucket.
+        :param fields: Fields of the census point
+        :param valid: True for a valid sample, False for a failed poll
+        :param power_on: The sample completed a power on
+        :return: None
+        """
+        if not valid:
+            self.failure_count += 1
+            return
+        self.energy_wh += fields.get("energy_wh") or 0
+        self.sample_count += fields.get("sample_count") or 1
+        self.power_on += power_on
+        power = fields.get("power")
+        if power is not None:
+            self.power_min = float(power) if self.power_min is None else min(self.power_min, power)
+            self.power_max = float(power) if self.power_max is None else max(self.power_max, power)
+            if self.sketch is not None:
+                self.sketch.add(float(power), fields.get("sample_count") or 1)
+
+    def to_point(self, measurement: str, device: str) -> dict:
+        """
+        Create the row of the bucket.
+        :param measurement: Measurement of the tier
+        :param device: Device name
+        :return: Point with the start of the bucket as time
+        """
+        fields = {
+            "energy_wh": float(self.energy_wh),
+            "sample_count": self.sample_count,
+            "failure_count": self.failure_count,
+            "power_on": self.power_on,
+        }
+        if self.power_min is not None:
+            fields["power_min"] = float(self.power_min)
+            fields["power_max"] = float(self.power_max)
+            if self.sketch is not None:
+                fields[SKETCH_FIELD] = self.sketch.to_field()
+        return {
+            "measurement": measurement,
+            "tags": {"device": device},
+            "time": self.start,
+            "fields": fields,
+        }
+
+
+class RollupState:
+    """
+    State file with the day from which on the rollups of every device are complete. After
+    a backfill without running app it also holds the day up to which they are complete.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path, encoding="utf-8") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+
+    def coverage(self, device: str) -> tuple:
+        """
+        Range in which the rollups of the device are complete.
+        :param device: Device name
+        :return: Midnight of the first complete day or None, midnight of the first
+        day which is not complete or None if the app continues the rollups
+        """
+        entry = self._load().get(device, {})
+        since, until = entry.get("since"), entry.get("until")
+        return (
+            datetime.strptime(since, DAY_FORMAT) if since is not None else None,
+            datetime.strptime(until, DAY_FORMAT) if until is not None else None,
+        )
+
+    def set_coverage(self, device: str, since: datetime, until: datetime = None) -> None:
+        """
+        Save the range in which the rollups of the device are complete. The file is
+        replaced atomically.
+        :param device: Device name
+        :param since: Midnight of the first complete day
+        :param until: Midnight of the first day which is not complete, None if the app
+        continues the rollups
+        :return: None
+        """
+        data = self._load()
+        data[device] = {"since": since.strftime(DAY_FORMAT)}
+        if until is not None:
+            data[device]["until"] = until.strftime(DAY_FORMAT)
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path + ".tmp", "w", encoding="utf-8") as file:
+            json.dump(data, file, indent=4)
+        os.replace(self.path + ".tmp", self.path)
+
+
+class RollupStage:
+    """
+    Rollup stage of the ingest pipeline. It passes the raw points of every poll and adds
+    the rows of the closed buckets. With every closed minute the open hour and day are
+    written again, so their rows are up to date if the app stops. Before the first poll
+    the open buckets are restored from the stored data of the current day.
+    """
+
+    def __init__(
+        self, device_name: str, settings: dict, backend: StorageBackend, state: RollupState
+    ):
+        self.device_name = device_name
+        self.backend = backend
+        self.state = state
+        self.counter = PowerOnCounter(*power_on_thresholds(settings))
+        self.buckets = [None] * len(ROLLUP_TIERS)
+        self.restored = False
+
+    def add(self, point: dict) -> list:
+        """
+        Add one point to the open buckets.
+        :param point: Point of the device handler
+        :return: Rows of the buckets which were closed by the point
+        """
+        fields = point["fields"]
+        if point["measurement"] == CENSUS_MEASUREMENT:
+            valid = fields.get("fetch_success", False)
+        elif point["measurement"] == HEALTH_MEASUREMENT and not fields["success"]:
+            # With the split schema a failed poll only leaves a health record
+            valid = False
+        else:
+            return []
+        power = fields.get("power") if valid else None
+        power_on = power is not None and self.counter.update(power)
+        closed = []
+        for index, (measurement, length_s) in enumerate(ROLLUP_TIERS):
+            start = window_start(point["time"], length_s)
+            bucket = self.buckets[index]
+            if bucket is not None and bucket.start != start:
+                closed.append(bucket.to_point(measurement, self.device_name))
+                bucket = None
+            if bucket is None:
+                bucket = self.buckets[index] = Bucket(
+                    start, sketch=QuantileSketch() if index >= FIRST_SKETCH_TIER else None
+                )
+            bucket.add(fields, valid, power_on)
+        return closed
+
+    def open_rows(self) -> list:
+        """
+        Rows of the open hour and day buckets.
+        :return: Points to write
+        """
+        return [
+            bucket.to_point(measurement, self.device_name)
+            for (measurement, _), bucket in zip(ROLLUP_TIERS[1:], self.buckets[1:])
+            if bucket is not None
+        ]
+
+    def flush(self) -> list:
+        """
+        Close all open buckets.
+        :return: Rows of the buckets
+        """
+        rows = [
+            bucket.to_point(measurement, self.device_name)
+            for (measurement, _), bucket in zip(ROLLUP_TIERS, self.buckets)
+            if bucket is not None
+        ]
+        self.buckets = [None] * len(ROLLUP_TIERS)
+        return rows
+
+    def replay(self, start: datetime, end: datetime) -> list:
+        """
+        Add the stored samples and failed polls of a range to the buckets.
+        :param start: Start of the range (inclusive)
+        :param end: End of the range (exclusive)
+        :return: Rows of the closed buckets
+        """
+        query_start = start - BEFORE_BOUNDARY
+        points = [
+            {
+                "measurement": CENSUS_MEASUREMENT,
+                "time": EPOCH + timedelta(milliseconds=row["time"]),
+                "fields": {key: row.get(key) for key in SAMPLE_FIELDS} | {"fetch_success": True},
+            }
+            for row in self.backend.query_samples(
+                self.device_name, query_start, end, list(SAMPLE_FIELDS)
+            )
+        ]
+        measurement, field = self.backend.failure_source()
+        points += [
+            {
+                "measurement": CENSUS_MEASUREMENT,
+                "time": EPOCH + timedelta(milliseconds=row["time"]),
+                "fields": {"fetch_success": False},
+            }
+            for row in self.backend.query_range(
+                measurement, self.device_name, query_start, end, [field], {field: False}
+            )
+        ]
+        points.sort(key=lambda point: point["time"])
+        closed = []
+        for point in points:
+            closed += self.add(point)
+        return closed
+
+    def restore(self, timestamp: datetime) -> list:
+        """
+        Restore the open buckets from the stored data of the current day and update the
+        coverage of the device. If the stored data can not be read, the rollups are only
+        complete from the next day on.
+        :param timestamp: Time of the first poll after the start
+        :return: Rows to write
+        """
+        self.restored = True
+        day = window_start(timestamp, ROLLUP_TIERS[-1][1])
+        try:
+            rows = self.replay(day, timestamp)
+        except StorageError as err:
+            self.state.set_coverage(self.device_name, day + ONE_DAY)
+            message = (
+                f"The rollups of {self.device_name} could not be restored, they are complete "
+                f"from tomorrow on. Run the backfill for older reports: {err}"
+            )
+            lh.write_log(lh.LoggingLevel.WARNING.value, message)
+            return []
+        since, until = self.state.coverage(self.device_name)
+        if since is None or (until is not None and until < day):
+            self.state.set_coverage(self.device_name, day)
+        elif until is not None:
+            self.state.set_coverage(self.device_name, since)
+        return rows + self.open_rows()
+
+    def process(self, points: list) -> list:
+        """
+        Add the points of one poll to the buckets.
+        :param points: Points of the device handler
+        :return: Points of the poll and the rows to write
+        """
+        result = list(points)
+        if not self.restored and points:
+            result += self.restore(points[0]["time"])
+        closed = []
+        for point in points:
+            closed += self.add(point)
+        if closed:
+            result += closed + self.open_rows()
+        return result
+
+
+def create_rollup_stage(device_name: str, settings: dict) -> RollupStage:
+    """
+    Create the rollup stage of a device if the rollups are active.
+    :param device_name: Device name
+    :param settings: Settings of the device from devices.json
+    :return: Rollup stage or None
+    """
+    if not check_rollup_config().active:
+        return None
+    return RollupStage(
+        device_name, settings, sf.get_storage_backend(), RollupState(ROLLUP_STATE_FILE_PATH)
+    )
+
+
+def tier_parts(start: datetime, end: datetime, tier: int) -> list:
+    """
+    Split a range into whole buckets of the tiers, coarsest first. The remaining edges
+    which are shorter than a minute are left out.
+    :param start: Start of the range
+    :param end: End of the range
+    :param tier: Index of the coarsest tier which is used
+    :return: Parts as tuples of tier index, start and end, sorted by time
+    """
+    if tier < 0:
+        return []
+    length_s = ROLLUP_TIERS[tier][1]
+    first = window_start(start, length_s)
+    if first < start:
+        first += timedelta(seconds=length_s)
+    last = window_start(end, length_s)
+    if first >= last:
+        return tier_parts(start, end, tier - 1)
+    return (
+        tier_parts(start, first, tier - 1)
+        + [(tier, first, last)]
+        + tier_parts(last, end, tier - 1)
+    )
+
+
+def split_window(start: datetime, end: datetime, since: datetime, settled: datetime) -> list:
+    """
+    Split a window into parts for the rollup tiers and the raw data.
+    :param start: Start of the window (exclusive)
+    :param end: End of the window (exclusive)
+    :param since: Time from which on the rollups are complete
+    :param settled: Time up to which the buckets are closed
+    :return: Parts as tuples of tier index (None for the raw data), start and end
+    """
+    # A bucket includes its start, the window does not
+    first = max(start + timedelta(milliseconds=1), since)
+    parts = tier_parts(first, settled, len(ROLLUP_TIERS) - 1) if first < settled else []
+    if not parts:
+        return [(None, start, end)]
+    return (
+        [(None, start, parts[0][1])]
+        + parts
+        + [(None, parts[-1][2] - BEFORE_BOUNDARY, end)]
+    )
+
+
+class RollupReader:
+    """
+    Aggregates of one device over windows from the given starts to a common end like the
+    NestedWindowPlanner. Every window is read from the coarsest tiers which cover it. The
+    edges, the time before the rollups are complete and the last minutes, whose buckets
+    may still be open, are read from the raw data.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        backend: StorageBackend,
+        device: str,
+        end: datetime,
+        starts: list,
+        coverage: tuple,
+        now: datetime = None,
+    ):
+        self.backend = backend
+        self.device = device
+        since, until = coverage
+        settled = min(end, (now or datetime.utcnow()) - timedelta(seconds=ROLLUP_SETTLE_S))
+        if until is not None:
+            settled = min(settled, until)
+        self.windows = [split_window(start, end, since, settled) for start in starts]
+        self.parts = {}
+        self.sketches = {}
+
+    def _totals(self, part: tuple) -> dict:
+        if part not in self.parts:
+            tier, start, end = part
+            if tier is None:
+                statistics = self.backend.sample_statistics(self.device, start, end)
+                totals = statistics | {
+                    "failure_count": self.backend.count_failures(self.device, start, end),
+                    "power_on": 0,
+                }
+            else:
+                rows = self.backend.query_range(
+                    ROLLUP_TIERS[tier][0],
+                    self.device,
+                    start - BEFORE_BOUNDARY,
+                    end,
+                    list(TOTAL_FIELDS),
+                )
+                totals = dict.fromkeys(TOTAL_FIELDS, 0)
+                for row in rows:
+                    for key in TOTAL_FIELDS:
+                        totals[key] += row.get(key) or 0
+            self.parts[part] = totals
+        return self.parts[part]
+
+    def _sum(self, key: str) -> list:
+        return [sum(self._totals(part)[key] for part in window) for window in self.windows]
+
+    def _sketch(self, part: tuple) -> QuantileSketch:
+        if part not in self.sketches:
+            tier, start, end = part
+            sketch = QuantileSketch()
+            rows = []
+            if tier is not None and tier >= FIRST_SKETCH_TIER:
+                rows = list(
+                    self.backend.query_range(
+                        ROLLUP_TIERS[tier][0],
+                        self.device,
+                        start - BEFORE_BOUNDARY,
+                        end,
+                        ["power_max", SKETCH_FIELD],
+                    )
+                )
+            if rows and all(row.get(SKETCH_FIELD) or row.get("power_max") is None for row in rows):
+                for row in rows:
+                    if row.get(SKETCH_FIELD):
+                        sketch.merge(QuantileSketch.from_field(row[SKETCH_FIELD]))
+            else:
+                # Edges, minute buckets and rows written before the sketches use raw data
+                if tier is not None:
+                    start -= BEFORE_BOUNDARY
+                for row in self.backend.query_samples(
+                    self.device, start, end, ["power", "sample_count"]
+                ):
+                    if row.get("power") is not None:
+                        sketch.add(row["power"], row.get("sample_count") or 1)
+            self.sketches[part] = sketch
+        return self.sketches[part]
+
+    def power_sketches(self) -> list:
+        """
+        Quantile sketch of the power per window, merged from the sketches of the hour and
+        day rows and the raw samples of the other parts.
+        :return: Sketch per window
+        """
+        sketches = []
+        for window in self.windows:
+            sketch = QuantileSketch()
+            for part in window:
+                sketch.merge(self._sketch(part))
+            sketches.append(sketch)
+        return sketches
+
+    def energy_sums(self) -> list:
+        """
+        Energy of the valid samples per window.
+        :return: Energy in Wh per window
+        """
+        return self._sum("energy_wh")
+
+    def sample_statistics(self) -> list:
+        """
+        Energy and number of the valid samples per window.
+        :return: Sum of energy_wh and number of samples per window
+        """
+        return [
+            {"energy_wh": energy_wh, "sample_count": int(count)}
+            for energy_wh, count in zip(self._sum("energy_wh"), self._sum("sample_count"))
+        ]
+
+    def failure_counts(self) -> list:
+        """
+        Number of failed polls per window.
+        :return: Failures per window
+        """
+        return [int(count) for count in self._sum("failure_count")]
+
+    def power_on_counts(self, on_threshold: float, off_threshold: float) -> list:
+        """
+        Power on transitions per window. The parts are counted on their own, so a
+        transition across a border between two parts can be missed.
+        :param on_threshold: Power which switches the device on
+        :param off_threshold: Power below which the device is off again
+        :return: Power on count per window, None for windows without samples
+        """
+        counts = []
+        for window, sample_count in zip(self.windows, self._sum("sample_count")):
+            if not sample_count:
+                counts.append(None)
+                continue
+            count = 0
+            for tier, start, end in window:
+                if tier is not None:
+                    count += self._totals((tier, start, end))["power_on"]
+                    continue
+                rows = self.backend.query_samples(self.device, start, end, ["power"])
+                values = [row["power"] for row in rows]
+                count += count_power_on(values, on_threshold, off_threshold) or 0
+            counts.append(count)
+        return counts
+
+
+def create_period_reader(device: str, end: datetime, starts: list):
+    """
+    Reader for aggregates of a device over report periods which end at the same time.
+    The rollups are used if they are active and complete for a part of the device
+    history, otherwise the raw data is read with the nested window planner.
+    :param device: Device name
+    :param end: Common end of the periods in UTC
+    :param starts: Starts of the periods in UTC
+    :return: RollupReader or NestedWindowPlanner
+    """
+    if check_rollup_config().active:
+        coverage = RollupState(ROLLUP_STATE_FILE_PATH).coverage(device)
+        if coverage[0] is not None:
+            return RollupReader(sf.get_storage_backend(), device, end, starts, coverage)
+    return sf.create_window_planner(device, end, starts)
+
+
+def backfill(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+    backend: StorageBackend,
+    state: RollupState,
+    device: str,
+    settings: dict,
+    start: datetime,
+    end: datetime,
+) -> int:
+    """
+    Roll up the stored data of a device day by day. Existing rows are replaced.
+    :param backend: Storage backend
+    :param state: Rollup state
+    :param device: Device name
+    :param settings: Settings of the device from devices.json
+    :param start: Midnight of the first day
+    :param end: Midnight of the first day which is not rolled up
+    :return: Number of written rows
+    """
+    stage = RollupStage(device, settings, backend, state)
+    written = 0
+    day = start
+    while day <= end:
+        rows = stage.replay(day, day + ONE_DAY) if day < end else stage.flush()
+        if rows:
+            backend.write_points(rows)
+            written += len(rows)
+        day += ONE_DAY
+    return written
+
+
+def backfill_devices(start: datetime, devices: list = None) -> None:
+    """
+    Roll up the history of the devices up to the day from which on the running app
+    keeps the rollups, or up to today if the app did not run with rollups yet.
+    :param start: Midnight of the first day
+    :param devices: Device names, all devices in devices.json if None
+    :return: None
+    """
+    with open(DEVICES_FILE_PATH, encoding="utf-8") as file:
+        data = json.load(file)
+    state = RollupState(ROLLUP_STATE_FILE_PATH)
+    today = window_start(datetime.utcnow(), ROLLUP_TIERS[-1][1])
+    for device in devices if devices else list(data):
+        since, until = state.coverage(device)
+        continued = since is not None and until is None
+        end = since if continued else today
+        if start >= end:
+            continue
+        written = backfill(
+            sf.get_storage_backend(), state, device, data.get(device, {}), start, end
+        )
+        state.set_coverage(device, start, None if continued else today)
+        message = f"Rolled up {device} from {start:%Y-%m-%d} to {end:%Y-%m-%d} in {written} rows."
+        lh.write_log(lh.LoggingLevel.INFO.value, message)
+
+
+def main() -> None:
+    """
+    Command line entry point of the backfill.
+    :return: None
+    """
+    parser = argparse.ArgumentParser(
+        description="Roll up the stored data into the minute, hour and day tiers."
+    )
+    parser.add_argument("--start", required=True, help="First day, e.g. 2023-01-01")
+    parser.add_argument("--device", action="append", help="Device name, can be repeated")
+    args = parser.parse_args()
+    start = datetime.strptime(args.start, DAY_FORMAT)
+    sf.check_database_config()
+    sf.check_and_verify_db_connection()
+    if sf.login_information.verified is not False:
+        backfill_devices(start, args.device)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Append-only on-disk spool which keeps all points that could not be written to the database.
+The spool is split into segment files, survives restarts and is replayed in batches as soon
+as the database is reachable again.
+"""
+import os
+import json
+import time
+from dataclasses import dataclass
+
+from source.constants import (
+    SPOOL_DIR_PATH,
+    SPOOL_SEGMENT_PREFIX,
+    SPOOL_SEGMENT_SUFFIX,
+    DEFAULT_SPOOL_MAX_SIZE_MB,
+    DEFAULT_SPOOL_SEGMENT_SIZE_KB,
+    DEFAULT_SPOOL_REPLAY_BATCH_SIZE,
+    DEFAULT_SPOOL_REPLAY_BATCHES_PER_RUN,
+    DEFAULT_SPOOL_RETRY_AFTER_S,
+)
+from source import logging_helper as lh
+from source.configuration import read_config_section, apply_positive_int_settings
+from source.line_protocol import encode_timestamp
+
+
+@dataclass
+class SpoolConfig:
+    """
+    Settings of the spool, read from the section spool in config.json.
+    """
+
+    active: bool = True
+    max_size_mb: int = DEFAULT_SPOOL_MAX_SIZE_MB
+    segment_size_kb: int = DEFAULT_SPOOL_SEGMENT_SIZE_KB
+    replay_batch_size: int = DEFAULT_SPOOL_REPLAY_BATCH_SIZE
+    replay_batches_per_run: int = DEFAULT_SPOOL_REPLAY_BATCHES_PER_RUN
+    retry_after_s: int = DEFAULT_SPOOL_RETRY_AFTER_S
+
+
+def check_spool_config() -> SpoolConfig:
+    """
+    Read the spool settings from the configuration file. Missing or invalid values are
+    replaced by the default values.
+    :return: Checked spool configuration
+    """
+    config = SpoolConfig()
+    spool_settings = read_config_section("spool")
+    if isinstance(spool_settings.get("active"), bool):
+        config.active = spool_settings["active"]
+    apply_positive_int_settings(
+        config,
+        spool_settings,
+        (
+            "max_size_mb",
+            "segment_size_kb",
+            "replay_batch_size",
+            "replay_batches_per_run",
+            "retry_after_s",
+        ),
+        "spool",
+    )
+    return config
+
+
+class WriteAheadSpool:
+    """
+    Segment based spool for points which could not be written to the database. The
+    timestamps are stored as integer nanoseconds, so a replayed point overwrites itself
+    if it was already written before and the replay stays idempotent.
+    """
+
+    def __init__(self, directory: str = SPOOL_DIR_PATH, config: SpoolConfig = None):
+        self.directory = directory
+        self.config = config if config is not None else SpoolConfig()
+        self.db_down_until = 0.0
+        self.evicted_points = 0
+        self.sequence = 0
+        self.total_size = 0
+        if os.path.isdir(self.directory):
+            segments = self.segments()
+            if segments:
+                self.sequence = self._sequence_of(segments[-1])
+            self.total_size = sum(
+                os.path.getsize(os.path.join(self.directory, segment))
+                for segment in segments
+            )
+
+    @staticmethod
+    def _sequence_of(segment: str) -> int:
+        return int(segment[len(SPOOL_SEGMENT_PREFIX): -len(SPOOL_SEGMENT_SUFFIX)])
+
+    def _segment_path(self, sequence: int) -> str:
+        return os.path.join(
+            self.directory, f"{SPOOL_SEGMENT_PREFIX}{sequence:010d}{SPOOL_SEGMENT_SUFFIX}"
+        )
+
+    def segments(self) -> list:
+        """
+        All segment files of the spool, the oldest first.
+        :return: Sorted list of segment file names
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(
+            name
+            for name in os.listdir(self.directory)
+            if name.startswith(SPOOL_SEGMENT_PREFIX) and name.endswith(SPOOL_SEGMENT_SUFFIX)
+        )
+
+    def pending(self) -> bool:
+        """
+        Check if points are waiting in the spool.
+        :return: True if at least one segment exists
+        """
+        return bool(self.segments())
+
+    def db_known_down(self) -> bool:
+        """
+        Fast fail check. As long as the database failed recently, writes go straight
+        to the spool instead of waiting for the connection timeout again.
+        :return: True if the database is known to be unreachable
+        """
+        return time.monotonic() < self.db_down_until
+
+    def mark_db_down(self) -> None:
+        """
+        Remember that the database is unreachable for the configured retry time.
+        :return: None
+        """
+        self.db_down_until = time.monotonic() + self.config.retry_after_s
+
+    def mark_db_up(self) -> None:
+        """
+        Reset the fast fail state after a successful write.
+        :return: None
+        """
+        self.db_down_until = 0.0
+
+    def _rotate(self) -> None:
+        self.sequence += 1
+
+    def append(self, points: list) -> None:
+        """
+        Append the points to the newest segment. A new segment is started once the
+        newest one has reached the configured size. Afterwards the size cap is enforced.
+        :param points: Points in the format of the device handlers
+        :return: None
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._segment_path(self.sequence)
+        if (
+            os.path.exists(path)
+            and os.path.getsize(path) >= self.config.segment_size_kb * 1024
+        ):
+            self._rotate()
+            path = self._segment_path(self.sequence)
+        lines = "".join(
+            json.dumps(
+                point | {"time": encode_timestamp(point["time"], "n")},
+                separators=(",", ":"),
+            )
+            + "\n"
+            for point in points
+        )
+        encoded = lines.encode("utf-8")
+        with open(path, "ab") as file:
+            file.write(encoded)
+            file.flush()
+            os.fsync(file.fileno())
+        self.total_size += len(encoded)
+        self._evict()
+
+    def _evict(self) -> None:
+        """
+        Delete the oldest segments as long as the spool is larger than the size cap.
+        The newest segment is never deleted.
+        :return: None
+        """
+        max_size = self.config.max_size_mb * 1024 * 1024
+        segments = self.segments()
+        while self.total_size > max_size and len(segments) > 1:
+            path = os.path.join(self.directory, segments.pop(0))
+            with open(path, "rb") as file:
+                lost_points = sum(1 for _ in file)
+            self.total_size -= os.path.getsize(path)
+            os.remove(path)
+            self.evicted_points += lost_points
+            message = (
+                f"Spool exceeds {self.config.max_size_mb}MB, the oldest {lost_points} "
+                f"points were dropped."
+            )
+            lh.write_log(lh.LoggingLevel.WARNING.value, message)
+
+    @staticmethod
+    def _read_segment(path: str) -> list:
+        points = []
+        with open(path, encoding="utf-8") as file:
+            for line in file:
+                try:
+                    points.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # A torn last line after a crash is skipped
+                    continue
+        return points
+
+    def replay(self, write_function) -> int:
+        """
+        Write the spooled points, the oldest first, in large batches. Per call only the
+        configured number of batches is written to keep the load on the database low.
+        A segment is deleted after all its points have been written. If the write
+        function raises, the exception is passed on and the segment remains.
+        :param write_function: Function which writes a list of points to the database
+        :return: Number of written points
+        """
+        segments = self.segments()
+        if not segments:
+            return 0
+        if self._segment_path(self.sequence).endswith(segments[-1]):
+            # Close the newest segment, so new failures do not extend the replayed one
+            self._rotate()
+        written = 0
+        batches = 0
+        batch_size = self.config.replay_batch_size
+        for segment in segments:
+            path = os.path.join(self.directory, segment)
+            points = self._read_segment(path)
+            if batches + -(-len(points) // batch_size) > self.config.replay_batches_per_run:
+                if batches > 0:
+                    break
+            for index in range(0, len(points), batch_size):
+                write_function(points[index: index + batch_size])
+                batches += 1
+                written += len(points[index: index + batch_size])
+            self.total_size -= os.path.getsize(path)
+            os.remove(path)
+            if batches >= self.config.replay_batches_per_run:
+                break
+        return written
+
+
+def main() -> None:
+    """
+    Scheduling function for regular call.
+    :return: None
+    """
+
+
+if __name__ == "__main__":
+    main()
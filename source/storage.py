@@ -0,0 +1,451 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Interface of the storage backends. The app only works against this interface, so the
+database behind it can be exchanged without touching the calculations, the energy
+monitoring or the write path.
+"""
+import math
+from abc import ABC, abstractmethod
+from array import array
+from datetime import datetime, timedelta
+from itertools import islice
+from typing import Iterator
+
+from source.constants import (
+    CENSUS_MEASUREMENT,
+    HEALTH_MEASUREMENT,
+    SCHEMA_LEGACY,
+    SCHEMA_SPLIT,
+    QUERY_CHUNK_SIZE,
+)
+from source.line_protocol import encode_timestamp
+
+
+class StorageError(Exception):
+    """
+    Base class of all errors raised by a storage backend.
+    """
+
+
+class StorageConnectionError(StorageError):
+    """
+    The storage is not reachable or could not process the request temporarily.
+    """
+
+
+class StorageWriteError(StorageError):
+    """
+    The storage rejected the request.
+    """
+
+    def __init__(self, message, invalid_data: bool = False):
+        super().__init__(message)
+        self.invalid_data = invalid_data
+
+
+def interval_ms(interval: timedelta) -> int:
+    """
+    Length of a time bucket in milliseconds.
+    :param interval: Length of the bucket
+    :return: Length in milliseconds
+    """
+    milliseconds = interval // timedelta(milliseconds=1)
+    if milliseconds <= 0:
+        raise ValueError(f"Bucket interval {interval} must be at least one millisecond.")
+    return milliseconds
+
+
+def bucket_offset_ms(origin: datetime, length_ms: int) -> int:
+    """
+    Offset of the time buckets against the epoch, so a bucket starts at the origin.
+    :param origin: Timestamp on a bucket boundary, None for buckets aligned to the epoch
+    :param length_ms: Length of the bucket in milliseconds
+    :return: Offset in milliseconds
+    """
+    if origin is None:
+        return 0
+    return encode_timestamp(origin, "ms") % length_ms
+
+
+def bucket_start_ms(timestamp_ms: int, length_ms: int, offset_ms: int = 0) -> int:
+    """
+    Start of the time bucket which contains the timestamp. Without offset the buckets
+    are aligned to the epoch like the GROUP BY time buckets of InfluxDB.
+    :param timestamp_ms: Timestamp in epoch milliseconds
+    :param length_ms: Length of the bucket in milliseconds
+    :param offset_ms: Offset of the buckets against the epoch
+    :return: Start of the bucket in epoch milliseconds
+    """
+    return timestamp_ms - (timestamp_ms - offset_ms) % length_ms
+
+
+def values_to_columns(names: list, values: list, fields: list) -> dict:
+    """
+    Transpose rows given as lists of values into typed columns without building a dict
+    per row.
+    :param names: Names of the values in each row, one of them is time
+    :param values: Rows as lists of values
+    :param fields: Fields of the returned columns
+    :return: Times as array of epoch milliseconds and one float array per field, missing
+        values are NaN
+    """
+    by_name = dict(zip(names, zip(*values)))
+    columns = {"time": array("q", by_name.get("time", ()))}
+    for field in fields:
+        column = by_name.get(field)
+        if column is None:
+            columns[field] = array("d", [math.nan]) * len(values)
+            continue
+        try:
+            columns[field] = array("d", column)
+        except TypeError:
+            columns[field] = array("d", [math.nan if value is None else value for value in column])
+    return columns
+
+
+def rows_to_columns(rows: list, fields: list) -> dict:
+    """
+    Convert rows of a range query to columns, see values_to_columns().
+    :param rows: Rows with the key time and the fields
+    :param fields: Fields of the returned columns
+    :return: Columns
+    """
+    names = ["time"] + fields
+    return values_to_columns(names, [[row.get(name) for name in names] for row in rows], fields)
+
+
+class StorageBackend(ABC):
+    """
+    Interface of a storage backend with batched write, range query and aggregate query.
+    All timestamps passed to the queries are naive datetime objects in UTC, the rows
+    returned by the range query contain the time as integer epoch milliseconds.
+    """
+
+    def __init__(self, schema: str = SCHEMA_LEGACY):
+        self.schema = schema
+
+    @abstractmethod
+    def verify(self) -> None:
+        """
+        Check the connection and create the database if necessary.
+        :return: None
+        """
+
+    @abstractmethod
+    def write_points(self, points: list, time_precision: str = None) -> None:
+        """
+        Write a batch of points in the format of the device handlers.
+        :param points: List of points
+        :param time_precision: Precision of the written timestamps
+        :return: None
+        """
+
+    @abstractmethod
+    def query_range(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        measurement: str,
+        device: str,
+        start: datetime,
+        end: datetime,
+        fields: list = None,
+        filters: dict = None,
+    ) -> Iterator[dict]:
+        """
+        Query the rows of a device between start and end (both exclusive).
+        :param measurement: Name of the measurement
+        :param device: Device name
+        :param start: Start of the range
+        :param end: End of the range
+        :param fields: Fields to return, all fields if None
+        :param filters: Field values the rows must match
+        :return: Rows with the key time and the requested fields
+        """
+
+    @abstractmethod
+    def query_aggregate(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        measurement: str,
+        device: str,
+        start: datetime,
+        end: datetime,
+        field: str,
+        function: str,
+        filters: dict = None,
+    ):
+        """
+        Aggregate one field of a device between start and end (both exclusive) on
+        the database side.
+        :param measurement: Name of the measurement
+        :param device: Device name
+        :param start: Start of the range
+        :param end: End of the range
+        :param field: Aggregated field
+        :param function: Aggregate function, one of sum, count, max and min
+        :param filters: Field values the rows must match
+        :return: Aggregated value or None if there are no rows
+        """
+
+    def query_group_aggregate(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        measurement: str,
+        devices: list,
+        start: datetime,
+        end: datetime,
+        field: str,
+        function: str,
+        filters: dict = None,
+    ) -> dict:
+        """
+        Aggregate one field of several devices between start and end (both exclusive).
+        Backends which can group by device on the database side override this with one
+        query, the default runs one query per device.
+        :param measurement: Name of the measurement
+        :param devices: Device names
+        :param start: Start of the range
+        :param end: End of the range
+        :param field: Aggregated field
+        :param function: Aggregate function, one of sum, count, max and min
+        :param filters: Field values the rows must match
+        :return: Aggregated value per device, devices without rows are left out
+        """
+        values = {}
+        for device in devices:
+            value = self.query_aggregate(measurement, device, start, end, field, function, filters)
+            if value is not None:
+                values[device] = value
+        return values
+
+    @abstractmethod
+    def query_buckets(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        measurement: str,
+        device: str,
+        start: datetime,
+        end: datetime,
+        field: str,
+        function: str,
+        interval: timedelta,
+        filters: dict = None,
+        origin: datetime = None,
+    ) -> list:
+        """
+        Aggregate one field of a device between start and end (both exclusive) per time
+        bucket on the database side. The buckets are aligned to the origin or the epoch,
+        buckets without rows are left out.
+        :param measurement: Name of the measurement
+        :param device: Device name
+        :param start: Start of the range
+        :param end: End of the range
+        :param field: Aggregated field
+        :param function: Aggregate function, one of sum, count, max and min
+        :param interval: Length of the buckets
+        :param filters: Field values the rows must match
+        :param origin: Timestamp on a bucket boundary, None for buckets aligned to the epoch
+        :return: Rows with the bucket start as key time and the key value, sorted by time
+        """
+
+    @abstractmethod
+    def delete_range(self, measurement: str, device: str, start: datetime, end: datetime) -> None:
+        """
+        Delete the rows of a device from start (inclusive) to end (exclusive).
+        :param measurement: Name of the measurement
+        :param device: Device name
+        :param start: Start of the range
+        :param end: End of the range
+        :return: None
+        """
+
+    def prune(self, before: datetime) -> int:  # pylint: disable=unused-argument
+        """
+        Delete all data older than the given timestamp. Backends whose database handles
+        the retention itself (retention policies of InfluxDB) keep the data.
+        :param before: Oldest timestamp which is kept
+        :return: Number of deleted rows
+        """
+        return 0
+
+    @abstractmethod
+    def field_keys(self, measurement: str, device: str, start: datetime, end: datetime) -> list:
+        """
+        Names of the fields of a measurement, used to know all columns of a range query
+        before its rows are read. Backends which cannot filter by device or range return
+        the fields of the whole measurement.
+        :param measurement: Name of the measurement
+        :param device: Device name
+        :param start: Start of the range
+        :param end: End of the range
+        :return: Sorted field names
+        """
+
+    def series_cardinality(  # pylint: disable=too-many-arguments,too-many-positional-arguments,unused-argument
+        self, measurement: str, device: str, start: datetime, end: datetime, field: str = None
+    ) -> int:
+        """
+        Number of series of a device in a measurement, used to estimate the rows of a
+        range query before it runs. Backends with one table per measurement hold one
+        series per device.
+        :param measurement: Name of the measurement
+        :param device: Device name
+        :param start: Start of the range
+        :param end: End of the range
+        :param field: Field whose series are counted, for backends with a series per field
+        :return: Number of series
+        """
+        return 1
+
+    def valid_sample_filter(self) -> dict:
+        """
+        Filter for the valid samples in the census measurement depending on the schema.
+        :return: Filter for the range and aggregate query
+        """
+        if self.schema == SCHEMA_SPLIT:
+            return None
+        return {"fetch_success": True}
+
+    def query_samples(
+        self, device: str, start: datetime, end: datetime, fields: list = None
+    ) -> Iterator[dict]:
+        """
+        Query the valid samples of a device.
+        :param device: Device name
+        :param start: Start of the range
+        :param end: End of the range
+        :param fields: Fields to return, all fields if None
+        :return: Rows with the key time and the requested fields
+        """
+        return self.query_range(
+            CENSUS_MEASUREMENT, device, start, end, fields, self.valid_sample_filter()
+        )
+
+    def query_columns(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        measurement: str,
+        device: str,
+        start: datetime,
+        end: datetime,
+        fields: list,
+        filters: dict = None,
+    ) -> Iterator[dict]:
+        """
+        Query the rows of a device between start and end (both exclusive) as chunks of
+        columns, see values_to_columns(). Backends which can decode their response
+        directly into columns override this.
+        :param measurement: Name of the measurement
+        :param device: Device name
+        :param start: Start of the range
+        :param end: End of the range
+        :param fields: Fields to return
+        :param filters: Field values the rows must match
+        :return: Columns of up to QUERY_CHUNK_SIZE rows in time order
+        """
+        rows = self.query_range(measurement, device, start, end, fields, filters)
+        while chunk := list(islice(rows, QUERY_CHUNK_SIZE)):
+            yield rows_to_columns(chunk, fields)
+
+    def query_sample_columns(
+        self, device: str, start: datetime, end: datetime, fields: list
+    ) -> Iterator[dict]:
+        """
+        Query the valid samples of a device as chunks of columns.
+        :param device: Device name
+        :param start: Start of the range
+        :param end: End of the range
+        :param fields: Fields to return
+        :return: Columns of up to QUERY_CHUNK_SIZE rows in time order
+        """
+        return self.query_columns(
+            CENSUS_MEASUREMENT, device, start, end, fields, self.valid_sample_filter()
+        )
+
+    def sum_samples(
+        self, device: str, start: datetime, end: datetime, field: str = "energy_wh"
+    ) -> float:
+        """
+        Sum one field over the valid samples of a device.
+        :param device: Device name
+        :param start: Start of the range
+        :param end: End of the range
+        :param field: Summed field
+        :return: Sum, 0 if there are no samples
+        """
+        total = self.query_aggregate(
+            CENSUS_MEASUREMENT, device, start, end, field, "sum", self.valid_sample_filter()
+        )
+        return total if total is not None else 0
+
+    def sum_samples_by_device(
+        self, devices: list, start: datetime, end: datetime, field: str = "energy_wh"
+    ) -> dict:
+        """
+        Sum one field over the valid samples of several devices.
+        :param devices: Device names
+        :param start: Start of the range
+        :param end: End of the range
+        :param field: Summed field
+        :return: Sum per device, 0 for devices without samples
+        """
+        totals = self.query_group_aggregate(
+            CENSUS_MEASUREMENT, devices, start, end, field, "sum", self.valid_sample_filter()
+        )
+        return {device: totals.get(device, 0) for device in devices}
+
+    def sample_statistics(self, device: str, start: datetime, end: datetime) -> dict:
+        """
+        Energy and number of the valid samples of a device. Aggregated and compressed
+        points count with their sample_count, all other points once.
+        :param device: Device name
+        :param start: Start of the range
+        :param end: End of the range
+        :return: Sum of energy_wh and number of samples
+        """
+        filters = self.valid_sample_filter()
+        points = self.query_aggregate(
+            CENSUS_MEASUREMENT, device, start, end, "energy_wh", "count", filters
+        )
+        represented = self.query_aggregate(
+            CENSUS_MEASUREMENT, device, start, end, "sample_count", "sum", filters
+        )
+        counted_points = 0
+        if represented:
+            counted_points = self.query_aggregate(
+                CENSUS_MEASUREMENT, device, start, end, "sample_count", "count", filters
+            )
+        return {
+            "energy_wh": self.sum_samples(device, start, end),
+            "sample_count": int(points or 0) + int(represented or 0) - int(counted_points or 0),
+        }
+
+    def failure_source(self) -> tuple:
+        """
+        Measurement and field which record the failed polls depending on the schema.
+        :return: Measurement and field, a failed poll has the field value False
+        """
+        if self.schema == SCHEMA_SPLIT:
+            return HEALTH_MEASUREMENT, "success"
+        return CENSUS_MEASUREMENT, "fetch_success"
+
+    def count_failures(self, device: str, start: datetime, end: datetime) -> int:
+        """
+        Count the failed polls of a device.
+        :param device: Device name
+        :param start: Start of the range
+        :param end: End of the range
+        :return: Number of failed polls
+        """
+        measurement, field = self.failure_source()
+        count = self.query_aggregate(
+            measurement, device, start, end, field, "count", {field: False}
+        )
+        return int(count) if count is not None else 0
+
+
+def main() -> None:
+    """
+    Scheduling function for regular call.
+    :return: None
+    """
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Storage backend which combines the raw sample archive with the database. Queries of the
+census measurement read the archived days from the archive and the remaining range from
+the database, so the calculations do not notice where the samples are stored.
+"""
+from datetime import datetime, timedelta
+from typing import Iterator
+from itertools import chain
+
+from source.storage import StorageBackend, interval_ms, bucket_offset_ms, bucket_start_ms
+from source.constants import CENSUS_MEASUREMENT
+from source.archive import RawSampleArchive, BEFORE_MIDNIGHT
+
+
+def combine_aggregates(function: str, values: list):
+    """
+    Combine partial aggregates of the archive and the database.
+    :param function: Aggregate function, one of sum, count, max and min
+    :param values: Partial aggregates, None for an empty part
+    :return: Aggregated value or None if all parts are empty
+    """
+    values = [value for value in values if value is not None]
+    if not values:
+        return None
+    if function in ("sum", "count"):
+        return sum(values)
+    if function == "max":
+        return max(values)
+    return min(values)
+
+
+class ArchiveBackend(StorageBackend):
+    """
+    Storage backend which reads old census data from the archive and everything else from
+    the wrapped database backend.
+    """
+
+    def __init__(self, inner: StorageBackend, archive: RawSampleArchive):
+        super().__init__(inner.schema)
+        self.inner = inner
+        self.archive = archive
+
+    def _split(self, measurement: str, device: str, start: datetime, end: datetime) -> tuple:
+        """
+        Split a range at the archive boundary of the device.
+        :return: Range of the archive and range of the database, None if not needed
+        """
+        boundary = None
+        if measurement == CENSUS_MEASUREMENT:
+            boundary = self.archive.exported_until(device)
+        if boundary is None or start >= boundary:
+            return None, (start, end)
+        if end <= boundary:
+            return (start, end), None
+        # The database range excludes its start, the sample at the boundary belongs to it
+        return (start, boundary), (boundary - BEFORE_MIDNIGHT, end)
+
+    def verify(self) -> None:
+        self.inner.verify()
+
+    def write_points(self, points: list, time_precision: str = None) -> None:
+        self.inner.write_points(points, time_precision)
+
+    def delete_range(self, measurement: str, device: str, start: datetime, end: datetime) -> None:
+        self.inner.delete_range(measurement, device, start, end)
+
+    def prune(self, before: datetime) -> int:
+        return self.inner.prune(before)
+
+    def field_keys(self, measurement: str, device: str, start: datetime, end: datetime) -> list:
+        """
+        Names of the fields in the archived days and the database.
+        :return: Sorted field names
+        """
+        archive_range, database_range = self._split(measurement, device, start, end)
+        fields = set()
+        if archive_range is not None:
+            fields |= set(self.archive.field_keys(device, *archive_range))
+        if database_range is not None:
+            fields |= set(self.inner.field_keys(measurement, device, *database_range))
+        return sorted(fields)
+
+    def series_cardinality(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self, measurement: str, device: str, start: datetime, end: datetime, field: str = None
+    ) -> int:
+        """
+        Number of series of a device in the database, at least the one of the archive.
+        :return: Number of series
+        """
+        return max(1, self.inner.series_cardinality(measurement, device, start, end, field))
+
+    def query_range(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        measurement: str,
+        device: str,
+        start: datetime,
+        end: datetime,
+        fields: list = None,
+        filters: dict = None,
+    ) -> Iterator[dict]:
+        """
+        Query the rows of a device between start and end (both exclusive) from the archive
+        and the database.
+        :param measurement: Name of the measurement
+        :param device: Device name
+        :param start: Start of the range
+        :param end: End of the range
+        :param fields: Fields to return, all fields if None
+        :param filters: Field values the rows must match
+        :return: Rows with the key time and the requested fields
+        """
+        archive_range, database_range = self._split(measurement, device, start, end)
+        parts = []
+        if archive_range is not None:
+            parts.append(self.archive.scan(device, *archive_range, fields, filters))
+        if database_range is not None:
+            parts.append(
+                self.inner.query_range(measurement, device, *database_range, fields, filters)
+            )
+        return chain.from_iterable(parts)
+
+    def query_aggregate(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        measurement: str,
+        device: str,
+        start: datetime,
+        end: datetime,
+        field: str,
+        function: str,
+        filters: dict = None,
+    ):
+        """
+        Aggregate one field of a device between start and end (both exclusive). The
+        archived part is aggregated while scanning, the database part by the database.
+        :param measurement: Name of the measurement
+        :param device: Device name
+        :param start: Start of the range
+        :param end: End of the range
+        :param field: Aggregated field
+        :param function: Aggregate function, one of sum, count, max, min and mean
+        :param filters: Field values the rows must match
+        :return: Aggregated value or None if there are no rows
+        """
+        archive_range, database_range = self._split(measurement, device, start, end)
+        if archive_range is None:
+            return self.inner.query_aggregate(
+                measurement, device, start, end, field, function, filters
+            )
+        functions = ("sum", "count") if function == "mean" else (function,)
+        values = [
+            row[field]
+            for row in self.archive.scan(device, *archive_range, [field], filters)
+            if row[field] is not None
+        ]
+        results = {}
+        for name in functions:
+            partial = [len(values) if name == "count" else combine_aggregates(name, values)]
+            if database_range is not None:
+                partial.append(
+                    self.inner.query_aggregate(
+                        measurement, device, *database_range, field, name, filters
+                    )
+                )
+            results[name] = combine_aggregates(name, partial)
+        if function == "mean":
+            return results["sum"] / results["count"] if results["count"] else None
+        return results[function]
+
+    def query_group_aggregate(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        measurement: str,
+        devices: list,
+        start: datetime,
+        end: datetime,
+        field: str,
+        function: str,
+        filters: dict = None,
+    ) -> dict:
+        """
+        Aggregate one field of several devices between start and end (both exclusive).
+        Devices whose range is not archived are aggregated with one database query, the
+        others one by one.
+        :param measurement: Name of the measurement
+        :param devices: Device names
+        :param start: Start of the range
+        :param end: End of the range
+        :param field: Aggregated field
+        :param function: Aggregate function, one of sum, count, max, min and mean
+        :param filters: Field values the rows must match
+        :return: Aggregated value per device, devices without rows are left out
+        """
+        archived = [
+            device
+            for device in devices
+            if self._split(measurement, device, start, end)[0] is not None
+        ]
+        values = self.inner.query_group_aggregate(
+            measurement,
+            [device for device in devices if device not in archived],
+            start,
+            end,
+            field,
+            function,
+            filters,
+        )
+        values.update(
+            super().query_group_aggregate(
+                measurement, archived, start, end, field, function, filters
+            )
+        )
+        return values
+
+    def query_buckets(  # pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-locals
+        self,
+        measurement: str,
+        device: str,
+        start: datetime,
+        end: datetime,
+        field: str,
+        function: str,
+        interval: timedelta,
+        filters: dict = None,
+        origin: datetime = None,
+    ) -> list:
+        """
+        Aggregate one field of a device between start and end (both exclusive) per time
+        bucket. The archived part is grouped while scanning, the database part by the
+        database. A bucket on the archive boundary combines both parts.
+        :param measurement: Name of the measurement
+        :param device: Device name
+        :param start: Start of the range
+        :param end: End of the range
+        :param field: Aggregated field
+        :param function: Aggregate function, one of sum, count, max, min and mean
+        :param interval: Length of the buckets
+        :param filters: Field values the rows must match
+        :param origin: Timestamp on a bucket boundary, None for buckets aligned to the epoch
+        :return: Rows with the bucket start as key time and the key value, sorted by time
+        """
+        archive_range, database_range = self._split(measurement, device, start, end)
+        if archive_range is None:
+            return self.inner.query_buckets(
+                measurement, device, start, end, field, function, interval, filters, origin
+            )
+        length_ms = interval_ms(interval)
+        offset_ms = bucket_offset_ms(origin, length_ms)
+        archived = {}
+        for row in self.archive.scan(device, *archive_range, [field], filters):
+            if row[field] is not None:
+                bucket = bucket_start_ms(row["time"], length_ms, offset_ms)
+                archived.setdefault(bucket, []).append(row[field])
+        results = {}
+        for name in ("sum", "count") if function == "mean" else (function,):
+            partials = {
+                bucket: [len(values) if name == "count" else combine_aggregates(name, values)]
+                for bucket, values in archived.items()
+            }
+            if database_range is not None:
+                for row in self.inner.query_buckets(
+                    measurement, device, *database_range, field, name, interval, filters, origin
+                ):
+                    partials.setdefault(row["time"], []).append(row["value"])
+            results[name] = {
+                bucket: combine_aggregates(name, values) for bucket, values in partials.items()
+            }
+        if function == "mean":
+            results[function] = {
+                bucket: total / results["count"][bucket]
+                for bucket, total in results["sum"].items()
+            }
+        return [
+            {"time": bucket, "value": value}
+            for bucket, value in sorted(results[function].items())
+        ]
+
+
+def main() -> None:
+    """
+    Scheduling function for regular call.
+    :return: None
+    """
+
+
+if __name__ == "__main__":
+    main()
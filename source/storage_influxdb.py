@@ -0,0 +1,586 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Storage backend for InfluxDB 1.x based on the influxdb client library.
+"""
+import json
+import socket
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Iterator
+
+import requests
+from influxdb import InfluxDBClient
+from influxdb.exceptions import InfluxDBClientError, InfluxDBServerError
+
+from source.storage import (
+    StorageBackend,
+    StorageConnectionError,
+    StorageWriteError,
+    interval_ms,
+    bucket_offset_ms,
+    values_to_columns,
+)
+from source import line_protocol as lp
+from source import logging_helper as lh
+from source.constants import (
+    CENSUS_MEASUREMENT,
+    HEALTH_MEASUREMENT,
+    UDP_STATISTICS_LOG_INTERVAL_S,
+    QUERY_CHUNK_SIZE,
+)
+
+QUERY_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+AGGREGATE_FUNCTIONS = ("sum", "count", "max", "min", "mean")
+
+
+class InfluxDBConnection(InfluxDBClient):
+    """
+    InfluxDB's connection class for handling in context manager
+    """
+
+    def __init__(self, login_information):
+        self.login_information = login_information
+        super().__init__(
+            host=login_information.db_ip_address,
+            port=login_information.db_port,
+            username=login_information.db_user_name,
+            password=login_information.db_user_password,
+            database=login_information.db_name,
+            ssl=login_information.ssl,
+            verify_ssl=login_information.verify_ssl,
+            gzip=login_information.gzip,
+        )
+
+    def __enter__(self):
+        return self
+
+
+def influxql_literal(value) -> str:
+    """
+    Convert a python value to an InfluxQL literal for a WHERE clause.
+    :param value: Filter value
+    :return: Value as InfluxQL literal
+    """
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, str):
+        return "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+    return repr(value)
+
+
+def influxql_where(filters: dict) -> str:
+    """
+    Create the additional conditions of the WHERE clause for field filters.
+    :param filters: Field values the rows must match
+    :return: Conditions which start with AND or an empty string
+    """
+    if not filters:
+        return ""
+    return "".join(
+        f' AND "{key}" = {influxql_literal(value)}' for key, value in filters.items()
+    )
+
+
+@contextmanager
+def query_errors():
+    """
+    Map the errors of a query to the storage errors.
+    :return: Context manager
+    """
+    try:
+        yield
+    except InfluxDBClientError as err:
+        raise StorageWriteError(err) from err
+    except (
+        InfluxDBServerError,
+        requests.exceptions.ConnectionError,
+        requests.exceptions.Timeout,
+    ) as err:
+        raise StorageConnectionError(err) from err
+
+
+def is_critical_point(point: dict) -> bool:
+    """
+    Points which must not get lost are written over HTTP also in the UDP mode. These are
+    all points outside the sample measurements and all failed polls, so the error rates
+    stay correct.
+    :param point: Point in the format of the device handlers
+    :return: True if the point must be written over HTTP
+    """
+    if point["measurement"] not in (CENSUS_MEASUREMENT, HEALTH_MEASUREMENT):
+        return True
+    fields = point["fields"]
+    return fields.get("fetch_success") is False or fields.get("success") is False
+
+
+def pack_datagrams(lines: list, max_datagram_size: int) -> tuple:
+    """
+    Pack lines into as few datagrams as possible which do not exceed the maximum size.
+    :param lines: Encoded lines
+    :param max_datagram_size: Maximum payload size of a datagram in bytes
+    :return: List of datagrams with the number of lines of each datagram and the list of
+    lines which are too long for a datagram
+    """
+    datagrams = []
+    oversized = []
+    payload = bytearray()
+    count = 0
+    for line in lines:
+        encoded = line.encode("utf-8") + b"\n"
+        if len(encoded) > max_datagram_size:
+            oversized.append(line)
+            continue
+        if len(payload) + len(encoded) > max_datagram_size:
+            datagrams.append((bytes(payload), count))
+            payload = bytearray()
+            count = 0
+        payload += encoded
+        count += 1
+    if payload:
+        datagrams.append((bytes(payload), count))
+    return datagrams, oversized
+
+
+class UdpLineSender:  # pylint: disable=too-many-instance-attributes
+    """
+    Sends line protocol to the UDP listener of InfluxDB 1.x without waiting for an answer.
+    The listener uses its own database and precision setting, the timestamps are sent in
+    nanoseconds which is the default precision of the listener. Send counters are kept
+    per second and as totals.
+    """
+
+    def __init__(self, host: str, port: int, max_datagram_size: int):
+        self.address = (host, port)
+        self.max_datagram_size = max_datagram_size
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.totals = {"datagrams": 0, "points": 0, "bytes": 0, "http_points": 0}
+        self.current_second = int(time.monotonic())
+        self.current = {"datagrams": 0, "points": 0}
+        self.last_second = {"datagrams": 0, "points": 0}
+        self.peak_points_per_second = 0
+        self.last_report = time.monotonic()
+
+    def _count(self, datagrams: int, points: int, size: int) -> None:
+        now = time.monotonic()
+        second = int(now)
+        if second != self.current_second:
+            self.last_second = self.current if second == self.current_second + 1 else {
+                "datagrams": 0,
+                "points": 0,
+            }
+            self.current = {"datagrams": 0, "points": 0}
+            self.current_second = second
+        self.current["datagrams"] += datagrams
+        self.current["points"] += points
+        self.peak_points_per_second = max(self.peak_points_per_second, self.current["points"])
+        self.totals["datagrams"] += datagrams
+        self.totals["points"] += points
+        self.totals["bytes"] += size
+        if now - self.last_report >= UDP_STATISTICS_LOG_INTERVAL_S:
+            self.last_report = now
+            lh.write_log(lh.LoggingLevel.INFO.value, f"UDP write statistics: {self.statistics()}")
+
+    def count_http_points(self, points: int) -> None:
+        """
+        Count the points which were written over HTTP instead.
+        :param points: Number of points
+        :return: None
+        """
+        self.totals["http_points"] += points
+
+    def statistics(self) -> dict:
+        """
+        Send counters of the last complete second, the peak and the totals.
+        :return: Counters
+        """
+        return {
+            "last_second_datagrams": self.last_second["datagrams"],
+            "last_second_points": self.last_second["points"],
+            "peak_points_per_second": self.peak_points_per_second,
+        } | self.totals
+
+    def send(self, lines: list) -> list:
+        """
+        Send the lines packed into datagrams.
+        :param lines: Lines with timestamps in nanoseconds
+        :return: Lines which are too long for a datagram
+        """
+        datagrams, oversized = pack_datagrams(lines, self.max_datagram_size)
+        size = 0
+        try:
+            for payload, _ in datagrams:
+                self.socket.sendto(payload, self.address)
+                size += len(payload)
+        except OSError as err:
+            raise StorageConnectionError(err) from err
+        self._count(len(datagrams), len(lines) - len(oversized), size)
+        return oversized
+
+
+class InfluxDBBackend(StorageBackend):
+    """
+    Storage backend for InfluxDB 1.x. Queries are written in InfluxQL.
+    """
+
+    def __init__(self, login_information, schema: str):
+        super().__init__(schema)
+        self.login_information = login_information
+        self.udp_sender = None
+
+    def connection(self) -> InfluxDBConnection:
+        """
+        Create a new connection to the database.
+        :return: Connection for the context manager
+        """
+        return InfluxDBConnection(self.login_information)
+
+    def _measurement_path(self, measurement: str) -> str:
+        return f'"{self.login_information.db_name}"."autogen"."{measurement}"'
+
+    @staticmethod
+    def _time_params(start: datetime, end: datetime) -> dict:
+        return {
+            "target_date": start.strftime(QUERY_TIME_FORMAT),
+            "current_date": end.strftime(QUERY_TIME_FORMAT),
+        }
+
+    def _bind_params(self, device: str, start: datetime, end: datetime) -> dict:
+        return {"device": device} | self._time_params(start, end)
+
+    def verify(self) -> None:
+        """
+        Check the connection and create the database if necessary.
+        :return: None
+        """
+        try:
+            with self.connection() as conn:
+                conn.ping()
+                if not any(
+                    True
+                    for db in conn.get_list_database()
+                    if db["name"] == self.login_information.db_name
+                ):
+                    conn.create_database(self.login_information.db_name)
+        except (InfluxDBClientError, InfluxDBServerError) as err:
+            raise StorageWriteError(err) from err
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as err:
+            raise StorageConnectionError(err) from err
+
+    def write_points(self, points: list, time_precision: str = None) -> None:
+        """
+        Encode the points to line protocol and write them to the database. In the UDP mode
+        the live samples (no explicit precision) are sent as datagrams, critical points
+        and writes with an explicit precision like the spool replay use HTTP.
+        :param points: List of points
+        :param time_precision: Precision of the written timestamps
+        :return: None
+        """
+        if self.udp_sender is not None and time_precision is None:
+            udp_points = [point for point in points if not is_critical_point(point)]
+            http_lines = self.udp_sender.send(lp.encode_points(udp_points, "n"))
+            http_points = [point for point in points if is_critical_point(point)]
+            self.udp_sender.count_http_points(len(http_points) + len(http_lines))
+            if http_lines:
+                self._write_lines(http_lines, "n")
+            if not http_points:
+                return
+            points = http_points
+        if time_precision is None:
+            time_precision = self.login_information.time_precision
+        self._write_lines(lp.encode_points(points, time_precision), time_precision)
+
+    def _write_lines(self, lines: list, time_precision: str) -> None:
+        try:
+            with self.connection() as conn:
+                conn.write_points(lines, time_precision=time_precision, protocol="line")
+        except InfluxDBClientError as err:
+            raise StorageWriteError(err, invalid_data=err.code == 400) from err
+        except (
+            InfluxDBServerError,
+            requests.exceptions.ConnectionError,
+            requests.exceptions.Timeout,
+        ) as err:
+            raise StorageConnectionError(err) from err
+
+    def _query(self, query: str, bind_params: dict):
+        with query_errors(), self.connection() as conn:
+            return conn.query(query, bind_params=bind_params, epoch="ms")
+
+    def _query_chunked(self, query: str, bind_params: dict) -> Iterator[dict]:
+        """
+        Run a query with a chunked response. The rows are decoded chunk by chunk while
+        they are read, so long ranges are not held in memory as a whole.
+        :param query: Query in InfluxQL
+        :param bind_params: Values of the bind parameters
+        :return: Rows of the response
+        """
+        with query_errors(), self.connection() as conn:
+            for chunk in conn.query(
+                query,
+                bind_params=bind_params,
+                epoch="ms",
+                chunked=True,
+                chunk_size=QUERY_CHUNK_SIZE,
+            ):
+                yield from chunk.get_points()
+
+    def series_cardinality(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self, measurement: str, device: str, start: datetime, end: datetime, field: str = None
+    ) -> int:
+        """
+        Number of series of a device in a measurement with SHOW SERIES. The fields share
+        the series of their tags.
+        :param measurement: Name of the measurement
+        :param device: Device name
+        :param start: Start of the range
+        :param end: End of the range
+        :param field: Not used, the fields share the series
+        :return: Number of series
+        """
+        query = (
+            f'SHOW SERIES EXACT CARDINALITY ON "{self.login_information.db_name}" '
+            f'FROM "{measurement}" '
+            f"WHERE device=$device AND time > $target_date AND time < $current_date"
+        )
+        result = self._query(query, self._bind_params(device, start, end))
+        return sum(int(row["count"]) for row in result.get_points())
+
+    def field_keys(self, measurement: str, device: str, start: datetime, end: datetime) -> list:
+        """
+        Names of the fields of a measurement with SHOW FIELD KEYS, which cannot filter by
+        tag or time, so the device and the range are not used.
+        :param measurement: Name of the measurement
+        :param device: Not used
+        :param start: Not used
+        :param end: Not used
+        :return: Sorted field names
+        """
+        query = (
+            f'SHOW FIELD KEYS ON "{self.login_information.db_name}" FROM "{measurement}"'
+        )
+        result = self._query(query, None)
+        return sorted(row["fieldKey"] for row in result.get_points())
+
+    def _range_query(self, measurement: str, fields: list, filters: dict) -> str:
+        selection = ", ".join(f'"{field}"' for field in fields) if fields else "*"
+        return (
+            f"SELECT {selection} FROM {self._measurement_path(measurement)} "
+            f"WHERE device=$device AND time > $target_date AND time < $current_date"
+            f"{influxql_where(filters)}"
+        )
+
+    def query_range(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        measurement: str,
+        device: str,
+        start: datetime,
+        end: datetime,
+        fields: list = None,
+        filters: dict = None,
+    ) -> Iterator[dict]:
+        """
+        Query the rows of a device between start and end (both exclusive).
+        :param measurement: Name of the measurement
+        :param device: Device name
+        :param start: Start of the range
+        :param end: End of the range
+        :param fields: Fields to return, all fields if None
+        :param filters: Field values the rows must match
+        :return: Rows with the key time and the requested fields
+        """
+        return self._query_chunked(
+            self._range_query(measurement, fields, filters),
+            self._bind_params(device, start, end),
+        )
+
+    def query_columns(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        measurement: str,
+        device: str,
+        start: datetime,
+        end: datetime,
+        fields: list,
+        filters: dict = None,
+    ) -> Iterator[dict]:
+        """
+        Query the rows of a device between start and end (both exclusive) as chunks of
+        columns. The chunked JSON response is transposed directly into the columns, the
+        client library would build a dict per row.
+        :param measurement: Name of the measurement
+        :param device: Device name
+        :param start: Start of the range
+        :param end: End of the range
+        :param fields: Fields to return
+        :param filters: Field values the rows must match
+        :return: Columns of up to QUERY_CHUNK_SIZE rows in time order
+        """
+        params = {
+            "q": self._range_query(measurement, fields, filters),
+            "db": self.login_information.db_name,
+            "params": json.dumps(self._bind_params(device, start, end)),
+            "epoch": "ms",
+            "chunked": "true",
+            "chunk_size": QUERY_CHUNK_SIZE,
+        }
+        with query_errors(), self.connection() as conn:
+            response = conn.request("query", params=params, stream=True)
+            for line in response.iter_lines():
+                for result in json.loads(line).get("results", []):
+                    if "error" in result:
+                        raise InfluxDBClientError(result["error"])
+                    for series in result.get("series", []):
+                        yield values_to_columns(series["columns"], series["values"], fields)
+
+    def _aggregate_query(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        measurement: str,
+        field: str,
+        function: str,
+        filters: dict,
+        device_condition: str = "device=$device",
+    ):
+        if function not in AGGREGATE_FUNCTIONS:
+            raise ValueError(f"Aggregate function {function} is not supported.")
+        return (
+            f'SELECT {function.upper()}("{field}") AS "value" '
+            f"FROM {self._measurement_path(measurement)} "
+            f"WHERE {device_condition} AND time > $target_date AND time < $current_date"
+            f"{influxql_where(filters)}"
+        )
+
+    def query_aggregate(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        measurement: str,
+        device: str,
+        start: datetime,
+        end: datetime,
+        field: str,
+        function: str,
+        filters: dict = None,
+    ):
+        """
+        Aggregate one field of a device between start and end (both exclusive) on
+        the database side.
+        :param measurement: Name of the measurement
+        :param device: Device name
+        :param start: Start of the range
+        :param end: End of the range
+        :param field: Aggregated field
+        :param function: Aggregate function, one of sum, count, max, min and mean
+        :param filters: Field values the rows must match
+        :return: Aggregated value or None if there are no rows
+        """
+        query = self._aggregate_query(measurement, field, function, filters)
+        result = self._query(query, self._bind_params(device, start, end))
+        return next((row["value"] for row in result.get_points()), None)
+
+    def query_group_aggregate(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        measurement: str,
+        devices: list,
+        start: datetime,
+        end: datetime,
+        field: str,
+        function: str,
+        filters: dict = None,
+    ) -> dict:
+        """
+        Aggregate one field of several devices between start and end (both exclusive)
+        with one query grouped by device.
+        :param measurement: Name of the measurement
+        :param devices: Device names
+        :param start: Start of the range
+        :param end: End of the range
+        :param field: Aggregated field
+        :param function: Aggregate function, one of sum, count, max, min and mean
+        :param filters: Field values the rows must match
+        :return: Aggregated value per device, devices without rows are left out
+        """
+        if not devices:
+            return {}
+        names = [f"device{index}" for index in range(len(devices))]
+        condition = " OR ".join(f"device=${name}" for name in names)
+        result = self._query(
+            self._aggregate_query(measurement, field, function, filters, f"({condition})")
+            + ' GROUP BY "device"',
+            dict(zip(names, devices)) | self._time_params(start, end),
+        )
+        values = {}
+        for (_, tags), points in result.items():
+            value = next(points, {}).get("value")
+            if value is not None:
+                values[tags["device"]] = value
+        return values
+
+    def query_buckets(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        measurement: str,
+        device: str,
+        start: datetime,
+        end: datetime,
+        field: str,
+        function: str,
+        interval: timedelta,
+        filters: dict = None,
+        origin: datetime = None,
+    ) -> list:
+        """
+        Aggregate one field of a device between start and end (both exclusive) per time
+        bucket with GROUP BY time.
+        :param measurement: Name of the measurement
+        :param device: Device name
+        :param start: Start of the range
+        :param end: End of the range
+        :param field: Aggregated field
+        :param function: Aggregate function, one of sum, count, max, min and mean
+        :param interval: Length of the buckets
+        :param filters: Field values the rows must match
+        :param origin: Timestamp on a bucket boundary, None for buckets aligned to the epoch
+        :return: Rows with the bucket start as key time and the key value, sorted by time
+        """
+        length_ms = interval_ms(interval)
+        offset_ms = bucket_offset_ms(origin, length_ms)
+        query = (
+            self._aggregate_query(measurement, field, function, filters)
+            + f" GROUP BY time({length_ms}ms, {offset_ms}ms) fill(none)"
+        )
+        result = self._query(query, self._bind_params(device, start, end))
+        return [{"time": row["time"], "value": row["value"]} for row in result.get_points()]
+
+    def delete_range(self, measurement: str, device: str, start: datetime, end: datetime) -> None:
+        """
+        Delete the rows of a device from start (inclusive) to end (exclusive).
+        :param measurement: Name of the measurement
+        :param device: Device name
+        :param start: Start of the range
+        :param end: End of the range
+        :return: None
+        """
+        query = (
+            f'DELETE FROM "{measurement}" '
+            f"WHERE device=$device AND time >= $target_date AND time < $current_date"
+        )
+        try:
+            with self.connection() as conn:
+                conn.query(query, bind_params=self._bind_params(device, start, end), method="POST")
+        except InfluxDBClientError as err:
+            raise StorageWriteError(err) from err
+        except (
+            InfluxDBServerError,
+            requests.exceptions.ConnectionError,
+            requests.exceptions.Timeout,
+        ) as err:
+            raise StorageConnectionError(err) from err
+
+
+def main() -> None:
+    """
+    Scheduling function for regular call.
+    :return: None
+    """
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,487 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Storage backend for InfluxDB 2.x. Points are written as line protocol over the HTTP API and
+queries are written in Flux, so aggregations are executed by the database.
+"""
+import csv
+import gzip
+from datetime import datetime, timedelta
+from typing import Iterable, Iterator
+
+import requests
+
+from source.storage import (
+    StorageBackend,
+    StorageConnectionError,
+    StorageWriteError,
+    interval_ms,
+    bucket_offset_ms,
+)
+from source.constants import TIMEOUT_RESPONSE_TIME
+from source import line_protocol as lp
+
+FLUX_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+AGGREGATE_FUNCTIONS = ("sum", "count", "max", "min", "mean")
+CSV_TYPE_CONVERTER = {
+    "double": float,
+    "long": int,
+    "unsignedLong": int,
+    "boolean": lambda value: value == "true",
+    "string": str,
+}
+IGNORED_CSV_COLUMNS = ("", "result", "table", "_start", "_stop", "_measurement")
+
+
+def flux_literal(value) -> str:
+    """
+    Convert a python value to a Flux literal.
+    :param value: Filter value
+    :return: Value as Flux literal
+    """
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, str):
+        return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+    return repr(value)
+
+
+def flux_rfc3339_to_epoch_ms(value: str) -> int:
+    """
+    Convert a RFC3339 timestamp of a Flux response to epoch milliseconds.
+    :param value: Timestamp as string
+    :return: Timestamp in milliseconds
+    """
+    timestamp = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return lp.encode_timestamp(timestamp, "ms")
+
+
+def parse_annotated_csv(lines: Iterable[str]) -> Iterator[dict]:
+    """
+    Parse a Flux response in annotated CSV with the datatype annotation. Each table
+    starts with its own annotation and header row.
+    :param lines: Lines of the response body
+    :return: Rows with converted values
+    """
+    converters = None
+    header = None
+    for row in csv.reader(lines):
+        if not row or not any(row):
+            converters = None
+            header = None
+            continue
+        if row[0] == "#datatype":
+            converters = row
+            header = None
+            continue
+        if row[0].startswith("#"):
+            continue
+        if header is None:
+            header = row
+            continue
+        result = {}
+        for index, name in enumerate(header):
+            if name in IGNORED_CSV_COLUMNS or row[index] == "":
+                continue
+            data_type = converters[index] if converters else "string"
+            if data_type.startswith("dateTime"):
+                result["time" if name == "_time" else name] = flux_rfc3339_to_epoch_ms(
+                    row[index]
+                )
+            else:
+                result[name] = CSV_TYPE_CONVERTER.get(data_type, str)(row[index])
+        yield result
+
+
+class InfluxDB2Backend(StorageBackend):
+    """
+    Storage backend for InfluxDB 2.x with organisation, bucket and token.
+    """
+
+    def __init__(self, login_information, schema: str):
+        super().__init__(schema)
+        self.login_information = login_information
+        protocol = "https" if login_information.ssl else "http"
+        self.base_url = (
+            f"{protocol}://{login_information.db_ip_address}:{login_information.db_port}"
+        )
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = f"Token {login_information.db_token}"
+
+    def _request(self, method: str, path: str, **kwargs) -> requests.Response:
+        try:
+            response = self.session.request(
+                method,
+                self.base_url + path,
+                timeout=TIMEOUT_RESPONSE_TIME,
+                verify=self.login_information.verify_ssl,
+                **kwargs,
+            )
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as err:
+            raise StorageConnectionError(err) from err
+        if response.status_code >= 500:
+            raise StorageConnectionError(f"{response.status_code}: {response.text}")
+        if response.status_code >= 300:
+            raise StorageWriteError(
+                f"{response.status_code}: {response.text}",
+                invalid_data=response.status_code == 400,
+            )
+        return response
+
+    def verify(self) -> None:
+        """
+        Check the connection. The bucket must already exist in InfluxDB 2.x.
+        :return: None
+        """
+        self._request("GET", "/ping")
+        response = self._request(
+            "GET",
+            "/api/v2/buckets",
+            params={"org": self.login_information.db_org,
+                    "name": self.login_information.db_bucket},
+        )
+        if not response.json().get("buckets"):
+            raise StorageWriteError(
+                f"Bucket {self.login_information.db_bucket} does not exist."
+            )
+
+    def write_points(self, points: list, time_precision: str = None) -> None:
+        """
+        Encode the points to line protocol and write them gzip compressed.
+        :param points: List of points
+        :param time_precision: Precision of the written timestamps
+        :return: None
+        """
+        if time_precision is None:
+            time_precision = self.login_information.time_precision
+        body = "\n".join(lp.encode_points(points, time_precision)) + "\n"
+        headers = {"Content-Type": "text/plain; charset=utf-8"}
+        if self.login_information.gzip:
+            body = gzip.compress(body.encode("utf-8"))
+            headers["Content-Encoding"] = "gzip"
+        self._request(
+            "POST",
+            "/api/v2/write",
+            params={
+                "org": self.login_information.db_org,
+                "bucket": self.login_information.db_bucket,
+                "precision": time_precision,
+            },
+            data=body,
+            headers=headers,
+        )
+
+    def query_flux(self, flux: str) -> Iterator[dict]:
+        """
+        Run a Flux query and parse the response while it is read, so long ranges are not
+        held in memory as a whole.
+        :param flux: Query in Flux
+        :return: Rows of all result tables
+        """
+        response = self._request(
+            "POST",
+            "/api/v2/query",
+            params={"org": self.login_information.db_org},
+            json={
+                "query": flux,
+                "type": "flux",
+                "dialect": {"annotations": ["datatype"], "header": True},
+            },
+            headers={"Accept": "application/csv"},
+            stream=True,
+        )
+        response.encoding = "utf-8"
+        try:
+            yield from parse_annotated_csv(response.iter_lines(decode_unicode=True))
+        except (
+            requests.exceptions.ConnectionError,
+            requests.exceptions.ChunkedEncodingError,
+            requests.exceptions.Timeout,
+        ) as err:
+            raise StorageConnectionError(err) from err
+        finally:
+            response.close()
+
+    def _flux_source(self, measurement: str, device, start: datetime, end: datetime):
+        if isinstance(device, list):
+            device_condition = f"contains(value: r.device, set: {flux_list(device)})"
+        else:
+            device_condition = f"r.device == {flux_literal(device)}"
+        return (
+            f"from(bucket: {flux_literal(self.login_information.db_bucket)})\n"
+            f"  |> range(start: {start.strftime(FLUX_TIME_FORMAT)}, "
+            f"stop: {end.strftime(FLUX_TIME_FORMAT)})\n"
+            f"  |> filter(fn: (r) => r._measurement == {flux_literal(measurement)} "
+            f"and {device_condition})\n"
+            f"  |> filter(fn: (r) => r._time > {start.strftime(FLUX_TIME_FORMAT)})\n"
+        )
+
+    @staticmethod
+    def _flux_filters(filters: dict) -> str:
+        if not filters:
+            return ""
+        conditions = " and ".join(
+            f"r[{flux_literal(key)}] == {flux_literal(value)}" for key, value in filters.items()
+        )
+        return f"  |> filter(fn: (r) => {conditions})\n"
+
+    @staticmethod
+    def _flux_field_selection(fields: list) -> str:
+        conditions = " or ".join(f"r._field == {flux_literal(field)}" for field in fields)
+        return f"  |> filter(fn: (r) => {conditions})\n"
+
+    def field_keys(self, measurement: str, device: str, start: datetime, end: datetime) -> list:
+        """
+        Names of the fields of a device in a range with schema.fieldKeys().
+        :param measurement: Name of the measurement
+        :param device: Device name
+        :param start: Start of the range
+        :param end: End of the range
+        :return: Sorted field names
+        """
+        flux = (
+            'import "influxdata/influxdb/schema"\n'
+            f"schema.fieldKeys(bucket: {flux_literal(self.login_information.db_bucket)}, "
+            f"start: {start.strftime(FLUX_TIME_FORMAT)}, stop: {end.strftime(FLUX_TIME_FORMAT)}, "
+            f"predicate: (r) => r._measurement == {flux_literal(measurement)} "
+            f"and r.device == {flux_literal(device)})\n"
+        )
+        return sorted({row["_value"] for row in self.query_flux(flux) if "_value" in row})
+
+    def series_cardinality(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self, measurement: str, device: str, start: datetime, end: datetime, field: str = None
+    ) -> int:
+        """
+        Number of series of a device in a measurement with influxdb.cardinality(). Every
+        field is a series of its own, so only the series of one field are counted.
+        :param measurement: Name of the measurement
+        :param device: Device name
+        :param start: Start of the range
+        :param end: End of the range
+        :param field: Field whose series are counted, all fields if None
+        :return: Number of series
+        """
+        predicate = (
+            f"r._measurement == {flux_literal(measurement)} and r.device == {flux_literal(device)}"
+        )
+        if field is not None:
+            predicate += f" and r._field == {flux_literal(field)}"
+        flux = (
+            'import "influxdata/influxdb"\n'
+            f"influxdb.cardinality(bucket: {flux_literal(self.login_information.db_bucket)}, "
+            f"start: {start.strftime(FLUX_TIME_FORMAT)}, stop: {end.strftime(FLUX_TIME_FORMAT)}, "
+            f"predicate: (r) => {predicate})\n"
+        )
+        return sum(int(row["_value"]) for row in self.query_flux(flux) if "_value" in row)
+
+    def query_range(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        measurement: str,
+        device: str,
+        start: datetime,
+        end: datetime,
+        fields: list = None,
+        filters: dict = None,
+    ) -> Iterator[dict]:
+        """
+        Query the rows of a device between start and end (both exclusive).
+        :param measurement: Name of the measurement
+        :param device: Device name
+        :param start: Start of the range
+        :param end: End of the range
+        :param fields: Fields to return, all fields if None
+        :param filters: Field values the rows must match
+        :return: Rows with the key time and the requested fields
+        """
+        flux = self._flux_source(measurement, device, start, end)
+        if fields:
+            flux += self._flux_field_selection(list(fields) + list(filters or {}))
+        flux += '  |> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")\n'
+        flux += self._flux_filters(filters)
+        if fields:
+            flux += f"  |> keep(columns: {flux_list(['_time'] + list(fields))})\n"
+        flux += '  |> group()\n  |> sort(columns: ["_time"])\n'
+        return self.query_flux(flux)
+
+    def _flux_aggregate_source(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        measurement: str,
+        device,
+        start: datetime,
+        end: datetime,
+        field: str,
+        function: str,
+        filters: dict,
+    ) -> tuple:
+        """
+        Flux query up to the aggregation of one field, all rows in one table. If a list of
+        devices is given, the rows are grouped in one table per device.
+        :return: Query and the column which holds the field
+        """
+        if function not in AGGREGATE_FUNCTIONS:
+            raise ValueError(f"Aggregate function {function} is not supported.")
+        flux = self._flux_source(measurement, device, start, end)
+        grouping = "  |> group()\n"
+        if isinstance(device, list):
+            grouping = '  |> group(columns: ["device"])\n'
+        if not filters:
+            flux += self._flux_field_selection([field])
+            return flux + grouping, "_value"
+        flux += self._flux_field_selection([field] + list(filters))
+        flux += '  |> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")\n'
+        flux += self._flux_filters(filters)
+        return flux + grouping, field
+
+    def query_aggregate(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        measurement: str,
+        device: str,
+        start: datetime,
+        end: datetime,
+        field: str,
+        function: str,
+        filters: dict = None,
+    ):
+        """
+        Aggregate one field of a device between start and end (both exclusive) with
+        the aggregate functions of Flux.
+        :param measurement: Name of the measurement
+        :param device: Device name
+        :param start: Start of the range
+        :param end: End of the range
+        :param field: Aggregated field
+        :param function: Aggregate function, one of sum, count, max, min and mean
+        :param filters: Field values the rows must match
+        :return: Aggregated value or None if there are no rows
+        """
+        flux, column = self._flux_aggregate_source(
+            measurement, device, start, end, field, function, filters
+        )
+        if column == "_value":
+            flux += f"  |> {function}()\n"
+        else:
+            flux += f"  |> {function}(column: {flux_literal(column)})\n"
+        return next((row[column] for row in self.query_flux(flux) if column in row), None)
+
+    def query_group_aggregate(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        measurement: str,
+        devices: list,
+        start: datetime,
+        end: datetime,
+        field: str,
+        function: str,
+        filters: dict = None,
+    ) -> dict:
+        """
+        Aggregate one field of several devices between start and end (both exclusive)
+        with one Flux query grouped by device.
+        :param measurement: Name of the measurement
+        :param devices: Device names
+        :param start: Start of the range
+        :param end: End of the range
+        :param field: Aggregated field
+        :param function: Aggregate function, one of sum, count, max, min and mean
+        :param filters: Field values the rows must match
+        :return: Aggregated value per device, devices without rows are left out
+        """
+        if not devices:
+            return {}
+        flux, column = self._flux_aggregate_source(
+            measurement, list(devices), start, end, field, function, filters
+        )
+        if column == "_value":
+            flux += f"  |> {function}()\n"
+        else:
+            flux += f"  |> {function}(column: {flux_literal(column)})\n"
+        return {
+            row["device"]: row[column]
+            for row in self.query_flux(flux)
+            if row.get(column) is not None
+        }
+
+    def query_buckets(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        measurement: str,
+        device: str,
+        start: datetime,
+        end: datetime,
+        field: str,
+        function: str,
+        interval: timedelta,
+        filters: dict = None,
+        origin: datetime = None,
+    ) -> list:
+        """
+        Aggregate one field of a device between start and end (both exclusive) per time
+        bucket with aggregateWindow.
+        :param measurement: Name of the measurement
+        :param device: Device name
+        :param start: Start of the range
+        :param end: End of the range
+        :param field: Aggregated field
+        :param function: Aggregate function, one of sum, count, max, min and mean
+        :param interval: Length of the buckets
+        :param filters: Field values the rows must match
+        :param origin: Timestamp on a bucket boundary, None for buckets aligned to the epoch
+        :return: Rows with the bucket start as key time and the key value, sorted by time
+        """
+        flux, column = self._flux_aggregate_source(
+            measurement, device, start, end, field, function, filters
+        )
+        length_ms = interval_ms(interval)
+        flux += (
+            f"  |> aggregateWindow(every: {length_ms}ms, "
+            f"offset: {bucket_offset_ms(origin, length_ms)}ms, fn: {function}, "
+            f'column: {flux_literal(column)}, timeSrc: "_start", createEmpty: false)\n'
+        )
+        return [
+            {"time": row["time"], "value": row[column]}
+            for row in self.query_flux(flux)
+            if column in row
+        ]
+
+    def delete_range(self, measurement: str, device: str, start: datetime, end: datetime) -> None:
+        """
+        Delete the rows of a device from start (inclusive) to end (exclusive) with the
+        delete API. The stop of the API is inclusive.
+        :param measurement: Name of the measurement
+        :param device: Device name
+        :param start: Start of the range
+        :param end: End of the range
+        :return: None
+        """
+        self._request(
+            "POST",
+            "/api/v2/delete",
+            params={
+                "org": self.login_information.db_org,
+                "bucket": self.login_information.db_bucket,
+            },
+            json={
+                "start": start.strftime(FLUX_TIME_FORMAT),
+                "stop": (end - timedelta(microseconds=1)).strftime(FLUX_TIME_FORMAT),
+                "predicate": f"_measurement={flux_literal(measurement)} "
+                f"AND device={flux_literal(device)}",
+            },
+        )
+
+
+def flux_list(values: list) -> str:
+    """
+    Convert a list of strings to a Flux array.
+    :param values: List of strings
+    :return: Flux array
+    """
+    return "[" + ", ".join(flux_literal(value) for value in values) + "]"
+
+
+def main() -> None:
+    """
+    Scheduling function for regular call.
+    :return: None
+    """
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,538 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Embedded storage backend based on SQLite for small installations without InfluxDB. Each
+measurement is a table clustered by (device, ts), so range and aggregate queries of a
+device read one continuous part of the index.
+"""
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Iterator
+
+from source.storage import (
+    StorageBackend,
+    StorageError,
+    StorageConnectionError,
+    StorageWriteError,
+    interval_ms,
+    bucket_offset_ms,
+    values_to_columns,
+)
+from source import line_protocol as lp
+from source.constants import QUERY_CHUNK_SIZE
+
+AGGREGATE_FUNCTIONS = ("sum", "count", "max", "min", "mean")
+RESERVED_COLUMNS = ("device", "ts")
+CHANGED_TABLE_ERRORS = (
+    "no such table",
+    "no such column",
+    "has no column named",
+    "duplicate column",
+)
+
+
+def quote_identifier(name: str) -> str:
+    """
+    Quote a table or column name for SQLite.
+    :param name: Name of the table or column
+    :return: Quoted name
+    """
+    return '"' + name.replace('"', '""') + '"'
+
+
+def to_epoch_ms(timestamp: datetime) -> int:
+    """
+    Convert a naive UTC datetime to epoch milliseconds.
+    :param timestamp: Timestamp
+    :return: Timestamp in milliseconds
+    """
+    return lp.encode_timestamp(timestamp, "ms")
+
+
+def aggregate_expression(function: str, column: str) -> str:
+    """
+    SQL expression of an aggregate function.
+    :param function: Aggregate function, one of sum, count, max, min and mean
+    :param column: Quoted column name
+    :return: Expression
+    """
+    return f"{'AVG' if function == 'mean' else function.upper()}({column})"
+
+
+def int_timestamp_to_ms(timestamp: int, time_precision: str) -> int:
+    """
+    Convert an integer timestamp with the given precision to epoch milliseconds.
+    :param timestamp: Integer timestamp
+    :param time_precision: Precision of the timestamp, milliseconds if None
+    :return: Timestamp in milliseconds
+    """
+    if time_precision == "s":
+        return timestamp * 1_000
+    if time_precision == "u":
+        return timestamp // 1_000
+    if time_precision == "n":
+        return timestamp // 1_000_000
+    return timestamp
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    Storage backend for SQLite in WAL mode. Every thread uses its own connection.
+    """
+
+    def __init__(self, login_information, schema: str):
+        super().__init__(schema)
+        self.database_path = login_information.db_path
+        self.local = threading.local()
+        self.columns = {}
+        self.lock = threading.Lock()
+
+    def connection(self) -> sqlite3.Connection:
+        """
+        Connection of the current thread.
+        :return: SQLite connection
+        """
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            directory = os.path.dirname(self.database_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            try:
+                conn = sqlite3.connect(self.database_path, timeout=30)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+            except sqlite3.Error as err:
+                raise StorageConnectionError(err) from err
+            self.local.conn = conn
+        return conn
+
+    def _table_columns(self, conn: sqlite3.Connection, table: str) -> set:
+        if table not in self.columns:
+            rows = conn.execute(f"PRAGMA table_info({quote_identifier(table)})").fetchall()
+            self.columns[table] = {row[1] for row in rows}
+        return self.columns[table]
+
+    def _forget_columns(self, tables) -> None:
+        """
+        Read the columns of the tables again with the next statement, because they were
+        changed by another process or a transaction was rolled back.
+        :param tables: Table names, all tables if None
+        :return: None
+        """
+        with self.lock:
+            if tables is None:
+                self.columns.clear()
+            for table in tables or ():
+                self.columns.pop(table, None)
+
+    @contextmanager
+    def _query_errors(self, table: str = None):
+        """
+        Map the SQLite errors of a statement to the storage errors.
+        :param table: Table of the statement, None for statements on all tables
+        :return: Context manager
+        """
+        try:
+            yield
+        except sqlite3.Error as err:
+            if any(text in str(err) for text in CHANGED_TABLE_ERRORS):
+                self._forget_columns(None if table is None else [table])
+            if isinstance(err, sqlite3.OperationalError):
+                raise StorageConnectionError(err) from err
+            raise StorageError(err) from err
+
+    def _ensure_table(self, conn: sqlite3.Connection, table: str, fields: set) -> None:
+        with self.lock:
+            columns = self._table_columns(conn, table)
+            if not columns:
+                conn.execute(
+                    f"CREATE TABLE IF NOT EXISTS {quote_identifier(table)} "
+                    f"(device TEXT NOT NULL, ts INTEGER NOT NULL, PRIMARY KEY (device, ts)) "
+                    f"WITHOUT ROWID"
+                )
+                columns.update(RESERVED_COLUMNS)
+            for field in sorted(fields - columns):
+                conn.execute(
+                    f"ALTER TABLE {quote_identifier(table)} ADD COLUMN {quote_identifier(field)}"
+                )
+                columns.add(field)
+
+    def verify(self) -> None:
+        """
+        Open the database file and check that it can be used.
+        :return: None
+        """
+        try:
+            self.connection().execute("SELECT 1").fetchone()
+        except sqlite3.Error as err:
+            raise StorageConnectionError(err) from err
+
+    def write_points(self, points: list, time_precision: str = None) -> None:
+        """
+        Insert the points in one transaction per measurement. A point with the same
+        device and timestamp replaces the existing row.
+        :param points: List of points
+        :param time_precision: Precision of integer timestamps, datetime objects are exact
+        :return: None
+        """
+        rows_per_table = {}
+        for point in points:
+            timestamp = point["time"]
+            if isinstance(timestamp, int):
+                timestamp = int_timestamp_to_ms(timestamp, time_precision)
+            else:
+                timestamp = to_epoch_ms(timestamp)
+            rows_per_table.setdefault(point["measurement"], []).append(
+                (point["tags"]["device"], timestamp, point["fields"])
+            )
+        conn = self.connection()
+        try:
+            with conn:
+                for table, rows in rows_per_table.items():
+                    fields = set()
+                    for row in rows:
+                        fields.update(row[2])
+                    self._ensure_table(conn, table, fields)
+                    columns = sorted(fields)
+                    statement = (
+                        f"INSERT OR REPLACE INTO {quote_identifier(table)} (device, ts"
+                        + "".join(f", {quote_identifier(column)}" for column in columns)
+                        + ") VALUES (?, ?"
+                        + ", ?" * len(columns)
+                        + ")"
+                    )
+                    conn.executemany(
+                        statement,
+                        (
+                            (device, timestamp, *(values.get(column) for column in columns))
+                            for device, timestamp, values in rows
+                        ),
+                    )
+        except sqlite3.OperationalError as err:
+            self._forget_columns(rows_per_table)
+            raise StorageConnectionError(err) from err
+        except sqlite3.Error as err:
+            self._forget_columns(rows_per_table)
+            raise StorageWriteError(err, invalid_data=True) from err
+
+    def _where(self, filters: dict) -> tuple:
+        if not filters:
+            return "", []
+        condition = "".join(f" AND {quote_identifier(key)} = ?" for key in filters)
+        return condition, list(filters.values())
+
+    def query_range(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        measurement: str,
+        device: str,
+        start: datetime,
+        end: datetime,
+        fields: list = None,
+        filters: dict = None,
+    ) -> Iterator[dict]:
+        """
+        Query the rows of a device between start and end (both exclusive) with the
+        primary key index.
+        :param measurement: Name of the measurement
+        :param device: Device name
+        :param start: Start of the range
+        :param end: End of the range
+        :param fields: Fields to return, all fields if None
+        :param filters: Field values the rows must match
+        :return: Rows with the key time and the requested fields
+        """
+        selected, cursor = self._select_range(measurement, device, start, end, fields, filters)
+        if cursor is None:
+            return iter(())
+        return (
+            {"time": row[0]} | dict(zip(selected, row[1:]))
+            for row in self._fetch(measurement, cursor)
+        )
+
+    def query_columns(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        measurement: str,
+        device: str,
+        start: datetime,
+        end: datetime,
+        fields: list,
+        filters: dict = None,
+    ) -> Iterator[dict]:
+        """
+        Query the rows of a device between start and end (both exclusive) as chunks of
+        columns, which are transposed directly from the row tuples of the cursor.
+        :param measurement: Name of the measurement
+        :param device: Device name
+        :param start: Start of the range
+        :param end: End of the range
+        :param fields: Fields to return
+        :param filters: Field values the rows must match
+        :return: Columns of up to QUERY_CHUNK_SIZE rows in time order
+        """
+        selected, cursor = self._select_range(measurement, device, start, end, fields, filters)
+        if cursor is None:
+            return
+        while True:
+            with self._query_errors(measurement):
+                rows = cursor.fetchmany(QUERY_CHUNK_SIZE)
+            if not rows:
+                return
+            yield values_to_columns(["time"] + selected, rows, fields)
+
+    def field_keys(self, measurement: str, device: str, start: datetime, end: datetime) -> list:
+        """
+        Names of the columns of the measurement table. The table holds all devices, so
+        the device and the range are not used.
+        :param measurement: Name of the measurement
+        :param device: Not used
+        :param start: Not used
+        :param end: Not used
+        :return: Sorted field names
+        """
+        with self._query_errors(measurement):
+            columns = self._table_columns(self.connection(), measurement)
+        return sorted(columns - set(RESERVED_COLUMNS))
+
+    def _select_range(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        measurement: str,
+        device: str,
+        start: datetime,
+        end: datetime,
+        fields: list,
+        filters: dict,
+    ) -> tuple:
+        conn = self.connection()
+        with self._query_errors(measurement):
+            columns = self._table_columns(conn, measurement)
+            if not columns:
+                return [], None
+            selected = [
+                column
+                for column in (fields if fields else sorted(columns - set(RESERVED_COLUMNS)))
+                if column in columns
+            ]
+            condition, values = self._where(filters)
+            cursor = conn.execute(
+                "SELECT ts" + "".join(f", {quote_identifier(column)}" for column in selected)
+                + f" FROM {quote_identifier(measurement)} WHERE device = ? AND ts > ? AND ts < ?"
+                + condition
+                + " ORDER BY ts",
+                [device, to_epoch_ms(start), to_epoch_ms(end)] + values,
+            )
+        return selected, cursor
+
+    def _fetch(self, table: str, cursor: sqlite3.Cursor) -> Iterator[tuple]:
+        """
+        Rows of a cursor, read in chunks with the storage errors.
+        :param table: Table of the statement
+        :param cursor: Cursor of the statement
+        :return: Row tuples
+        """
+        while True:
+            with self._query_errors(table):
+                rows = cursor.fetchmany(QUERY_CHUNK_SIZE)
+            if not rows:
+                return
+            yield from rows
+
+    def _aggregate_query(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        measurement: str,
+        device: str,
+        time_range: tuple,
+        field: str,
+        function: str,
+        filters: dict,
+        buckets: tuple = None,
+    ) -> tuple:
+        """
+        SQL statement of an aggregate query, grouped by time buckets if the length and
+        offset of the buckets are given.
+        :return: Statement and its parameters
+        """
+        if function not in AGGREGATE_FUNCTIONS:
+            raise ValueError(f"Aggregate function {function} is not supported.")
+        condition, values = self._where(filters)
+        column = quote_identifier(field)
+        select = aggregate_expression(function, column)
+        grouping = ""
+        if buckets is not None:
+            length_ms, offset_ms = buckets
+            select = f"ts - (ts - {offset_ms}) % {length_ms} AS bucket, " + select
+            grouping = f" AND {column} IS NOT NULL GROUP BY bucket ORDER BY bucket"
+        return (
+            f"SELECT {select} "
+            f"FROM {quote_identifier(measurement)} WHERE device = ? AND ts > ? AND ts < ?"
+            + condition
+            + grouping,
+            [device] + [to_epoch_ms(timestamp) for timestamp in time_range] + values,
+        )
+
+    def query_aggregate(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        measurement: str,
+        device: str,
+        start: datetime,
+        end: datetime,
+        field: str,
+        function: str,
+        filters: dict = None,
+    ):
+        """
+        Aggregate one field of a device between start and end (both exclusive) in SQLite.
+        :param measurement: Name of the measurement
+        :param device: Device name
+        :param start: Start of the range
+        :param end: End of the range
+        :param field: Aggregated field
+        :param function: Aggregate function, one of sum, count, max, min and mean
+        :param filters: Field values the rows must match
+        :return: Aggregated value or None if there are no rows
+        """
+        conn = self.connection()
+        with self._query_errors(measurement):
+            if field not in self._table_columns(conn, measurement):
+                return None
+            row = conn.execute(
+                *self._aggregate_query(measurement, device, (start, end), field, function, filters)
+            ).fetchone()
+        return row[0]
+
+    def query_group_aggregate(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        measurement: str,
+        devices: list,
+        start: datetime,
+        end: datetime,
+        field: str,
+        function: str,
+        filters: dict = None,
+    ) -> dict:
+        """
+        Aggregate one field of several devices between start and end (both exclusive)
+        with one statement grouped by device.
+        :param measurement: Name of the measurement
+        :param devices: Device names
+        :param start: Start of the range
+        :param end: End of the range
+        :param field: Aggregated field
+        :param function: Aggregate function, one of sum, count, max, min and mean
+        :param filters: Field values the rows must match
+        :return: Aggregated value per device, devices without rows are left out
+        """
+        if function not in AGGREGATE_FUNCTIONS:
+            raise ValueError(f"Aggregate function {function} is not supported.")
+        conn = self.connection()
+        with self._query_errors(measurement):
+            if not devices or field not in self._table_columns(conn, measurement):
+                return {}
+            condition, values = self._where(filters)
+            rows = conn.execute(
+                f"SELECT device, {aggregate_expression(function, quote_identifier(field))} "
+                f"FROM {quote_identifier(measurement)} "
+                f"WHERE device IN ({', '.join('?' for _ in devices)}) AND ts > ? AND ts < ?"
+                + condition
+                + " GROUP BY device",
+                list(devices) + [to_epoch_ms(start), to_epoch_ms(end)] + values,
+            ).fetchall()
+        return {device: value for device, value in rows if value is not None}
+
+    def query_buckets(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        measurement: str,
+        device: str,
+        start: datetime,
+        end: datetime,
+        field: str,
+        function: str,
+        interval: timedelta,
+        filters: dict = None,
+        origin: datetime = None,
+    ) -> list:
+        """
+        Aggregate one field of a device between start and end (both exclusive) per time
+        bucket in SQLite.
+        :param measurement: Name of the measurement
+        :param device: Device name
+        :param start: Start of the range
+        :param end: End of the range
+        :param field: Aggregated field
+        :param function: Aggregate function, one of sum, count, max, min and mean
+        :param interval: Length of the buckets
+        :param filters: Field values the rows must match
+        :param origin: Timestamp on a bucket boundary, None for buckets aligned to the epoch
+        :return: Rows with the bucket start as key time and the key value, sorted by time
+        """
+        conn = self.connection()
+        length_ms = interval_ms(interval)
+        with self._query_errors(measurement):
+            if field not in self._table_columns(conn, measurement):
+                return []
+            rows = conn.execute(
+                *self._aggregate_query(
+                    measurement,
+                    device,
+                    (start, end),
+                    field,
+                    function,
+                    filters,
+                    (length_ms, bucket_offset_ms(origin, length_ms)),
+                )
+            ).fetchall()
+        return [{"time": bucket, "value": value} for bucket, value in rows]
+
+    def delete_range(self, measurement: str, device: str, start: datetime, end: datetime) -> None:
+        """
+        Delete the rows of a device from start (inclusive) to end (exclusive).
+        :param measurement: Name of the measurement
+        :param device: Device name
+        :param start: Start of the range
+        :param end: End of the range
+        :return: None
+        """
+        conn = self.connection()
+        with self._query_errors(measurement):
+            if not self._table_columns(conn, measurement):
+                return
+            with conn:
+                conn.execute(
+                    f"DELETE FROM {quote_identifier(measurement)} "
+                    f"WHERE device = ? AND ts >= ? AND ts < ?",
+                    (device, to_epoch_ms(start), to_epoch_ms(end)),
+                )
+
+    def prune(self, before: datetime) -> int:
+        """
+        Delete all rows older than the given timestamp in all measurements.
+        :param before: Oldest timestamp which is kept
+        :return: Number of deleted rows
+        """
+        conn = self.connection()
+        deleted = 0
+        with self._query_errors():
+            tables = [
+                row[0]
+                for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+            ]
+            with conn:
+                for table in tables:
+                    deleted += conn.execute(
+                        f"DELETE FROM {quote_identifier(table)} WHERE ts < ?",
+                        (to_epoch_ms(before),),
+                    ).rowcount
+        return deleted
+
+
+def main() -> None:
+    """
+    Scheduling function for regular call.
+    :return: None
+    """
+
+
+if __name__ == "__main__":
+    main()
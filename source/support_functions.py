@@ -5,16 +5,58 @@ Collection of support function for main app with definition of classes and verif
 """
 from dataclasses import dataclass
 import os
-import influxdb.resultset
-from requests.exceptions import ConnectTimeout
-from influxdb import InfluxDBClient
-from influxdb.exceptions import InfluxDBClientError
+import threading
+from datetime import datetime, timedelta
+from typing import Callable
 
 from source.constants import (
     DEFAULT_THRESHOLD_ON_POWER_ON_COUNTER,
     DEFAULT_THRESHOLD_OFF_POWER_ON_COUNTER,
+    SCHEMA_LEGACY,
+    SCHEMA_SPLIT,
+    BACKEND_INFLUXDB,
+    BACKEND_INFLUXDB2,
+    BACKEND_SQLITE,
+    SQLITE_DATABASE_PATH,
+    ARCHIVE_DIR_PATH,
+    DEFAULT_UDP_PORT,
+    DEFAULT_UDP_MAX_DATAGRAM_SIZE,
 )
 from source import logging_helper as lh
+from source.storage import StorageBackend, StorageError
+from source.storage_influxdb import InfluxDBBackend, UdpLineSender
+from source.storage_influxdb2 import InfluxDB2Backend
+from source.storage_sqlite import SQLiteBackend
+from source.storage_archive import ArchiveBackend
+from source.query_planner import NestedWindowPlanner
+from source.query_cache import QueryCache, CachingBackend, check_query_cache_config
+from source.query_executor import QueryExecutor, check_query_executor_config
+from source import archive as ar
+from source.configuration import read_config_section
+
+database_config = {
+    "schema": SCHEMA_LEGACY,
+    "retention_days": None,
+    "udp": {
+        "active": False,
+        "port": DEFAULT_UDP_PORT,
+        "max_datagram_size": DEFAULT_UDP_MAX_DATAGRAM_SIZE,
+    },
+}
+REPORT_FILE_HEADER = [
+    "|               Period in UTC               |"
+    " consumption in KWh |         Costs          |  Error rate in %  |"
+    " Power on count |   P50 W |   P95 W |   P99 W |  Peak W |  Base W |\n",
+    "|-------------------------------------------|"
+    "--------------------|------------------------|-------------------|"
+    "----------------|---------|---------|---------|---------|---------|\n",
+]
+POWER_REPORT_KEYS = ("power_p50", "power_p95", "power_p99", "power_peak", "power_baseload")
+storage_backends = {
+    BACKEND_INFLUXDB: InfluxDBBackend,
+    BACKEND_INFLUXDB2: InfluxDB2Backend,
+    BACKEND_SQLITE: SQLiteBackend,
+}
 
 
 @dataclass
@@ -30,9 +72,24 @@ class DataApp:  # pylint: disable=too-many-instance-attributes
     ssl: bool = False
     verify_ssl: bool = False
     db_port: int = 0
+    gzip: bool = True
+    time_precision: str = os.getenv("DB_TIME_PRECISION", "ms")
+    db_backend: str = os.getenv("DB_BACKEND", BACKEND_INFLUXDB)
+    db_org: str = os.getenv("DB_ORG")
+    db_bucket: str = os.getenv("DB_BUCKET", db_name)
+    db_token: str = os.getenv("DB_TOKEN")
+    db_path: str = os.getenv("DB_PATH", SQLITE_DATABASE_PATH)
     verified: bool = True
     try:
-        if None in (db_ip_address, db_user_name, db_name):
+        if db_backend == BACKEND_INFLUXDB:
+            required_login_information = (db_ip_address, db_user_name, db_name)
+        elif db_backend == BACKEND_INFLUXDB2:
+            required_login_information = (db_ip_address, db_org, db_bucket, db_token)
+        elif db_backend == BACKEND_SQLITE:
+            required_login_information = (db_path,)
+        else:
+            raise ValueError(f"Environment variable DB_BACKEND {db_backend} is not supported.")
+        if None in required_login_information:
             raise ValueError(
                 "Not all needed env variable are defined. Please check the documentation and "
                 "add all necessary login information."
@@ -62,29 +119,171 @@ class DataApp:  # pylint: disable=too-many-instance-attributes
             verify_ssl = False
         else:
             raise ValueError("Environment variable VERIFY_SSL is not True or False.")
+        gzip = os.getenv("DB_GZIP", "True")
+        if gzip in ("True", "true"):
+            gzip = True
+        elif gzip in ("False", "false"):
+            gzip = False
+        else:
+            raise ValueError("Environment variable DB_GZIP is not True or False.")
+        if time_precision not in ("s", "ms"):
+            raise ValueError("Environment variable DB_TIME_PRECISION is not s or ms.")
     except ValueError as err:
         verified = False
         lh.write_log(lh.LoggingLevel.ERROR.value, err)
 
 
-class InfluxDBConnection(InfluxDBClient):
+def check_database_config() -> None:
+    """
+    Read the database section of the configuration file. If a setting is missing or
+    not valid, the default value is kept.
+    :return: None
+    """
+    database_settings = read_config_section("database")
+    schema = database_settings.get("schema", SCHEMA_LEGACY)
+    if schema in (SCHEMA_LEGACY, SCHEMA_SPLIT):
+        database_config["schema"] = schema
+    else:
+        message = (
+            f"The database schema {schema} is not supported. The default schema "
+            f"{SCHEMA_LEGACY} is used."
+        )
+        lh.write_log(lh.LoggingLevel.WARNING.value, message)
+    retention_days = database_settings.get("retention_days")
+    if retention_days is not None:
+        if isinstance(retention_days, int) and retention_days > 0:
+            database_config["retention_days"] = retention_days
+        else:
+            message = (
+                f"The retention of {retention_days} days is not a positive number. "
+                f"The data is kept without limit."
+            )
+            lh.write_log(lh.LoggingLevel.WARNING.value, message)
+    check_udp_config(database_settings.get("udp", {}))
+
+
+def check_udp_config(udp_settings: dict) -> None:
     """
-    InfluxDB's connection class for handling in context manager
+    Check the settings of the UDP write mode in the database section.
+    :param udp_settings: Settings of the UDP write mode
+    :return: None
     """
+    if isinstance(udp_settings.get("active"), bool):
+        database_config["udp"]["active"] = udp_settings["active"]
+    for key, maximum in (("port", 65535), ("max_datagram_size", 65507)):
+        value = udp_settings.get(key)
+        if value is None:
+            continue
+        if isinstance(value, int) and not isinstance(value, bool) and 0 < value <= maximum:
+            database_config["udp"][key] = value
+        else:
+            message = (
+                f"The UDP setting {key} must be a number between 1 and {maximum}. The "
+                f"default value {database_config['udp'][key]} is used."
+            )
+            lh.write_log(lh.LoggingLevel.WARNING.value, message)
+
 
-    def __init__(self):
-        self.login_information = login_information
-        super().__init__(
-            host=login_information.db_ip_address,
-            port=login_information.db_port,
-            username=login_information.db_user_name,
-            password=login_information.db_user_password,
-            ssl=login_information.ssl,
-            verify_ssl=login_information.verify_ssl,
+def get_storage_backend() -> StorageBackend:
+    """
+    Storage backend which was selected with the environment variable DB_BACKEND. The
+    backend is created with the first call. If the archive is active, the backend also
+    reads the archived census data. The UDP write mode is set up for InfluxDB 1.x.
+    :return: Storage backend
+    """
+    if storage["backend"] is None:
+        backend = storage_backends[login_information.db_backend](
+            login_information, database_config["schema"]
         )
+        if database_config["udp"]["active"]:
+            if isinstance(backend, InfluxDBBackend):
+                backend.udp_sender = UdpLineSender(
+                    login_information.db_ip_address,
+                    database_config["udp"]["port"],
+                    database_config["udp"]["max_datagram_size"],
+                )
+            else:
+                message = "The UDP write mode is only available for InfluxDB 1.x."
+                lh.write_log(lh.LoggingLevel.WARNING.value, message)
+        if ar.check_archive_config().active:
+            backend = ArchiveBackend(backend, ar.RawSampleArchive(ARCHIVE_DIR_PATH))
+        storage["backend"] = backend
+        cache_config = check_query_cache_config()
+        if cache_config.active:
+            storage["query_cache"] = QueryCache(cache_config)
+    return storage["backend"]
+
+
+def get_database_backend() -> StorageBackend:
+    """
+    Backend of the configured database without the archive, for the tools which need a
+    specific database like the migration of the census measurement.
+    :return: Storage backend
+    """
+    backend = get_storage_backend()
+    return backend.inner if isinstance(backend, ArchiveBackend) else backend
+
+
+def get_query_backend() -> StorageBackend:
+    """
+    Storage backend for the aggregate queries of the energy monitoring and the Telegram
+    requests. If the query cache is active, identical queries are answered from it.
+    :return: Storage backend
+    """
+    backend = get_storage_backend()
+    if storage["query_cache"] is None:
+        return backend
+    return CachingBackend(backend, storage["query_cache"])
+
+
+def get_query_executor() -> QueryExecutor:
+    """
+    Executor of the queries, created with the first call.
+    :return: Query executor
+    """
+    if storage["query_executor"] is None:
+        storage["query_executor"] = QueryExecutor(check_query_executor_config())
+    return storage["query_executor"]
+
+
+def run_query(caller: str, query: Callable[[threading.Event], object], timeout_s: int = None):
+    """
+    Run a query on the query executor, see QueryExecutor.run().
+    :param caller: Name of the caller in the statistics
+    :param query: Function which runs the query, it gets the cancellation event
+    :param timeout_s: Deadline in seconds, the configured timeout if None
+    :return: Result of the query
+    """
+    return get_query_executor().run(caller, query, timeout_s)
+
+
+def write_points(points: list, time_precision: str = None) -> None:
+    """
+    Write the points to the storage backend.
+    :param points: Points in the format of the device handlers
+    :param time_precision: Precision of the written timestamps, default from login information
+    :return: None
+    """
+    get_storage_backend().write_points(points, time_precision)
 
-    def __enter__(self):
-        return self
+
+def prune_storage() -> None:
+    """
+    Delete the data which is older than the configured retention from the storage.
+    :return: None
+    """
+    before = datetime.utcnow() - timedelta(days=database_config["retention_days"])
+    try:
+        deleted = get_storage_backend().prune(before)
+    except StorageError as err:
+        message = f"Old data could not be deleted from the database: {err}"
+        lh.write_log(lh.LoggingLevel.ERROR.value, message)
+        return
+    if storage["query_cache"] is not None:
+        storage["query_cache"].clear()
+    if deleted:
+        message = f"{deleted} rows older than {before:%Y-%m-%d %H:%M} were deleted."
+        lh.write_log(lh.LoggingLevel.INFO.value, message)
 
 
 def check_and_verify_db_connection() -> None:
@@ -95,17 +294,9 @@ def check_and_verify_db_connection() -> None:
     if login_information.verified is False:
         return
     try:
-        with InfluxDBConnection() as connection:
-            connection.ping()
-            if not any(
-                True
-                for db in connection.get_list_database()
-                if db["name"] == login_information.db_name
-            ):
-                connection.create_database(login_information.db_name)
-            connection.switch_database(login_information.db_name)
-            login_information.verified = True
-    except (InfluxDBClientError, ConnectTimeout, ConnectionError) as err:
+        get_storage_backend().verify()
+        login_information.verified = True
+    except StorageError as err:
         print(
             f"Error occurred during setting the database with error message: {err}. All login"
             f"information correct? Like database address, user name and so on? "
@@ -118,28 +309,21 @@ def check_and_verify_db_connection() -> None:
         lh.write_log(lh.LoggingLevel.ERROR.value, error_message)
 
 
-def write_device_information(file_name: str, data: dict) -> None:
+def device_information_path(file_name: str) -> str:
     """
-    Write all the requested information to external file.
-    :param file_name: Filename under which it should be saved
-    :param data: information for logging
-    :return:
-    """
-    if not os.path.exists(os.path.join("..", "files", file_name + ".txt")):
-        with open(
-            os.path.join("..", "files", file_name + ".txt"), "a", encoding="utf-8"
-        ) as file:
-            file.write(
-                "|               Period in UTC               |"
-                " consumption in KWh |         Costs          |  Error rate in %  |"
-                " Power on count |\n"
-            )
-            file.write(
-                "|-------------------------------------------|"
-                "--------------------|------------------------|-------------------|"
-                "----------------|\n"
-            )
+    Path of a report file.
+    :param file_name: Filename without extension
+    :return: Path
+    """
+    return os.path.join("..", "files", file_name + ".txt")
+
 
+def format_report_line(data: dict) -> str:
+    """
+    Line of a report in a report file.
+    :param data: Report with the keys of calculations.CALCULATION_DATA_KEYS
+    :return: Line with line break
+    """
     date = f"{data['start_date']} - {data['end_date']}"
 
     if isinstance(data["total_cost"], float):
@@ -159,28 +343,81 @@ def write_device_information(file_name: str, data: dict) -> None:
     else:
         checked_error_rate_one = data["error_rate_one"]
         checked_error_rate_two = data["error_rate_two"]
-    with open(
-        os.path.join("..", "files", file_name + ".txt"), "a", encoding="utf-8"
-    ) as file:
-        file.write(
-            f"| {date:>41} | {data['sum_of_energy']:>18} |"
-            f"{checked_total_cost:>10} ({checked_cost_kwh:>5}€/KWh) |{checked_error_rate_one:>8} |"
-            f"{checked_error_rate_two:>8} | {data['power_on']:>14} |\n"
-        )
+    power = "".join(
+        f" {round(value, 1) if isinstance(value, float) else value:>7} |"
+        for value in (data.get(key, "Not req") for key in POWER_REPORT_KEYS)
+    )
+    return (
+        f"| {date:>41} | {data['sum_of_energy']:>18} |"
+        f"{checked_total_cost:>10} ({checked_cost_kwh:>5}€/KWh) |{checked_error_rate_one:>8} |"
+        f"{checked_error_rate_two:>8} | {data['power_on']:>14} |{power}\n"
+    )
+
+
+def write_device_information(file_name: str, reports: list) -> None:
+    """
+    Write the report file of a device and period as a view of its stored reports, see
+    report_store.py. The file is replaced atomically, so a report is either complete or
+    missing if the app stops meanwhile.
+    :param file_name: Filename under which it should be saved
+    :param reports: Reports of the period in the order of their start
+    :return: None
+    """
+    path = device_information_path(file_name)
+    with open(path + ".tmp", "w", encoding="utf-8") as file:
+        file.writelines(REPORT_FILE_HEADER)
+        file.writelines(format_report_line(data) for data in reports)
+    os.replace(path + ".tmp", path)
 
 
-def fetch_measurements(bind_params: dict) -> influxdb.resultset.ResultSet:
+def fetch_energy_sum(device: str, start: datetime, end: datetime) -> float:
     """
-    Fetch measurements with transferred query parameters.
-    :param bind_params: Parameters for query
-    :return: All measurements which are matched tp parameters as a ResultSet
+    Sum the energy of the valid measurements of a device on the database side.
+    :param device: Device name
+    :param start: Start of the period in UTC
+    :param end: End of the period in UTC
+    :return: Energy in Wh
     """
-    with InfluxDBConnection() as conn:
-        query = (
-            f'SELECT * FROM {conn.login_information.db_name}."autogen"."census" '
-            f"WHERE device=$device AND time > $target_date AND time < $current_date"
-        )
-        return conn.query(query, bind_params=bind_params)
+    return run_query("energy_sum", lambda _: get_query_backend().sum_samples(device, start, end))
+
+
+def fetch_energy_sums(devices: list, start: datetime, end: datetime) -> dict:
+    """
+    Sum the energy of the valid measurements of several devices with one query grouped
+    by device.
+    :param devices: Device names
+    :param start: Start of the period in UTC
+    :param end: End of the period in UTC
+    :return: Energy in Wh per device
+    """
+    return run_query(
+        "energy_monitoring",
+        lambda _: get_query_backend().sum_samples_by_device(devices, start, end),
+    )
+
+
+def create_window_planner(device: str, end: datetime, starts: list) -> NestedWindowPlanner:
+    """
+    Planner for aggregates of a device over nested windows which end at the same time.
+    :param device: Device name
+    :param end: Common end of the windows in UTC
+    :param starts: Starts of the windows in UTC
+    :return: Planner on the selected storage backend
+    """
+    return NestedWindowPlanner(get_query_backend(), device, end, starts)
+
+
+def fetch_failure_count(device: str, start: datetime, end: datetime) -> int:
+    """
+    Count the failed polls of a device.
+    :param device: Device name
+    :param start: Start of the period in UTC
+    :param end: End of the period in UTC
+    :return: Number of failed polls
+    """
+    return run_query(
+        "failure_count", lambda _: get_query_backend().count_failures(device, start, end)
+    )
 
 
 def validation_power_on_parameter(settings: dict, calc_requested: dict) -> None:
@@ -211,6 +448,7 @@ def validation_power_on_parameter(settings: dict, calc_requested: dict) -> None:
 
 
 login_information = DataApp()
+storage = {"backend": None, "query_cache": None, "query_executor": None}
 
 
 def main() -> None:
@@ -11,6 +11,7 @@ from collections import namedtuple
 import requests
 from source import logging_helper as lh
 from source import communication as com
+from source import report_store
 from source.switch import get_switch_information_for_user, toggle_switch, handle_switch_information
 from source.constants import (
     CONFIGURATION_FILE_PATH,
@@ -191,6 +192,10 @@ def handle_message_input(message: Message) -> None:
             com.shared_information["observed_devices"]
         )
         send_inline_keyboard_for_set_alarm(cleaned_message, copy_observed_devices)
+    elif cleaned_message == "reports":
+        send_message(
+            report_store.latest_reports_message(com.shared_information["started_devices"])
+        )
     elif cleaned_message == "switchstatus":
         handle_switch_information(com.shared_information["switchable_devices"])
         send_message(get_switch_information_for_user())
@@ -547,6 +552,7 @@ def set_commands() -> None:
             "command": "/energydevice",
             "description": "Get energy of device from last period",
         },
+        {"command": "/reports", "description": "Get the latest reports of all devices"},
         {"command": "/switchstatus", "description": "Show the switch status of devices"},
         {"command": "/switchoff", "description": "Turn off a device"},
         {"command": "/switchon", "description": "Turn on a device"},
@@ -0,0 +1,114 @@
+"""
+Tests for aggregation.py
+"""
+from datetime import datetime, timedelta
+
+import pytest
+from source.aggregation import (
+    AggregationConfig,
+    WindowAggregator,
+    check_aggregation_config,
+    window_start,
+)
+from source.ingest import create_pipeline
+
+START = datetime(2023, 5, 1, 12, 0, 0)
+
+
+def create_plug_point(second: int, power: float, temperature: float) -> dict:
+    """
+    Create a valid Plug S census point
+    :return: Point
+    """
+    fields = {
+        "power": power,
+        "is_valid": True,
+        "device_temperature": temperature,
+        "fetch_success": True,
+        "energy_wh": power * 10 / 3600,
+    }
+    timestamp = START + timedelta(seconds=second)
+    return {"measurement": "census", "tags": {"device": "Kuehlschrank"}, "time": timestamp,
+            "fields": fields}
+
+
+def test_window_start():
+    """
+    Windows are aligned to the full minute or hour.
+    """
+    assert window_start(datetime(2023, 5, 1, 12, 3, 59, 999), 60) == datetime(
+        2023, 5, 1, 12, 3
+    )
+    assert window_start(datetime(2023, 5, 1, 12, 59, 1), 3600) == datetime(2023, 5, 1, 12)
+
+
+def test_window_statistics():
+    """
+    One point per window with energy sum, mean, minimum and maximum.
+    """
+    aggregator = WindowAggregator(AggregationConfig(window_s=60))
+    written = []
+    for index, power in enumerate([100.0, 300.0, 200.0, 50.0, 60.0]):
+        written += aggregator.process([create_plug_point(index * 20, power, 30.0 + index)])
+    assert len(written) == 1
+    fields = written[0]["fields"]
+    assert written[0]["time"] == START
+    assert fields["sample_count"] == 3
+    assert fields["power"] == pytest.approx(200.0)
+    assert fields["power_min"] == 100.0
+    assert fields["power_max"] == 300.0
+    assert fields["device_temperature_max"] == 32.0
+    assert fields["energy_wh"] == pytest.approx(600.0 * 10 / 3600)
+    assert fields["is_valid"] is True
+    written = aggregator.flush()
+    assert written[0]["time"] == START + timedelta(minutes=1)
+    assert written[0]["fields"]["sample_count"] == 2
+
+
+def test_failed_poll_passes_and_closes_window():
+    """
+    A failed poll is written unchanged and closes the window once it has ended.
+    """
+    aggregator = WindowAggregator(AggregationConfig(window_s=60))
+    failure = {
+        "measurement": "census",
+        "tags": {"device": "Kuehlschrank"},
+        "time": START + timedelta(seconds=30),
+        "fields": {"fetch_success": False},
+    }
+    assert not aggregator.process([create_plug_point(0, 10.0, 20.0)])
+    assert aggregator.process([failure]) == [failure]
+    written = aggregator.process([failure | {"time": START + timedelta(seconds=70)}])
+    assert [point["fields"]["fetch_success"] for point in written] == [True, False]
+    assert written[0]["fields"]["sample_count"] == 1
+
+
+def test_pipeline_with_aggregation_and_compression():
+    """
+    The aggregated points pass the compression and keep their sample count.
+    """
+    pipeline = create_pipeline(
+        "Kuehlschrank",
+        {
+            "aggregation": {"active": True, "window_s": 60},
+            "compression": {"active": True, "absolute": 5.0, "heartbeat_s": 3600},
+        },
+    )
+    written = []
+    for second in range(0, 600, 10):
+        written += pipeline.process([create_plug_point(second, 100.0, 25.0)])
+    written += pipeline.stages[1].flush()
+    assert sum(point["fields"]["sample_count"] for point in written) == 54
+    assert len(written) == 2
+    assert pipeline.reduction() > 90
+
+
+def test_check_aggregation_config():
+    """
+    The pre-aggregation is only active with the flag, invalid values keep the defaults.
+    """
+    assert check_aggregation_config("Kuehlschrank", {"aggregation": {}}) is None
+    config = check_aggregation_config(
+        "Kuehlschrank", {"aggregation": {"active": True, "window_s": 0, "fields": "power"}}
+    )
+    assert config == AggregationConfig()
@@ -0,0 +1,231 @@
+"""
+Tests for gorilla.py, archive.py and storage_archive.py
+"""
+import math
+import random
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from source import gorilla
+from source.archive import (
+    ArchiveConfig,
+    ArchiveFile,
+    RawSampleArchive,
+    encode_day,
+    export_device,
+    first_of_next_month,
+)
+from source.storage_archive import ArchiveBackend
+from source.storage_sqlite import SQLiteBackend
+from source.constants import SCHEMA_LEGACY
+
+DAY = datetime(2023, 5, 1)
+DAY_MS = int((DAY - datetime(1970, 1, 1)).total_seconds()) * 1000
+
+
+def test_gorilla_round_trip():
+    """
+    Timestamps and floats are restored exactly, including irregular intervals, NaN and
+    extreme values.
+    """
+    generator = random.Random(4)
+    for _ in range(50):
+        count = generator.randint(0, 200)
+        timestamp = generator.randint(0, 2**45)
+        timestamps = []
+        for _ in range(count):
+            timestamp += generator.choice(
+                [10_000, 10_000, 10_001, 9_936, 10_255, 0, generator.randint(0, 10**10)]
+            )
+            timestamps.append(timestamp)
+        values = [
+            generator.choice(
+                [0.0, 1.0, 230.1, math.nan, -generator.random(), 1e300, 5e-324,
+                 round(generator.random() * 100, 1)]
+            )
+            for _ in range(count)
+        ]
+        assert gorilla.decode_timestamps(gorilla.encode_timestamps(timestamps), count) == (
+            timestamps
+        )
+        decoded = gorilla.decode_floats(gorilla.encode_floats(values), count)
+        assert [repr(value) for value in decoded] == [repr(value) for value in values]
+
+
+def test_gorilla_compression():
+    """
+    A constant interval costs one bit per timestamp and a repeated value one bit.
+    """
+    timestamps = [DAY_MS + 10_000 * index for index in range(8640)]
+    assert len(gorilla.encode_timestamps(timestamps)) < 8 + 8640 // 8 + 10
+    assert len(gorilla.encode_floats([230.1] * 8640)) < 8 + 8640 // 8 + 10
+
+
+def create_rows(count: int) -> list:
+    """
+    Rows of a plug with one failed poll in the legacy schema
+    :return: Rows
+    """
+    rows = []
+    for index in range(count):
+        row = {
+            "time": DAY_MS + 10_000 * index,
+            "power": 12.5 + index,
+            "energy_wh": 0.03,
+            "temperature": 24,
+            "fetch_success": True,
+        }
+        if index == 1:
+            row = {"time": row["time"], "fetch_success": False, "device": "plug"}
+        rows.append(row)
+    return rows
+
+
+def test_archive_file(tmp_path):
+    """
+    An archive file restores the field types, missing values and filters.
+    """
+    path = tmp_path / "day.gorilla"
+    path.write_bytes(encode_day("plug", DAY, create_rows(4)))
+    with ArchiveFile(str(path)) as archive_file:
+        assert archive_file.header["count"] == 4
+        assert sorted(archive_file.header["columns"]) == [
+            "energy_wh", "fetch_success", "power", "temperature"
+        ]
+        rows = list(archive_file.rows(DAY_MS, DAY_MS + 40_000))
+        assert rows[0] == {
+            "time": DAY_MS + 10_000,
+            "energy_wh": None,
+            "fetch_success": False,
+            "power": None,
+            "temperature": None,
+        }
+        assert rows[1]["temperature"] == 24 and isinstance(rows[1]["temperature"], int)
+        filtered = list(
+            archive_file.rows(0, DAY_MS + 40_000, ["power"], {"fetch_success": True})
+        )
+        assert filtered == [
+            {"time": DAY_MS, "power": 12.5},
+            {"time": DAY_MS + 20_000, "power": 14.5},
+            {"time": DAY_MS + 30_000, "power": 15.5},
+        ]
+    (tmp_path / "other").write_bytes(b"not an archive")
+    with pytest.raises(ValueError):
+        with ArchiveFile(str(tmp_path / "other")):
+            pass
+
+
+def test_first_of_next_month():
+    """
+    Pure test for function first_of_next_month()
+    """
+    assert first_of_next_month(datetime(2023, 5, 17)) == datetime(2023, 6, 1)
+    assert first_of_next_month(datetime(2023, 12, 1)) == datetime(2024, 1, 1)
+
+
+def test_export_and_transparent_reads(tmp_path):
+    """
+    Exported days are removed from the database and all queries return the same result
+    through the archive backend as before the export.
+    """
+    database = SQLiteBackend(SimpleNamespace(db_path=str(tmp_path / "db.sqlite")), SCHEMA_LEGACY)
+    points = []
+    for index in range(3 * 8640):
+        points.append(
+            {
+                "measurement": "census",
+                "tags": {"device": "plug"},
+                "time": DAY + timedelta(seconds=10 * index),
+                "fields": {
+                    "power": float(index % 97),
+                    "energy_wh": (index % 97) / 360,
+                    "fetch_success": index % 1000 != 5,
+                },
+            }
+        )
+    database.write_points(points)
+    backend = ArchiveBackend(database, RawSampleArchive(str(tmp_path / "archive")))
+    periods = [
+        (DAY - timedelta(days=1), DAY + timedelta(days=4)),
+        (DAY + timedelta(hours=12), DAY + timedelta(days=2, hours=3)),
+        (DAY + timedelta(days=1, seconds=-10), DAY + timedelta(days=1, seconds=10)),
+    ]
+
+    def snapshot() -> list:
+        results = []
+        for start, end in periods:
+            results.append(list(backend.query_samples("plug", start, end, ["energy_wh"])))
+            results.append(backend.count_failures("plug", start, end))
+            totals = backend.sum_samples_by_device(["plug", "other"], start, end)
+            results.append((round(totals["plug"], 9), totals["other"]))
+            for function in ("sum", "max", "min", "mean"):
+                value = backend.query_aggregate("census", "plug", start, end, "power", function)
+                results.append(round(value, 9))
+                buckets = backend.query_buckets(
+                    "census", "plug", start, end, "power", function, timedelta(hours=5)
+                )
+                results.append([(row["time"], round(row["value"], 9)) for row in buckets])
+        return results
+
+    before = snapshot()
+    config = ArchiveConfig(active=True, days_per_run=1, first_day="2023-03-15")
+    assert export_device(database, backend.archive, "plug", DAY + timedelta(days=2), config) == 1
+    assert backend.archive.exported_until("plug") == DAY + timedelta(days=1)
+    assert export_device(database, backend.archive, "plug", DAY + timedelta(days=2), config) == 1
+    assert export_device(database, backend.archive, "plug", DAY + timedelta(days=2), config) == 0
+    assert backend.archive.exported_until("plug") == DAY + timedelta(days=2)
+    remaining = list(database.query_range("census", "plug", DAY - timedelta(days=1),
+                                          DAY + timedelta(days=4)))
+    assert len(remaining) == 8640
+    assert snapshot() == before
+
+
+def test_interrupted_export(tmp_path, monkeypatch):
+    """
+    The boundary moves before a day is deleted from the database, rows which were left
+    by an interrupted export are deleted by the next run.
+    """
+    database = SQLiteBackend(SimpleNamespace(db_path=str(tmp_path / "db.sqlite")), SCHEMA_LEGACY)
+    database.write_points(
+        [
+            {
+                "measurement": "census",
+                "tags": {"device": "plug"},
+                "time": DAY + timedelta(hours=hour),
+                "fields": {"power": 1.0, "fetch_success": True},
+            }
+            for hour in range(48)
+        ]
+    )
+    backend = ArchiveBackend(database, RawSampleArchive(str(tmp_path / "archive")))
+    config = ArchiveConfig(active=True, days_per_run=1, first_day="2023-05-01")
+    end = DAY + timedelta(days=2)
+    counts = []
+    delete_range = database.delete_range
+
+    def interrupted_delete_range(*args):
+        delete_range(*args)
+        counts.append(backend.query_aggregate("census", "plug", DAY, end, "power", "count"))
+        raise OSError("interrupted")
+
+    monkeypatch.setattr(database, "delete_range", interrupted_delete_range)
+    with pytest.raises(OSError):
+        export_device(database, backend.archive, "plug", end, config)
+    assert counts == [47]
+    assert backend.archive.exported_until("plug") == DAY + timedelta(days=1)
+    monkeypatch.undo()
+    database.write_points(
+        [
+            {
+                "measurement": "census",
+                "tags": {"device": "plug"},
+                "time": DAY + timedelta(hours=12),
+                "fields": {"power": 1.0, "fetch_success": True},
+            }
+        ]
+    )
+    assert export_device(database, backend.archive, "plug", end, config) == 1
+    assert not list(database.query_range("census", "plug", DAY - timedelta(days=1), end))
+    assert backend.query_aggregate("census", "plug", DAY, end, "power", "count") == 47
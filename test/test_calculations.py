@@ -2,7 +2,9 @@
 Tests for cost_calculation.py
 """
 import json
-from datetime import datetime
+import random
+from datetime import datetime, timedelta
+from types import SimpleNamespace
 import unittest
 from unittest.mock import patch, mock_open
 
@@ -16,8 +18,18 @@ from source.calculations import (
     check_cost_calc_request_time,
     config_request_time,
     check_cost_config,
+    stream_period_aggregates,
 )
-from source.constants import CONFIGURATION_FILE_PATH
+from source.constants import (
+    CONFIGURATION_FILE_PATH,
+    CENSUS_MEASUREMENT,
+    HEALTH_MEASUREMENT,
+    SCHEMA_LEGACY,
+    SCHEMA_SPLIT,
+)
+from source.query_planner import NestedWindowPlanner
+from source.rollup import count_power_on
+from source.storage_sqlite import SQLiteBackend
 
 
 @pytest.mark.parametrize(
@@ -204,3 +216,49 @@ class TestCheckCostConfig(unittest.TestCase):
         with patch("builtins.open", mock_open(read_data=mock_file_contents)):
             result = check_cost_config()
             self.assertEqual(result, 0.3)
+
+
+@pytest.mark.parametrize("schema", [SCHEMA_LEGACY, SCHEMA_SPLIT])
+def test_stream_period_aggregates(tmp_path, schema):
+    """
+    The streaming pass yields the same aggregates as the database and the power on
+    counts of the power values of each period.
+    """
+    backend = SQLiteBackend(SimpleNamespace(db_path=str(tmp_path / "db.sqlite")), schema)
+    rng = random.Random(7)
+    end = datetime(2023, 5, 3, 12)
+    points = []
+    for index in range(4000):
+        timestamp = end - timedelta(seconds=60 * index + 30)
+        power = rng.choice([0.0, 5.0, 60.0, 120.0])
+        success = rng.random() > 0.1
+        fields = {"fetch_success": success}
+        if success:
+            fields |= {"power": power, "energy_wh": power / 60, "sample_count": 1 + index % 3}
+        measurement = CENSUS_MEASUREMENT
+        if schema == SCHEMA_SPLIT and not success:
+            measurement, fields = HEALTH_MEASUREMENT, {"success": False}
+        points.append(
+            {
+                "measurement": measurement,
+                "tags": {"device": "plug"},
+                "time": timestamp,
+                "fields": fields,
+            }
+        )
+    backend.write_points(points)
+    starts = [end - timedelta(hours=5), end - timedelta(days=1), end - timedelta(days=3)]
+    accumulator = stream_period_aggregates(backend, "plug", end, starts, (50, 10))
+    planner = NestedWindowPlanner(backend, "plug", end, starts)
+    assert accumulator.statistics == [
+        pytest.approx(statistics) for statistics in planner.sample_statistics()
+    ]
+    assert accumulator.failure_counts == planner.failure_counts()
+    assert accumulator.power_on == [
+        count_power_on(
+            [row["power"] for row in backend.query_samples("plug", start, end, ["power"])],
+            50,
+            10,
+        )
+        for start in starts
+    ]
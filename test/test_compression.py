@@ -0,0 +1,202 @@
+"""
+Tests for compression.py and ingest.py
+"""
+import random
+from datetime import datetime, timedelta
+
+import pytest
+from source.compression import (
+    CompressionConfig,
+    SampleCompressor,
+    check_compression_config,
+)
+from source.calculations import cost_calc
+from source.ingest import DevicePipeline, create_pipeline
+from source import ingest
+
+START = datetime(2023, 5, 1, 12, 0, 0)
+
+
+def create_point(second: int, power: float, energy: float = 1.0) -> dict:
+    """
+    Create a valid census point for the compression tests
+    :return: Point
+    """
+    return {
+        "measurement": "census",
+        "tags": {"device": "Kuehlschrank"},
+        "time": START + timedelta(seconds=second),
+        "fields": {"power": power, "energy_wh": energy, "fetch_success": True},
+    }
+
+
+def compress_all(compressor: SampleCompressor, points: list) -> list:
+    """
+    Run all points through the compressor and flush at the end
+    :return: Written points
+    """
+    written = []
+    for point in points:
+        written += compressor.process([point])
+    return written + compressor.flush()
+
+
+def test_deadband_suppresses_and_sends_heartbeat():
+    """
+    Samples within the deadband are held back until a change or the heartbeat.
+    """
+    compressor = SampleCompressor(CompressionConfig(absolute=2.0, heartbeat_s=30))
+    points = [create_point(second, 100.0 + second % 2) for second in range(0, 40, 5)]
+    points.append(create_point(40, 150.0))
+    written = compress_all(compressor, points)
+    assert [point["time"] for point in written] == [
+        START,
+        START + timedelta(seconds=30),
+        START + timedelta(seconds=40),
+    ]
+    assert [point["fields"]["sample_count"] for point in written] == [1, 6, 2]
+
+
+@pytest.mark.parametrize("mode", ["deadband", "swinging_door"])
+def test_energy_and_sample_count_are_preserved(mode):
+    """
+    The energy of suppressed samples is carried by the next written point.
+    """
+    compressor = SampleCompressor(CompressionConfig(mode=mode, absolute=5.0))
+    points = [create_point(second, 50.0, energy=0.25) for second in range(100)]
+    written = compress_all(compressor, points)
+    assert len(written) < 10
+    assert sum(point["fields"]["energy_wh"] for point in written) == pytest.approx(25.0)
+    assert sum(point["fields"]["sample_count"] for point in written) == 100
+
+
+def test_failed_poll_flushes_pending_sample():
+    """
+    A failed poll writes the pending sample and passes unchanged, also with the split
+    schema where only the health record is left.
+    """
+    compressor = SampleCompressor(CompressionConfig(absolute=5.0))
+    failure = {
+        "measurement": "census",
+        "tags": {"device": "Kuehlschrank"},
+        "time": START + timedelta(seconds=3),
+        "fields": {"power": 0.0, "energy_wh": 0.0, "fetch_success": False},
+    }
+    health_failure = {
+        "measurement": "poll_health",
+        "tags": {"device": "Kuehlschrank"},
+        "time": START + timedelta(seconds=6),
+        "fields": {"success": False, "latency_ms": 5000, "error_type": "timeout"},
+    }
+    assert len(compressor.process([create_point(0, 10.0)])) == 1
+    assert compressor.process([create_point(1, 10.0)]) == []
+    assert compressor.process([failure]) == [
+        create_point(1, 10.0) | {
+            "fields": create_point(1, 10.0)["fields"] | {"sample_count": 1}
+        },
+        failure,
+    ]
+    assert len(compressor.process([create_point(4, 10.0)])) == 1
+    assert compressor.process([create_point(5, 10.0)]) == []
+    written = compressor.process([health_failure])
+    assert [point["measurement"] for point in written] == ["census", "poll_health"]
+
+
+@pytest.mark.parametrize("mode", ["deadband", "swinging_door"])
+def test_reconstruction_within_tolerance(mode):
+    """
+    Every suppressed sample can be reconstructed from the written points within the
+    tolerance, by holding the value or by linear interpolation.
+    """
+    rng = random.Random(4711)
+    config = CompressionConfig(mode=mode, absolute=3.0, relative=0.02, heartbeat_s=120)
+    power = 100.0
+    points = []
+    for second in range(3000):
+        power = max(0.0, power + rng.gauss(0, 2) + (300 if rng.random() < 0.005 else 0))
+        if rng.random() < 0.005:
+            power = 5.0
+        points.append(create_point(second, round(power, 1)))
+    written = compress_all(SampleCompressor(config), points)
+    assert len(written) < len(points) / 3
+    compressor = SampleCompressor(config)
+    segment = 0
+    for point in points:
+        while (
+            segment + 1 < len(written) - 1 and written[segment + 1]["time"] <= point["time"]
+        ):
+            segment += 1
+        left, right = written[segment], written[segment + 1]
+        reference = left["fields"]["power"]
+        if mode == "deadband" or point["time"] == left["time"]:
+            value = reference
+        else:
+            share = (point["time"] - left["time"]) / (right["time"] - left["time"])
+            value = reference + share * (right["fields"]["power"] - reference)
+        if point["time"] not in (left["time"], right["time"]):
+            assert abs(value - point["fields"]["power"]) <= compressor.tolerance(
+                reference
+            ) + 1e-9
+
+
+def test_check_compression_config():
+    """
+    The compression is only active with the flag, invalid values keep the defaults.
+    """
+    assert check_compression_config("Kuehlschrank", {}) is None
+    config = check_compression_config(
+        "Kuehlschrank",
+        {
+            "compression": {
+                "active": True,
+                "mode": "unknown",
+                "absolute": 2,
+                "relative": -1,
+                "fields": ["power", "power_a"],
+            }
+        },
+    )
+    assert config == CompressionConfig(absolute=2, fields=["power", "power_a"])
+
+
+def test_pipeline_listeners_and_statistics(monkeypatch):
+    """
+    The listeners receive every raw sample, the statistics count the reduction.
+    """
+    received = []
+    monkeypatch.setattr(ingest, "raw_sample_listeners", [received.extend])
+    pipeline = create_pipeline(
+        "Kuehlschrank", {"compression": {"active": True, "absolute": 5.0}}
+    )
+    for second in range(10):
+        pipeline.process([create_point(second, 20.0)])
+    assert len(received) == 10
+    assert pipeline.samples == 10
+    assert pipeline.written_points == 1
+    assert pipeline.reduction() == pytest.approx(90.0)
+    assert DevicePipeline("Kuehlschrank", []).process([create_point(0, 1.0)]) == [
+        create_point(0, 1.0)
+    ]
+
+
+def test_cost_calc_counts_compressed_samples(monkeypatch):
+    """
+    The error rate uses the number of samples a compressed point represents.
+    """
+    monkeypatch.setattr("source.calculations.check_cost_config", lambda: 0.3)
+    data = {}
+    db_fetch = [
+        {"energy_wh": 500.0, "sample_count": 50},
+        {"energy_wh": 500.0, "sample_count": 50},
+    ]
+    cost_calc(
+        {"update_time": 36},
+        data,
+        datetime(2023, 5, 1, 13, 0),
+        timedelta(hours=1),
+        db_fetch,
+        0,
+    )
+    assert data["sum_of_energy"] == 1.0
+    assert data["error_rate_one"] == 0
+    assert data["error_rate_two"] == 0
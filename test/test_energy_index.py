@@ -0,0 +1,93 @@
+"""
+Tests for energy_index.py
+"""
+import random
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from source.constants import CENSUS_MEASUREMENT, SCHEMA_LEGACY
+from source.energy_index import EnergyIndex, EnergyIndexConfig, EnergyRing
+from source.line_protocol import encode_timestamp
+from source.storage_sqlite import SQLiteBackend
+
+NOW = datetime(2023, 5, 1, 12, 0, 0)
+
+
+def create_samples(start: datetime, count: int) -> list:
+    """
+    Valid samples every 10 seconds with random energy.
+    """
+    rng = random.Random(3)
+    return [
+        {
+            "measurement": CENSUS_MEASUREMENT,
+            "tags": {"device": "plug"},
+            "time": start + timedelta(seconds=10 * index),
+            "fields": {"fetch_success": True, "energy_wh": rng.random()},
+        }
+        for index in range(count)
+    ]
+
+
+def expected_energy(samples: list, start: datetime, end: datetime) -> float:
+    """
+    Energy of the samples between start and end, both exclusive.
+    """
+    return sum(
+        sample["fields"]["energy_wh"] for sample in samples if start < sample["time"] < end
+    )
+
+
+def test_ring_wraps_around():
+    """
+    The ring answers ranges with two binary searches and refuses ranges with dropped
+    samples.
+    """
+    samples = create_samples(NOW, 50)
+    ring = EnergyRing(16, 0)
+    for sample in samples:
+        ring.append(encode_timestamp(sample["time"], "ms"), sample["fields"]["energy_wh"])
+    ring.append(encode_timestamp(NOW, "ms"), 100.0)
+    assert ring.length == 16
+    oldest = samples[-16]["time"]
+    for start in (oldest - timedelta(seconds=10), oldest, oldest + timedelta(seconds=55)):
+        end = samples[-1]["time"] - timedelta(seconds=25)
+        energy_wh = ring.energy_between(
+            encode_timestamp(start, "ms"), encode_timestamp(end, "ms")
+        )
+        assert energy_wh == pytest.approx(expected_energy(samples, start, end))
+    assert ring.energy_between(encode_timestamp(oldest - timedelta(seconds=11), "ms"), 0) is None
+
+
+def test_index_warm_up_and_listener(tmp_path):
+    """
+    The index is filled from the database and continued by the ingest pipeline, other
+    devices and failed polls are ignored.
+    """
+    backend = SQLiteBackend(SimpleNamespace(db_path=str(tmp_path / "db.sqlite")), SCHEMA_LEGACY)
+    samples = create_samples(NOW - timedelta(hours=2), 1440)
+    stored = [sample for sample in samples if sample["time"] < NOW]
+    backend.write_points(stored)
+    index = EnergyIndex()
+    index.add_device("plug", 10, EnergyIndexConfig(retention_min=60), NOW)
+    index.warm_up("plug", backend, NOW - timedelta(minutes=60), NOW)
+    failed = {
+        "measurement": CENSUS_MEASUREMENT,
+        "tags": {"device": "plug"},
+        "time": NOW + timedelta(seconds=1),
+        "fields": {"fetch_success": False},
+    }
+    other = samples[-1] | {"tags": {"device": "fridge"}}
+    index.add_points([failed, other])
+    for sample in samples[len(stored):]:
+        index.add_points([sample])
+    end = samples[-1]["time"] + timedelta(seconds=1)
+    for minutes in (3, 15, 59):
+        start = end - timedelta(minutes=minutes)
+        assert index.energy_sum("plug", start, end) == pytest.approx(
+            expected_energy(samples, start, end)
+        )
+    assert index.energy_sum("plug", end - timedelta(minutes=120), end) is None
+    assert index.energy_sum("fridge", end - timedelta(minutes=3), end) is None
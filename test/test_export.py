@@ -0,0 +1,135 @@
+"""
+Tests for export.py with a SQLite database and the export files in a temporary directory
+"""
+import csv
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from source import export as ex
+from source import support_functions as sf
+from source.constants import CENSUS_MEASUREMENT, SCHEMA_LEGACY
+from source.storage_sqlite import SQLiteBackend
+
+START = datetime(2023, 5, 1)
+
+
+@pytest.fixture(name="backend")
+def fixture_backend(tmp_path, monkeypatch) -> SQLiteBackend:
+    """
+    Backend of the app with a sample every minute for 10 days, the last day also with a
+    temperature
+    """
+    backend = SQLiteBackend(SimpleNamespace(db_path=str(tmp_path / "db.sqlite")), SCHEMA_LEGACY)
+    backend.write_points(
+        [
+            {
+                "measurement": CENSUS_MEASUREMENT,
+                "tags": {"device": "plug"},
+                "time": START + timedelta(minutes=index),
+                "fields": {"fetch_success": True, "power": float(index % 100), "energy_wh": 0.5}
+                | ({"device_temperature": 30.0} if index >= 9 * 1440 else {}),
+            }
+            for index in range(10 * 1440)
+        ]
+    )
+    monkeypatch.setitem(sf.storage, "backend", backend)
+    return backend
+
+
+def read_csv(path) -> list:
+    """
+    Rows of a CSV file including the header.
+    """
+    with open(path, encoding="utf-8", newline="") as file:
+        return list(csv.reader(file))
+
+
+def test_shards():
+    """
+    The shards cover the range without gaps, the last one is shorter.
+    """
+    assert ex.shards(START, START + timedelta(days=10), 4) == [
+        (START, START + timedelta(days=4)),
+        (START + timedelta(days=4), START + timedelta(days=8)),
+        (START + timedelta(days=8), START + timedelta(days=10)),
+    ]
+    assert not ex.shards(START, START, 4)
+
+
+def test_export_csv(backend, tmp_path):
+    """
+    Every shard gets its own file with the requested fields, existing shards are kept and
+    a shard without fields has all fields of the measurement, also those which appear only
+    later.
+    """
+    assert backend is sf.storage["backend"]
+    output = tmp_path / "export"
+    request = ex.ExportRequest(
+        "plug",
+        START,
+        START + timedelta(days=10),
+        fields=["power"],
+        shard_days=4,
+        output=str(output),
+    )
+    assert ex.export_device(request) == 10 * 1440
+    files = sorted(path.name for path in (output / "plug").iterdir())
+    assert files == ["census_2023-05-01.csv", "census_2023-05-05.csv", "census_2023-05-09.csv"]
+    rows = read_csv(output / "plug" / "census_2023-05-05.csv")
+    assert rows[0] == ["time", "power"]
+    assert rows[1] == ["2023-05-05T00:00:00.000+00:00", "60.0"]
+    assert len(rows) == 4 * 1440 + 1
+    (output / "plug" / "census_2023-05-05.csv").unlink()
+    assert ex.export_device(request) == 4 * 1440
+    first_day = ex.ExportRequest("plug", START, START + timedelta(days=1), output=str(tmp_path))
+    ex.export_device(first_day)
+    rows = read_csv(tmp_path / "plug" / "census_2023-05-01.csv")
+    assert rows[0] == ["time", "device_temperature", "energy_wh", "fetch_success", "power"]
+    assert rows[1] == ["2023-05-01T00:00:00.000+00:00", "", "0.5", "1", "0.0"]
+    assert len(rows) == 1441
+
+
+def test_open_shard_is_exported_again(backend, tmp_path):
+    """
+    The shard of the current day is exported again, because it was not complete.
+    """
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    request = ex.ExportRequest(
+        "plug", today, today + timedelta(days=1), fields=["power"], output=str(tmp_path)
+    )
+    assert ex.export_device(request) == 0
+    backend.write_points(
+        [
+            {
+                "measurement": CENSUS_MEASUREMENT,
+                "tags": {"device": "plug"},
+                "time": today,
+                "fields": {"fetch_success": True, "power": 5.0, "energy_wh": 0.5},
+            }
+        ]
+    )
+    assert ex.export_device(request) == 1
+    assert len(read_csv(tmp_path / "plug" / f"census_{today:%Y-%m-%d}.csv")) == 2
+
+
+def test_export_parquet(backend, tmp_path):
+    """
+    The Parquet file holds the same rows as the CSV file.
+    """
+    pytest.importorskip("pyarrow")
+    assert backend is sf.storage["backend"]
+    request = ex.ExportRequest(
+        "plug",
+        START,
+        START + timedelta(days=1),
+        fields=["power", "fetch_success"],
+        file_format="parquet",
+        output=str(tmp_path),
+    )
+    assert ex.export_device(request) == 1440
+    table = ex.pq.read_table(tmp_path / "plug" / "census_2023-05-01.parquet")
+    assert table.column_names == ["time", "power", "fetch_success"]
+    assert table.column("power").to_pylist()[:2] == [0.0, 1.0]
+    assert table.num_rows == 1440
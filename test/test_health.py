@@ -0,0 +1,142 @@
+"""
+Tests for health.py
+"""
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from source.health import migrate, migrate_window, split_device_data
+from source import support_functions as sf
+from source.archive import RawSampleArchive
+from source.storage_archive import ArchiveBackend
+from source.storage_influxdb import InfluxDBBackend
+from source.constants import SCHEMA_LEGACY, SCHEMA_SPLIT, HEALTH_MEASUREMENT
+
+
+def create_point(fetch_success: bool) -> dict:
+    """
+    Create a point like the device handlers
+    :return: Point
+    """
+    fields = {"fetch_success": fetch_success}
+    if fetch_success:
+        fields |= {"power": 12.5, "energy_wh": 0.1}
+    return {
+        "measurement": "census",
+        "tags": {"device": "Kuehlschrank"},
+        "time": datetime(2023, 5, 1),
+        "fields": fields,
+    }
+
+
+@pytest.fixture(name="schema")
+def fixture_schema():
+    """
+    Restore the configured schema after the test
+    """
+    yield sf.database_config
+    sf.database_config["schema"] = SCHEMA_LEGACY
+
+
+def test_legacy_schema_is_unchanged(schema):
+    """
+    With the legacy schema the handler output is written as it is.
+    """
+    schema["schema"] = SCHEMA_LEGACY
+    device_data = [create_point(False)]
+    assert split_device_data(device_data, 20, "URLError") is device_data
+
+
+def test_split_schema_success(schema):
+    """
+    A successful poll is written to census and to the health measurement.
+    """
+    schema["schema"] = SCHEMA_SPLIT
+    points = split_device_data([create_point(True)], 20)
+    assert [point["measurement"] for point in points] == [HEALTH_MEASUREMENT, "census"]
+    assert points[0]["fields"] == {"success": True, "latency_ms": 20}
+
+
+def test_split_schema_failure(schema):
+    """
+    A failed poll is only written to the health measurement.
+    """
+    schema["schema"] = SCHEMA_SPLIT
+    points = split_device_data([create_point(False)], 20000, "TimeoutError")
+    assert len(points) == 1
+    assert points[0]["measurement"] == HEALTH_MEASUREMENT
+    assert points[0]["fields"] == {
+        "success": False,
+        "latency_ms": 20000,
+        "error_type": "TimeoutError",
+    }
+
+
+def test_migration_keeps_valid_samples(monkeypatch):
+    """
+    The migration deletes only the failed polls by their timestamps, the valid samples
+    are neither deleted nor written again.
+    """
+    rows = [
+        {"time": 1000, "fetch_success": True, "power": 12.5},
+        {"time": 2000, "fetch_success": False},
+        {"time": 3000, "fetch_success": None},
+    ]
+    queries = []
+
+    def query(text, **_):
+        queries.append(text)
+        return SimpleNamespace(get_points=lambda: iter(rows))
+
+    written = []
+    monkeypatch.setattr(sf, "write_points", lambda points, **_: written.extend(points))
+    migrated = migrate_window(
+        SimpleNamespace(query=query),
+        "plug",
+        datetime(2023, 5, 1),
+        datetime(2023, 5, 2),
+        {"fetch_success": bool},
+    )
+    assert migrated == 2
+    assert [point["measurement"] for point in written] == [HEALTH_MEASUREMENT] * 2
+    assert [point["time"] for point in written] == [2000, 3000]
+    assert queries[1:] == [
+        'DELETE FROM "census" WHERE device=$device AND time = 2000; '
+        'DELETE FROM "census" WHERE device=$device AND time = 3000'
+    ]
+
+
+def test_migration_with_archive(monkeypatch, tmp_path):
+    """
+    With the archive the migration uses the wrapped InfluxDB 1.x backend.
+    """
+    login_information = SimpleNamespace(db_name="power")
+    database = InfluxDBBackend(login_information, SCHEMA_LEGACY)
+    backend = ArchiveBackend(database, RawSampleArchive(str(tmp_path)))
+    monkeypatch.setitem(sf.storage, "backend", backend)
+    assert sf.get_database_backend() is database
+    queries = []
+
+    class Connection:
+        """
+        Connection which records the queries
+        """
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *_):
+            return False
+
+        @staticmethod
+        def query(text, **_):
+            """
+            Record a query without result rows
+            """
+            queries.append(text)
+            return SimpleNamespace(get_points=lambda: iter([]))
+
+    monkeypatch.setattr(database, "connection", Connection)
+    migrate(datetime(2023, 5, 1), datetime(2023, 5, 2), ["plug"])
+    assert queries[0] == 'SHOW FIELD KEYS FROM "census"'
+    assert len(queries) == 2
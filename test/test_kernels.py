@@ -0,0 +1,122 @@
+"""
+Property tests for kernels.py against the per-row functions with random data
+"""
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from source import kernels
+from source.calculations import PeriodAccumulator, STREAMED_FIELDS
+from source.line_protocol import encode_timestamp
+from source.storage import rows_to_columns
+from source.rollup import PowerOnCounter, count_power_on
+
+np = pytest.importorskip("numpy")
+
+SEEDS = range(40)
+FIELDS = STREAMED_FIELDS + ["fetch_success"]
+BASE = datetime(2023, 5, 1)
+
+
+def random_power(rng: random.Random, count: int) -> list:
+    """
+    Power values around the thresholds with missing values.
+    """
+    return [
+        None if rng.random() < 0.1 else rng.choice([0.0, 4.0, 5.0, 9.5, 10.0, 50.0, 120.0])
+        for _ in range(count)
+    ]
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_count_power_on_matches_counter(seed):
+    """
+    The kernel counts the same transitions as the hysteresis loop, also with an on
+    threshold below the off threshold and with the state carried between chunks.
+    """
+    rng = random.Random(seed)
+    values = random_power(rng, rng.randint(1, 300))
+    on_threshold, off_threshold = rng.choice([(50, 10), (10, 10), (5, 50), (10, 9.5)])
+    counter = PowerOnCounter(on_threshold, off_threshold)
+    split = rng.randint(0, len(values))
+    total, state = 0, False
+    for part in (values[:split], values[split:]):
+        power = np.array(part, dtype=np.float64)
+        count, state = kernels.count_power_on(power, on_threshold, off_threshold, state)
+        total += count
+    assert total == counter.count(values)
+    assert state == counter.high_threshold_passed
+    assert total == (count_power_on(values, on_threshold, off_threshold) or 0)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_sums_and_rates_match_python(seed):
+    """
+    Sums are bit for bit equal to a Python loop, the error rates to the formulas of
+    cost_calc().
+    """
+    rng = random.Random(seed)
+    values = [rng.random() * 10 ** rng.randint(-3, 3) for _ in range(rng.randint(0, 500))]
+    initial = rng.random()
+    assert kernels.sequential_sum(np.array(values), initial) == sum(values, initial)
+    successes = [rng.randint(0, 10_000) for _ in range(3)]
+    failures = [rng.randint(1, 500) for _ in range(3)]
+    max_values = [rng.randint(1, 10_000) * 1.0 for _ in range(3)]
+    first, second = kernels.error_rates(successes, failures, max_values)
+    for index, (success, failure, max_value) in enumerate(zip(successes, failures, max_values)):
+        assert first[index] == failure * 100 / (success + failure)
+        assert second[index] == (max_value - success) * 100 / max_value
+
+
+@pytest.mark.parametrize("seed", SEEDS[:10])
+def test_on_time(seed):
+    """
+    Each on state lasts until the next sample or the end.
+    """
+    rng = random.Random(seed)
+    values = [rng.choice([0.0, 30.0, 80.0]) for _ in range(rng.randint(1, 200))]
+    times = sorted(rng.sample(range(1_000_000), len(values)))
+    counter = PowerOnCounter(50, 10)
+    expected = 0
+    for index, value in enumerate(values):
+        counter.update(value)
+        if counter.high_threshold_passed:
+            following = times[index + 1] if index + 1 < len(times) else 1_000_000
+            expected += following - times[index]
+    states = kernels.hysteresis_states(np.array(values), 50, 10, False)
+    assert kernels.on_time_ms(np.array(times), states, 1_000_000) == expected
+
+
+@pytest.mark.parametrize("seed", SEEDS[:10])
+def test_accumulator_columns_match_rows(seed):
+    """
+    Chunks of columns give exactly the aggregates of the rows added one by one.
+    """
+    rng = random.Random(seed)
+    rows = []
+    for index in range(rng.randint(10, 400)):
+        time_ms = encode_timestamp(BASE + timedelta(seconds=index), "ms")
+        row = {"time": time_ms, "fetch_success": rng.choice([True, True, False, None])}
+        if row["fetch_success"]:
+            row |= {"energy_wh": rng.random(), "power": random_power(rng, 1)[0]}
+            if rng.random() < 0.3:
+                row["sample_count"] = rng.randint(0, 5)
+        rows.append(row)
+    starts = [BASE + timedelta(seconds=rng.randint(-1, len(rows))) for _ in range(3)]
+    by_rows = PeriodAccumulator(starts, (50, 10))
+    by_columns = PeriodAccumulator(starts, (50, 10))
+    for row in rows:
+        if row["fetch_success"]:
+            by_rows.add_sample(row)
+        elif row["fetch_success"] is not None:
+            by_rows.add_failure(row["time"])
+    for offset in range(0, len(rows), 64):
+        columns = rows_to_columns(rows[offset:offset + 64], FIELDS)
+        by_columns.add_columns(kernels.numpy_columns(columns))
+    assert by_columns.statistics == by_rows.statistics
+    assert by_columns.failure_counts == by_rows.failure_counts
+    assert by_columns.power_on == by_rows.power_on
+    assert [vars(sketch) for sketch in by_columns.sketches] == [
+        vars(sketch) for sketch in by_rows.sketches
+    ]
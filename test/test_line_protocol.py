@@ -0,0 +1,83 @@
+"""
+Tests for line_protocol.py
+"""
+import re
+from datetime import datetime, timezone, timedelta
+
+import pytest
+from influxdb.line_protocol import make_line
+from source.line_protocol import encode_point, encode_points, encode_timestamp, encode_value
+
+
+def split_line(line: str) -> tuple:
+    """
+    Split a line into series key, set of fields and timestamp for comparison
+    :return: Parts of the line
+    """
+    series, fields, timestamp = re.split(r"(?<!\\) ", line)
+    return series, set(fields.split(",")), timestamp
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        (1.5, "1.5"),
+        (0.0, "0.0"),
+        (3, "3i"),
+        (True, "True"),
+        (False, "False"),
+        ('a "b"', '"a \\"b\\""'),
+    ],
+)
+def test_encode_value(value, expected):
+    """
+    Pure test for function encode_value()
+    """
+    assert encode_value(value) == expected
+
+
+@pytest.mark.parametrize(
+    "timestamp, precision, expected",
+    [
+        (datetime(1970, 1, 1, 0, 0, 1, 500_000), "s", 1),
+        (datetime(1970, 1, 1, 0, 0, 1, 500_000), "ms", 1500),
+        (datetime(1970, 1, 1, 0, 0, 1, 500_000), "n", 1_500_000_000),
+        (datetime(1970, 1, 1, 1, 0, 1, tzinfo=timezone(timedelta(hours=1))), "s", 1),
+        (12345, "ms", 12345),
+    ],
+)
+def test_encode_timestamp(timestamp, precision, expected):
+    """
+    Pure test for function encode_timestamp()
+    """
+    assert encode_timestamp(timestamp, precision) == expected
+
+
+def test_encode_point_matches_influxdb_library():
+    """
+    The encoder creates the same line as the influxdb library.
+    """
+    point = {
+        "measurement": "census",
+        "tags": {"device": "Wasch maschine,1"},
+        "time": datetime(2023, 5, 1, 12, 30, 15, 123_000),
+        "fields": {
+            "power": 123.4,
+            "is_valid": True,
+            "device_temperature": 31,
+            "fetch_success": True,
+            "energy_wh": 0.342,
+        },
+    }
+    expected = make_line(
+        point["measurement"], point["tags"], point["fields"], point["time"], "ms"
+    )
+    assert split_line(encode_point(point, "ms")) == split_line(expected)
+
+
+def test_encode_points_rejects_unknown_precision():
+    """
+    Only the supported precisions are accepted.
+    """
+    with pytest.raises(ValueError):
+        encode_points([], "h")
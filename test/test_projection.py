@@ -0,0 +1,109 @@
+"""
+Tests for projection.py
+"""
+import json
+from types import SimpleNamespace
+
+import pytest
+from source.projection import (
+    DEVICE_FIELDS,
+    check_field_projection,
+    estimate_write_volume,
+)
+from source.supported_devices import plugins
+
+EMETER = {"power": 100.0, "pf": 0.9, "current": 0.5, "voltage": 230.0, "is_valid": True}
+
+
+@pytest.mark.parametrize(
+    "fields, expected",
+    [
+        (None, None),
+        ("full", None),
+        ("unknown", None),
+        ("totals", {"power", "energy_wh", "fetch_success", "is_valid", "device_temperature"}),
+        (
+            ["voltage_a"],
+            {"power", "energy_wh", "fetch_success", "is_valid", "device_temperature", "voltage_a"},
+        ),
+        (
+            {"preset": "per_phase_power", "exclude": ["energy_wh_a", "power", "is_valid"]},
+            {
+                "power",
+                "energy_wh",
+                "fetch_success",
+                "device_temperature",
+                "power_a",
+                "power_b",
+                "power_c",
+                "energy_wh_b",
+                "energy_wh_c",
+            },
+        ),
+        (
+            {"exclude": ["is_valid_a", "is_valid_b", "is_valid_c"]},
+            set(DEVICE_FIELDS["shelly:3em"]) - {"is_valid_a", "is_valid_b", "is_valid_c"},
+        ),
+    ],
+)
+def test_check_field_projection(fields, expected):
+    """
+    Presets, include and exclude lists, the required fields are always selected.
+    """
+    settings = {"type": "shelly:3em"}
+    if fields is not None:
+        settings["fields"] = fields
+    selection = check_field_projection("Hausanschluss", settings)
+    assert selection == (None if expected is None else frozenset(expected))
+
+
+def test_exclude_for_unknown_device_type(monkeypatch):
+    """
+    Exclusions for a device type without known fields are reported and all fields are
+    written.
+    """
+    messages = []
+    monkeypatch.setattr(
+        "source.projection.lh.write_log", lambda level, message: messages.append(message)
+    )
+    settings = {"type": "unknown:plug", "fields": {"exclude": ["is_valid"]}}
+    assert check_field_projection("Plug", settings) is None
+    assert "exclusions are ignored" in messages[0]
+
+
+def test_3em_handler_extracts_selected_fields(stand_in_server):
+    """
+    The handler only writes the fields of the selection.
+    """
+    stand_in_server.respond("/status", 200, json.dumps({"emeters": [EMETER] * 3}))
+    settings = {
+        "device_name": "Hausanschluss",
+        "ip": f"127.0.0.1:{stand_in_server.port}",
+        "update_time": 10,
+        "type": "shelly:3em",
+        "watch_hen": SimpleNamespace(normal_processing=lambda: None),
+    }
+    full = plugins["shelly:3em"](settings | {"field_selection": None})[0]["fields"]
+    assert set(full) == set(DEVICE_FIELDS["shelly:3em"])
+    selection = check_field_projection("Hausanschluss", settings | {"fields": "totals"})
+    fields = plugins["shelly:3em"](settings | {"field_selection": selection})[0]["fields"]
+    assert fields == {
+        "power": 300.0,
+        "energy_wh": pytest.approx(300.0 * 10 / 3600),
+        "fetch_success": True,
+    }
+
+
+def test_estimate_write_volume():
+    """
+    The estimate scales with the poll interval and shrinks with the selection.
+    """
+    settings = {"type": "shelly:3em", "update_time": 10}
+    points, full_size = estimate_write_volume("Hausanschluss", settings)
+    assert points == 8640
+    selection = check_field_projection("Hausanschluss", settings | {"fields": "totals"})
+    _, totals_size = estimate_write_volume(
+        "Hausanschluss", settings | {"field_selection": selection}
+    )
+    assert totals_size * 4 < full_size
+    assert estimate_write_volume("Steckdose", {"type": "custom", "update_time": 10}) is None
@@ -0,0 +1,56 @@
+"""
+Tests for quantile_sketch.py
+"""
+import random
+
+import pytest
+
+from source.quantile_sketch import QuantileSketch
+
+
+def exact_quantile(values: list, quantile: float) -> float:
+    """
+    Quantile of the sorted values at the rank used by the sketch.
+    """
+    return sorted(values)[int(quantile * (len(values) - 1))]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_relative_accuracy(seed):
+    """
+    Every quantile is within the relative accuracy of the exact quantile, the minimum and
+    maximum are exact.
+    """
+    rng = random.Random(seed)
+    values = [rng.lognormvariate(3, 1.5) for _ in range(5000)] + [0.0] * 500
+    values += [-rng.random() for _ in range(50)]
+    sketch = QuantileSketch(0.01)
+    for value in values:
+        sketch.add(value)
+    for quantile in (0.01, 0.05, 0.5, 0.95, 0.99):
+        assert sketch.quantile(quantile) == pytest.approx(
+            exact_quantile(values, quantile), rel=0.01, abs=1e-9
+        )
+    assert sketch.quantile(0) == min(values)
+    assert sketch.quantile(1) == max(values)
+    assert QuantileSketch().quantile(0.5) is None
+
+
+def test_merge_and_field():
+    """
+    Merged sketches equal one sketch of all values and survive the string field.
+    """
+    rng = random.Random(7)
+    hours = [[rng.uniform(0, 2000) for _ in range(360)] for _ in range(24)]
+    day = QuantileSketch()
+    merged = QuantileSketch()
+    for values in hours:
+        hour = QuantileSketch()
+        for value in values:
+            hour.add(value, 2)
+            day.add(value, 2)
+        merged.merge(QuantileSketch.from_field(hour.to_field()))
+    assert vars(merged) == vars(day)
+    assert merged.count == 2 * 24 * 360
+    with pytest.raises(ValueError):
+        merged.merge(QuantileSketch(0.05))
@@ -0,0 +1,151 @@
+"""
+Tests for query_cache.py with a fake clock and a SQLite database in a temporary directory
+"""
+import threading
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from source.constants import SCHEMA_LEGACY
+from source.query_cache import CachingBackend, QueryCache, QueryCacheConfig
+from source.query_planner import NestedWindowPlanner
+from source.storage_sqlite import SQLiteBackend
+
+
+class CountingBackend(SQLiteBackend):
+    """
+    SQLite backend which counts the aggregate queries
+    """
+
+    aggregates = 0
+
+    def query_aggregate(self, *args, **kwargs):
+        self.aggregates += 1
+        return super().query_aggregate(*args, **kwargs)
+
+
+@pytest.fixture(name="backend")
+def fixture_backend(tmp_path) -> CountingBackend:
+    """
+    Backend with one sample per minute of the last day
+    """
+    backend = CountingBackend(
+        SimpleNamespace(db_path=str(tmp_path / "db.sqlite")), SCHEMA_LEGACY
+    )
+    now = datetime.utcnow()
+    backend.write_points(
+        [
+            {
+                "measurement": "census",
+                "tags": {"device": "plug"},
+                "time": now - timedelta(minutes=minute),
+                "fields": {"energy_wh": 0.5, "fetch_success": True},
+            }
+            for minute in range(1, 24 * 60)
+        ]
+    )
+    return backend
+
+
+def test_ttl_and_past_windows(backend):
+    """
+    Live windows expire after the time to live, windows in the past much later.
+    """
+    clock = SimpleNamespace(now=0.0)
+    cache = QueryCache(
+        QueryCacheConfig(True, ttl_s=3600, past_ttl_s=86400), lambda: clock.now
+    )
+    cached = CachingBackend(backend, cache)
+    end = datetime.utcnow().replace(minute=30, second=0, microsecond=0)
+    past_end = end - timedelta(hours=12)
+    expected = backend.sum_samples("plug", end - timedelta(hours=1), end)
+    for _ in range(3):
+        assert cached.sum_samples("plug", end - timedelta(hours=1), end) == expected
+        cached.sum_samples("plug", past_end - timedelta(hours=1), past_end)
+    assert backend.aggregates == 3
+    clock.now = 3601
+    cached.sum_samples("plug", end - timedelta(hours=1), end)
+    cached.sum_samples("plug", past_end - timedelta(hours=1), past_end)
+    assert backend.aggregates == 4
+    assert cache.statistics()["hits"] == 5
+
+
+def test_lru_eviction():
+    """
+    The least recently used results are evicted when the memory bound is exceeded.
+    """
+    cache = QueryCache(QueryCacheConfig(True, max_memory_kb=1), lambda: 0.0)
+    for index in range(20):
+        cache.get(("key", index), lambda value=index: [value], 10)
+        cache.get(("key", 0), lambda: None, 10)
+    statistics = cache.statistics()
+    assert statistics["evictions"] > 0
+    assert statistics["size"] <= 1024
+    assert cache.get(("key", 0), lambda: None, 10) == [0]
+    assert cache.get(("key", 1), lambda: None, 10) is None
+
+
+def test_single_flight():
+    """
+    A query which is already running is awaited instead of being sent again.
+    """
+    cache = QueryCache(QueryCacheConfig(True), lambda: 0.0)
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def query():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return 42
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(cache.get("key", query, 10)))
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=lambda: results.append(cache.get("key", query, 10)))
+    follower.start()
+    while cache.statistics()["coalesced"] == 0:
+        pass
+    release.set()
+    leader.join()
+    follower.join()
+    assert results == [42, 42]
+    assert len(calls) == 1
+
+
+def test_single_flight_error():
+    """
+    An error of the query is raised for all waiting callers and nothing is cached.
+    """
+    cache = QueryCache(QueryCacheConfig(True), lambda: 0.0)
+
+    def query():
+        raise ValueError("failed")
+
+    with pytest.raises(ValueError):
+        cache.get("key", query, 10)
+    assert cache.get("key", lambda: 1, 10) == 1
+
+
+def test_shifted_buckets(backend, monkeypatch):
+    """
+    Buckets of a slightly older window within the time to live are moved to the end of
+    the new window, so the planner gives the results of the older window.
+    """
+    # All windows of the test are treated as live windows
+    monkeypatch.setattr("source.query_cache.QUERY_CACHE_PAST_AFTER_S", 10**9)
+    cache = QueryCache(QueryCacheConfig(True, ttl_s=3600), lambda: 0.0)
+    cached = CachingBackend(backend, cache)
+    periods = [timedelta(minutes=5), timedelta(minutes=55), timedelta(hours=6)]
+    first_end = datetime.utcnow().replace(minute=30, second=10) - timedelta(hours=1)
+    expected = NestedWindowPlanner(
+        backend, "plug", first_end, [first_end - period for period in periods]
+    ).energy_sums()
+    # The second window is two buckets later in the same hour
+    for end in (first_end, first_end + timedelta(minutes=10)):
+        planner = NestedWindowPlanner(cached, "plug", end, [end - period for period in periods])
+        assert planner.resolution_ms is not None
+        assert planner.energy_sums() == expected
+    assert cache.statistics()["misses"] == cache.statistics()["hits"] == 1
@@ -0,0 +1,135 @@
+"""
+Tests for query_executor.py and the routing of oversized report queries
+"""
+import threading
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from source import calculations as cc
+from source import support_functions as sf
+from source.constants import CENSUS_MEASUREMENT, SCHEMA_LEGACY
+from source.query_executor import (
+    QueryExecutor,
+    QueryExecutorConfig,
+    QueryTimeoutError,
+    cancellable,
+)
+from source.rollup import count_power_on
+from source.storage_sqlite import SQLiteBackend
+
+
+def test_run_counts_per_caller():
+    """
+    Queries run on the pool, a query started by a query runs directly and the queue
+    wait and execution time are counted per caller.
+    """
+    executor = QueryExecutor(QueryExecutorConfig(max_workers=1))
+    threads = []
+
+    def outer(_cancel):
+        threads.append(threading.current_thread().name)
+        return executor.run("inner", lambda _: threading.current_thread().name) + "!"
+
+    assert executor.run("outer", outer).startswith("query")
+    assert executor.run("outer", lambda _: 42) == 42
+    statistics = executor.statistics()
+    assert statistics["outer"]["queries"] == 2
+    assert statistics["outer"]["timeouts"] == 0
+    assert statistics["outer"]["queue_s"] >= 0
+    assert statistics["outer"]["execution_s"] >= 0
+    assert "inner" not in statistics
+    assert threads[0].startswith("query")
+
+
+def test_timeout_cancels_streaming_query():
+    """
+    A query which misses its deadline raises QueryTimeoutError and a streaming query
+    stops at its next row.
+    """
+    executor = QueryExecutor(QueryExecutorConfig(max_workers=1))
+    started = threading.Event()
+    stopped = threading.Event()
+
+    def rows():
+        started.set()
+        while True:
+            yield 1
+            started.wait(0.01)
+
+    def query(cancel):
+        try:
+            return sum(cancellable(rows(), cancel))
+        except QueryTimeoutError:
+            stopped.set()
+            raise
+
+    with pytest.raises(QueryTimeoutError):
+        executor.run("reports", query, timeout_s=0.1)
+    assert stopped.wait(5)
+    assert executor.statistics()["reports"]["timeouts"] == 1
+
+
+def test_raw_rows(tmp_path):
+    """
+    The rows of a raw query are the series times the samples of the range.
+    """
+    backend = SQLiteBackend(SimpleNamespace(db_path=str(tmp_path / "db.sqlite")), SCHEMA_LEGACY)
+    start = datetime(2023, 5, 1)
+    day = (backend, CENSUS_MEASUREMENT, "plug", start, start + timedelta(days=1))
+    assert QueryExecutor.raw_rows(*day, 60) == 1440
+    assert QueryExecutor.raw_rows(*day, 10) == 8640
+
+
+def test_oversized_period_uses_buckets(tmp_path, monkeypatch):
+    """
+    A power on period with too many raw rows is counted on buckets, the shorter period is
+    still streamed. Devices which stay off longer than a bucket give the same count.
+    """
+    backend = SQLiteBackend(SimpleNamespace(db_path=str(tmp_path / "db.sqlite")), SCHEMA_LEGACY)
+    end = datetime(2023, 5, 3, 12)
+    backend.write_points(
+        [
+            {
+                "measurement": CENSUS_MEASUREMENT,
+                "tags": {"device": "plug"},
+                "time": end - timedelta(seconds=60 * index + 30),
+                "fields": {
+                    "fetch_success": True,
+                    "power": 120.0 if index // 10 % 2 else 0.0,
+                    "energy_wh": 1.0,
+                },
+            }
+            for index in range(3 * 24 * 60)
+        ]
+    )
+    monkeypatch.setitem(sf.storage, "backend", backend)
+    monkeypatch.setitem(
+        sf.storage, "query_executor", QueryExecutor(QueryExecutorConfig(max_raw_rows=2000))
+    )
+    monkeypatch.setattr("source.rollup.check_rollup_config", lambda: SimpleNamespace(active=False))
+    settings = {
+        "device_name": "plug",
+        "update_time": 60,
+        "power_on_counter": {"on_threshold": 50, "off_threshold": 10},
+    }
+    starts = {0: end - timedelta(days=1), 1: end - timedelta(days=3)}
+    calc_requested = {"cost_calc": [True, True, False], "power_on_counter": [True, True, False]}
+    statistics, failure_counts, power_on, sketches = cc.period_aggregates(
+        settings, end, starts, calc_requested
+    )
+    assert power_on == {
+        period: count_power_on(
+            [row["power"] for row in backend.query_samples("plug", start, end, ["power"])],
+            50,
+            10,
+        )
+        for period, start in starts.items()
+    }
+    assert statistics[1]["sample_count"] == 3 * 24 * 60
+    assert failure_counts == {0: 0, 1: 0}
+    assert sketches[0].count == 24 * 60
+    assert sketches[0].max == 120.0
+    executor_statistics = sf.storage["query_executor"].statistics()
+    assert executor_statistics["reports"]["queries"] == 5
@@ -0,0 +1,81 @@
+"""
+Tests for query_planner.py with a SQLite database in a temporary directory
+"""
+import random
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from dateutil.relativedelta import relativedelta
+
+from source.constants import SCHEMA_LEGACY, SCHEMA_SPLIT
+from source.query_planner import NestedWindowPlanner
+from source.storage_sqlite import SQLiteBackend
+
+END = datetime(2023, 5, 1, 17, 23, 41, 512000)
+
+
+@pytest.fixture(name="backend")
+def fixture_backend(tmp_path) -> SQLiteBackend:
+    """
+    Backend with random census points of the last two days before END
+    """
+    backend = SQLiteBackend(SimpleNamespace(db_path=str(tmp_path / "db.sqlite")), SCHEMA_LEGACY)
+    rng = random.Random(17)
+    points = []
+    timestamp = END - timedelta(days=2)
+    while timestamp < END:
+        fields = {"energy_wh": rng.random(), "fetch_success": rng.random() > 0.05}
+        if rng.random() < 0.1:
+            fields["sample_count"] = rng.randint(2, 6)
+        points.append(
+            {
+                "measurement": "census",
+                "tags": {"device": "plug"},
+                "time": timestamp,
+                "fields": fields,
+            }
+        )
+        timestamp += timedelta(seconds=rng.randint(1, 20), milliseconds=rng.randint(1, 999))
+    backend.write_points(points)
+    return backend
+
+
+@pytest.mark.parametrize(
+    "periods",
+    [
+        [timedelta(minutes=3), timedelta(minutes=15), timedelta(hours=1), timedelta(days=1)],
+        [timedelta(seconds=7), timedelta(days=1, seconds=1)],
+    ],
+)
+def test_planner_matches_single_queries(backend, periods):
+    """
+    The nested windows give the same result as one query per window, with buckets and
+    with the fallback for too many buckets.
+    """
+    starts = [END - period for period in periods]
+    planner = NestedWindowPlanner(backend, "plug", END, starts)
+    assert (planner.resolution_ms is None) == (len(periods) == 2)
+    expected_energy = [backend.sum_samples("plug", start, END) for start in starts]
+    assert planner.energy_sums() == pytest.approx(expected_energy)
+    assert planner.sample_statistics() == [
+        pytest.approx(backend.sample_statistics("plug", start, END)) for start in starts
+    ]
+    assert planner.failure_counts() == [
+        backend.count_failures("plug", start, END) for start in starts
+    ]
+
+
+def test_planner_for_calculation_periods(backend):
+    """
+    Day, month and year windows are planned in daily buckets.
+    """
+    starts = [END - relativedelta(**{period: 1}) for period in ("days", "months", "years")]
+    planner = NestedWindowPlanner(backend, "plug", END, starts)
+    assert planner.resolution_ms == 86_400_000
+    energy = planner.energy_sums()
+    assert energy[1] == energy[2] == pytest.approx(backend.sum_samples("plug", starts[2], END))
+    backend.schema = SCHEMA_SPLIT
+    assert planner.failure_counts() == [0, 0, 0]
+    with pytest.raises(ValueError):
+        planner.aggregate("census", "energy_wh", "max")
@@ -0,0 +1,130 @@
+"""
+Tests for report_backfill.py with a SQLite database and report files in a temporary
+directory
+"""
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from source import report_backfill as rb
+from source import support_functions as sf
+from source.constants import SCHEMA_LEGACY
+from source.storage_sqlite import SQLiteBackend
+
+CALC_REQUESTED = {
+    "start_schedule_task": True,
+    "cost_calc": [True, False, False],
+    "power_on_counter": [False, True, False],
+}
+SETTINGS = {
+    "device_name": "plug",
+    "update_time": 60,
+    "power_on_counter": {"on_threshold": 50, "off_threshold": 10},
+}
+
+
+@pytest.fixture(name="report_files")
+def fixture_report_files(tmp_path, monkeypatch):
+    """
+    Working directory next to an empty files directory and the default request times
+    """
+    (tmp_path / "files").mkdir()
+    (tmp_path / "source").mkdir()
+    monkeypatch.chdir(tmp_path / "source")
+    monkeypatch.setitem(rb.cc.config_request_time, "calc_request_time_daily", "13:16")
+    monkeypatch.setitem(rb.cc.config_request_time, "calc_request_time_monthly", "01")
+    monkeypatch.setitem(rb.cc.config_request_time, "calc_request_time_yearly", "01.01")
+    return tmp_path / "files"
+
+
+def test_requested_runs(report_files):
+    """
+    Every day has a run at the daily request time with the periods due on that day.
+    """
+    assert report_files.is_dir()
+    runs = rb.requested_runs(CALC_REQUESTED, datetime(2023, 4, 29), datetime(2023, 5, 2))
+    assert runs == [
+        (datetime(2023, 4, 29, 13, 16), [0]),
+        (datetime(2023, 4, 30, 13, 16), [0]),
+        (datetime(2023, 5, 1, 13, 16), [0, 1]),
+        (datetime(2023, 5, 2, 13, 16), [0]),
+    ]
+    restricted = rb.restrict_calc_requested(CALC_REQUESTED, [1])
+    assert restricted["cost_calc"] == [False, False, False]
+    assert restricted["power_on_counter"] == [False, True, False]
+
+
+def test_missed_runs(report_files):
+    """
+    Runs after the last report of a period and before now are missed, periods without a
+    report are not caught up.
+    """
+    rb.report_store.write_report(
+        "plug",
+        "day",
+        {key: "Not req" for key in rb.cc.CALCULATION_DATA_KEYS}
+        | {"start_date": "2023-04-30 13:16:02", "end_date": "2023-05-01 13:16:02"},
+    )
+    assert (report_files / "plug_day.txt").exists()
+    assert (report_files / "reports.sqlite").exists()
+    runs = rb.missed_runs(SETTINGS, CALC_REQUESTED, datetime(2023, 5, 4, 12, 0))
+    assert runs == [(datetime(2023, 5, 2, 13, 16), [0]), (datetime(2023, 5, 3, 13, 16), [0])]
+
+
+def test_regenerate_device(report_files, tmp_path, monkeypatch):
+    """
+    Regenerated reports replace the reports of the same days, for example with a new
+    price, and missing days are inserted in order.
+    """
+    backend = SQLiteBackend(SimpleNamespace(db_path=str(tmp_path / "db.sqlite")), SCHEMA_LEGACY)
+    start = datetime(2023, 4, 28, 13, 16)
+    backend.write_points(
+        [
+            {
+                "measurement": "census",
+                "tags": {"device": "plug"},
+                "time": start + timedelta(minutes=minute),
+                "fields": {"energy_wh": 1.0, "power": 60.0, "fetch_success": True},
+            }
+            for minute in range(4 * 24 * 60)
+        ]
+    )
+    monkeypatch.setitem(sf.storage, "backend", backend)
+    monkeypatch.setattr("source.calculations.check_cost_config", lambda: 0.3)
+    runs = rb.requested_runs(CALC_REQUESTED, datetime(2023, 4, 29), datetime(2023, 5, 2))
+    assert rb.regenerate_device(SETTINGS, CALC_REQUESTED, [runs[0], runs[2]]) == 2
+    monkeypatch.setattr("source.calculations.check_cost_config", lambda: 0.5)
+    assert rb.regenerate_device(SETTINGS, CALC_REQUESTED, runs) == 4
+    lines = (report_files / "plug_day.txt").read_text(encoding="utf-8").splitlines()
+    assert [rb.report_store.parse_report_line(line)["end_date"][:10] for line in lines[2:]] == [
+        "2023-04-29",
+        "2023-04-30",
+        "2023-05-01",
+        "2023-05-02",
+    ]
+    assert all("0.5€/KWh" in line and "1.44" in line for line in lines[2:])
+    monthly = (report_files / "plug_month.txt").read_text(encoding="utf-8").splitlines()
+    assert len(monthly) == 3
+
+
+def test_regenerate_continues_after_broken_worker(monkeypatch):
+    """
+    A device whose worker process breaks is logged and the other devices are still
+    regenerated.
+    """
+
+    def regenerate_device(settings, _calc_requested, runs):
+        if settings["device_name"] == "broken":
+            raise BrokenProcessPool("worker died")
+        return len(runs)
+
+    monkeypatch.setattr(
+        rb, "ProcessPoolExecutor", lambda max_workers, **_: ThreadPoolExecutor(max_workers)
+    )
+    monkeypatch.setattr(rb, "regenerate_device", regenerate_device)
+    jobs = [({"device_name": name}, CALC_REQUESTED) for name in ("broken", "plug")]
+    runs = {"broken": [(datetime(2023, 5, 1), [0])], "plug": [(datetime(2023, 5, 1), [0])] * 2}
+    assert rb.regenerate(jobs, runs, 2) == 2
@@ -0,0 +1,76 @@
+"""
+Tests for report_runner.py
+"""
+import threading
+import time
+
+from source import report_runner
+from source.storage import StorageConnectionError
+
+def test_batch_runs_devices_in_parallel(monkeypatch):
+    """
+    All devices of a batch share the end of their periods, run at most max_workers at
+    once and an error of one device does not stop the others.
+    """
+    calls = []
+    running = {"now": 0, "max": 0}
+    lock = threading.Lock()
+
+    def calculation_handler(settings, _calc_requested, current_timestamp):
+        with lock:
+            calls.append((settings["device_name"], current_timestamp))
+            running["now"] += 1
+            running["max"] = max(running["max"], running["now"])
+        time.sleep(0.02)
+        with lock:
+            running["now"] -= 1
+        if settings["device_name"] == "plug3":
+            raise StorageConnectionError("offline")
+
+    monkeypatch.setattr("source.calculations.calculation_handler", calculation_handler)
+    runner = report_runner.ReportRunner(report_runner.ReportRunnerConfig(max_workers=2))
+    for index in range(6):
+        runner.add({"device_name": f"plug{index}"}, {})
+    durations = runner.run_batch()
+    assert sorted(durations) == [f"plug{index}" for index in range(6)]
+    assert len({timestamp for _, timestamp in calls}) == 1
+    assert running["max"] == 2
+
+
+def test_start_skips_running_batch(monkeypatch):
+    """
+    A batch which is still running is not started a second time.
+    """
+    release = threading.Event()
+    batches = []
+    monkeypatch.setattr(
+        report_runner.ReportRunner, "run_batch", lambda self: batches.append(release.wait(5))
+    )
+    runner = report_runner.ReportRunner(report_runner.ReportRunnerConfig())
+    runner.start()
+    runner.start()
+    release.set()
+    runner.thread.join()
+    assert batches == [True]
+
+
+def test_batch_waits_for_catch_up(monkeypatch):
+    """
+    A daily batch which is due during the catch-up runs after it.
+    """
+    release = threading.Event()
+    order = []
+    monkeypatch.setattr(
+        report_runner.ReportRunner,
+        "catch_up",
+        lambda self: order.append(("catch_up", release.wait(5))),
+    )
+    monkeypatch.setattr(
+        report_runner.ReportRunner, "run_batch", lambda self: order.append(("batch", True))
+    )
+    runner = report_runner.ReportRunner(report_runner.ReportRunnerConfig())
+    runner.start_catch_up()
+    runner.start()
+    release.set()
+    runner.thread.join()
+    assert order == [("catch_up", True), ("batch", True)]
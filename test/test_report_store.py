@@ -0,0 +1,147 @@
+"""
+Tests for report_store.py and the report files rendered from it
+"""
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+from source import report_store as rs
+from source import support_functions as sf
+
+REPORT_DATA = {
+    "start_date": "2023-05-01 00:00:00",
+    "end_date": "2023-05-02 00:00:00",
+    "sum_of_energy": 1.25,
+    "total_cost": 0.375,
+    "cost_kwh": 0.3,
+    "error_rate_one": 0.5,
+    "error_rate_two": 1.0,
+    "power_on": 3,
+}
+
+
+@pytest.fixture(name="report_files")
+def fixture_report_files(tmp_path, monkeypatch):
+    """
+    Working directory next to an empty files directory
+    """
+    (tmp_path / "files").mkdir()
+    (tmp_path / "source").mkdir()
+    monkeypatch.chdir(tmp_path / "source")
+    return tmp_path / "files"
+
+
+def test_write_report(report_files):
+    """
+    The report file is rendered from the store with its header, reports are kept in the
+    order of their start and a report which ends on the same day replaces the old one. No
+    temporary file is left behind.
+    """
+    earlier = {"start_date": "2023-04-30 00:00:03", "end_date": "2023-05-01 00:00:03"}
+    rs.write_report("plug", "day", REPORT_DATA)
+    rs.write_report("plug", "day", REPORT_DATA | earlier)
+    rs.write_report("plug", "day", REPORT_DATA | {"total_cost": "Not req"})
+    lines = (report_files / "plug_day.txt").read_text(encoding="utf-8").splitlines()
+    assert len(lines) == 4
+    assert lines[0].startswith("|               Period in UTC")
+    assert lines[2].startswith("| 2023-04-30 00:00:03 - 2023-05-01 00:00:03 |")
+    assert "0.38 (  0.3€/KWh)" in lines[2]
+    assert "Not req ( N.A.€/KWh)" in lines[3]
+    assert lines[3].endswith("| Not req | Not req | Not req | Not req | Not req |")
+    assert sorted(path.name for path in report_files.iterdir()) == [
+        "plug_day.txt",
+        "reports.sqlite",
+    ]
+
+
+def test_lookup_and_range(report_files):
+    """
+    A point in time finds the report which contains it, ranges list the reports which
+    start in them and devices and periods are kept apart.
+    """
+    assert report_files.is_dir()
+    store = rs.get_report_store()
+    store.write(
+        "plug",
+        "day",
+        [
+            REPORT_DATA
+            | {
+                "start_date": f"2023-05-0{day} 00:00:00",
+                "end_date": f"2023-05-0{day + 1} 00:00:00",
+            }
+            for day in range(1, 6)
+        ],
+    )
+    store.write("other", "day", [REPORT_DATA])
+    store.write(
+        "plug",
+        "month",
+        [REPORT_DATA | {"power_peak": 2012.25, "power_baseload": 3.04, "power_p50": 60.0}],
+    )
+    report = store.report("plug", "day", datetime(2023, 5, 3, 12))
+    assert report["start_date"] == "2023-05-03 00:00:00"
+    assert report["total_cost"] == 0.375
+    assert store.report("plug", "day", datetime(2023, 5, 6, 0)) is None
+    assert store.report("plug", "month", datetime(2023, 5, 3)) is None
+    listed = store.reports("plug", "day", datetime(2023, 5, 2), datetime(2023, 5, 4))
+    assert [report["start_date"][:10] for report in listed] == ["2023-05-02", "2023-05-03"]
+    assert store.last_end("plug", "day") == datetime(2023, 5, 6)
+    assert store.last_end("plug", "year") is None
+    message = rs.latest_reports_message(["plug", "missing"])
+    assert message == (
+        "plug\nday: 2023-05-05 00:00:00 - 2023-05-06 00:00:00: 1.25 KWh, 0.375 €, power on 3"
+        "\nmonth: 2023-05-01 00:00:00 - 2023-05-02 00:00:00: 1.25 KWh, 0.375 €, power on 3, "
+        "peak 2012.2 W, baseload 3.0 W\n\nmissing\nNo reports yet."
+    )
+
+
+def test_import_report_file(report_files):
+    """
+    A report file which existed before the store is imported on the first write and
+    renders unchanged, lines without period are skipped.
+    """
+    old_reports = [
+        REPORT_DATA | {"cost_kwh": 12.0, "total_cost": 15.0},
+        {key: "Not req" for key in REPORT_DATA},
+    ]
+    sf.write_device_information("plug_month", old_reports)
+    old_lines = (report_files / "plug_month.txt").read_text(encoding="utf-8").splitlines()
+    assert "9.99+" in old_lines[2]
+    june = {"start_date": "2023-06-01 00:00:00", "end_date": "2023-07-01 00:00:00"}
+    rs.write_report("plug", "month", REPORT_DATA | june)
+    lines = (report_files / "plug_month.txt").read_text(encoding="utf-8").splitlines()
+    assert lines[:3] == old_lines[:3]
+    assert len(lines) == 4
+    assert rs.parse_report_line(lines[3])["start_date"] == "2023-06-01 00:00:00"
+    assert rs.parse_report_line(old_lines[3]) is None
+
+
+def test_reports_without_power_statistics(report_files):
+    """
+    A store and a report file from before the power statistics are read with Not req for
+    them and rendered with the new columns.
+    """
+    with sqlite3.connect(report_files / "reports.sqlite") as conn:
+        conn.execute(
+            "CREATE TABLE reports (device TEXT NOT NULL, period_type TEXT NOT NULL, "
+            "start TEXT NOT NULL, end TEXT NOT NULL, sum_of_energy REAL, total_cost REAL, "
+            "cost_kwh REAL, error_rate_one REAL, error_rate_two REAL, power_on INTEGER, "
+            "PRIMARY KEY (device, period_type, start)) WITHOUT ROWID"
+        )
+        conn.execute(
+            "INSERT INTO reports VALUES ('plug', 'day', '2023-04-30 00:00:00', "
+            "'2023-05-01 00:00:00', 1.0, 0.3, 0.3, 0.0, 0.0, 2)"
+        )
+    conn.close()
+    rs.write_report("plug", "day", REPORT_DATA | {"power_p99": 1500.0})
+    old, new = rs.get_report_store().reports("plug", "day")
+    assert old["power_p99"] == "Not req"
+    assert new["power_p99"] == 1500.0
+    lines = (report_files / "plug_day.txt").read_text(encoding="utf-8").splitlines()
+    assert lines[3].endswith("|  1500.0 | Not req | Not req |")
+    legacy_line = "|".join(lines[2].split("|")[:7]) + "|"
+    parsed = rs.parse_report_line(legacy_line)
+    assert parsed["power_on"] == old["power_on"] == 2
+    assert parsed["power_peak"] is None
@@ -0,0 +1,207 @@
+"""
+Tests for rollup.py with a SQLite database in a temporary directory
+"""
+import random
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from source.constants import (
+    CENSUS_MEASUREMENT,
+    HEALTH_MEASUREMENT,
+    SCHEMA_LEGACY,
+    ROLLUP_MINUTE_MEASUREMENT,
+    ROLLUP_HOUR_MEASUREMENT,
+    ROLLUP_DAY_MEASUREMENT,
+)
+from source.query_planner import NestedWindowPlanner
+from source.rollup import (
+    RollupReader,
+    RollupStage,
+    RollupState,
+    backfill,
+    count_power_on,
+    split_window,
+)
+from source.storage_sqlite import SQLiteBackend
+
+SETTINGS = {"power_on_counter": {"on_threshold": 50, "off_threshold": 10}}
+FIRST_POLL = datetime(2023, 5, 1, 0, 0, 3)
+END = datetime(2023, 5, 3, 17, 23, 41, 512000)
+
+
+def create_polls(start: datetime, end: datetime) -> list:
+    """
+    Polls of a device every 10 seconds with some failures, the power switches between
+    0 W and 100 W every few minutes.
+    """
+    rng = random.Random(5)
+    polls = []
+    timestamp = start
+    while timestamp < end:
+        success = rng.random() > 0.05
+        fields = {"fetch_success": success}
+        if success:
+            power = 100.0 if (timestamp.hour * 60 + timestamp.minute) % 7 < 3 else 0.0
+            fields |= {"power": power, "energy_wh": power * 10 / 3600}
+        polls.append(
+            {
+                "measurement": CENSUS_MEASUREMENT,
+                "tags": {"device": "plug"},
+                "time": timestamp,
+                "fields": fields,
+            }
+        )
+        timestamp += timedelta(seconds=10)
+    return polls
+
+
+@pytest.fixture(name="backend")
+def fixture_backend(tmp_path) -> SQLiteBackend:
+    """
+    Empty backend with the legacy schema
+    """
+    return SQLiteBackend(SimpleNamespace(db_path=str(tmp_path / "db.sqlite")), SCHEMA_LEGACY)
+
+
+@pytest.fixture(name="state")
+def fixture_state(tmp_path) -> RollupState:
+    """
+    State file in the temporary directory
+    """
+    return RollupState(str(tmp_path / "rollup_state.json"))
+
+
+def ingest(stage: RollupStage, backend: SQLiteBackend, polls: list) -> None:
+    """
+    Pass the polls one by one through the stage and write the result.
+    """
+    for poll in polls:
+        backend.write_points(stage.process([poll]))
+
+
+def test_stage_closes_buckets(backend, state):
+    """
+    A poll of a new minute closes the minute and writes the open hour and day again,
+    failed polls of both schemas are counted.
+    """
+    stage = RollupStage("plug", SETTINGS, backend, state)
+    polls = create_polls(datetime(2023, 5, 1, 23, 58), datetime(2023, 5, 2, 0, 0, 10))
+    polls[2] = {
+        "measurement": HEALTH_MEASUREMENT,
+        "tags": {"device": "plug"},
+        "time": polls[2]["time"],
+        "fields": {"success": False, "latency_ms": 20},
+    }
+    rows = []
+    for poll in polls:
+        rows += stage.process([poll])[1:]
+    assert [(row["measurement"], row["time"].strftime("%d %H:%M")) for row in rows] == [
+        (ROLLUP_MINUTE_MEASUREMENT, "01 23:58"),
+        (ROLLUP_HOUR_MEASUREMENT, "01 23:00"),
+        (ROLLUP_DAY_MEASUREMENT, "01 00:00"),
+        (ROLLUP_MINUTE_MEASUREMENT, "01 23:59"),
+        (ROLLUP_HOUR_MEASUREMENT, "01 23:00"),
+        (ROLLUP_DAY_MEASUREMENT, "01 00:00"),
+        (ROLLUP_HOUR_MEASUREMENT, "02 00:00"),
+        (ROLLUP_DAY_MEASUREMENT, "02 00:00"),
+    ]
+    minutes = [polls[:6], polls[6:12]]
+    for row, minute in zip((rows[0], rows[3]), minutes):
+        failures = sum(
+            1 for poll in minute if not poll["fields"].get("fetch_success", False)
+        )
+        assert row["fields"]["failure_count"] == failures
+        assert row["fields"]["sample_count"] == 6 - failures
+    assert rows[4]["fields"]["sample_count"] == (
+        rows[0]["fields"]["sample_count"] + rows[3]["fields"]["sample_count"]
+    )
+    assert state.coverage("plug") == (datetime(2023, 5, 1), None)
+
+
+def test_count_power_on():
+    """
+    Transitions are counted with hysteresis, missing values are skipped.
+    """
+    assert count_power_on([0, 60, 30, 60, 5, None, 60, 0], 50, 10) == 2
+    assert count_power_on([None], 50, 10) is None
+
+
+def test_split_window():
+    """
+    The coarsest tiers cover the middle of the window, the edges and the settle time
+    are read from the raw data.
+    """
+    since = datetime(2023, 4, 1)
+    parts = split_window(datetime(2023, 4, 28, 22, 30, 5), END, since, END - timedelta(minutes=10))
+    assert [part[0] for part in parts] == [None, 0, 1, 2, 1, 0, None]
+    assert parts[3][1:] == (datetime(2023, 4, 29), datetime(2023, 5, 3))
+    assert parts[-1][1] < datetime(2023, 5, 3, 17, 13) < parts[-1][2]
+    assert split_window(since - timedelta(days=3), since, since, since) == [
+        (None, since - timedelta(days=3), since)
+    ]
+
+
+def test_reader_matches_raw_data(backend, state):
+    """
+    The reports from the rollups match the reports from the raw data, also after a
+    restart in the middle of a day.
+    """
+    polls = create_polls(FIRST_POLL, END)
+    restart = datetime(2023, 5, 2, 13, 7, 25)
+    ingest(
+        RollupStage("plug", SETTINGS, backend, state),
+        backend,
+        [poll for poll in polls if poll["time"] < restart - timedelta(minutes=3)],
+    )
+    ingest(
+        RollupStage("plug", SETTINGS, backend, state),
+        backend,
+        [poll for poll in polls if poll["time"] >= restart],
+    )
+    starts = [END - timedelta(hours=3), END - timedelta(days=1, minutes=5), FIRST_POLL]
+    coverage = state.coverage("plug")
+    assert coverage == (datetime(2023, 5, 1), None)
+    reader = RollupReader(backend, "plug", END, starts, coverage, END)
+    planner = NestedWindowPlanner(backend, "plug", END, starts)
+    assert reader.sample_statistics() == [
+        pytest.approx(statistics) for statistics in planner.sample_statistics()
+    ]
+    assert reader.failure_counts() == planner.failure_counts()
+    assert any(part[0] == 2 for part in reader.windows[2])
+    expected = [
+        count_power_on(
+            [row["power"] for row in backend.query_samples("plug", start, END, ["power"])], 50, 10
+        )
+        for start in starts
+    ]
+    for count, expect in zip(reader.power_on_counts(50, 10), expected):
+        assert abs(count - expect) <= 2
+    for sketch, start in zip(reader.power_sketches(), starts):
+        rows = backend.query_samples("plug", start, END, ["power"])
+        powers = sorted(row["power"] for row in rows)
+        assert sketch.count == len(powers)
+        assert sketch.max == max(powers)
+        assert sketch.quantile(0.5) == pytest.approx(powers[(len(powers) - 1) // 2], rel=0.01)
+
+
+def test_backfill(backend, state):
+    """
+    The backfill rolls up the stored history of a device day by day.
+    """
+    polls = create_polls(FIRST_POLL, datetime(2023, 5, 3))
+    backend.write_points(polls)
+    assert backfill(backend, state, "plug", SETTINGS, datetime(2023, 5, 1), datetime(2023, 5, 3))
+    day_rows = list(
+        backend.query_range(
+            ROLLUP_DAY_MEASUREMENT, "plug", datetime(2023, 4, 30), datetime(2023, 5, 4)
+        )
+    )
+    assert [row["sample_count"] + row["failure_count"] for row in day_rows] == [8640, 8640]
+    starts = [datetime(2023, 5, 1), datetime(2023, 5, 2, 8)]
+    coverage = (datetime(2023, 5, 1), datetime(2023, 5, 3))
+    reader = RollupReader(backend, "plug", END, starts, coverage, END)
+    planner = NestedWindowPlanner(backend, "plug", END, starts)
+    assert reader.energy_sums() == pytest.approx(planner.energy_sums())
+    assert reader.failure_counts() == planner.failure_counts()
@@ -0,0 +1,127 @@
+"""
+Tests for spool.py
+"""
+import json
+from datetime import datetime
+from unittest.mock import patch, mock_open
+
+import pytest
+from source.spool import WriteAheadSpool, SpoolConfig, check_spool_config
+from source.line_protocol import encode_timestamp
+
+
+def create_points(count: int, start: int = 0) -> list:
+    """
+    Create simple census points for the spool tests
+    :return: List of points
+    """
+    return [
+        {
+            "measurement": "census",
+            "tags": {"device": "Kuehlschrank"},
+            "time": datetime(2023, 5, 1, 12, 0, (start + index) % 60, 250),
+            "fields": {"power": float(start + index), "fetch_success": True},
+        }
+        for index in range(count)
+    ]
+
+
+def test_append_and_replay_in_order(tmp_path):
+    """
+    Spooled points are replayed oldest first with unchanged timestamps and the
+    segments are deleted afterwards.
+    """
+    spool = WriteAheadSpool(str(tmp_path), SpoolConfig(segment_size_kb=1))
+    for start in range(0, 40, 10):
+        spool.append(create_points(10, start))
+    assert len(spool.segments()) > 1
+    written = []
+    count = spool.replay(written.extend)
+    assert count == 40
+    assert [point["fields"]["power"] for point in written] == [
+        float(value) for value in range(40)
+    ]
+    assert written[0]["time"] == encode_timestamp(datetime(2023, 5, 1, 12, 0, 0, 250), "n")
+    assert not spool.pending()
+
+
+def test_spool_survives_restart(tmp_path):
+    """
+    A new spool object continues with the segments of the old one.
+    """
+    WriteAheadSpool(str(tmp_path)).append(create_points(3))
+    spool = WriteAheadSpool(str(tmp_path))
+    spool.append(create_points(2))
+    assert spool.pending()
+    written = []
+    spool.replay(written.extend)
+    assert len(written) == 5
+
+
+def test_replay_failure_keeps_segment(tmp_path):
+    """
+    If the database fails during replay, the points stay in the spool.
+    """
+    spool = WriteAheadSpool(str(tmp_path))
+    spool.append(create_points(5))
+
+    def failing_write(_):
+        raise ConnectionError("database down")
+
+    with pytest.raises(ConnectionError):
+        spool.replay(failing_write)
+    written = []
+    spool.replay(written.extend)
+    assert len(written) == 5
+
+
+def test_replay_is_rate_limited(tmp_path):
+    """
+    Only the configured number of batches is written per replay call.
+    """
+    config = SpoolConfig(segment_size_kb=1, replay_batch_size=10, replay_batches_per_run=1)
+    spool = WriteAheadSpool(str(tmp_path), config)
+    for start in range(0, 30, 10):
+        spool.append(create_points(10, start))
+    written = []
+    assert spool.replay(written.extend) == 10
+    assert spool.pending()
+
+
+def test_oldest_segments_are_evicted(tmp_path):
+    """
+    The oldest segments are removed if the size cap is exceeded.
+    """
+    spool = WriteAheadSpool(str(tmp_path), SpoolConfig(segment_size_kb=1, max_size_mb=1))
+    spool.config.max_size_mb = 0
+    for start in range(0, 50, 10):
+        spool.append(create_points(10, start))
+    assert spool.evicted_points > 0
+    assert len(spool.segments()) == 1
+    written = []
+    spool.replay(written.extend)
+    assert written[-1]["fields"]["power"] == 49.0
+
+
+def test_fast_fail():
+    """
+    The database is marked as down until it is marked up again.
+    """
+    spool = WriteAheadSpool("not_existing_dir", SpoolConfig(retry_after_s=60))
+    assert not spool.db_known_down()
+    spool.mark_db_down()
+    assert spool.db_known_down()
+    spool.mark_db_up()
+    assert not spool.db_known_down()
+
+
+def test_check_spool_config():
+    """
+    Valid values are taken, invalid values are replaced by default values.
+    """
+    mocked_config = {"spool": {"active": False, "max_size_mb": 5, "retry_after_s": "ten"}}
+    with patch("builtins.open", mock_open(read_data=json.dumps(mocked_config))):
+        config = check_spool_config()
+    assert config.active is False
+    assert config.max_size_mb == 5
+    assert config.retry_after_s == SpoolConfig().retry_after_s
@@ -0,0 +1,344 @@
+"""
+Tests for storage_influxdb.py against a local stand-in HTTP server
+"""
+import json
+import math
+import socket
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from source.storage_influxdb import (
+    InfluxDBBackend,
+    UdpLineSender,
+    influxql_where,
+    pack_datagrams,
+)
+from source.constants import SCHEMA_LEGACY
+
+QUERY_RESPONSE = {
+    "results": [
+        {
+            "statement_id": 0,
+            "series": [
+                {
+                    "name": "census",
+                    "columns": ["time", "value"],
+                    "values": [[0, 42.5]],
+                }
+            ],
+        }
+    ]
+}
+
+
+def create_backend(port: int) -> InfluxDBBackend:
+    """
+    Create a backend for the stand-in server
+    :return: Backend
+    """
+    login_information = SimpleNamespace(
+        db_ip_address="127.0.0.1",
+        db_port=port,
+        db_user_name="user",
+        db_user_password="",
+        db_name="power",
+        ssl=False,
+        verify_ssl=False,
+        gzip=False,
+        time_precision="ms",
+    )
+    return InfluxDBBackend(login_information, SCHEMA_LEGACY)
+
+
+def test_influxql_where():
+    """
+    Pure test for function influxql_where()
+    """
+    assert influxql_where(None) == ""
+    assert influxql_where({"fetch_success": False, "error_type": "a'b"}) == (
+        ' AND "fetch_success" = false AND "error_type" = \'a\\\'b\''
+    )
+
+
+def test_write_points(stand_in_server):
+    """
+    Points are written as line protocol into the configured database.
+    """
+    point = {
+        "measurement": "census",
+        "tags": {"device": "Kuehlschrank"},
+        "time": datetime(2023, 5, 1, 12, 0, 10),
+        "fields": {"fetch_success": False},
+    }
+    create_backend(stand_in_server.port).write_points([point])
+    request = stand_in_server.requests[0]
+    assert request["path"] == "/write"
+    assert request["params"]["db"] == "power"
+    assert request["params"]["precision"] == "ms"
+    assert request["body"] == "census,device=Kuehlschrank fetch_success=False 1682942410000\n"
+
+
+def test_query_range_chunked(stand_in_server):
+    """
+    The rows are requested in chunks and read chunk by chunk.
+    """
+    chunks = [
+        {
+            "results": [
+                {
+                    "statement_id": 0,
+                    "series": [
+                        {
+                            "name": "census",
+                            "columns": ["time", "power"],
+                            "values": [[time_ms, 10.5] for time_ms in times],
+                        }
+                    ],
+                    "partial": partial,
+                }
+            ]
+        }
+        for times, partial in (([1000, 2000], True), ([3000], False))
+    ]
+    stand_in_server.respond(
+        "/query",
+        200,
+        "\n".join(json.dumps(chunk) for chunk in chunks),
+        {"Content-Type": "application/json"},
+    )
+    backend = create_backend(stand_in_server.port)
+    start = datetime(2023, 5, 1)
+    rows = backend.query_range("census", "Kuehlschrank", start, start + timedelta(days=1))
+    assert not stand_in_server.requests
+    assert [row["time"] for row in rows] == [1000, 2000, 3000]
+    params = stand_in_server.requests[0]["params"]
+    assert params["chunked"] == "true"
+    assert params["epoch"] == "ms"
+
+
+def test_query_columns(stand_in_server):
+    """
+    The chunked response is transposed into columns, missing values are NaN.
+    """
+    chunks = [
+        {
+            "results": [
+                {
+                    "statement_id": 0,
+                    "series": [
+                        {
+                            "name": "census",
+                            "columns": ["time", "energy_wh", "fetch_success"],
+                            "values": values,
+                        }
+                    ],
+                }
+            ]
+        }
+        for values in ([[1000, 0.5, True], [2000, None, False]], [[3000, 1.5, True]])
+    ]
+    stand_in_server.respond(
+        "/query",
+        200,
+        "\n".join(json.dumps(chunk) for chunk in chunks),
+        {"Content-Type": "application/json"},
+    )
+    backend = create_backend(stand_in_server.port)
+    start = datetime(2023, 5, 1)
+    columns = list(
+        backend.query_columns(
+            "census",
+            "Kuehlschrank",
+            start,
+            start + timedelta(days=1),
+            ["energy_wh", "fetch_success", "power"],
+        )
+    )
+    assert [list(chunk["time"]) for chunk in columns] == [[1000, 2000], [3000]]
+    assert columns[0]["energy_wh"][0] == 0.5 and math.isnan(columns[0]["energy_wh"][1])
+    assert list(columns[0]["fetch_success"]) == [1.0, 0.0]
+    assert all(math.isnan(value) for chunk in columns for value in chunk["power"])
+    params = stand_in_server.requests[0]["params"]
+    assert params["q"].startswith('SELECT "energy_wh", "fetch_success", "power" FROM')
+    assert params["chunked"] == "true"
+    assert json.loads(params["params"])["device"] == "Kuehlschrank"
+
+
+def test_query_aggregate(stand_in_server):
+    """
+    The aggregate query is executed by the database.
+    """
+    stand_in_server.respond(
+        "/query", 200, json.dumps(QUERY_RESPONSE), {"Content-Type": "application/json"}
+    )
+    backend = create_backend(stand_in_server.port)
+    value = backend.query_aggregate(
+        "census",
+        "Kuehlschrank",
+        datetime(2023, 5, 1),
+        datetime(2023, 5, 2),
+        "energy_wh",
+        "sum",
+        backend.valid_sample_filter(),
+    )
+    assert value == 42.5
+    query = stand_in_server.requests[0]["params"]["q"]
+    assert query.startswith('SELECT SUM("energy_wh")')
+    assert '"fetch_success" = true' in query
+
+
+def test_query_group_aggregate(stand_in_server):
+    """
+    The devices are aggregated with one query grouped by device.
+    """
+    response = {
+        "results": [
+            {
+                "statement_id": 0,
+                "series": [
+                    {
+                        "name": "census",
+                        "tags": {"device": device},
+                        "columns": ["time", "value"],
+                        "values": [[0, value]],
+                    }
+                    for device, value in (("Kuehlschrank", 42.5), ("Lampe", 1.5))
+                ],
+            }
+        ]
+    }
+    stand_in_server.respond(
+        "/query", 200, json.dumps(response), {"Content-Type": "application/json"}
+    )
+    backend = create_backend(stand_in_server.port)
+    start = datetime(2023, 5, 1)
+    totals = backend.sum_samples_by_device(
+        ["Kuehlschrank", "Lampe", "Fernseher"], start, start + timedelta(days=1)
+    )
+    assert totals == {"Kuehlschrank": 42.5, "Lampe": 1.5, "Fernseher": 0}
+    assert len(stand_in_server.requests) == 1
+    params = stand_in_server.requests[0]["params"]
+    assert "(device=$device0 OR device=$device1 OR device=$device2)" in params["q"]
+    assert params["q"].endswith('GROUP BY "device"')
+    assert json.loads(params["params"])["device2"] == "Fernseher"
+
+
+def test_series_cardinality(stand_in_server):
+    """
+    The series of a device are counted with SHOW SERIES EXACT CARDINALITY.
+    """
+    response = {
+        "results": [
+            {
+                "statement_id": 0,
+                "series": [{"name": "census", "columns": ["count"], "values": [[2]]}],
+            }
+        ]
+    }
+    stand_in_server.respond(
+        "/query", 200, json.dumps(response), {"Content-Type": "application/json"}
+    )
+    backend = create_backend(stand_in_server.port)
+    start = datetime(2023, 5, 1)
+    assert backend.series_cardinality("census", "Lampe", start, start + timedelta(days=1)) == 2
+    params = stand_in_server.requests[0]["params"]
+    assert params["q"].startswith('SHOW SERIES EXACT CARDINALITY ON "power" FROM "census"')
+    assert json.loads(params["params"])["device"] == "Lampe"
+
+
+def test_field_keys(stand_in_server):
+    """
+    The fields of a measurement are listed with SHOW FIELD KEYS.
+    """
+    response = {
+        "results": [
+            {
+                "statement_id": 0,
+                "series": [
+                    {
+                        "name": "census",
+                        "columns": ["fieldKey", "fieldType"],
+                        "values": [["power", "float"], ["fetch_success", "boolean"]],
+                    }
+                ],
+            }
+        ]
+    }
+    stand_in_server.respond(
+        "/query", 200, json.dumps(response), {"Content-Type": "application/json"}
+    )
+    backend = create_backend(stand_in_server.port)
+    start = datetime(2023, 5, 1)
+    fields = backend.field_keys("census", "Lampe", start, start + timedelta(days=1))
+    assert fields == ["fetch_success", "power"]
+    params = stand_in_server.requests[0]["params"]
+    assert params["q"] == 'SHOW FIELD KEYS ON "power" FROM "census"'
+
+
+def test_query_buckets(stand_in_server):
+    """
+    The buckets are grouped by the database with GROUP BY time.
+    """
+    stand_in_server.respond(
+        "/query", 200, json.dumps(QUERY_RESPONSE), {"Content-Type": "application/json"}
+    )
+    backend = create_backend(stand_in_server.port)
+    start = datetime(2023, 5, 1)
+    rows = backend.query_buckets(
+        "census", "Kuehlschrank", start, start + timedelta(days=1), "power", "max",
+        timedelta(hours=1),
+    )
+    assert rows == [{"time": 0, "value": 42.5}]
+    query = stand_in_server.requests[0]["params"]["q"]
+    assert query.startswith('SELECT MAX("power")')
+    assert query.endswith("GROUP BY time(3600000ms, 0ms) fill(none)")
+
+
+def test_pack_datagrams():
+    """
+    Pure test for function pack_datagrams()
+    """
+    lines = ["a" * 5, "b" * 5, "c" * 20, "d" * 3]
+    datagrams, oversized = pack_datagrams(lines, 12)
+    assert datagrams == [(b"aaaaa\nbbbbb\n", 2), (b"ddd\n", 1)]
+    assert oversized == ["c" * 20]
+
+
+def test_udp_write_mode(stand_in_server):
+    """
+    Samples are sent as datagrams, failed polls are written over HTTP.
+    """
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(("127.0.0.1", 0))
+    receiver.settimeout(2)
+    backend = create_backend(stand_in_server.port)
+    backend.udp_sender = UdpLineSender("127.0.0.1", receiver.getsockname()[1], 200)
+    points = [
+        {
+            "measurement": "census",
+            "tags": {"device": "Kuehlschrank"},
+            "time": datetime(2023, 5, 1, 12, 0, index),
+            "fields": {"power": 10.5, "fetch_success": index != 3},
+        }
+        for index in range(10)
+    ]
+    backend.write_points(points)
+    lines = []
+    while len(lines) < 9:
+        datagram = receiver.recv(65535)
+        assert len(datagram) <= 200
+        lines.extend(datagram.decode("utf-8").splitlines())
+    receiver.close()
+    assert lines[0] == (
+        "census,device=Kuehlschrank power=10.5,fetch_success=True 1682942400000000000"
+    )
+    assert len(stand_in_server.requests) == 1
+    assert stand_in_server.requests[0]["body"] == (
+        "census,device=Kuehlschrank power=10.5,fetch_success=False 1682942403000\n"
+    )
+    statistics = backend.udp_sender.statistics()
+    assert statistics["points"] == 9
+    assert statistics["http_points"] == 1
+    assert statistics["datagrams"] == 5
+    backend.write_points(points[:1], time_precision="n")
+    assert len(stand_in_server.requests) == 2
@@ -0,0 +1,240 @@
+"""
+Tests for storage_influxdb2.py against a local stand-in HTTP server
+"""
+import json
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from source.storage import StorageWriteError, StorageConnectionError
+from source.storage_influxdb2 import InfluxDB2Backend, parse_annotated_csv
+from source.constants import SCHEMA_LEGACY, SCHEMA_SPLIT
+
+RANGE_RESPONSE = (
+    "#datatype,string,long,dateTime:RFC3339,double,boolean\r\n"
+    ",result,table,_time,energy_wh,fetch_success\r\n"
+    ",_result,0,2023-05-01T12:00:10Z,0.5,true\r\n"
+    ",_result,0,2023-05-01T12:00:20.5Z,0.25,true\r\n"
+    "\r\n"
+)
+AGGREGATE_RESPONSE = (
+    "#datatype,string,long,double\r\n"
+    ",result,table,_value\r\n"
+    ",_result,0,12.5\r\n"
+    "\r\n"
+)
+
+
+def create_backend(port: int, schema: str = SCHEMA_LEGACY) -> InfluxDB2Backend:
+    """
+    Create a backend for the stand-in server
+    :return: Backend
+    """
+    login_information = SimpleNamespace(
+        db_ip_address="127.0.0.1",
+        db_port=port,
+        db_org="home",
+        db_bucket="power",
+        db_token="secret",
+        ssl=False,
+        verify_ssl=False,
+        gzip=True,
+        time_precision="ms",
+    )
+    return InfluxDB2Backend(login_information, schema)
+
+
+def test_parse_annotated_csv():
+    """
+    Pure test for function parse_annotated_csv()
+    """
+    rows = list(parse_annotated_csv(RANGE_RESPONSE.splitlines()))
+    assert rows == [
+        {"time": 1682942410000, "energy_wh": 0.5, "fetch_success": True},
+        {"time": 1682942420500, "energy_wh": 0.25, "fetch_success": True},
+    ]
+
+
+def test_write_points(stand_in_server):
+    """
+    Points are written gzip compressed as line protocol with token authentication.
+    """
+    backend = create_backend(stand_in_server.port)
+    backend.write_points(
+        [
+            {
+                "measurement": "census",
+                "tags": {"device": "Kuehlschrank"},
+                "time": datetime(2023, 5, 1, 12, 0, 10),
+                "fields": {"power": 12.5, "fetch_success": True},
+            }
+        ]
+    )
+    request = stand_in_server.requests[0]
+    assert request["path"] == "/api/v2/write"
+    assert request["params"] == {"org": "home", "bucket": "power", "precision": "ms"}
+    assert request["headers"]["Authorization"] == "Token secret"
+    assert request["headers"]["Content-Encoding"] == "gzip"
+    assert request["body"] == (
+        "census,device=Kuehlschrank power=12.5,fetch_success=True 1682942410000\n"
+    )
+
+
+@pytest.mark.parametrize(
+    "status, error, invalid_data",
+    [
+        (400, StorageWriteError, True),
+        (401, StorageWriteError, False),
+        (503, StorageConnectionError, None),
+    ],
+)
+def test_write_errors(stand_in_server, status, error, invalid_data):
+    """
+    Errors of the database are converted to storage errors.
+    """
+    stand_in_server.respond("/api/v2/write", status, "error")
+    backend = create_backend(stand_in_server.port)
+    with pytest.raises(error) as err:
+        backend.write_points([])
+    if invalid_data is not None:
+        assert err.value.invalid_data is invalid_data
+
+
+def test_query_samples(stand_in_server):
+    """
+    The range query filters the failed polls in Flux with the legacy schema.
+    """
+    stand_in_server.respond("/api/v2/query", 200, RANGE_RESPONSE)
+    backend = create_backend(stand_in_server.port)
+    rows = list(
+        backend.query_samples(
+            "Kuehlschrank", datetime(2023, 5, 1, 12), datetime(2023, 5, 1, 13), ["energy_wh"]
+        )
+    )
+    assert len(rows) == 2
+    flux = json.loads(stand_in_server.requests[0]["body"])["query"]
+    assert 'r.device == "Kuehlschrank"' in flux
+    assert 'r["fetch_success"] == true' in flux
+    assert "pivot(" in flux
+
+
+def test_count_failures_split_schema(stand_in_server):
+    """
+    With the split schema the failures are counted by the database in the health
+    measurement.
+    """
+    stand_in_server.respond(
+        "/api/v2/query",
+        200,
+        "#datatype,string,long,long\r\n,result,table,success\r\n,_result,0,7\r\n",
+    )
+    backend = create_backend(stand_in_server.port, SCHEMA_SPLIT)
+    count = backend.count_failures(
+        "Kuehlschrank", datetime(2023, 5, 1), datetime(2023, 5, 2)
+    )
+    assert count == 7
+    flux = json.loads(stand_in_server.requests[0]["body"])["query"]
+    assert 'r._measurement == "poll_health"' in flux
+    assert 'count(column: "success")' in flux
+
+
+def test_query_aggregate(stand_in_server):
+    """
+    Aggregations are executed with Flux on the database side.
+    """
+    stand_in_server.respond("/api/v2/query", 200, AGGREGATE_RESPONSE)
+    backend = create_backend(stand_in_server.port, SCHEMA_SPLIT)
+    value = backend.query_aggregate(
+        "census", "Kuehlschrank", datetime(2023, 5, 1), datetime(2023, 5, 2), "energy_wh", "sum"
+    )
+    assert value == 12.5
+    flux = json.loads(stand_in_server.requests[0]["body"])["query"]
+    assert "|> sum()" in flux
+
+
+def test_query_group_aggregate(stand_in_server):
+    """
+    The devices are aggregated with one Flux query grouped by device.
+    """
+    stand_in_server.respond(
+        "/api/v2/query",
+        200,
+        "#datatype,string,long,string,double\r\n"
+        ",result,table,device,energy_wh\r\n"
+        ",_result,0,Kuehlschrank,12.5\r\n"
+        ",_result,1,Lampe,1.5\r\n",
+    )
+    backend = create_backend(stand_in_server.port)
+    start = datetime(2023, 5, 1)
+    totals = backend.sum_samples_by_device(
+        ["Kuehlschrank", "Lampe", "Fernseher"], start, start + timedelta(days=1)
+    )
+    assert totals == {"Kuehlschrank": 12.5, "Lampe": 1.5, "Fernseher": 0}
+    flux = json.loads(stand_in_server.requests[0]["body"])["query"]
+    assert 'contains(value: r.device, set: ["Kuehlschrank", "Lampe", "Fernseher"])' in flux
+    assert '|> group(columns: ["device"])' in flux
+
+
+def test_series_cardinality(stand_in_server):
+    """
+    The series of one field of a device are counted with influxdb.cardinality().
+    """
+    stand_in_server.respond(
+        "/api/v2/query",
+        200,
+        "#datatype,string,long,long\r\n,result,table,_value\r\n,_result,0,1\r\n",
+    )
+    backend = create_backend(stand_in_server.port)
+    start = datetime(2023, 5, 1)
+    cardinality = backend.series_cardinality(
+        "census", "Lampe", start, start + timedelta(days=1), "energy_wh"
+    )
+    assert cardinality == 1
+    flux = json.loads(stand_in_server.requests[0]["body"])["query"]
+    assert flux.startswith('import "influxdata/influxdb"')
+    assert 'r.device == "Lampe" and r._field == "energy_wh"' in flux
+
+
+def test_field_keys(stand_in_server):
+    """
+    The fields of a device in a range are listed with schema.fieldKeys().
+    """
+    stand_in_server.respond(
+        "/api/v2/query",
+        200,
+        "#datatype,string,long,string\r\n,result,table,_value\r\n"
+        ",_result,0,power\r\n,_result,0,energy_wh\r\n",
+    )
+    backend = create_backend(stand_in_server.port)
+    start = datetime(2023, 5, 1)
+    fields = backend.field_keys("census", "Lampe", start, start + timedelta(days=1))
+    assert fields == ["energy_wh", "power"]
+    flux = json.loads(stand_in_server.requests[0]["body"])["query"]
+    assert flux.startswith('import "influxdata/influxdb/schema"')
+    assert 'r._measurement == "census" and r.device == "Lampe"' in flux
+
+
+def test_query_buckets(stand_in_server):
+    """
+    The buckets are grouped by the database with aggregateWindow.
+    """
+    stand_in_server.respond(
+        "/api/v2/query",
+        200,
+        "#datatype,string,long,dateTime:RFC3339,double\r\n"
+        ",result,table,_time,energy_wh\r\n"
+        ",_result,0,2023-05-01T00:00:00Z,12.5\r\n",
+    )
+    backend = create_backend(stand_in_server.port)
+    start = datetime(2023, 5, 1)
+    filters = backend.valid_sample_filter()
+    rows = backend.query_buckets(
+        "census", "Kuehlschrank", start, start + timedelta(days=1), "energy_wh", "sum",
+        timedelta(days=1), filters,
+    )
+    assert rows == [{"time": 1682899200000, "value": 12.5}]
+    flux = json.loads(stand_in_server.requests[0]["body"])["query"]
+    assert (
+        'aggregateWindow(every: 86400000ms, offset: 0ms, fn: sum, column: "energy_wh", '
+        'timeSrc: "_start", createEmpty: false)'
+    ) in flux
@@ -0,0 +1,257 @@
+"""
+Tests for storage_sqlite.py with a database in a temporary directory
+"""
+import math
+import sqlite3
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from source.line_protocol import encode_timestamp
+from source.storage import StorageError, StorageConnectionError
+from source.storage_sqlite import SQLiteBackend, int_timestamp_to_ms
+from source.constants import SCHEMA_LEGACY, SCHEMA_SPLIT
+
+START = datetime(2023, 5, 1)
+
+
+def create_point(minute: int, energy_wh: float, fetch_success: bool = True) -> dict:
+    """
+    Create a census point of a plug
+    :return: Point
+    """
+    return {
+        "measurement": "census",
+        "tags": {"device": "plug"},
+        "time": START + timedelta(minutes=minute),
+        "fields": {"energy_wh": energy_wh, "fetch_success": fetch_success},
+    }
+
+
+@pytest.fixture(name="backend")
+def fixture_backend(tmp_path) -> SQLiteBackend:
+    """
+    Backend with a database file in a temporary directory
+    """
+    login_information = SimpleNamespace(db_path=str(tmp_path / "data" / "db.sqlite"))
+    return SQLiteBackend(login_information, SCHEMA_LEGACY)
+
+
+def test_int_timestamp_to_ms():
+    """
+    Pure test for function int_timestamp_to_ms()
+    """
+    assert int_timestamp_to_ms(2, "s") == 2000
+    assert int_timestamp_to_ms(2000, "ms") == 2000
+    assert int_timestamp_to_ms(2000, None) == 2000
+    assert int_timestamp_to_ms(2_000_999, "u") == 2000
+    assert int_timestamp_to_ms(2_000_999_999, "n") == 2000
+
+
+def test_write_and_query_range(backend):
+    """
+    Rows are returned in time order with epoch milliseconds, new fields become new columns
+    and the range excludes both ends.
+    """
+    backend.verify()
+    backend.write_points([create_point(2, 1.5), create_point(1, 1.0)])
+    backend.write_points(
+        [create_point(3, 2.0) | {"fields": {"energy_wh": 2.0, "fetch_success": True,
+                                            "temperature": 21.5}}]
+    )
+    rows = list(
+        backend.query_range(
+            "census", "plug", START + timedelta(minutes=1), START + timedelta(minutes=4)
+        )
+    )
+    start_ms = int((START - datetime(1970, 1, 1)).total_seconds()) * 1000
+    assert rows == [
+        {"time": start_ms + 120_000, "energy_wh": 1.5, "fetch_success": 1, "temperature": None},
+        {"time": start_ms + 180_000, "energy_wh": 2.0, "fetch_success": 1, "temperature": 21.5},
+    ]
+    assert not list(backend.query_range("census", "other", START, START + timedelta(hours=1)))
+    assert not list(backend.query_range("unknown", "plug", START, START + timedelta(hours=1)))
+
+
+def test_query_columns(backend, monkeypatch):
+    """
+    The columns hold the same values as the rows, missing fields are NaN and the rows
+    are split into chunks.
+    """
+    monkeypatch.setattr("source.storage_sqlite.QUERY_CHUNK_SIZE", 2)
+    backend.write_points([create_point(minute, minute / 2, minute != 3) for minute in range(5)])
+    chunks = list(
+        backend.query_columns(
+            "census",
+            "plug",
+            START,
+            START + timedelta(hours=1),
+            ["energy_wh", "power"],
+            {"fetch_success": True},
+        )
+    )
+    assert [list(chunk["time"]) for chunk in chunks] == [
+        [encode_timestamp(START + timedelta(minutes=minute), "ms") for minute in minutes]
+        for minutes in ((1, 2), (4,))
+    ]
+    assert [list(chunk["energy_wh"]) for chunk in chunks] == [[0.5, 1.0], [2.0]]
+    assert all(math.isnan(value) for chunk in chunks for value in chunk["power"])
+    assert not list(
+        backend.query_columns("poll_health", "plug", START, START + timedelta(hours=1), ["a"])
+    )
+
+
+def test_write_is_idempotent(backend):
+    """
+    A point with the same device and timestamp replaces the existing row.
+    """
+    backend.write_points([create_point(1, 1.0)])
+    backend.write_points([create_point(1, 3.0)])
+    rows = list(
+        backend.query_range("census", "plug", START, START + timedelta(hours=1), ["energy_wh"])
+    )
+    assert [row["energy_wh"] for row in rows] == [3.0]
+
+
+def test_query_aggregate_and_failures(backend):
+    """
+    Aggregates respect the filters and failures are counted for both schemas.
+    """
+    backend.write_points(
+        [create_point(1, 1.0), create_point(2, 2.0), create_point(3, 0.0, False)]
+    )
+    end = START + timedelta(hours=1)
+    assert backend.query_aggregate("census", "plug", START, end, "energy_wh", "sum") == 3.0
+    assert backend.query_aggregate(
+        "census", "plug", START, end, "energy_wh", "count", {"fetch_success": True}
+    ) == 2
+    assert backend.query_aggregate("census", "plug", START, end, "energy_wh", "mean") == 1.0
+    assert backend.query_aggregate("census", "plug", START, end, "unknown", "sum") is None
+    assert backend.count_failures("plug", START, end) == 1
+    assert [row["energy_wh"] for row in backend.query_samples("plug", START, end)] == [1.0, 2.0]
+    backend.schema = SCHEMA_SPLIT
+    assert backend.count_failures("plug", START, end) == 0
+    with pytest.raises(ValueError):
+        backend.query_aggregate("census", "plug", START, end, "energy_wh", "median")
+
+
+def test_query_group_aggregate(backend):
+    """
+    One statement aggregates all devices like one query per device, devices without
+    samples get 0 in the sums.
+    """
+    backend.write_points(
+        [create_point(1, 1.0), create_point(2, 2.0), create_point(3, 5.0, False)]
+        + [create_point(minute, 0.5) | {"tags": {"device": "lamp"}} for minute in (1, 2)]
+    )
+    end = START + timedelta(hours=1)
+    devices = ["plug", "lamp", "other"]
+    values = backend.query_group_aggregate(
+        "census", devices, START, end, "energy_wh", "sum", {"fetch_success": True}
+    )
+    assert values == {"plug": 3.0, "lamp": 1.0}
+    assert values == super(SQLiteBackend, backend).query_group_aggregate(
+        "census", devices, START, end, "energy_wh", "sum", {"fetch_success": True}
+    )
+    assert backend.sum_samples_by_device(devices, START, end) == {
+        "plug": 3.0,
+        "lamp": 1.0,
+        "other": 0,
+    }
+    assert not backend.query_group_aggregate("census", [], START, end, "energy_wh", "sum")
+
+
+def test_query_buckets_and_sample_statistics(backend):
+    """
+    Buckets are aligned to the epoch and empty buckets are left out. Aggregated points
+    count with their sample_count.
+    """
+    backend.write_points(
+        [create_point(minute, 1.0) for minute in (1, 2, 14, 31)] + [create_point(15, 0.0, False)]
+    )
+    end = START + timedelta(hours=1)
+    start_ms = int((START - datetime(1970, 1, 1)).total_seconds()) * 1000
+    rows = backend.query_buckets(
+        "census", "plug", START, end, "energy_wh", "sum", timedelta(minutes=15),
+        {"fetch_success": True},
+    )
+    assert rows == [
+        {"time": start_ms, "value": 3.0},
+        {"time": start_ms + 30 * 60_000, "value": 1.0},
+    ]
+    assert backend.query_buckets(
+        "census", "plug", START, end, "unknown", "sum", timedelta(minutes=15)
+    ) == []
+    assert backend.sample_statistics("plug", START, end) == {
+        "energy_wh": 4.0, "sample_count": 4
+    }
+    aggregated = create_point(40, 6.0)
+    aggregated["fields"]["sample_count"] = 6
+    backend.write_points([aggregated])
+    assert backend.sample_statistics("plug", START, end) == {
+        "energy_wh": 10.0, "sample_count": 10
+    }
+
+
+def test_prune(backend):
+    """
+    Rows older than the retention are deleted in all measurements.
+    """
+    health_point = {
+        "measurement": "poll_health",
+        "tags": {"device": "plug"},
+        "time": START,
+        "fields": {"success": True, "latency_ms": 12},
+    }
+    backend.write_points([create_point(0, 1.0), create_point(10, 2.0), health_point])
+    assert backend.prune(START + timedelta(minutes=5)) == 2
+    rows = list(backend.query_range("census", "plug", START, START + timedelta(hours=1)))
+    assert [row["energy_wh"] for row in rows] == [2.0]
+
+
+def test_errors_are_storage_errors(backend):
+    """
+    A locked database and a closed connection raise storage errors in the read, delete
+    and prune paths.
+    """
+    end = START + timedelta(hours=1)
+    backend.write_points([create_point(0, 1.0)])
+    with sqlite3.connect(backend.database_path) as other:
+        other.execute("BEGIN EXCLUSIVE")
+        backend.local.conn = sqlite3.connect(backend.database_path, timeout=0)
+        with pytest.raises(StorageConnectionError):
+            backend.prune(end)
+        with pytest.raises(StorageConnectionError):
+            backend.delete_range("census", "plug", START, end)
+        other.rollback()
+    backend.local.conn.close()
+    with pytest.raises(StorageError):
+        list(backend.query_range("census", "plug", START, end))
+    with pytest.raises(StorageError):
+        backend.query_aggregate("census", "plug", START, end, "energy_wh", "sum")
+
+
+def test_changed_table_refreshes_columns(backend):
+    """
+    If another process changed a table, the cached columns are read again after the
+    failed statement, so the next write succeeds.
+    """
+    end = START + timedelta(hours=1)
+    backend.write_points([create_point(0, 1.0)])
+    with sqlite3.connect(backend.database_path) as other:
+        other.execute('ALTER TABLE "census" ADD COLUMN "temperature"')
+    point = create_point(1, 2.0)
+    point["fields"]["temperature"] = 21.5
+    with pytest.raises(StorageConnectionError):
+        backend.write_points([point])
+    backend.write_points([point])
+    with sqlite3.connect(backend.database_path) as other:
+        other.execute('DROP TABLE "census"')
+        other.execute('CREATE TABLE "census" (device TEXT, ts INTEGER, "power" REAL)')
+    with pytest.raises(StorageConnectionError):
+        backend.write_points([create_point(2, 3.0)])
+    backend.write_points([create_point(2, 3.0)])
+    assert backend.field_keys("census", "plug", START, end) == [
+        "energy_wh", "fetch_success", "power"
+    ]